@@ -37,6 +37,7 @@ Parameters that can be set
 
     "genome_reference", "", ""
     "chrom_list", "Comma-separated list of chromosome names as mentioned in the BAM file"
+    "telemetry", "empty | path to directory", "Record the resource usage of every CatVariants command in ``<step>.<name>.metrics.jsonl``, in the given directory or in the step directory. Summarize with ``utilities/telemetry.py collect``"
 
 Lines for parameter file
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -60,10 +61,12 @@ Van der Auwera, Geraldine A., et al. "From FastQ data to high‐confidence varia
 import os
 import sys
 from neatseq_flow.PLC_step import Step,AssertionExcept
+from neatseq_flow_modules.utilities.intervals import *
+from neatseq_flow_modules.utilities.telemetry import *
 
 
 __author__ = "Michal Gordon"
-__version__ = "1.6.0"
+__version__ = "1.6.1"
 
 
 class Step_GATK_CatVariants(Step):
@@ -95,6 +98,7 @@ class Step_GATK_CatVariants(Step):
         
         # Prepare a list to store the qsub names of this steps scripts (will then be put in pipe_data and returned somehow)
 
+        self.telemetry_file = get_telemetry_file(self.params, self.base_dir, self.step, self.name)
         
        
         # Each iteration must define the following class variables:
@@ -116,13 +120,19 @@ class Step_GATK_CatVariants(Step):
                         "GATK_path" : self.params["script_path"],
                         "genome_reference" : self.params["genome_reference"]
                 }      
-            for chr in self.params["chrom_list"].split(','):
-                chr = chr.strip()
+            chr_vcfs = list()
+            for chr, region in get_region_list(self.params, self.sample_data):
 
                 # Name of specific script:
                 my_CatVariants_string = my_CatVariants_string + "    -V " + self.sample_data[sample][chr]["GATK_vcf"] + " \\\n"
+                chr_vcfs.append(self.sample_data[sample][chr]["GATK_vcf"])
             my_CatVariants_string = my_CatVariants_string + "    -out " + output_file + " \n"
-            self.script = my_CatVariants_string
+            self.script = get_telemetry_script(command=my_CatVariants_string,
+                                               metrics_file=self.telemetry_file,
+                                               step=self.step,
+                                               name=self.name,
+                                               sample=sample,
+                                               inputs=chr_vcfs)
     #        print self.script
             self.spec_script_name = self.jid_name_sep.join([self.step,self.name,sample])
             # self.spec_script_name = set_spec_script_name()
@@ -11,6 +11,11 @@ A class that defines a module for separation of multi-VCF per-chromosome to one
 
 .. attention:: The module generates a script for each sample/chromosome.
 
+.. Note:: If ``single_pass`` is set, the module generates one script per chromosome instead. The script reads the
+    multi-sample VCF once and writes all per-sample VCFs simultaneously. Sites are dropped from a sample's VCF if the
+    sample's genotype does not contain a non-reference allele (rather than by grepping ``AC=0``). The per-sample VCFs
+    are compressed with BGZF and indexed with ``tabix``. GATK is not used in this mode.
+
 The programs included in the module are the following:
 
 * ``SelectVariants`` (GATK) 
@@ -39,6 +44,9 @@ Parameters that can be set
 
     "genome_reference", "", "path to reference genome"
     "chrom_list", "", "Comma-separated list of chromosome names as mentioned in the BAM file "
+    "single_pass", "", "Split the VCF into all samples in one pass. See note above"
+    "tabix_path", "", "Path to tabix, used when ``single_pass`` is set. Default: 'tabix'"
+    "telemetry", "empty | path to directory", "Record the resource usage of every SelectVariants command, or of the splitting command with ``single_pass`` in ``<step>.<name>.metrics.jsonl``, in the given directory or in the step directory. Summarize with ``utilities/telemetry.py collect``"
 
 Lines for parameter file
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -54,6 +62,18 @@ Lines for parameter file
         redirects:
             --setFilteredGtToNocall: null
 
+**Splitting in a single pass:**
+
+::
+
+    GATK_SelectVariants_single_pass:
+        module: GATK_SelectVariants
+        base: VEP1
+        script_path: python
+        single_pass:
+        tabix_path: /path/to/tabix
+        genome_reference:   /path/to/gatk/bundle/b37/human_g1k_v37_decoy.fasta
+
 References
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 Van der Auwera, Geraldine A., et al. "From FastQ data to high‐confidence variant calls: the genome analysis toolkit best practices pipeline." Current protocols in bioinformatics 43.1 (2013): 11-10.‏
@@ -63,10 +83,12 @@ Van der Auwera, Geraldine A., et al. "From FastQ data to high‐confidence varia
 import os
 import sys
 from neatseq_flow.PLC_step import Step,AssertionExcept
+from neatseq_flow_modules.utilities.intervals import *
+from neatseq_flow_modules.utilities.telemetry import *
 
 
 __author__ = "Michal Gordon"
-__version__ = "1.6.0"
+__version__ = "1.6.1"
 
 class Step_GATK_SelectVariants (Step):
     """ A class that defines a pipeline step name (=instance).
@@ -98,13 +120,17 @@ class Step_GATK_SelectVariants (Step):
         # Prepare a list to store the qsub names of this steps scripts (will then be put in pipe_data and returned somehow)
         self.qsub_names=[]
         
+        self.telemetry_file = get_telemetry_file(self.params, self.base_dir, self.step, self.name)
        
+        if "single_pass" in self.params:
+            self.build_scripts_single_pass()
+            return
+
         # Each iteration must define the following class variables:
             # spec_qsub_name
             # spec_script_name
             # script
-        for chr in self.params["chrom_list"].split(','):
-            chr = chr.strip()
+        for chr, region in get_region_list(self.params, self.sample_data):
 
             for sample in self.sample_data["samples"]:      # Getting list of samples out of samples_hash
             
@@ -118,7 +144,6 @@ class Step_GATK_SelectVariants (Step):
                 # This line should be left before every new script. It sees to local issues.
                 # Use the dir it returns as the base_dir for this step.
                 use_dir = self.local_start(sample_dir)
-                self.script += self.get_script_const()
                 
                 output_file = sample_dir + sample + "_" + chr + "_GATK.vcf" 
                 
@@ -132,7 +157,7 @@ class Step_GATK_SelectVariants (Step):
                 """ % { "sample_dir" : sample_dir,
                         "genome_reference" : self.params["genome_reference"],
                         "input_full_vcf" : self.sample_data[chr]["vcf"],
-                        "my_chrom" : chr,
+                        "my_chrom" : region,
                         "output_sample_vcf" : output_file,
                         "SAMPLE" : sample
                 }
@@ -140,7 +165,14 @@ class Step_GATK_SelectVariants (Step):
 # delete as reference rows                 
                 my_string_egrep = """egrep -v "AC=0;|AC=0,0;|AC=0,0,0;|AC=0,0,0,0;|AC=0,0,0,0,0;|AC=0,0,0,0,0,0;"  """ + output_file + " > " + final_output
                 my_rm_script = "rm -f " +  output_file + "\n\t" + "rm -f " +  output_file + ".idx"
-                self.script += my_string + "\n\t" + my_string_egrep + "\n\t" + my_rm_script
+                self.script += get_telemetry_script(command=self.get_script_const() + my_string,
+                                                    metrics_file=self.telemetry_file,
+                                                    step=self.step,
+                                                    name=self.name,
+                                                    sample=sample,
+                                                    label=chr,
+                                                    inputs=[self.sample_data[chr]["vcf"]])
+                self.script += "\n\t" + my_string_egrep + "\n\t" + my_rm_script
                 #self.get_script_env_path()
                 
 
@@ -151,4 +183,60 @@ class Step_GATK_SelectVariants (Step):
                 self.local_finish(use_dir,sample_dir)       # Sees to copying local files to final destination (and other stuff)
 
                 self.create_low_level_script()
-                        
+
+    def build_scripts_single_pass(self):
+        """ Build one script per chromosome, splitting the multi-sample VCF into all samples at once
+        """
+
+        split_script = os.path.join(os.path.dirname(os.path.realpath(__file__)), "split_vcf_by_sample.py")
+        tabix = self.params["tabix_path"] if "tabix_path" in self.params else "tabix"
+
+        for chr, region in get_region_list(self.params, self.sample_data):
+
+            # Name of specific script:
+            self.spec_script_name = self.jid_name_sep.join([self.step,self.name,chr])
+            self.script = ""
+
+            # This line should be left before every new script. It sees to local issues.
+            # Use the dir it returns as the base_dir for this step.
+            use_dir = self.local_start(self.base_dir)
+
+            # File listing the output file for each sample:
+            outputs_file = self.base_dir + chr + "_sample_outputs.tsv"
+            with open(outputs_file, "w") as outputs_fh:
+                for sample in self.sample_data["samples"]:      # Getting list of samples out of samples_hash
+                    # Make a dir for the current sample:
+                    sample_dir = self.make_folder_for_sample(sample)
+                    final_output = sample_dir + sample + "_" + chr + "_GATK_final.vcf.gz"
+                    outputs_fh.write("{sample}\t{output}\n".format(sample=sample, output=final_output))
+
+                    self.sample_data[sample][chr] = {}
+                    self.sample_data[sample][chr]["GATK_vcf"] = final_output
+                    self.stamp_file(self.sample_data[sample][chr]["GATK_vcf"])
+
+            split_command = """\
+{python} {split_script} \\
+    -V {input_full_vcf} \\
+    -o {outputs_file} \\
+    --tabix {tabix}
+
+""".format(python=self.params["script_path"] if self.params["script_path"] else "python",
+           split_script=split_script,
+           input_full_vcf=self.sample_data[chr]["vcf"],
+           outputs_file=outputs_file,
+           tabix=tabix)
+
+            self.script += """
+echo '\\n---------- Splitting VCF by sample -------------\\n'
+"""
+            self.script += get_telemetry_script(command=split_command,
+                                                metrics_file=self.telemetry_file,
+                                                step=self.step,
+                                                name=self.name,
+                                                sample="project_data",
+                                                label=chr,
+                                                inputs=[self.sample_data[chr]["vcf"]])
+
+            self.local_finish(use_dir,self.base_dir)       # Sees to copying local files to final destination (and other stuff)
+
+            self.create_low_level_script()
@@ -41,6 +41,7 @@ Parameters that can be set
     "ts_filter_level_INDEL", "", "filter e xpression for INDEL"
     "resource_SNP", "", ""
     "resource_INDEL", "", ""
+    "telemetry", "empty | path to directory", "Record the resource usage of every VariantRecalibrator and ApplyRecalibration command in ``<step>.<name>.metrics.jsonl``, in the given directory or in the step directory. Summarize with ``utilities/telemetry.py collect``"
 
 Lines for parameter file
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -75,6 +76,8 @@ Van der Auwera, Geraldine A., et al. "From FastQ data to high‐confidence varia
 import os
 import sys
 from neatseq_flow.PLC_step import Step,AssertionExcept
+from neatseq_flow_modules.utilities.intervals import *
+from neatseq_flow_modules.utilities.telemetry import *
 
 
 __author__ = "Michal Gordon"
@@ -116,9 +119,10 @@ class Step_GATK_VQSR(Step):
         # script
 ######################################################## SNP
 
+        self.telemetry_file = get_telemetry_file(self.params, self.base_dir, self.step, self.name)
+
         use_dir = self.local_start(self.base_dir)
-        for chr in self.params["chrom_list"].split(','):
-            chr = chr.strip()
+        for chr, region in get_region_list(self.params, self.sample_data):
             self.spec_script_name = self.jid_name_sep.join([self.step,self.name,self.sample_data["Title"],chr])
 
             input_file = self.sample_data[chr]["vcf"]
@@ -250,7 +254,17 @@ class Step_GATK_VQSR(Step):
             self.script = ""
             
              
-            self.script = my_SNP_VariantRecalibrator_string + my_SNP_ApplyRecalibration_string + my_INDEL_VariantRecalibrator_string + my_INDEL_ApplyRecalibration_string
+            for label, command, command_input in [("SNP_VariantRecalibrator", my_SNP_VariantRecalibrator_string, input_file),
+                                                  ("SNP_ApplyRecalibration", my_SNP_ApplyRecalibration_string, input_file),
+                                                  ("INDEL_VariantRecalibrator", my_INDEL_VariantRecalibrator_string, output_AppllyRecal_SNP),
+                                                  ("INDEL_ApplyRecalibration", my_INDEL_ApplyRecalibration_string, output_AppllyRecal_SNP)]:
+                self.script += get_telemetry_script(command=command,
+                                                    metrics_file=self.telemetry_file,
+                                                    step=self.step,
+                                                    name=self.name,
+                                                    sample="project_data",
+                                                    label=".".join([chr, label]),
+                                                    inputs=[command_input])
 
 
             self.sample_data[chr]["vcf"]= output_AppllyRecal_INDEL
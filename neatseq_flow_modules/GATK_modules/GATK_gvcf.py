@@ -11,6 +11,11 @@ A class that defines a module for generate gVCF file from BAM file.
 
 .. attention:: The module generate script for each sample-chromosom.
 
+.. Note:: Instead of passing ``chrom_list``, you can set ``scatter`` to the number of shards to split the work into.
+    The intervals are generated automatically from the reference ``.fai`` (or ``.dict``) file: Large chromosomes are
+    split into pieces and small contigs are packed together, so that all shards have about the same size.
+    One script is created per sample-shard. Downstream GATK modules use the same shards when ``chrom_list`` is not set.
+
 The programs included in the module are the following:
 
 * ``HaplotypeCaller`` (GATK) 
@@ -27,6 +32,10 @@ Output
 
 * ``self.sample_data[sample][chr]["GATK_g.vcf"]``
 
+* If ``scatter`` is set, the interval files are stored in:
+
+    * ``self.sample_data["project_data"]["scatter_intervals"]``
+
 Parameters that can be set
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
@@ -36,6 +45,18 @@ Parameters that can be set
 
     "genome_reference", "", ""
     "chrom_list", "Comma-separated list of chromosome names as mentioned in the BAM file"
+    "scatter", "Number of shards", "Use automatically generated, size-balanced intervals instead of ``chrom_list``"
+    "scatter_gap_size", "Integer", "When ``scatter`` is set, split large chromosomes at runs of N's of at least this length. Requires reading the reference fasta"
+    "telemetry", "empty | path to directory", "Record the resource usage of every HaplotypeCaller command in ``<step>.<name>.metrics.jsonl``, in the given directory or in the step directory. Summarize with ``utilities/telemetry.py collect``"
+    "resource_models", "path to models file", "Set ``-pe``, ``h_vmem`` and ``-nct`` of every script to values recommended from recorded metrics. See ``utilities/resources.py``"
+    "stage_inputs", "empty | path to node-local directory", "Copy the reference (with ``.fai`` and ``.dict``) and the sample BAM (with index) to node-local scratch. See note below."
+    "stage_streams", "integer", "Number of parallel streams for copying with ``stage_inputs``. Default: 4"
+    "step_cache", "empty | content", "Skip scripts whose command, BAM file, reference, intervals and module version did not change since the last successful execution. With ``content``, compare file contents rather than sizes and modification times. See ``utilities/step_cache.py``"
+
+.. Note:: With ``stage_inputs``, every script copies the reference and the BAM file to the given directory (default:
+    ``/tmp/neatseq_flow_inputs``) and runs HaplotypeCaller on the local copies. Jobs running on the same node, *e.g.*
+    the scripts of different chromosomes of a sample, share the copies, which are removed when the last of them
+    finishes. See ``neatseq_flow_modules/utilities/input_staging.py``.
 
 Lines for parameter file
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -53,6 +74,18 @@ Lines for parameter file
         redirects:
             -nct: 15
 
+**With automatic interval generation:**
+
+::
+
+    GATK_gvcf:
+        module: GATK_gvcf
+        base: GATK_pre_processing
+        script_path: /path/to/java -jar /path/to/GenomeAnalysisTK.jar
+        genome_reference:    /path/to/gatk/bundle/b37/human_g1k_v37_decoy.fasta
+        scatter:             50
+        scatter_gap_size:    1000
+
 References
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 Van der Auwera, Geraldine A., et al. "From FastQ data to high‐confidence variant calls: the genome analysis toolkit best practices pipeline." Current protocols in bioinformatics 43.1 (2013): 11-10.‏
@@ -63,9 +96,15 @@ Van der Auwera, Geraldine A., et al. "From FastQ data to high‐confidence varia
 import os
 import sys
 from neatseq_flow.PLC_step import Step,AssertionExcept
+from neatseq_flow_modules.utilities.intervals import *
+from neatseq_flow_modules.utilities.telemetry import *
+from neatseq_flow_modules.utilities.resources import *
+from neatseq_flow_modules.utilities.input_staging import *
+from neatseq_flow_modules.utilities.step_cache import *
 
 
 __author__ = "Michal Gordon"
+__version__ = "1.6.0"
 
 class Step_GATK_gvcf(Step):
     """ A class that defines a pipeline step name (=instance).
@@ -75,6 +114,14 @@ class Step_GATK_gvcf(Step):
     def step_specific_init(self):
         self.shell = "bash"      # Can be set to "bash" by inheriting instances
 
+        if "scatter" in self.params:
+            if "chrom_list" in self.params:
+                raise AssertionExcept("Please pass either 'chrom_list' or 'scatter', not both")
+            try:
+                self.params["scatter"] = int(self.params["scatter"])
+            except (TypeError, ValueError):
+                raise AssertionExcept("'scatter' must be the number of shards")
+
     def step_sample_initiation(self):
         """ A place to do initiation stages following setting of sample_data
         """
@@ -98,6 +145,18 @@ class Step_GATK_gvcf(Step):
         self.qsub_names=[]
         
        
+        if "scatter" in self.params:
+            shards = get_scatter_intervals(reference=self.params["genome_reference"],
+                                           shard_num=self.params["scatter"],
+                                           min_gap=self.params.get("scatter_gap_size"))
+            self.sample_data["project_data"]["scatter_intervals"] = \
+                write_scatter_intervals(shards, os.path.join(self.base_dir, "intervals"))
+
+        self.telemetry_file = get_telemetry_file(self.params, self.base_dir, self.step, self.name)
+        self.resource_models = get_resource_models(self.params)
+        self.stage_dir = get_input_stage_dir(self.params)
+        self.step_cache = get_step_cache_mode(self.params)
+
         # Each iteration must define the following class variables:
             # spec_qsub_name
             # spec_script_name
@@ -111,14 +170,19 @@ class Step_GATK_gvcf(Step):
             # Use the dir it returns as the base_dir for this step.
             use_dir = self.local_start(sample_dir)
             
-            for chr in self.params["chrom_list"].split(','):      # Getting list of cohorts out of cohort_hash
-                chr = chr.strip()
+            for chr, region in get_region_list(self.params, self.sample_data):
                 # Name of specific script:
             
                 self.spec_script_name = self.jid_name_sep.join([self.step,self.name,sample,chr])
                 self.script = ""
             
             
+                if self.stage_dir:
+                    self.script += get_input_stage_script(inputs=[("GATK_reference", self.params["genome_reference"], "reference"),
+                                                                  ("GATK_bam", self.sample_data[sample]["bam"], "bam")],
+                                                          stage_dir=self.stage_dir,
+                                                          streams=self.params.get("stage_streams"))
+
                 my_pre_string = """
 cd %(sample_dir)s
 
@@ -136,15 +200,24 @@ echo '\\n---------- Create gvcf file -------------\\n'
     -L %(my_chrom)s
                         
                 """ % {
-                        "genome_reference" : self.params["genome_reference"],
-                        "output_duplicates" : self.sample_data[sample]["bam"],
+                        "genome_reference" : "$GATK_reference" if self.stage_dir else self.params["genome_reference"],
+                        "output_duplicates" : "$GATK_bam" if self.stage_dir else self.sample_data[sample]["bam"],
                         "output_gvcf_creation" : sample_dir + sample + "_chr_" + chr + ".g.vcf",
-                        "my_chrom" : chr
+                        "my_chrom" : region
                 }          
                 
-                self.script = my_pre_string
-                self.script += self.get_script_const()
-                self.script += my_string
+                set_recommended_resources(self.params, self.resource_models, self.step,
+                                          inputs=[self.sample_data[sample]["bam"]],
+                                          threads_param="-nct")
+
+                self.script += my_pre_string
+                self.script += get_telemetry_script(command=self.get_script_const() + my_string,
+                                                    metrics_file=self.telemetry_file,
+                                                    step=self.step,
+                                                    name=self.name,
+                                                    sample=sample,
+                                                    label=chr,
+                                                    inputs=[self.sample_data[sample]["bam"]])
 
                 #self.get_script_env_path()
             
@@ -155,5 +228,14 @@ echo '\\n---------- Create gvcf file -------------\\n'
             
                 self.local_finish(use_dir,sample_dir)       # Sees to copying local files to final destination (and other stuff)
 
+                self.script = get_step_cache_script(command=self.script,
+                                                    mode=self.step_cache,
+                                                    cache_file=get_step_cache_file(sample_dir, self.spec_script_name),
+                                                    module=self.step,
+                                                    version=__version__,
+                                                    inputs=[self.params["genome_reference"],
+                                                            self.sample_data[sample]["bam"]] +
+                                                           ([region] if os.path.isfile(region) else []),
+                                                    outputs=[self.sample_data[sample][chr]["GATK_g.vcf"]])
                 self.create_low_level_script()
                     
@@ -41,6 +41,7 @@ Parameters that can be set
     "chrom_list",           "",      "Comma-separated list of chromosome names as mentioned in the BAM file"
     "filterExpression_SNP", "", "filter e xpression for SNP"
     "filterExpression_INDEL", "", "filter e xpression for INDEL"
+    "telemetry", "empty | path to directory", "Record the resource usage of every SelectVariants, VariantFiltration and CombineVariants command in ``<step>.<name>.metrics.jsonl``, in the given directory or in the step directory. Summarize with ``utilities/telemetry.py collect``"
 
 
 Lines for parameter file
@@ -67,10 +68,12 @@ Van der Auwera, Geraldine A., et al. "From FastQ data to high‐confidence varia
 import os
 import sys
 from neatseq_flow.PLC_step import Step,AssertionExcept
+from neatseq_flow_modules.utilities.intervals import *
+from neatseq_flow_modules.utilities.telemetry import *
 
 
 __author__ = "Michal Gordon"
-__version__ = "1.6.0"
+__version__ = "1.6.1"
 
 class Step_GATK_hard_filters(Step):
     """ A class that defines a pipeline step name (=instance).
@@ -109,9 +112,10 @@ class Step_GATK_hard_filters(Step):
         # script
 ######################################################## SNP
 
+        self.telemetry_file = get_telemetry_file(self.params, self.base_dir, self.step, self.name)
+
         use_dir = self.local_start(self.base_dir)
-        for chr in self.params["chrom_list"].split(','):
-            chr = chr.strip()
+        for chr, region in get_region_list(self.params, self.sample_data):
             self.spec_script_name = self.jid_name_sep.join([self.step,self.name,self.sample_data["Title"],chr])
 
             input_file = self.sample_data[chr]["vcf"]
@@ -138,7 +142,7 @@ class Step_GATK_hard_filters(Step):
                     "GATK_path" : self.params["script_path"],
                     "genome_reference" : self.params["genome_reference"],
                     "input_file" : input_file,
-                    "my_chrom" : chr,
+                    "my_chrom" : region,
                     "raw_snps" : raw_snps
 
             }      
@@ -160,7 +164,7 @@ class Step_GATK_hard_filters(Step):
                                 "genome_reference" : self.params["genome_reference"],
                                 "raw_snps" : raw_snps,
                                 "filtered_snps" : filtered_snps,
-                                "my_chrom" : chr,
+                                "my_chrom" : region,
                                 "filterExpression_SNP" : self.params["filterExpression_SNP"]
                         }             
 
@@ -181,7 +185,7 @@ class Step_GATK_hard_filters(Step):
                                 "GATK_path" : self.params["script_path"],
                                 "genome_reference" : self.params["genome_reference"],
                                 "input_file" : input_file,
-                                "my_chrom" : chr,
+                                "my_chrom" : region,
                                 "raw_indel" : raw_indel
 
                         }      
@@ -202,7 +206,7 @@ class Step_GATK_hard_filters(Step):
                     "GATK_path" : self.params["script_path"],
                     "genome_reference" : self.params["genome_reference"],
                     "raw_indel" : raw_indel,
-                    "my_chrom" : chr,
+                    "my_chrom" : region,
                     "filterExpression_INDEL" : self.params["filterExpression_INDEL"],
                     "filtered_indel" : filtered_indel
             }
@@ -227,18 +231,25 @@ class Step_GATK_hard_filters(Step):
                     "filtered_indel" : filtered_indel,
                     "filtered_snps" : filtered_snps,
                     "dir"            : use_dir,
-                    "my_chrom" : chr,
+                    "my_chrom" : region,
                     "hard_filtering" : hard_filtering
             }
             
             self.script = ""
         
          
-            self.script = Select_SNP_Variants_string + \
-                        SNP_VariantFiltration_string + \
-                        Select_INDEL_Variants_string + \
-                        INDEL_VariantFiltration_string + \
-                        CombineVariants_string
+            for label, command, command_inputs in [("Select_SNP", Select_SNP_Variants_string, [input_file]),
+                                                   ("SNP_VariantFiltration", SNP_VariantFiltration_string, [raw_snps]),
+                                                   ("Select_INDEL", Select_INDEL_Variants_string, [input_file]),
+                                                   ("INDEL_VariantFiltration", INDEL_VariantFiltration_string, [raw_indel]),
+                                                   ("CombineVariants", CombineVariants_string, [filtered_snps, filtered_indel])]:
+                self.script += get_telemetry_script(command=command,
+                                                    metrics_file=self.telemetry_file,
+                                                    step=self.step,
+                                                    name=self.name,
+                                                    sample="project_data",
+                                                    label=".".join([chr, label]),
+                                                    inputs=command_inputs)
                         
             self.sample_data[chr]["vcf"]= self.base_dir + hard_filtering
             self.stamp_file(self.sample_data[chr]["vcf"])
@@ -39,6 +39,7 @@ Parameters that can be set
     "genome_reference", "", ""
     "chrom_list", "Comma-separated list of chromosome names as mentioned in the BAM file"
     "cohort_size", "", "number of g.vcf file to be in each cohort"
+    "telemetry", "empty | path to directory", "Record the resource usage of every CombineGVCFs command in ``<step>.<name>.metrics.jsonl``, in the given directory or in the step directory. Summarize with ``utilities/telemetry.py collect``"
 
 
 Lines for parameter file
@@ -65,10 +66,12 @@ Van der Auwera, Geraldine A., et al. "From FastQ data to high‐confidence varia
 import os
 import sys
 from neatseq_flow.PLC_step import Step,AssertionExcept
+from neatseq_flow_modules.utilities.intervals import *
+from neatseq_flow_modules.utilities.telemetry import *
 
 
 __author__ = "Michal Gordon"
-__version__ = "1.6.0"
+__version__ = "1.6.1"
 
 class Step_GATK_merge_gvcf(Step):
     """ A class that defines a pipeline step name (=instance).
@@ -104,6 +107,7 @@ class Step_GATK_merge_gvcf(Step):
         # Prepare a list to store the qsub names of this steps scripts (will then be put in pipe_data and returned somehow)
         self.qsub_names=[]
         
+        self.telemetry_file = get_telemetry_file(self.params, self.base_dir, self.step, self.name)
        
         # Each iteration must define the following class variables:
             # spec_qsub_name
@@ -125,13 +129,14 @@ class Step_GATK_merge_gvcf(Step):
                 
             new_sample_list.append(cohort_name)
             
-            for chr in self.params["chrom_list"].split(','):
-                chr = chr.strip()
+            for chr, region in get_region_list(self.params, self.sample_data):
                 my_variant_string = ""
+                cohort_gvcfs = list()
 
                 
                 for sample in cohort:
                     my_variant_string += "\t--variant " + self.sample_data[sample][chr]["GATK_g.vcf"] + " \\\n"     # Getting list of samples within cohort
+                    cohort_gvcfs.append(self.sample_data[sample][chr]["GATK_g.vcf"])
 #                   self.sample_data[sample][chr]["cohort"] = cohort_name
                 
                 
@@ -159,7 +164,13 @@ echo '\\n---------- Create gvcf file -------------\\n'
                         "output_cohort_gvcf_creation" : "{d}{n}.chr{c}.g.vcf".format(d = sample_dir, n = cohort_name, c= chr),
                         "my_variant" : my_variant_string                    
                 }
-                self.script += my_string
+                self.script += get_telemetry_script(command=my_string,
+                                                    metrics_file=self.telemetry_file,
+                                                    step=self.step,
+                                                    name=self.name,
+                                                    sample=cohort_name,
+                                                    label=chr,
+                                                    inputs=cohort_gvcfs)
                 #self.get_script_env_path()
                 
                 self.sample_data[cohort_name][chr] = {}
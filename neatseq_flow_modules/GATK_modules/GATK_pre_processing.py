@@ -11,6 +11,11 @@ A class that defines a module for generating *ready-to-GATK-use* BAM files from
 
 .. attention:: The module lacks the "base recalibration process (BQSR)" step
 
+.. Note:: If ``piped`` is set, ``MarkIlluminaAdapters``, ``SamToFastq``, ``BWA MEM`` and ``MergeBamAlignment`` are
+    connected by pipes, as in the GATK best-practice "piped" command, so that no intermediate BAM or fastq files are
+    written to disk. Only the uBAM (required by ``MergeBamAlignment``), the final BAM and the metrics are written.
+    The JVM heap sizes and the number of ``BWA MEM`` threads are derived from ``memory`` and ``threads``.
+
 The programs included in the module are the following:
 
 * ``FastqToSam`` Picard tool to generate uBAM
@@ -47,6 +52,10 @@ Parameters that can be set
     "picard_path", "path to PICARD", "Full path to the PICARD .jar file"
     "bwa_mem_path", "", ""
     "genome_reference", "", ""
+    "threads", "", "Number of threads"
+    "piped", "", "Connect the adapter marking, mapping and merging stages with pipes. See note above"
+    "memory", "GB", "Memory available to the job, used for sizing the JVM heaps in ``piped`` mode. Default: 16"
+    "telemetry", "empty | path to directory", "Record the resource usage of the processing of every sample in ``<step>.<name>.metrics.jsonl``, in the given directory or in the step directory. Summarize with ``utilities/telemetry.py collect``"
 
 Lines for parameter file
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -64,6 +73,23 @@ Lines for parameter file
         qsub_params:
             -pe: shared 20
 
+**Piped mode:**
+
+::
+
+    GATK_pre_processing:
+        module: GATK_pre_processing
+        base: fQC_trim
+        script_path: /path/to/java -jar /path/to/GenomeAnalysisTK.jar
+        picard_path:     java -jar /path/to/picard.jar
+        bwa_mem_path:    /path/to/bwa mem
+        genome_reference:    /path/to/gatk/bundle/b37/human_g1k_v37_decoy.fasta
+        piped:
+        threads: 20
+        memory: 64
+        qsub_params:
+            -pe: shared 20
+
 
 
 References
@@ -75,10 +101,11 @@ http://broadinstitute.github.io/picard/
 import os
 import sys
 from neatseq_flow.PLC_step import Step,AssertionExcept
+from neatseq_flow_modules.utilities.telemetry import *
 
 
 __author__ = "Michal Gordon"
-__version__ = "1.6.0"
+__version__ = "1.6.2"
 
 class Step_GATK_pre_processing(Step):
     """ A class that defines a pipeline step name (=instance).
@@ -88,6 +115,18 @@ class Step_GATK_pre_processing(Step):
     def step_specific_init(self):
         self.shell = "bash"      # Can be set to "bash" by inheriting instances
 
+        if "piped" in self.params:
+            try:
+                self.params["memory"] = int(self.params["memory"]) if "memory" in self.params else 16
+                self.params["threads"] = int(self.params["threads"]) if "threads" in self.params else 1
+            except (TypeError, ValueError):
+                raise AssertionExcept("'memory' and 'threads' must be integers")
+            # Reserving memory for the BWA index. The rest is divided between the JVMs.
+            # MergeBamAlignment gets a double share.
+            self.java_heap = max(1, (self.params["memory"] - 6) // 4)
+            # Three JVMs are running alongside BWA:
+            self.bwa_threads = max(1, self.params["threads"] - 3)
+
     def step_sample_initiation(self):
         """ A place to do initiation stages following setting of sample_data
         """
@@ -101,12 +140,28 @@ class Step_GATK_pre_processing(Step):
             
             
     
+    def get_picard_cmd(self, heap):
+        """ Return the picard command with a JVM heap size of 'heap' GB.
+            Works for 'java -jar picard.jar' as well as for the picard wrapper script, which passes -X options to java.
+        """
+
+        if self.params["picard_path"].split()[0].endswith("java"):
+            java, rest = self.params["picard_path"].split(None, 1)
+            return "{java} -Xmx{heap}g {rest}".format(java=java, heap=heap, rest=rest)
+        return "{picard} -Xmx{heap}g".format(picard=self.params["picard_path"], heap=heap)
+
     def build_scripts(self):
         """ This is the actual script building function
-            Most, if not all, editing should be done here 
+            Most, if not all, editing should be done here
             HOWEVER, DON'T FORGET TO CHANGE THE CLASS NAME AND THE FILENAME!
         """
-        
+
+        self.telemetry_file = get_telemetry_file(self.params, self.base_dir, self.step, self.name)
+
+        if "piped" in self.params:
+            self.build_scripts_piped()
+            return
+
         # Prepare a list to store the qsub names of this steps scripts (will then be put in pipe_data and returned somehow)
         self.qsub_names=[]
         
@@ -214,7 +269,15 @@ echo '\\n---------- Mark dup -------------\\n'
 
             }
             
-            my_string += """
+            self.script += get_telemetry_script(command=my_string,
+                                                metrics_file=self.telemetry_file,
+                                                step=self.step,
+                                                name=self.name,
+                                                sample=sample,
+                                                inputs=[self.sample_data[sample]["fastq.F"],
+                                                        self.sample_data[sample]["fastq.R"]])
+
+            my_string = """
 rm -rf {merge_bam} \
     {merge_bai} \
     {bwa_mem_bam} \
@@ -243,4 +306,137 @@ rm -rf {merge_bam} \
             self.local_finish(use_dir,sample_dir)       # Sees to copying local files to final destination (and other stuff)
 
             self.create_low_level_script()
-                    
+
+    def build_scripts_piped(self):
+        """ Build scripts in which the adapter marking, mapping and merging stages are connected by pipes
+        """
+
+        for sample in self.sample_data["samples"]:      # Getting list of samples out of samples_hash
+
+            # Name of specific script:
+            self.spec_script_name = self.jid_name_sep.join([self.step,self.name,sample])
+            self.script = ""
+
+            # Make a dir for the current sample:
+            sample_dir = self.make_folder_for_sample(sample)
+
+            # This line should be left before every new script. It sees to local issues.
+            # Use the dir it returns as the base_dir for this step.
+            use_dir = self.local_start(sample_dir)
+
+            my_string = """
+set -o pipefail
+cd %(sample_dir)s
+echo '\\n---------- generate uBAM -------------\\n'
+%(picard_small)s FastqToSam \\
+    FASTQ=%(Forword_reads)s \\
+    FASTQ2=%(Revers_reads)s \\
+    OUTPUT=%(output_uBAM)s \\
+    READ_GROUP_NAME=%(sample_name)s \\
+    SAMPLE_NAME=%(sample_name)s \\
+    LIBRARY_NAME=%(group_name)s \\
+    PLATFORM_UNIT=Unit1 \\
+    PLATFORM=illumina \\
+    SEQUENCING_CENTER=BI \\
+    TMP_DIR=%(sample_dir)s \\
+    RUN_DATE=2016-08-20T00:00:00-0400
+if [ $? -ne 0 ]; then
+    echo "FastqToSam failed"
+    exit 1
+fi
+
+echo '\\n---------- MarkIlluminaAdapters | SamToFastq | BWA MEM | MergeBamAlignment -------------\\n'
+%(picard_small)s MarkIlluminaAdapters \\
+    I=%(output_uBAM)s \\
+    O=/dev/stdout \\
+    M=%(matrix_markilluminaadapters)s \\
+    COMPRESSION_LEVEL=0 \\
+    QUIET=true \\
+    TMP_DIR=%(sample_dir)s | \\
+%(picard_small)s SamToFastq \\
+    I=/dev/stdin \\
+    FASTQ=/dev/stdout \\
+    CLIPPING_ATTRIBUTE=XT \\
+    CLIPPING_ACTION=2 \\
+    INTERLEAVE=true \\
+    NON_PF=true \\
+    QUIET=true \\
+    TMP_DIR=%(sample_dir)s | \\
+%(path_bwa_mem)s -M -t %(thread_number)s -p %(genome_reference)s \\
+    /dev/stdin | \\
+%(picard_large)s MergeBamAlignment \\
+    R=%(genome_reference)s \\
+    UNMAPPED_BAM=%(output_uBAM)s \\
+    ALIGNED_BAM=/dev/stdin \\
+    O=%(output_merge_bam_ubam)s \\
+    CREATE_INDEX=true \\
+    ADD_MATE_CIGAR=true \\
+    CLIP_ADAPTERS=false \\
+    CLIP_OVERLAPPING_READS=true \\
+    INCLUDE_SECONDARY_ALIGNMENTS=true \\
+    MAX_INSERTIONS_OR_DELETIONS=-1 \\
+    PRIMARY_ALIGNMENT_STRATEGY=MostDistant \\
+    ATTRIBUTES_TO_RETAIN=XS \\
+    TMP_DIR=%(sample_dir)s
+if [ $? -ne 0 ]; then
+    echo "Mapping pipe failed. Keeping %(output_uBAM)s"
+    exit 1
+fi
+
+echo '\\n---------- Mark dup -------------\\n'
+%(picard_large)s MarkDuplicates \\
+    INPUT=%(output_merge_bam_ubam)s \\
+    OUTPUT=%(output_duplicates)s \\
+    METRICS_FILE=%(matrix_duplicates)s \\
+    OPTICAL_DUPLICATE_PIXEL_DISTANCE=2500 \\
+    CREATE_INDEX=true \\
+    TMP_DIR=%(sample_dir)s
+if [ $? -ne 0 ]; then
+    echo "MarkDuplicates failed. Keeping intermediate files"
+    exit 1
+fi
+""" % { "sample_dir" : sample_dir,
+        "picard_small" : self.get_picard_cmd(self.java_heap),
+        "picard_large" : self.get_picard_cmd(2 * self.java_heap),
+        "Forword_reads" : self.sample_data[sample]["fastq.F"],
+        "Revers_reads" : self.sample_data[sample]["fastq.R"],
+        "output_uBAM" : sample_dir + sample + "_fastqtosam.bam",
+        "matrix_markilluminaadapters": sample_dir + sample + "_markilluminaadapters_metrics.txt",
+        "group_name" : "OCD",
+        "sample_name" : sample,
+        "path_bwa_mem" : self.params["bwa_mem_path"],
+        "genome_reference" : self.params["genome_reference"],
+        "output_merge_bam_ubam" : sample_dir + sample + "_merge.bam",
+        "merge_bai" : sample_dir + sample + "_merge.bai",
+        "output_duplicates" : sample_dir + sample + "_duplicates.bam",
+        "matrix_duplicates" : sample_dir + sample + "_matrix_duplicates.txt",
+        "thread_number" : self.bwa_threads
+}
+
+            self.script = get_telemetry_script(command=my_string,
+                                               metrics_file=self.telemetry_file,
+                                               step=self.step,
+                                               name=self.name,
+                                               sample=sample,
+                                               inputs=[self.sample_data[sample]["fastq.F"],
+                                                       self.sample_data[sample]["fastq.R"]])
+            if self.telemetry_file:
+                # The stages run in a child shell, which exits on failure
+                self.script += "if [ $? -ne 0 ]; then exit 1; fi\n"
+
+            self.script += """
+# Removing intermediate files only once all stages succeeded
+rm -rf {merge_bam} \\
+    {merge_bai} \\
+    {uBAM}
+
+""".format(merge_bam=sample_dir + sample + "_merge.bam",
+           merge_bai=sample_dir + sample + "_merge.bai",
+           uBAM=sample_dir + sample + "_fastqtosam.bam")
+
+            self.sample_data[sample]["bam"] = sample_dir + sample + "_duplicates.bam"
+            self.stamp_file(self.sample_data[sample]["bam"])
+
+            self.local_finish(use_dir,sample_dir)       # Sees to copying local files to final destination (and other stuff)
+
+            self.create_low_level_script()
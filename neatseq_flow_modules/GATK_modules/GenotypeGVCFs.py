@@ -11,6 +11,16 @@ A class that defines a module for perform joint genotyping on gVCF files produce
 
 .. attention:: The module generate script for each cohort-chromosom.
 
+.. Note:: If ``chrom_list`` is not passed, the module uses the size-balanced shards created by ``GATK_gvcf`` with
+    ``scatter``. In this case, the per-shard VCFs are also gathered, in reference order, into a single project VCF.
+
+.. Note:: If ``genomicsdb_workspace`` is set, the module does not use the cohorts created by ``GATK_merge_gvcf``.
+    Instead, the per-sample gVCFs created by ``GATK_gvcf`` are imported into a GenomicsDB workspace per chromosome
+    (or shard), and genotyping is performed directly from the workspace. The workspaces and a manifest of the imported
+    samples are kept in the ``genomicsdb_workspace`` directory, so that when samples are added to the project and the
+    workflow is re-run, only the new samples are imported (with ``--genomicsdb-update-workspace-path``).
+    This mode requires GATK4: set ``script_path`` to the ``gatk`` launcher.
+
 The programs included in the module are the following:
 
 * ``GenotypeGVCFs`` (GATK) 
@@ -22,12 +32,20 @@ Requires
 
 * ``self.sample_data["cohorts"]``
 
+* Or, if ``genomicsdb_workspace`` is set:
+
+    * ``self.sample_data[sample][chr]["GATK_g.vcf"]``
+
 
 Output
 ~~~~~~~~~~~~~~~~~~~~
 
 * ``self.sample_data[chr]["vcf"]``
 
+* If working on shards, the gathered VCF is stored in:
+
+    * ``self.sample_data["project_data"]["vcf"]``
+
 Parameters that can be set
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
@@ -36,7 +54,9 @@ Parameters that can be set
     :widths: 15, 10, 10
 
     "genome_reference", "", ""
-    "chrom_list", "", "list of chromosomes names as mentioned in BAM file separated by ','"
+    "chrom_list", "", "list of chromosomes names as mentioned in BAM file separated by ','. If not passed, using shards defined by ``GATK_gvcf``"
+    "genomicsdb_workspace", "path", "Use GenomicsDB workspaces in this directory for joint genotyping. See note above."
+    "telemetry", "empty | path to directory", "Record the resource usage of every GenotypeGVCFs and GenomicsDBImport command in ``<step>.<name>.metrics.jsonl``, in the given directory or in the step directory. Summarize with ``utilities/telemetry.py collect``"
 
 
 Lines for parameter file
@@ -51,6 +71,17 @@ Lines for parameter file
         chrom_list: "1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 20, 21, 22, X, Y, MT" 
         genome_reference:   /path/to/gatk/bundle/b37/human_g1k_v37_decoy.fasta
 
+**Joint genotyping from GenomicsDB workspaces:**
+
+::
+
+    GenotypeGVCFs1:
+        module: GenotypeGVCFs
+        base: GATK_gvcf
+        script_path:     /path/to/gatk
+        genome_reference:   /path/to/gatk/bundle/b37/human_g1k_v37_decoy.fasta
+        genomicsdb_workspace:   /path/to/persistent/genomicsdb
+
 
 References
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -61,10 +92,12 @@ Van der Auwera, Geraldine A., et al. "From FastQ data to high‐confidence varia
 import os
 import sys
 from neatseq_flow.PLC_step import Step,AssertionExcept
+from neatseq_flow_modules.utilities.intervals import *
+from neatseq_flow_modules.utilities.telemetry import *
 
 
 __author__ = "Michal Gordon"
-__version__ = "1.6.0"
+__version__ = "1.6.1"
 
 class Step_GenotypeGVCFs(Step):
     """ A class that defines a pipeline step name (=instance).
@@ -77,13 +110,41 @@ class Step_GenotypeGVCFs(Step):
     def step_sample_initiation(self):
         """ A place to do initiation stages following setting of sample_data
         """
-        pass
+
+        if "genomicsdb_workspace" in self.params:
+            # Report samples already imported in previous runs. The actual check is done at run time.
+            for chr, region in get_region_list(self.params, self.sample_data):
+                manifest = os.path.join(self.params["genomicsdb_workspace"], chr + ".samples")
+                if os.path.isfile(manifest):
+                    with open(manifest, "r") as manifest_fh:
+                        imported = set(manifest_fh.read().split())
+                    new_samples = [sample for sample in self.sample_data["samples"] if sample not in imported]
+                    self.write_warning("{num} new samples will be imported into GenomicsDB workspace for {chr}".
+                                       format(num=len(new_samples), chr=chr))
+        elif "cohorts" not in self.sample_data:
+            raise AssertionExcept("No cohorts defined. Do you have a GATK_merge_gvcf step defined?")
         
     def create_spec_wrapping_up_script(self):
         """ Add stuff to check and agglomerate the output data
         """
-        
-        pass
+
+        # When working on shards, gather the shard VCFs in reference order.
+        # Shards are non-overlapping and ordered, so concatenating the bodies after the first header is sufficient.
+        if "chrom_list" not in self.params:
+            shard_vcfs = [self.sample_data[chr]["vcf"]
+                          for chr, region in get_region_list(self.params, self.sample_data)]
+            output_vcf = "{d}{s}.joint_genotyping.vcf".format(d=self.base_dir, s=self.sample_data["Title"])
+
+            self.script = """
+echo '\\n---------- Gathering shard VCFs -------------\\n'
+awk 'FNR==1 {{file_num++}} file_num==1 || !/^#/' \\
+    {shard_vcfs} \\
+    > {output_vcf}
+""".format(shard_vcfs=" \\\n    ".join(shard_vcfs),
+           output_vcf=output_vcf)
+
+            self.sample_data["project_data"]["vcf"] = output_vcf
+            self.stamp_file(self.sample_data["project_data"]["vcf"])
             
             
     
@@ -102,15 +163,21 @@ class Step_GenotypeGVCFs(Step):
             # spec_script_name
             # script
 
+        self.telemetry_file = get_telemetry_file(self.params, self.base_dir, self.step, self.name)
+
+        if "genomicsdb_workspace" in self.params:
+            self.build_scripts_genomicsdb()
+            return
 
         use_dir = self.local_start(self.base_dir)
         
-        for chr in self.params["chrom_list"].split(','):
-            chr = chr.strip()
+        for chr, region in get_region_list(self.params, self.sample_data):
             my_variant_string = ""
+            cohort_gvcfs = list()
 
             for cohort_gvcf in self.sample_data["cohorts"]:
                 my_variant_string += "    --variant " + self.sample_data[cohort_gvcf][chr]["g.vcf"] + " \\\n"     # Getting list of samples within cohort
+                cohort_gvcfs.append(self.sample_data[cohort_gvcf][chr]["g.vcf"])
 
 #            self.sample_data["original_samples"] = self.sample_data["samples"]
 #            self.sample_data["samples"] = self.params["chrom_list"]
@@ -143,11 +210,17 @@ echo '\\n---------- Create gvcf file -------------\\n'
                     "genome_reference" : self.params["genome_reference"],
                     "output_vcf_creation" : "{d}{s}.joint_genotyping.vcf".format(d = use_dir, s = chr), #dir????????????
                     "my_variant" : my_variant_string,
-                    "my_chrom" : chr
+                    "my_chrom" : region
             }
             
             
-            self.script += my_string
+            self.script += get_telemetry_script(command=my_string,
+                                                metrics_file=self.telemetry_file,
+                                                step=self.step,
+                                                name=self.name,
+                                                sample="project_data",
+                                                label=chr,
+                                                inputs=cohort_gvcfs)
             #self.get_script_env_path()
             
             self.sample_data[chr] = dict()
@@ -158,3 +231,118 @@ echo '\\n---------- Create gvcf file -------------\\n'
             self.local_finish(use_dir,sample_dir)
 
             self.create_low_level_script()
+
+    def build_scripts_genomicsdb(self):
+        """ Build scripts importing the gVCFs into GenomicsDB workspaces and genotyping from the workspaces.
+            Only samples not in the workspace manifest are imported.
+        """
+
+        workspace_dir = self.params["genomicsdb_workspace"].rstrip(os.sep) + os.sep
+
+        for chr, region in get_region_list(self.params, self.sample_data):
+
+            # Name of specific script:
+            self.spec_script_name = self.jid_name_sep.join([self.step,self.name,chr])
+            self.script = ""
+
+            # Make a dir for the current sample:
+            sample_dir = self.make_folder_for_sample(chr)
+
+            # This line should be left before every new script. It sees to local issues.
+            # Use the dir it returns as the base_dir for this step.
+            use_dir = self.local_start(sample_dir)
+
+            # Write the map of all samples. Samples already in the workspace are removed from it at run time
+            sample_map = sample_dir + chr + ".sample_map"
+            sample_gvcfs = [self.sample_data[sample][chr]["GATK_g.vcf"] for sample in self.sample_data["samples"]]
+            with open(sample_map + ".all", "w") as sample_map_fh:
+                for sample, gvcf in zip(self.sample_data["samples"], sample_gvcfs):
+                    sample_map_fh.write("{sample}\t{gvcf}\n".format(sample=sample, gvcf=gvcf))
+
+            output_vcf = "{d}{s}.joint_genotyping.vcf".format(d=use_dir, s=chr)
+            workspace = workspace_dir + chr
+
+            import_command = """\
+{GATK_path} GenomicsDBImport \\
+    $workspace_arg \\
+    --sample-name-map {sample_map}
+""".format(GATK_path=self.params["script_path"],
+           sample_map=sample_map)
+
+            genotype_command = """\
+{GATK_path} GenotypeGVCFs \\
+    -R {genome_reference} \\
+    -V gendb://{workspace} \\
+    -L {region} \\
+    -O {output_vcf}
+""".format(GATK_path=self.params["script_path"],
+           genome_reference=self.params["genome_reference"],
+           workspace=workspace,
+           region=region,
+           output_vcf=output_vcf)
+
+            self.script = """
+mkdir -p {workspace_dir}
+exec 9> {workspace}.lock
+flock -x 9
+
+# Keep only samples not yet imported into the workspace
+touch {manifest}
+awk 'FILENAME == ARGV[1] {{imported[$1]; next}} !($1 in imported)' \\
+    {manifest} \\
+    {sample_map}.all \\
+    > {sample_map}
+
+if [ -s {sample_map} ]; then
+    echo '\\n---------- Importing gVCFs into GenomicsDB -------------\\n'
+    if [ -d {workspace} ]; then
+        workspace_new=""
+        workspace_arg="--genomicsdb-update-workspace-path {workspace}"
+    else
+        workspace_new=yes
+        workspace_arg="--genomicsdb-workspace-path {workspace} -L {region}"
+    fi
+{import_command}
+    # Record the samples in the manifest only if the import succeeded
+    if [ $? -eq 0 ]; then
+        cut -f1 {sample_map} >> {manifest}
+    else
+        echo "GenomicsDBImport failed. Not genotyping"
+        if [ -n "$workspace_new" ]; then
+            rm -rf {workspace}
+        fi
+        exit 1
+    fi
+fi
+flock -u 9
+exec 9>&-
+
+echo '\\n---------- Genotyping from GenomicsDB -------------\\n'
+{genotype_command}
+""".format(import_command=get_telemetry_script(command=import_command,
+                                               metrics_file=self.telemetry_file,
+                                               step=self.step,
+                                               name=self.name,
+                                               sample="project_data",
+                                               label=".".join([chr, "GenomicsDBImport"]),
+                                               inputs=sample_gvcfs).strip("\n"),
+           genotype_command=get_telemetry_script(command=genotype_command,
+                                                 metrics_file=self.telemetry_file,
+                                                 step=self.step,
+                                                 name=self.name,
+                                                 sample="project_data",
+                                                 label=chr),
+           workspace_dir=workspace_dir,
+           workspace=workspace,
+           manifest=workspace_dir + chr + ".samples",
+           sample_map=sample_map,
+           region=region)
+
+            self.sample_data[chr] = dict()
+
+            self.sample_data[chr]["vcf"] = output_vcf
+            self.stamp_file(self.sample_data[chr]["vcf"])
+
+            self.local_finish(use_dir,sample_dir)
+
+            self.create_low_level_script()
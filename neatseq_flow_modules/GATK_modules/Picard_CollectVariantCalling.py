@@ -50,6 +50,7 @@ http://broadinstitute.github.io/picard/
 import os
 import sys
 from neatseq_flow.PLC_step import Step,AssertionExcept
+from neatseq_flow_modules.utilities.intervals import *
 
 
 __author__ = "Michal Gordon"
@@ -91,9 +92,8 @@ class Step_Picard_CollectVariantCalling(Step):
             # script
         use_dir = self.local_start(self.base_dir)
 
-        for chr in self.params["chrom_list"].split(','):
+        for chr, region in get_region_list(self.params, self.sample_data):
             self.script = ""
-            chr = chr.strip()
             self.spec_script_name = self.jid_name_sep.join([self.step,self.name,self.sample_data["Title"],chr])
 
             input_file = self.sample_data[chr]["vcf"]
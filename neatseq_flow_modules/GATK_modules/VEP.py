@@ -11,6 +11,15 @@ A class that defines a module for annotation of the multi VCF file
 
 .. attention:: The module generates a script for each chromosome.
 
+.. Note:: If ``shards`` is set, the module generates ``shards`` scripts for each chromosome. The chromosome VCF is
+    compressed with ``bgzip`` and indexed with ``tabix``, and divided into ranges with similar numbers of records,
+    based on the tabix index. VEP is run on each range with ``--offline --cache --fork``, and the per-range outputs are
+    concatenated in order, with the header written once.
+
+.. Note:: When using the VEP cache (``shards`` mode or ``--offline``/``--cache`` redirects), the cache directory is
+    checked when building the scripts, and an error is raised if it does not contain a cache for the requested species,
+    assembly and ``--cache_version``.
+
 The programs included in the module are the following:
 
 * ``VEP`` (`Variant Effect Predictor <https://www.ensembl.org/info/docs/tools/vep/index.html>`_. )
@@ -37,6 +46,9 @@ Parameters that can be set
     :widths: 15, 10, 10
 
     "chrom_list", "Comma-separated list of chromosome names as mentioned in the BAM file"
+    "shards", "int", "Number of ranges to divide each chromosome VCF into. See note above"
+    "tabix_path", "", "Path to tabix, used when ``shards`` is set. Default: 'tabix'"
+    "bgzip_path", "", "Path to bgzip, used when ``shards`` is set. Default: 'bgzip'"
 
 .. Note:: VEP parameters can be passed via ``redirects``
 
@@ -64,6 +76,29 @@ Lines for parameter file
             --force_overwrite: null
             --vcf: null
 
+**Sharded mode:**
+
+::
+
+    VEP1:
+        module: VEP
+        base: GATK_hard_filters1
+        script_path: /path/to/vep
+        chrom_list: "1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 20, 21, 22, X, Y, MT"
+        shards: 10
+        tabix_path: /path/to/tabix
+        bgzip_path: /path/to/bgzip
+        redirects:
+            --format: vcf
+            --species: homo_sapiens
+            --fork: 4
+            --buffer_size: 10000
+            --assembly: GRCh37
+            --cache_version: 88
+            --dir_cache: /path/to/VEP/cache
+            --pick: null
+            --vcf: null
+
 References
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 McLaren, William, et al. "The ensembl variant effect predictor." Genome biology 17.1 (2016): 122.‏
@@ -72,12 +107,14 @@ McLaren, William, et al. "The ensembl variant effect predictor." Genome biology
 
 
 import os
+import re
 import sys
 from neatseq_flow.PLC_step import Step,AssertionExcept
+from neatseq_flow_modules.utilities.intervals import *
 
 
 __author__ = "Michal Gordon"
-__version__ = "1.6.0"
+__version__ = "1.6.1"
 
 class Step_VEP(Step):
     """ A class that defines a pipeline step name (=instance).
@@ -87,16 +124,148 @@ class Step_VEP(Step):
     def step_specific_init(self):
         self.shell = "bash"      # Can be set to "bash" by inheriting instances
 
+        if "shards" in self.params:
+            try:
+                self.params["shards"] = int(self.params["shards"])
+            except (TypeError, ValueError):
+                raise AssertionExcept("'shards' must be an integer")
+            if "--compress_output" in self.params["redir_params"]:
+                raise AssertionExcept("--compress_output can't be used with 'shards'")
+            # Shards are run from the local cache
+            for option in ["--offline", "--cache"]:
+                if option not in self.params["redir_params"]:
+                    self.params["redir_params"][option] = None
+            if "--fork" not in self.params["redir_params"]:
+                self.params["redir_params"]["--fork"] = 4
+            for prog in ["tabix", "bgzip"]:
+                if prog + "_path" not in self.params:
+                    self.params[prog + "_path"] = prog
+
+        if "--offline" in self.params["redir_params"] or "--cache" in self.params["redir_params"]:
+            self.check_vep_cache()
+
+    def check_vep_cache(self):
+        """ Make sure the cache directory contains a cache for the requested species, assembly and version.
+            Cache layout is <dir_cache>/<species>/<version>_<assembly>
+        """
+
+        redir_params = self.params["redir_params"]
+        cache_dir = redir_params.get("--dir_cache") or redir_params.get("--dir") or os.path.expanduser("~/.vep")
+        species = redir_params.get("--species") or "homo_sapiens"
+        if "--merged" in redir_params:
+            species += "_merged"
+        elif "--refseq" in redir_params:
+            species += "_refseq"
+        assembly = redir_params.get("--assembly")
+        version = redir_params.get("--cache_version")
+
+        species_dir = os.path.join(cache_dir, species)
+        if not os.path.isdir(species_dir):
+            raise AssertionExcept("No VEP cache for {species} in {dir}".format(species=species, dir=cache_dir))
+        caches = [cache.split("_", 1)
+                  for cache in sorted(os.listdir(species_dir))
+                  if re.match(r"^\d+_\S+$", cache) and os.path.isdir(os.path.join(species_dir, cache))]
+        matching = [cache for cache in caches
+                    if (version is None or cache[0] == str(version)) and (assembly is None or cache[1] == assembly)]
+        available = ", ".join("_".join(cache) for cache in caches) or "none"
+        if not matching:
+            raise AssertionExcept("No VEP cache matching version {version} and assembly {assembly} in {dir}. "
+                                  "Available caches: {available}".format(version=version or "(any)",
+                                                                         assembly=assembly or "(any)",
+                                                                         dir=species_dir,
+                                                                         available=available))
+        if assembly is None and len(set(cache[1] for cache in matching)) > 1:
+            raise AssertionExcept("VEP cache in {dir} contains more than one assembly ({available}). "
+                                  "Please pass --assembly in redirects".format(dir=species_dir, available=available))
+
     def step_sample_initiation(self):
         """ A place to do initiation stages following setting of sample_data
         """
-        pass
-        
+
+        if "shards" in self.params:
+            # Storing the input VCFs. The vcf slots are replaced with the output when building the scripts
+            self.shard_inputs = dict()
+            for chr, region in get_region_list(self.params, self.sample_data):
+                input_file = self.sample_data[chr]["vcf"]
+                if input_file.endswith(".gz"):
+                    self.shard_inputs[chr] = (input_file, input_file)
+                else:
+                    self.shard_inputs[chr] = (input_file, self.base_dir + "shards" + os.sep + chr + ".input.vcf.gz")
+
+    def create_spec_preliminary_script(self):
+        """ Add script to run BEFORE all other steps
+        """
+
+        if "shards" not in self.params:
+            return
+
+        # Compressing and indexing the VCFs and dividing them into ranges.
+        shard_script = os.path.join(os.path.dirname(os.path.realpath(__file__)), "vep_shard_vcf.py")
+        shards_dir = self.make_folder_for_sample("shards")
+        self.script = ""
+        for chr, region in get_region_list(self.params, self.sample_data):
+            input_file, input_gz = self.shard_inputs[chr]
+            if input_file != input_gz:
+                self.script += "{bgzip} -c {input_file} > {input_gz}\n".format(bgzip=self.params["bgzip_path"],
+                                                                             input_file=input_file,
+                                                                             input_gz=input_gz)
+            self.script += """\
+if [ ! -f {input_gz}.tbi ] || [ {input_gz}.tbi -ot {input_gz} ]; then
+    {tabix} -f -p vcf {input_gz}
+fi
+python {shard_script} -V {input_gz} -n {shards} -o {prefix}
+
+""".format(tabix=self.params["tabix_path"],
+           input_gz=input_gz,
+           shard_script=shard_script,
+           shards=self.params["shards"],
+           prefix=shards_dir + chr)
+
+    def get_shard_names(self):
+        """ Return list of shard names, as written by vep_shard_vcf.py
+        """
+
+        width = max(len(str(self.params["shards"])), 2)
+        return ["shard{ind:0{width}d}".format(ind=ind + 1, width=width) for ind in range(self.params["shards"])]
+
     def create_spec_wrapping_up_script(self):
         """ Add stuff to check and agglomerate the output data
         """
-        
-        pass
+
+        if "shards" not in self.params:
+            return
+
+        # Concatenating shard outputs in order. Header is taken from the first shard
+        # Every shard with a non-empty regions file must have an output. Otherwise, the shards are kept and the
+        # script fails
+        shards_dir = self.base_dir + "shards" + os.sep
+        self.script = "vep_gather_status=0\n\n"
+        for chr, region in get_region_list(self.params, self.sample_data):
+            self.script += """\
+shard_outputs=""
+shards_missing=""
+for shard in {shards}; do
+    if [ -s {prefix}.$shard.regions ]; then
+        if [ -f {prefix}.$shard.vep.out ]; then
+            shard_outputs="$shard_outputs {prefix}.$shard.vep.out"
+        else
+            shards_missing="$shards_missing $shard"
+        fi
+    fi
+done
+if [ -n "$shards_missing" ]; then
+    echo "Missing VEP output for {chr} shards:$shards_missing. Not concatenating"
+    vep_gather_status=1
+elif [ -n "$shard_outputs" ]; then
+    awk 'FNR==1 {{file_num++}} file_num==1 || !/^#/' $shard_outputs > {output_file} && \\
+        rm -f $shard_outputs
+fi
+
+""".format(shards=" ".join(self.get_shard_names()),
+           prefix=shards_dir + chr,
+           chr=chr,
+           output_file=self.base_dir + self.sample_data["Title"] + "_VEP_" + chr + ".vcf")
+        self.script += "if [ $vep_gather_status -ne 0 ]; then exit 1; fi\n\n"
             
             
     
@@ -116,9 +285,12 @@ class Step_VEP(Step):
         # script
 ######################################################## SNP
 
+        if "shards" in self.params:
+            self.build_scripts_sharded()
+            return
+
         use_dir = self.local_start(self.base_dir)
-        for chr in self.params["chrom_list"].split(','):
-            chr = chr.strip()
+        for chr, region in get_region_list(self.params, self.sample_data):
             self.spec_script_name = self.jid_name_sep.join([self.step,self.name,self.sample_data["Title"],chr])
 
             input_file = self.sample_data[chr]["vcf"]
@@ -140,5 +312,50 @@ class Step_VEP(Step):
             self.local_finish(use_dir,self.base_dir)
 
             self.create_low_level_script()
-                        
 
+    def build_scripts_sharded(self):
+        """ Build a script per chromosome and range. The outputs are concatenated by the wrapping up script.
+        """
+
+        shards_dir = self.make_folder_for_sample("shards")
+        for chr, region in get_region_list(self.params, self.sample_data):
+            input_file, input_gz = self.shard_inputs[chr]
+
+            for shard in self.get_shard_names():
+                self.spec_script_name = self.jid_name_sep.join([self.step,self.name,self.sample_data["Title"],chr,shard])
+                self.script = ""
+
+                use_dir = self.local_start(shards_dir)
+
+                regions = shards_dir + chr + "." + shard + ".regions"
+                shard_input = use_dir + chr + "." + shard + ".vcf"
+                # Records overlapping a range boundary are returned by tabix for both ranges.
+                # Keeping only records starting in the range
+                self.script += """\
+if [ -s {regions} ]; then
+{tabix} -h -R {regions} {input_gz} | \\
+    awk 'NR==FNR {{start[$1]=$2; end[$1]=$3; next}} /^#/ || ($1 in start && $2>=start[$1] && $2<=end[$1])' \\
+    {regions} - \\
+    > {shard_input}
+
+""".format(tabix=self.params["tabix_path"],
+           regions=regions,
+           input_gz=input_gz,
+           shard_input=shard_input)
+                self.script += self.get_script_const()
+                self.script += """-i %(input_file)s \\
+    -o %(output_file)s
+
+rm -f %(input_file)s
+fi
+""" % {
+                    "input_file" : shard_input,
+                    "output_file" : use_dir + chr + "." + shard + ".vep.out"
+                }
+
+                self.local_finish(use_dir,shards_dir)
+
+                self.create_low_level_script()
+
+            self.sample_data[chr]["vcf"]= self.base_dir + self.sample_data["Title"] + "_VEP_" + chr + ".vcf"
+            self.stamp_file(self.sample_data[chr]["vcf"])
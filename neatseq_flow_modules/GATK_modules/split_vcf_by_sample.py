@@ -0,0 +1,135 @@
+# -*- coding: UTF-8 -*-
+"""
+Split a multi-sample VCF into per-sample VCFs in a single pass.
+
+The joint VCF is read once. Each record is written to the VCF of every sample carrying a non-reference allele
+in it's genotype, so that non-variant sites are dropped per sample. The per-sample VCFs are written in BGZF format
+and indexed with tabix.
+
+To avoid keeping one open file per sample, output is buffered per sample and appended to the output files one
+BGZF block at a time.
+
+Used by the ``GATK_SelectVariants`` module.
+"""
+
+import re
+import sys
+import gzip
+import zlib
+import struct
+import argparse
+import subprocess
+
+__author__ = "Menachem Sklarz"
+__version__ = "1.6.0"
+
+# Maximal uncompressed size of a BGZF block is 64KB. Keeping a margin for incompressible data.
+BGZF_BLOCK_SIZE = 0xff00
+BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+
+def bgzf_block(data):
+    """ Return data compressed into a single BGZF block.
+    """
+
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    compressed = compressor.compress(data) + compressor.flush()
+    # Header: gzip magic, deflate, FEXTRA flag, mtime, xfl, OS, XLEN=6, 'BC' subfield with total block size - 1
+    header = struct.pack("<BBBBIBBHBBHH", 31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, len(compressed) + 25)
+    footer = struct.pack("<II", zlib.crc32(data) & 0xffffffff, len(data))
+    return header + compressed + footer
+
+
+class SampleWriter(object):
+    """ Buffered BGZF writer, opening the output file only when a block is full.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.buffer = list()
+        self.buffer_size = 0
+        # Truncate existing file
+        open(self.filename, "wb").close()
+
+    def write(self, line):
+        self.buffer.append(line)
+        self.buffer_size += len(line)
+        if self.buffer_size >= BGZF_BLOCK_SIZE:
+            self.flush()
+
+    def flush(self, final=False):
+        data = "".join(self.buffer).encode()
+        with open(self.filename, "ab") as out_fh:
+            for start in range(0, len(data), BGZF_BLOCK_SIZE):
+                out_fh.write(bgzf_block(data[start:start + BGZF_BLOCK_SIZE]))
+            if final:
+                out_fh.write(BGZF_EOF)
+        self.buffer = list()
+        self.buffer_size = 0
+
+
+def is_variant(genotype):
+    """ Return True if the GT field contains a non-reference allele.
+    """
+
+    return any(allele not in ("0", ".", "") for allele in re.split("[/|]", genotype))
+
+
+def split_vcf(vcf, outputs, tabix=None):
+    """ Split 'vcf' into per-sample files.
+        :param outputs: dict of sample name: output file name. Samples not in dict are skipped.
+        :param tabix: Path to tabix, for indexing the outputs. If None, outputs are not indexed.
+    """
+
+    opener = gzip.open if vcf.endswith(".gz") else open
+    header = list()
+    writers = dict()
+    columns = dict()
+
+    with opener(vcf, "rt") as vcf_fh:
+        for line in vcf_fh:
+            if line.startswith("##"):
+                header.append(line)
+                continue
+            if line.startswith("#CHROM"):
+                fields = line.rstrip("\n").split("\t")
+                missing = set(outputs) - set(fields[9:])
+                if missing:
+                    sys.exit("Samples missing from VCF: {samples}".format(samples=", ".join(sorted(missing))))
+                for sample in outputs:
+                    columns[sample] = fields.index(sample)
+                    writers[sample] = SampleWriter(outputs[sample])
+                    writers[sample].write("".join(header) + "\t".join(fields[:9] + [sample]) + "\n")
+                continue
+
+            fields = line.rstrip("\n").split("\t")
+            fixed = "\t".join(fields[:9])
+            format_keys = fields[8].split(":")
+            gt_index = format_keys.index("GT") if "GT" in format_keys else None
+            for sample, column in columns.items():
+                # Records without genotypes are kept for all samples
+                if gt_index is not None:
+                    sample_fields = fields[column].split(":")
+                    if gt_index >= len(sample_fields) or not is_variant(sample_fields[gt_index]):
+                        continue
+                writers[sample].write(fixed + "\t" + fields[column] + "\n")
+
+    for sample in writers:
+        writers[sample].flush(final=True)
+        if tabix:
+            subprocess.check_call([tabix, "-f", "-p", "vcf", outputs[sample]])
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Split a multi-sample VCF into per-sample VCFs in a single pass")
+    parser.add_argument("-V", "--vcf", required=True, help="Input multi-sample VCF (plain or gzipped)")
+    parser.add_argument("-o", "--outputs", required=True,
+                        help="Tab-separated file of sample name and output file name")
+    parser.add_argument("--tabix", default="tabix", help="Path to tabix. Pass 'none' to skip indexing")
+    args = parser.parse_args()
+
+    with open(args.outputs, "r") as outputs_fh:
+        outputs = dict(line.rstrip("\n").split("\t")[:2] for line in outputs_fh if line.strip())
+
+    split_vcf(args.vcf, outputs, None if args.tabix == "none" else args.tabix)
@@ -0,0 +1,148 @@
+# -*- coding: UTF-8 -*-
+"""
+Divide a bgzipped, tabix-indexed VCF into shards of approximately equal numbers of records.
+
+The VCF itself is not read. The shard boundaries are computed from the linear index in the ``.tbi`` file: the virtual
+file offset of each 16kb window gives the amount of data preceding the window, so the data can be divided into equal
+portions at window boundaries.
+
+For each shard, a regions file is written with one ``contig, start, end`` line (1-based, inclusive) per contig in the
+shard. Shards are ordered, so concatenating per-shard results in shard order preserves the VCF order. A shard with no
+data gets an empty regions file.
+
+Records overlapping a shard boundary are returned by ``tabix`` for both shards. Filter records by ``POS`` to assign
+each record to a single shard.
+
+Used by the ``VEP`` module.
+"""
+
+import gzip
+import struct
+import argparse
+
+__author__ = "Michal Gordon"
+__version__ = "1.6.0"
+
+TBI_WINDOW = 1 << 14
+TBI_PSEUDO_BIN = 37450
+# Maximal coordinate supported by tabix
+TBI_MAX_POS = 1 << 29
+# Approximate compression ratio of VCF text, used for comparing offsets within a BGZF block
+VCF_COMPRESSION = 4
+
+
+def read_tbi(tbi):
+    """ Return list of (contig, list of window offsets, contig end offset).
+        Offsets are virtual file offsets. Contig end offset is None if the index lacks the pseudo-bin.
+    """
+
+    with gzip.open(tbi, "rb") as tbi_fh:
+        data = tbi_fh.read()
+
+    if data[:4] != b"TBI\x01":
+        raise ValueError("{tbi} is not a tabix index".format(tbi=tbi))
+    n_ref, _, _, _, _, _, _, l_nm = struct.unpack_from("<8i", data, 4)
+    pos = 36
+    names = data[pos:pos + l_nm].decode().split("\0")[:n_ref]
+    pos += l_nm
+
+    contigs = list()
+    for name in names:
+        (n_bin,) = struct.unpack_from("<i", data, pos)
+        pos += 4
+        contig_end = None
+        for _ in range(n_bin):
+            bin_num, n_chunk = struct.unpack_from("<Ii", data, pos)
+            pos += 8
+            chunks = struct.unpack_from("<{n}Q".format(n=2 * n_chunk), data, pos)
+            pos += 16 * n_chunk
+            if bin_num == TBI_PSEUDO_BIN:
+                contig_end = chunks[1]
+        (n_intv,) = struct.unpack_from("<i", data, pos)
+        pos += 4
+        offsets = list(struct.unpack_from("<{n}Q".format(n=n_intv), data, pos))
+        pos += 8 * n_intv
+        contigs.append((name, offsets, contig_end))
+
+    return contigs
+
+
+def offset_size(voffset):
+    """ Convert a virtual file offset into an approximate number of compressed bytes.
+    """
+
+    return (voffset >> 16) + float(voffset & 0xffff) / VCF_COMPRESSION
+
+
+def get_shards(tbi, shard_num):
+    """ Return list of 'shard_num' shards. Each shard is a list of (contig, start, end), 1-based, inclusive.
+    """
+
+    # Build list of (contig, window, weight)
+    windows = list()
+    for contig, offsets, contig_end in read_tbi(tbi):
+        if not offsets:
+            continue
+        # Empty windows may have 0 offsets. Using the offset of the previous window
+        sizes = list()
+        for voffset in offsets:
+            sizes.append(max(offset_size(voffset), sizes[-1] if sizes else 0))
+        end = offset_size(contig_end) if contig_end is not None else None
+        for ind in range(len(sizes)):
+            if ind + 1 < len(sizes):
+                weight = sizes[ind + 1] - sizes[ind]
+            elif end is not None:
+                weight = max(end - sizes[ind], 0)
+            else:
+                # No end offset in index. Using the mean window size
+                weight = (sizes[-1] - sizes[0]) / (len(sizes) - 1) if len(sizes) > 1 else 1
+            windows.append((contig, ind, weight))
+
+    total = sum(window[2] for window in windows)
+    shards = [list() for _ in range(shard_num)]
+    cumulative = 0.0
+    for contig, ind, weight in windows:
+        # Shard is determined by the middle of the window
+        shard = min(int((cumulative + weight / 2) * shard_num / total) if total else 0, shard_num - 1)
+        cumulative += weight
+        start = ind * TBI_WINDOW + 1
+        if shards[shard] and shards[shard][-1][0] == contig:
+            shards[shard][-1][2] = start + TBI_WINDOW - 1
+        else:
+            shards[shard].append([contig, start, start + TBI_WINDOW - 1])
+
+    # Extending ranges so that no positions fall between shards
+    last = dict()
+    for shard in shards:
+        for contig_range in shard:
+            last[contig_range[0]] = contig_range
+    for contig_range in last.values():
+        contig_range[2] = TBI_MAX_POS
+
+    return shards
+
+
+def write_shards(shards, prefix):
+    """ Write a regions file per shard. Returns list of file names.
+    """
+
+    width = max(len(str(len(shards))), 2)
+    files = list()
+    for ind, shard in enumerate(shards):
+        regions = "{prefix}.shard{ind:0{width}d}.regions".format(prefix=prefix, ind=ind + 1, width=width)
+        with open(regions, "w") as regions_fh:
+            for contig, start, end in shard:
+                regions_fh.write("{contig}\t{start}\t{end}\n".format(contig=contig, start=start, end=end))
+        files.append(regions)
+    return files
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Divide a tabix-indexed VCF into shards of similar size")
+    parser.add_argument("-V", "--vcf", required=True, help="bgzipped VCF. Must have a .tbi index")
+    parser.add_argument("-n", "--shards", required=True, type=int, help="Number of shards")
+    parser.add_argument("-o", "--prefix", required=True, help="Prefix for regions files")
+    args = parser.parse_args()
+
+    write_shards(get_shards(args.vcf + ".tbi", args.shards), args.prefix)
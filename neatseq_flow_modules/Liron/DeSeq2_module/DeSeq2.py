@@ -37,6 +37,14 @@ Parameters that can be set
     :widths: 15, 10, 10
 
     "use_click",  "", "Will use the CLICK clustering program (Shamir et al. 2000)"
+    "step_cache", "empty | content", "Skip the analysis if the command, the count files, the files passed in ``redirects`` and the module version did not change since the last successful execution. With ``content``, compare file contents rather than sizes and modification times. See ``utilities/step_cache.py`` and the note below."
+
+.. Note:: To re-run only DeSeq2 after changing its parameters, set ``step_cache`` in every step between the import and
+    DeSeq2 as well. The modules supporting it are ``Import``, ``bwa_mapper``, ``bowtie2_mapper``, ``STAR_mapper``,
+    ``samtools``, ``htseq_count``, ``RSEM_mapper`` and ``RSEM``. Any other step in between (*e.g.* trimming) is
+    re-executed, and its outputs get new modification times, so the following steps are re-executed too. In that case,
+    use ``step_cache: content`` in the following steps: they are skipped if the re-executed step produced identical
+    files.
     
 .. Note:: 
     If your using the **use_click** option, cite:
@@ -143,10 +151,11 @@ import os
 import sys
 import re
 from neatseq_flow.PLC_step import Step,AssertionExcept
+from neatseq_flow_modules.utilities.step_cache import *
 
 
 __author__ = "Liron Levin"
-__version__= "1.2.0"
+__version__= "1.2.1"
 # Collect and mereg/append results from all base directories
 
 class Step_DeSeq2(Step):
@@ -272,6 +281,17 @@ class Step_DeSeq2(Step):
             
         # Wrapping up function. Leave these lines at the end of every iteration:
         self.local_finish(use_dir,sample_dir)       # Sees to copying local files to final destination (and other stuff)
-                  
+
+        # Count files and annotations which may be used by the script. The R session is saved in every execution
+        inputs = self.RSEM_FILES + self.HTSeq_FILES + get_redirect_files(self.params)
+        inputs += [self.sample_data["project_data"][x] for x in ["results", "trino.rep"]
+                   if x in self.sample_data["project_data"]]
+        self.script = get_step_cache_script(command=self.script,
+                                            mode=get_step_cache_mode(self.params),
+                                            cache_file=get_step_cache_file(sample_dir, self.spec_script_name),
+                                            module=self.step,
+                                            version=__version__,
+                                            inputs=inputs,
+                                            outputs=[sample_dir + "Session.RSession"])
         
         self.create_low_level_script()
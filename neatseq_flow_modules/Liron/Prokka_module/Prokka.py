@@ -37,6 +37,8 @@ Parameters that can be set
     :widths: 15, 10, 10
 
     "generate_GFF_dir",  "", "Create GFF directory"
+    "telemetry", "empty | path to directory", "Record the resource usage of the Prokka command in ``<step>.<name>.metrics.jsonl``, in the given directory or in the step directory. Summarize with ``utilities/telemetry.py collect``"
+    "resource_models", "path to models file", "Set ``-pe``, ``h_vmem`` and ``--cpus`` to values recommended from recorded metrics. See ``utilities/resources.py``"
 
 Comments
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -70,10 +72,12 @@ import os
 import sys
 import re
 from neatseq_flow.PLC_step import Step,AssertionExcept
+from neatseq_flow_modules.utilities.telemetry import *
+from neatseq_flow_modules.utilities.resources import *
 
 
 __author__ = "Liron Levin"
-__version__= "1.2.0"
+__version__= "1.2.1"
 
 class Step_Prokka(Step):
     
@@ -116,6 +120,8 @@ class Step_Prokka(Step):
             GFF_dir = self.make_folder_for_sample("GFF")
             self.sample_data["project_data"]["GFF_dir"]=GFF_dir
             
+        self.telemetry_file = get_telemetry_file(self.params, self.base_dir, self.step, self.name)
+        self.resource_models = get_resource_models(self.params)
             
         for sample in self.sample_data["samples"]:      # Getting list of samples out of samples_hash
             # Name of specific script:
@@ -133,6 +139,10 @@ class Step_Prokka(Step):
             # Define output filename 
             output_filename = "".join([use_dir , sample ])
 
+            set_recommended_resources(self.params, self.resource_models, self.step,
+                                      inputs=[self.sample_data[sample]["fasta.nucl"]],
+                                      threads_param="--cpus")
+
             self.script += self.get_script_const()
             if "--proteins VFDB" in self.script:
                 if "Virulence_Resistance.fasta" in os.listdir(self.module_location):
@@ -146,6 +156,12 @@ class Step_Prokka(Step):
             self.script += "--strain %s \\\n\t"   % sample
             self.script += "--prefix %s \\\n\t"   % sample
             self.script += "%s \n\n" % self.sample_data[sample]["fasta.nucl"]
+            self.script = get_telemetry_script(command=self.script,
+                                               metrics_file=self.telemetry_file,
+                                               step=self.step,
+                                               name=self.name,
+                                               sample=sample,
+                                               inputs=[self.sample_data[sample]["fasta.nucl"]])
             if "generate_GFF_dir" in list(self.params.keys()):
                 self.script += "cp %s  %%s \n\n" % os.path.join(sample_dir,sample+".gff") % GFF_dir
             
@@ -39,6 +39,7 @@ Parameters that can be set
 
     "mode",  "transcriptome/genome ", "Is the reference is a genome or a transcriptome?"
     "gff3","None","Use if the mode is genome and the annotation file is in gff3 format"
+    "step_cache","empty | content","Skip the reference preparation and the samples whose command, input files and module version did not change since the last successful execution. With ``content``, compare file contents rather than sizes and modification times. See ``utilities/step_cache.py``"
 
 Comments
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -91,9 +92,10 @@ import os
 import sys
 import re
 from neatseq_flow.PLC_step import Step,AssertionExcept
+from neatseq_flow_modules.utilities.step_cache import *
 
 __author__ = "Levin Levin"
-__version__= "1.2.0"
+__version__= "1.2.1"
 
 
 class Step_RSEM(Step):
@@ -124,6 +126,7 @@ class Step_RSEM(Step):
         
         import inspect
         self.module_location=os.path.dirname(os.path.abspath(inspect.getsourcefile(lambda:0)))
+        self.step_cache = get_step_cache_mode(self.params)
     def step_sample_initiation(self):
         """ A place to do initiation stages following setting of sample_data
         """
@@ -179,6 +182,8 @@ class Step_RSEM(Step):
             
         #initiating new script 
         self.script = ""
+        # Original reference and annotation, for the step cache
+        reference_inputs = [self.params["reference"]] + ([self.params["annotation"]] if self.params["annotation"] else [])
         if ("transcriptome" in self.params["mode"]) and (self.params["annotation"] != None):
             if "Trinity" in self.params["annotation"]:
                 gene_map_command = "%s  %%s  %%%%s \n\n"
@@ -226,6 +231,14 @@ class Step_RSEM(Step):
                                            % os.sep.join([REF_dir.rstrip(os.sep),"REF"])
         #update the reference slot to the new reference folder location and the reference files prefix 
         self.params["reference"]= os.sep.join([REF_dir.rstrip(os.sep),"REF"])        
+        self.script = get_step_cache_script(command=self.script,
+                                            mode=self.step_cache,
+                                            cache_file=get_step_cache_file(REF_dir, "prepare_reference"),
+                                            module=self.step,
+                                            version=__version__,
+                                            inputs=reference_inputs,
+                                            outputs=[self.params["reference"] + ".grp",
+                                                     self.params["reference"] + ".ti"])
                 
         pass
         
@@ -340,7 +353,8 @@ class Step_RSEM(Step):
                     #self.sample_data[sample]["unsorted_bam"]=os.sep.join([sample_dir.rstrip(os.sep),sample+".transcript.bam"])
             else:
                 #Add the bam file
-                self.script +="%s \\\n\t" % self.sample_data[sample]["bam"]
+                bam_file = self.sample_data[sample]["bam"]
+                self.script +="%s \\\n\t" % bam_file
             #The output information at the end 
             self.script +="%s \\\n\t%%s \\\n\t " % self.params["reference"]  % os.sep.join([use_dir.rstrip(os.sep),sample])
             #Generate log file:
@@ -352,6 +366,17 @@ class Step_RSEM(Step):
             self.sample_data[sample]["isoforms.results"]=self.sample_data[sample]['RSEM']+'.isoforms.results'
             # Wrapping up function. Leave these lines at the end of every iteration:
             self.local_finish(use_dir,sample_dir)       # Sees to copying local files to final destination (and other stuff)         
+            # Reads or bam file, and the reference files (the reference is a prefix)
+            inputs = [self.sample_data[sample][x] for x in ["fastq.F", "fastq.R", "fastq.S"] if x in self.sample_data[sample]] \
+                if "--bam" not in self.params["redir_params"] else [bam_file]
+            self.script = get_step_cache_script(command=self.script,
+                                                mode=self.step_cache,
+                                                cache_file=get_step_cache_file(sample_dir, self.spec_script_name),
+                                                module=self.step,
+                                                version=__version__,
+                                                inputs=inputs + [self.params["reference"] + "*"],
+                                                outputs=[self.sample_data[sample]["genes.results"],
+                                                         self.sample_data[sample]["isoforms.results"]])
             self.create_low_level_script()
 
 def set_Sample_data_dir(self,category,info,data):
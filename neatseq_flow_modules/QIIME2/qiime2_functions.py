@@ -1,4 +1,13 @@
+import os
 import re
+import copy
+import pickle
+import hashlib
+import yaml
+try:
+    from yaml import CSafeLoader as Loader
+except ImportError:
+    from yaml import SafeLoader as Loader
 
 def edit_qiime_params(param):
 
@@ -16,4 +25,138 @@ def edit_qiime_types(qtype):
                   repl=".",
                   string=re.sub(pattern="\]",
                                 repl="",
-                                string=qtype))
\ No newline at end of file
+                                string=qtype))
+
+# Version of the binary cache format. Increment when the structure of the index changes
+ARGS_INDEX_CACHE_VERSION = 1
+
+# Process-wide cache of loaded YAML indices, by path: (mtime, size, data)
+_yaml_index_cache = dict()
+
+
+def get_file_key(filename):
+    """ Return (mtime, sha1 of contents) identifying the current version of filename
+    """
+
+    with open(filename, "rb") as fileh:
+        digest = hashlib.sha1(fileh.read()).hexdigest()
+    return os.path.getmtime(filename), digest
+
+
+def load_binary_cache(cache_file, key):
+    """ Return the data stored in cache_file if it was created for 'key', or None
+    """
+
+    try:
+        with open(cache_file, "rb") as fileh:
+            cached = pickle.load(fileh)
+    except (IOError, OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError, ValueError):
+        return None
+    if not isinstance(cached, dict) \
+            or cached.get("version") != ARGS_INDEX_CACHE_VERSION \
+            or cached.get("key") != key:
+        return None
+    return cached["data"]
+
+
+def save_binary_cache(cache_file, key, data):
+    """ Store data in cache_file. Failing to write the cache is not an error.
+        The file is written to a temporary file and renamed, so that concurrent readers never see a partial cache.
+    """
+
+    tmp_file = "{cache}.{pid}.tmp".format(cache=cache_file, pid=os.getpid())
+    try:
+        with open(tmp_file, "wb") as fileh:
+            pickle.dump({"version": ARGS_INDEX_CACHE_VERSION, "key": key, "data": data},
+                        fileh,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_file, cache_file)
+    except (IOError, OSError):
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+
+def load_qiime_yaml(filename, builder=None, cache_file=None):
+    """ Load a YAML index once per process, with the C loader when available.
+        If builder is passed, it is applied to the loaded YAML and its result is returned (and cached).
+        If cache_file is passed, the result is also stored in a binary cache, keyed by the file's mtime and sha1, and
+        re-used by subsequent processes as long as the YAML file is not changed.
+        The returned data is shared. Do not modify it.
+    """
+
+    filename = os.path.realpath(filename)
+    stat = os.stat(filename)
+    if filename in _yaml_index_cache and _yaml_index_cache[filename][:2] == (stat.st_mtime, stat.st_size):
+        return _yaml_index_cache[filename][2]
+
+    data = None
+    if cache_file:
+        key = get_file_key(filename)
+        data = load_binary_cache(cache_file, key)
+    if data is None:
+        with open(filename, "r") as fileh:
+            data = yaml.load(fileh, Loader=Loader)
+        if builder:
+            data = builder(data)
+        if cache_file:
+            save_binary_cache(cache_file, key, data)
+
+    _yaml_index_cache[filename] = (stat.st_mtime, stat.st_size, data)
+    return data
+
+
+def listify(value):
+    """ Return value as a list. Single strings are converted into single-member lists
+    """
+
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [value]
+    return list(value)
+
+
+def build_qiime_args_index(qiime_args):
+    """ Build lookup tables from the QIIME2 arguments YAML:
+
+        * ``plugins``: the YAML as is, plugin: method: argument index
+        * ``all_inputs``: (plugin, method): {input flag: list of types} for inputs and optional_inputs
+        * ``outputs``: (plugin, method): {output flag: type}
+        * ``producers``: type: list of (plugin, method, output flag) creating the type
+        * ``consumers``: type: list of (plugin, method, input flag) accepting the type
+    """
+
+    index = {"plugins":    qiime_args,
+             "all_inputs": dict(),
+             "outputs":    dict(),
+             "producers":  dict(),
+             "consumers":  dict()}
+    for plugin, methods in qiime_args.items():
+        for method, method_index in methods.items():
+            all_inputs = dict()
+            for section in ["inputs", "optional_inputs"]:
+                for flag, types in (method_index.get(section) or {}).items():
+                    all_inputs[flag] = listify(types)
+                    for qtype in all_inputs[flag]:
+                        index["consumers"].setdefault(qtype, []).append((plugin, method, flag))
+            index["all_inputs"][(plugin, method)] = all_inputs
+            index["outputs"][(plugin, method)] = dict(method_index.get("outputs") or {})
+            for flag, qtype in index["outputs"][(plugin, method)].items():
+                index["producers"].setdefault(qtype, []).append((plugin, method, flag))
+    return index
+
+
+def get_qiime_args_index(cache_file=None):
+    """ Return the QIIME2 arguments index (see build_qiime_args_index), loaded once per process
+    """
+
+    return load_qiime_yaml(os.path.join(os.path.dirname(os.path.realpath(__file__)), "qiime2_arguments_index.yml"),
+                           builder=build_qiime_args_index,
+                           cache_file=cache_file)
+
+
+def get_method_index(args_index, plugin, method):
+    """ Return a private copy of the argument index of plugin method, which the step may modify
+    """
+
+    return copy.deepcopy(args_index["plugins"][plugin][method])
@@ -45,6 +45,9 @@ Parameters that can be set
 
     "store_output", "list of output parameters", "These parameters will be stored as file types for use by downstream modules"
     "export_o_params", "empty or list of output parameters", "If empty, all outputs will be exported, *i.e.* unzipped with qiime tools export. If list of parameters, only those types will be exported."
+    "args_cache", "empty or path", "Store the parsed plugin arguments index in a binary cache file, re-used as long as ``qiime2_arguments_index.yml`` is not changed. If empty, the cache is stored next to the YAML file."
+
+.. Note:: The plugin arguments index is read once per NeatSeq-Flow run and shared by all ``qiime2_general`` steps.
 
 
 Lines for parameter file
@@ -68,6 +71,7 @@ Classical visualization. Only ``base`` and ``script_path``::
         module:                     qiime2_general
         base:                       dada2
         script_path:                qiime feature-table summarize
+        args_cache:
 
 Store only particular outputs in type index::
 
@@ -116,7 +120,7 @@ except ImportError:
 
 
 __author__ = "Menachem Sklarz"
-__version__ = "1.1.0"
+__version__ = "1.1.1"
 
 
 class Step_qiime2_general(Step):
@@ -124,11 +128,16 @@ class Step_qiime2_general(Step):
     def step_specific_init(self):
         self.shell = "bash"      # Can be set to "bash" by inheriting instances
 
-        # Read YAML of plugin arguments
-        with open(os.path.join(os.path.dirname(os.path.realpath(__file__)),"qiime2_arguments_index.yml"),"r") as fileh:
-            filelines = fileh.readlines()
-
-        self.qiime_args = yaml.load("".join(filelines),  Loader=yaml.Loader)
+        # Get index of plugin arguments. The YAML is read once per process and shared by all qiime2 steps
+        if "args_cache" in self.params and self.params["args_cache"] is not None:
+            # Empty args_cache: Store the binary cache next to the YAML
+            args_cache = self.params["args_cache"] \
+                if self.params["args_cache"] \
+                else os.path.join(os.path.dirname(os.path.realpath(__file__)), "qiime2_arguments_index.cache")
+        else:
+            args_cache = None
+        self.args_index = get_qiime_args_index(cache_file=args_cache)
+        self.qiime_args = self.args_index["plugins"]
 
         # extract qiime path, plugin name and method/pipeline/visualization from script_path
         self.qiime_path = self.params["script_path"].split(" ")[0]
@@ -145,7 +154,7 @@ class Step_qiime2_general(Step):
                                   format(method=self.method,
                                          methods=", ".join(list(self.qiime_args[self.plugin].keys()))))
         # Get argument index for method
-        self.method_index = self.qiime_args[self.plugin][self.method]
+        self.method_index = get_method_index(self.args_index, self.plugin, self.method)
 
 
 
@@ -160,12 +169,8 @@ class Step_qiime2_general(Step):
         self.input_dict = dict()
 
         # Check inputs exist in sample_data
-        # Merge inputs and optional_inputs dicts:
-        all_inputs = dict()
-        if "inputs" in self.method_index:
-            all_inputs.update(self.method_index["inputs"])
-        if "optional_inputs" in self.method_index:
-            all_inputs.update(self.method_index["optional_inputs"])
+        # Merged inputs and optional_inputs dicts:
+        all_inputs = self.args_index["all_inputs"][(self.plugin, self.method)]
         
         # for inpflag,inptype in self.method_index["inputs"].iteritems():
 
@@ -173,10 +178,6 @@ class Step_qiime2_general(Step):
             if inpflag in self.params["redir_params"]:
                 pass
             else:
-                # Convert single value strings into lists:
-                if isinstance(inptype,str):
-                    inptype = [inptype]
-
                 # Make sure at least one of the list members exists in sample_data
                 # (only for required inputs!)
                 if inpflag in self.method_index["inputs"]:
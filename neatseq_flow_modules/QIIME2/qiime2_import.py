@@ -104,7 +104,7 @@ except ImportError:
 
 
 __author__ = "Menachem Sklarz"
-__version__ = "1.1.0"
+__version__ = "1.1.1"
 
 
 class Step_qiime2_import(Step):
@@ -112,12 +112,9 @@ class Step_qiime2_import(Step):
     def step_specific_init(self):
         self.shell = "bash"      # Can be set to "bash" by inheriting instances
 
-        # Read YAML of plugin arguments
-        with open(os.path.join(os.path.dirname(os.path.realpath(__file__)),
-                               "importable_types_and_formats.yml"),"r") as fileh:
-            filelines = fileh.readlines()
-
-        self.qiime_types_formats = yaml.load("".join(filelines),  Loader=yaml.Loader)
+        # Read YAML of importable types and formats. Read once per process and shared by all import steps
+        self.qiime_types_formats = load_qiime_yaml(os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                                                "importable_types_and_formats.yml"))
 
         if "scope" not in self.params:
             self.params["scope"] = "project"
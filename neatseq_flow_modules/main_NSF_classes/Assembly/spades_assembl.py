@@ -48,6 +48,8 @@ Parameters that can be set
     "scope", "sample|project", "Set if project-wide fasta slot should be used"
     "truncate_names", , "truncates contig names, *e.g.* '>NODE_82_length_18610_cov_38.4999_ID_165' will be changed to '>NODE_82_length_18610'"
     "use_corrected",,"Use the reads files after reads correction for douwnstream usge"
+    "telemetry", "empty | path to directory", "Record the resource usage of the spades command in ``<step>.<name>.metrics.jsonl``, in the given directory or in the step directory. Summarize with ``utilities/telemetry.py collect``"
+    "resource_models", "path to models file", "Set ``-pe``, ``h_vmem`` and ``-t`` to values recommended from recorded metrics. See ``utilities/resources.py``"
     
 Lines for parameter file
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -70,10 +72,12 @@ Bankevich, A., Nurk, S., Antipov, D., Gurevich, A.A., Dvorkin, M., Kulikov, A.S.
 import os
 import sys
 from neatseq_flow.PLC_step import Step,AssertionExcept
+from neatseq_flow_modules.utilities.telemetry import *
+from neatseq_flow_modules.utilities.resources import *
 
 
 __author__ = "Menachem Sklarz"
-__version__ = "1.6.0"
+__version__ = "1.6.1"
 
 
 class Step_spades_assembl(Step):
@@ -133,6 +137,9 @@ class Step_spades_assembl(Step):
         
         else:
         
+            self.telemetry_file = get_telemetry_file(self.params, self.base_dir, self.step, self.name)
+            self.resource_models = get_resource_models(self.params)
+
             # Each iteration must define the following class variables:
                 # spec_script_name
                 # script
@@ -149,6 +156,12 @@ class Step_spades_assembl(Step):
                 # Use the dir it returns as the base_dir for this step.
                 use_dir = self.local_start(sample_dir)
 
+                reads = [self.sample_data[sample][x] for x in ["fastq.F", "fastq.R", "fastq.S"]
+                         if x in self.sample_data[sample]]
+                set_recommended_resources(self.params, self.resource_models, self.step,
+                                          inputs=reads,
+                                          threads_param="-t")
+
                 self.script += self.get_script_const()
                 self.script += "-o %s \\\n\t" % sample_dir
 
@@ -164,6 +177,13 @@ class Step_spades_assembl(Step):
                     self.script += "--s1 %s \n\n" % self.sample_data[sample]["fastq.S"]
                 else:
                     raise AssertionExcept("Strange type configuration for sample\n" ,sample)
+
+                self.script = get_telemetry_script(command=self.script,
+                                                   metrics_file=self.telemetry_file,
+                                                   step=self.step,
+                                                   name=self.name,
+                                                   sample=sample,
+                                                   inputs=reads)
                     
                 # For prokka compliance, you can request a truncation of the contig names
                 # e.g. ">NODE_82_length_18610_cov_38.4999_ID_165" will be changed to ">NODE_82_length_18610"
@@ -128,6 +128,7 @@ import sys
 import re
 from functools import reduce
 from neatseq_flow.PLC_step import Step,AssertionExcept
+from neatseq_flow_modules.utilities.step_ancestors import get_ancestors
 
 
 __author__ = "Liron Levin"
@@ -767,15 +768,8 @@ def get_File_Type_data(dic,category,default=""):
         return default
         
         
-def get_base_dirs_dict(step,depend_dir_dic={}):
-    """ Recursion. Beware
-    Returns list of base dirs of the base steps of 'step'
+def get_base_dirs_dict(step):
+    """ Returns dict of all the base steps of 'step', directly or indirectly, by step name
     """
 
-    
-    if step.base_step_list:
-        for base_step in step.base_step_list:
-            depend_dir_dic[base_step.name]=base_step
-            get_base_dirs_dict(base_step,depend_dir_dic)
-            
-    return depend_dir_dic
\ No newline at end of file
+    return dict(get_ancestors(step))
\ No newline at end of file
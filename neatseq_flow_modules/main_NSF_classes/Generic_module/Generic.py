@@ -131,6 +131,8 @@ import sys
 import re
 from functools import reduce
 from neatseq_flow.PLC_step import Step,AssertionExcept
+from neatseq_flow_modules.utilities.step_ancestors import get_ancestors
+from neatseq_flow_modules.utilities.generic_spec import *
 
 
 __author__ = "Liron Levin"
@@ -148,6 +150,9 @@ class Step_Generic(Step):
             if self.params['arg_separator']==None:
                 self.params['arg_separator']=""
         self.params['arg_separator'] = get_File_Type_data(self.params,["arg_separator"]," ")
+        # Parse the inputs and outputs once. Building the scripts is then only filling in the sample data
+        self.compiled_inputs  = compile_inputs(get_File_Type_data(self.params,["inputs"],{}),self.params['arg_separator'])
+        self.compiled_outputs = compile_outputs(get_File_Type_data(self.params,["outputs"],{}),self.params['arg_separator'])
         pass
         
     def step_sample_initiation(self):
@@ -253,118 +258,94 @@ class Step_Generic(Step):
         
     pass
         
+    def step_sample_initiation_inputs(self):
+        """ Test if the input File_Types exist. Common to sample-level and project-level
+        """
+        for spec in self.compiled_inputs:
+
+            if spec["constant_value"] is None:
+
+                inputs_sample_data, base = self.get_inputs_sample_data(spec)
+
+                if spec["File_Type"]==None: #Test if the user specify a File_Type for the input argument
+                    raise AssertionExcept("You must specify a File_Type argument in the input parameter: %s " % spec["arg"])
+                else:  #Test if the File_Type for the input argument exists
+                    if spec["project"]:
+                        for File_Type in spec["slots"]:
+                            if File_Type not in inputs_sample_data["project_data"]:
+                                raise AssertionExcept("The File_Type %s is not found in the PROJECT level \n\t File_Types available are : %%s in step %%%%s" % File_Type % list(inputs_sample_data["project_data"].keys()) % base )
+                            elif not isinstance(inputs_sample_data["project_data"][File_Type],str):
+                                raise AssertionExcept("The File_Type %s in the PROJECT level is empty !!  in step %%s" % File_Type  % base)
+                    else:
+                        for sample in self.sample_data["samples"]:
+                            for File_Type in spec["slots"]:
+                                if File_Type not in inputs_sample_data[sample]:
+                                    raise AssertionExcept("The File_Type %s is not found in the SAMPLE level [in sample name %%s] \n\t File_Types available are : %%%%s in step %%%%%%%%s" % File_Type % sample % list(inputs_sample_data[sample].keys()) % base )
+                                elif not isinstance(inputs_sample_data[sample][File_Type],str):
+                                    raise AssertionExcept("The File_Type %s in SAMPLE %%s is empty !!  in step %%%%s" % File_Type % sample % base)
+
+                if spec["del"]:
+                    self.write_warning("!!! The file/directory in the input File_Type %s in step %%s will be DELETED at the end of this step!!! " % spec["File_Type"] % base)
+
     def step_sample_initiation_bysample(self):
         """ A place to do initiation stages following setting of sample_data
             This set of tests is performed for sample-level
         """
-        if len(get_File_Type_data(self.params,["inputs"]))>0:
-            # Test if the input File_Types exists 
-            for inputs in list(self.params["inputs"].keys()):
-                
-                if "constant_value" not in list(self.params["inputs"][inputs].keys()):
-                    
-                    base=get_File_Type_data(self.params["inputs"],[inputs,"base"],None)                
-                    inputs_sample_data=self.sample_data
-                    if base!=None:
-                        if base in list(self.get_base_sample_data().keys()):
-                            inputs_sample_data=self.get_base_sample_data()[base]
+        self.step_sample_initiation_inputs()
+
+        # Test if the output File_Types
+        for spec in self.compiled_outputs:
+            if spec["File_Type"]!=None: #Test if the user specify a File_Type for the output argument
+                for sample in self.sample_data["samples"]:
+                    if spec["File_Type"] in self.sample_data[sample]: #Test if the File_Type for the output argument exists
+                        if self.sample_data[sample][spec["File_Type"]]==None: #Test if the File_Type was already defined in the output arguments
+                            raise AssertionExcept("The output File_Type %s in the SAMPLE level was defined more the once !!! " % spec["File_Type"] )
                         else:
-                            raise AssertionExcept("The step name %s is not one of the previous steps of the %%s step" % base  % self.step )
-                    else:
-                        base=self.step
-                    
-                    
-                    if get_File_Type_data(self.params["inputs"],[inputs,"File_Type"],None)==None: #Test if the user specify a File_Type for the input argument
-                        raise AssertionExcept("You must specify a File_Type argument in the input parameter: %s " % inputs)
-                    else:  #Test if the File_Type for the input argument exists
-                        if get_File_Type_data(self.params["inputs"],[inputs,"scope"])=="project":
-                            for File_Type in str(get_File_Type_data(self.params["inputs"],[inputs,"File_Type"])).replace("'",'').replace(" ",'').strip('[').strip(']').strip('"').split(','):
-                                if File_Type not in list(inputs_sample_data["project_data"].keys()):
-                                    raise AssertionExcept("The File_Type %s is not found in the PROJECT level \n\t File_Types available are : %%s in step %%%%s" % File_Type % list(inputs_sample_data["project_data"].keys()) % base )
-                                elif not isinstance(inputs_sample_data["project_data"][File_Type],str):
-                                    raise AssertionExcept("The File_Type %s in the PROJECT level is empty !!  in step %%s" % File_Type  % base)
-                        else:
-                            for sample in self.sample_data["samples"]:
-                                for File_Type in str(get_File_Type_data(self.params["inputs"],[inputs,"File_Type"])).replace("'",'').replace(" ",'').strip('[').strip(']').strip('"').split(','):
-                                    if File_Type not in list(inputs_sample_data[sample].keys()):
-                                        raise AssertionExcept("The File_Type %s is not found in the SAMPLE level [in sample name %%s] \n\t File_Types available are : %%%%s in step %%%%%%%%s" % File_Type % sample % list(inputs_sample_data[sample].keys()) % base )
-                                    elif not isinstance(inputs_sample_data[sample][File_Type],str):
-                                        raise AssertionExcept("The File_Type %s in SAMPLE %%s is empty !!  in step %%%%s" % File_Type % sample % base)
-                                    
-                    if "del" in list(self.params["inputs"][inputs].keys()):
-                        self.write_warning("!!! The file/directory in the input File_Type %s in step %%s will be DELETED at the end of this step!!! " % get_File_Type_data(self.params["inputs"],[inputs,"File_Type"]) % base)
-            
-        if len(get_File_Type_data(self.params,["outputs"]))>0:
-            # Test if the output File_Types
-            for outputs in list(self.params["outputs"].keys()):
-                if get_File_Type_data(self.params["outputs"],[outputs,"File_Type"],None)!=None: #Test if the user specify a File_Type for the output argument
-                    for sample in self.sample_data["samples"]:
-                        if get_File_Type_data(self.params["outputs"],[outputs,"File_Type"]) in list(self.sample_data[sample].keys()): #Test if the File_Type for the output argument exists
-                            if self.sample_data[sample][get_File_Type_data(self.params["outputs"],[outputs,"File_Type"])]==None: #Test if the File_Type was already defined in the output arguments
-                                raise AssertionExcept("The output File_Type %s in the SAMPLE level was defined more the once !!! " % get_File_Type_data(self.params["outputs"],[outputs,"File_Type"]) )
-                            else:
-                                self.write_warning("The output File_Type %s already exists in the SAMPLE level, its content will be override !!! " % get_File_Type_data(self.params["outputs"],[outputs,"File_Type"]) )
-                        else: # If the File_Type dose not exists, will generate empty File_Type 
-                            self.sample_data[sample][get_File_Type_data(self.params["outputs"],[outputs,"File_Type"])]=None
-                if "del" in list(self.params["outputs"][outputs].keys()):
-                    raise AssertionExcept("Output File_Types cannot be deleted")
+                            self.write_warning("The output File_Type %s already exists in the SAMPLE level, its content will be override !!! " % spec["File_Type"] )
+                    else: # If the File_Type dose not exists, will generate empty File_Type
+                        self.sample_data[sample][spec["File_Type"]]=None
+            if spec["del"]:
+                raise AssertionExcept("Output File_Types cannot be deleted")
         pass
-        
+
     def step_sample_initiation_byproject(self):
         """ A place to do initiation stages following setting of sample_data
-            This set of tests is performed for project-level 
+            This set of tests is performed for project-level
         """
-        if len(get_File_Type_data(self.params,["inputs"]))>0:
-            # Test if the input File_Types exists 
-            for inputs in list(self.params["inputs"].keys()):
-                
-                if "constant_value" not in list(self.params["inputs"][inputs].keys()):
-                    base=get_File_Type_data(self.params["inputs"],[inputs,"base"],None)                
-                    inputs_sample_data=self.sample_data
-                    if base!=None:
-                        if base in list(self.get_base_sample_data().keys()):
-                            inputs_sample_data=self.get_base_sample_data()[base]
-                        else:
-                            raise AssertionExcept("The step name %s is not one of the previous steps of the %%s step" % base  % self.step )
+        self.step_sample_initiation_inputs()
+
+        # Test if the output File_Types
+        for spec in self.compiled_outputs:
+            if spec["File_Type"]!=None: #Test if the user specify a File_Type for the output argument
+                if spec["File_Type"] in self.sample_data["project_data"]: #Test if the File_Type for the output argument exists
+                    if self.sample_data["project_data"][spec["File_Type"]]==None: #Test if the File_Type was already defined in the output arguments
+                        raise AssertionExcept("The output File_Type %s in the PROJECT level was defined more the once !!! " % spec["File_Type"] )
                     else:
-                        base=self.step    
-                    
-                    if get_File_Type_data(self.params["inputs"],[inputs,"File_Type"],None)==None: #Test if the user specify a File_Type for the input argument
-                        raise AssertionExcept("You must specify a File_Type argument in the input parameter: %s " % inputs)
-                    else:  #Test if the File_Type for the input argument exists
-                        if get_File_Type_data(self.params["inputs"],[inputs,"scope"])=="project":
-                            for File_Type in str(get_File_Type_data(self.params["inputs"],[inputs,"File_Type"])).replace("'",'').replace(" ",'').strip('[').strip(']').strip('"').split(','):
-                                if File_Type not in list(inputs_sample_data["project_data"].keys()):
-                                    raise AssertionExcept("The File_Type %s is not found in the PROJECT level \n\t File_Types available are : %%s in step %%%%s" % File_Type % list(inputs_sample_data["project_data"].keys()) % base)
-                                elif not isinstance(inputs_sample_data["project_data"][File_Type],str):
-                                    raise AssertionExcept("The File_Type %s in the PROJECT level is empty !!  in step %%s" % File_Type  % base)
-                        else:
-                            for sample in self.sample_data["samples"]:
-                                for File_Type in str(get_File_Type_data(self.params["inputs"],[inputs,"File_Type"])).replace("'",'').replace(" ",'').strip('[').strip(']').strip('"').split(','):
-                                    if File_Type not in list(inputs_sample_data[sample].keys()):
-                                        raise AssertionExcept("The File_Type %s is not found in the SAMPLE level [in sample name %%s] \n\t File_Types available are : %%%%s in step %%%%%%%%s" % File_Type % sample % list(inputs_sample_data[sample].keys()) % base)
-                                    elif not isinstance(inputs_sample_data[sample][File_Type],str):
-                                        raise AssertionExcept("The File_Type %s in SAMPLE %%s is empty !!  in step %%%%s" % File_Type % sample % base)
-                    if "del" in list(self.params["inputs"][inputs].keys()):
-                        self.write_warning("!!! The file/directory in the input File_Type %s in step %%s will be DELETED at the end of this step!!! " % get_File_Type_data(self.params["inputs"],[inputs,"File_Type"]),base)
-             
-        if len(get_File_Type_data(self.params,["outputs"]))>0:
-            # Test if the output File_Types
-            for outputs in list(self.params["outputs"].keys()):
-                if get_File_Type_data(self.params["outputs"],[outputs,"File_Type"],None)!=None: #Test if the user specify a File_Type for the output argument
-                    if get_File_Type_data(self.params["outputs"],[outputs,"File_Type"]) in list(self.sample_data["project_data"].keys()): #Test if the File_Type for the output argument exists
-                        if self.sample_data["project_data"][get_File_Type_data(self.params["outputs"],[outputs,"File_Type"])]==None: #Test if the File_Type was already defined in the output arguments
-                            raise AssertionExcept("The output File_Type %s in the PROJECT level was defined more the once !!! " % get_File_Type_data(self.params["outputs"],[outputs,"File_Type"]) )
-                        else:
-                            self.write_warning("The output File_Type %s already exists in the PROJECT level, it's content will be override !!! " % get_File_Type_data(self.params["outputs"],[outputs,"File_Type"]) )
-                    else: # If the File_Type dose not exists, will generate empty File_Type 
-                        self.sample_data["project_data"][get_File_Type_data(self.params["outputs"],[outputs,"File_Type"])]=None
-                if "del" in list(self.params["outputs"][outputs].keys()):
-                    raise AssertionExcept("Output File_Types cannot be deleted")
-        
+                        self.write_warning("The output File_Type %s already exists in the PROJECT level, it's content will be override !!! " % spec["File_Type"] )
+                else: # If the File_Type dose not exists, will generate empty File_Type
+                    self.sample_data["project_data"][spec["File_Type"]]=None
+            if spec["del"]:
+                raise AssertionExcept("Output File_Types cannot be deleted")
         pass
-        
-        
+
+    def get_inputs_sample_data(self, spec):
+        """ Returns the sample_data to take the files of input argument 'spec' from, and the name of its step
+        """
+        if spec["base"]!=None:
+            if spec["base"] in list(self.get_base_sample_data().keys()):
+                return self.get_base_sample_data()[spec["base"]], spec["base"]
+            else:
+                raise AssertionExcept("The step name %s is not one of the previous steps of the %%s step" % spec["base"]  % self.step )
+        return self.sample_data, self.step
+
+    def get_inputs_sample_data_list(self):
+        """ Returns list of the sample_data of each input argument, resolved once per build.
+            None for constant_value arguments
+        """
+        return [self.get_inputs_sample_data(spec)[0] if spec["constant_value"] is None else None
+                    for spec in self.compiled_inputs]
+
+
     def create_spec_preliminary_script(self):
         """ Add script to run BEFORE all other steps
         """
@@ -372,7 +353,8 @@ class Step_Generic(Step):
     def create_spec_wrapping_up_script(self):
         """ Add stuff to check and agglomerate the output data
         """
-        self.project_del_script=set(self.project_del_script)
+        # Remove duplicates, keeping the order of the lines
+        self.project_del_script=list(dict.fromkeys(self.project_del_script))
         if len(self.project_del_script)>0:
             self.script=""
             for line in self.project_del_script:
@@ -396,381 +378,166 @@ class Step_Generic(Step):
         pass
     def build_scripts_bysample(self):
         """ Script building function for sample-level"""
-        del_script=""
+        # The input arguments' sample data is the same for all samples
+        inputs_sample_data = self.get_inputs_sample_data_list()
+
+        # Project scope input files are deleted once, at the end of the step
+        for spec,spec_sample_data in zip(self.compiled_inputs,inputs_sample_data):
+            if spec["del"] and spec["constant_value"] is None and spec["project"]:
+                for file2delete in get_input_files(spec,spec_sample_data,[]):
+                    self.project_del_script.extend(get_delete_lines(file2delete))
+
         # Each iteration must define the following class variables:
             # spec_script_name
             # script
         for sample in self.sample_data["samples"]:      # Getting list of samples out of samples_hash
-            
+
             # Name of specific script:
             self.spec_script_name = self.set_spec_script_name(sample)
             self.script = ""
-            
+
             inputs_script = ""
             outputs_script = ""
-            
-            
-            
-            
-            if 'use_base_dir' in list(self.params.keys()):
+            del_script = ""
+
+            if 'use_base_dir' in self.params:
                 sample_dir    = self.base_step_to_use.make_folder_for_sample(sample)
                 self.base_dir = self.base_step_to_use.base_dir
             else:
                 # Make a dir for the current sample:
                 sample_dir = self.make_folder_for_sample(sample)
-                
-                
+
+
             # This line should be left before every new script. It sees to local issues.
             # Use the dir it returns as the base_dir for this step.
             use_dir = self.local_start(sample_dir)
-            
-            if 'cd' in list(self.params.keys()):
+
+            if 'cd' in self.params:
                 self.script += "cd %s \n\n" % use_dir
-            
-            # Add the script constant args 
+
+            # Add the script constant args
             self.script += self.get_script_const()
-            if len(get_File_Type_data(self.params,["inputs"]))>0:
-                # Adds inputs files
-                for inputs in list(self.params["inputs"].keys()): 
-                    
-                    if "constant_value" in list(self.params["inputs"][inputs].keys()):
-                        value =get_File_Type_data(self.params["inputs"],[inputs,"constant_value"],'')
-                        value = value.replace('{{sample_name}}',sample)
-                        value = value.replace('{{project_name}}',self.sample_data["Title"])
-                        if value!='':
-                            if inputs.startswith("Empty".lower()):
-                                inputs_script +="%s   \\\n\t"    % value
-                            else:
-                                inputs_script +="%s%%s%%%%s \\\n\t" % inputs \
-                                                                    % self.params['arg_separator'] \
-                                                                    % value
-                    else:
-                        base=get_File_Type_data(self.params["inputs"],[inputs,"base"],None)                
-                        inputs_sample_data=self.sample_data
-                        if base!=None:
-                            if base in list(self.get_base_sample_data().keys()):
-                                inputs_sample_data=self.get_base_sample_data()[base]
-                            else:
-                                raise AssertionExcept("The step name %s is not one of the previous steps of the %%s step" % base  % self.step )
-                        else:
-                            base=self.step    
-                        
-                        prefix       = get_File_Type_data(self.params["inputs"],[inputs,"prefix"])
-                        suffix       = get_File_Type_data(self.params["inputs"],[inputs,"suffix"])
-                        
-                        if len(get_File_Type_data(self.params["inputs"],[inputs,"sep"]))>0:
-                            sep=get_File_Type_data(self.params["inputs"],[inputs,"sep"])
-                        else:
-                            if inputs.startswith("Empty".lower()):
-                                sep=" "
-                            else:
-                                sep=" \\\n\t"+inputs + self.params['arg_separator']
-                        File_Type = ''
-                        for File_Type_slot in str(get_File_Type_data(self.params["inputs"],[inputs,"File_Type"])).replace("'",'').replace(" ",'').strip('[').strip(']').strip('"').split(','):
-                            if len(File_Type)>0:
-                                File_Type+=sep
-                            if get_File_Type_data(self.params["inputs"],[inputs,"scope"])=="project":
-                                if 'use_dirname' in self.params["inputs"][inputs].keys():
-                                    File_Type += prefix + os.path.join(os.path.dirname(inputs_sample_data["project_data"][File_Type_slot]) , (suffix).lstrip(os.sep) )
-                                else:
-                                    File_Type +=          os.path.join(os.path.dirname(inputs_sample_data["project_data"][File_Type_slot]) , (prefix + os.path.basename(inputs_sample_data["project_data"][File_Type_slot]) + suffix).lstrip(os.sep) )
-                            else:
-                                if 'use_dirname' in self.params["inputs"][inputs].keys():
-                                    File_Type += prefix + os.path.join(os.path.dirname(     inputs_sample_data[sample][File_Type_slot]   ) , (suffix).lstrip(os.sep) )
-                                else:
-                                    File_Type +=          os.path.join(os.path.dirname(     inputs_sample_data[sample][File_Type_slot]   ) , (prefix + os.path.basename( inputs_sample_data[sample][File_Type_slot]       ) + suffix).lstrip(os.sep) )
-                        if inputs.startswith("Empty".lower()):
-                            inputs_script +="%s   \\\n\t"    % File_Type
-                        else:
-                            inputs_script +="%s%%s%%%%s \\\n\t" % inputs \
-                                                                % self.params['arg_separator'] \
-                                                                % File_Type
-                
-            
-            
-            if len(get_File_Type_data(self.params,["inputs"]))>0:
-                # Generating delete script for input File_Types if specified 
-                del_script=""
-                for inputs in list(self.params["inputs"].keys()):  
-                    
-                    if "constant_value" not in list(self.params["inputs"][inputs].keys()):
-                        if ("del" in list(self.params["inputs"][inputs].keys()) ):
-                            
-                            base=get_File_Type_data(self.params["inputs"],[inputs,"base"],None)                
-                            inputs_sample_data=self.sample_data
-                            if base!=None:
-                                if base in list(self.get_base_sample_data().keys()):
-                                    inputs_sample_data=self.get_base_sample_data()[base]
-                                else:
-                                    raise AssertionExcept("The step name %s is not one of the previous steps of the %%s step" % base  % self.step )
-                            else:
-                                base=self.step    
-                            
-                            prefix       = get_File_Type_data(self.params["inputs"],[inputs,"prefix"])
-                            suffix       = get_File_Type_data(self.params["inputs"],[inputs,"suffix"])
-                            
-                            for File_Type_slot in str(get_File_Type_data(self.params["inputs"],[inputs,"File_Type"])).replace("'",'').replace(" ",'').strip('[').strip(']').strip('"').split(','):
-                                if get_File_Type_data(self.params["inputs"],[inputs,"scope"])=="project":
-                                    if 'use_dirname' in self.params["inputs"][inputs].keys():
-                                        file2delete = prefix + os.path.join(os.path.dirname(inputs_sample_data["project_data"][File_Type_slot]) , (suffix).lstrip(os.sep) )
-                                    else:
-                                        file2delete =          os.path.join(os.path.dirname(inputs_sample_data["project_data"][File_Type_slot]) , ( prefix + os.path.basename(inputs_sample_data["project_data"][File_Type_slot]) + suffix).lstrip(os.sep)) 
-                                    
-                                    if file2delete.endswith(os.sep):
-                                        self.project_del_script.append("rm -rf %s*   \n\n"      % file2delete )
-                                    else:
-                                        self.project_del_script.append("rm -rf %s   \n\n"       % file2delete )
-                                        self.project_del_script.append("echo > %s_DELETED \n\n" % file2delete.rstrip(os.sep) )
-                                else:
-                                    if 'use_dirname' in self.params["inputs"][inputs].keys():
-                                        file2delet = prefix + os.path.join(os.path.dirname(     inputs_sample_data[sample][File_Type_slot]   ) , (suffix).lstrip(os.sep) )
-                                    else:
-                                        file2delet =          os.path.join(os.path.dirname(     inputs_sample_data[sample][File_Type_slot]   ) , ( prefix + os.path.basename(     inputs_sample_data[sample][File_Type_slot]     ) + suffix).lstrip(os.sep) )
-                                    
-                                    if file2delete.endswith(os.sep):
-                                        self.project_del_script.append("rm -rf %s*   \n\n"       % file2delete )
-                                    else:
-                                        del_script +="rm -rf %s   \n\n"        % file2delete
-                                        del_script +="echo > %s_DELETED  \n\n" % file2delete.rstrip(os.sep)
-                    
-            if len(get_File_Type_data(self.params,["outputs"]))>0:
-                # Add output files
-                for outputs in list(self.params["outputs"].keys()): 
-                    # Define output filename  
-                    if get_File_Type_data(self.params["outputs"],[outputs,"constant_file_name"])=="":
-                        prefix=get_File_Type_data(self.params["outputs"],[outputs,"prefix"])
-                        suffix=get_File_Type_data(self.params["outputs"],[outputs,"suffix"])
-                        if "use_base_name" not in list(self.params["outputs"][outputs].keys()):                            
-                            output_filename = "".join([use_dir ,prefix, sample , suffix])    
-                            real_filename   = "".join([sample_dir ,prefix, sample , suffix]) 
-                        else:
-                            output_filename = "".join([prefix, sample , suffix])
-                            real_filename   = "".join([prefix, sample , suffix])
-                    else:
-                        output_filename = "".join([use_dir ,get_File_Type_data(self.params["outputs"],[outputs,"constant_file_name"])])
-                        real_filename   = "".join([sample_dir ,get_File_Type_data(self.params["outputs"],[outputs,"constant_file_name"])])
-                    File_Type=""
-                    if outputs.startswith("No_run")==False:
-                        if outputs.startswith("Empty".lower()):
-                            outputs_script +="%s   \\\n\t"    % output_filename
-                        else:
-                            outputs_script +="%s%%s%%%%s \\\n\t" % outputs \
-                                                            % self.params['arg_separator'] \
-                                                            % output_filename
-                    
-                    #updating the output File_Types
-                    if get_File_Type_data(self.params["outputs"],[outputs,"File_Type"],None)!=None:
-                        File_Type=get_File_Type_data(self.params["outputs"],[outputs,"File_Type"])
-                        # Save output file location in File_Type
-                        self.sample_data[sample][File_Type]=(real_filename)
-                        # Stamp the output file
-                        self.stamp_file(self.sample_data[sample][File_Type])
-            
-            if "inputs_last" in list(self.params.keys()):
+            # Adds inputs files
+            for spec,spec_sample_data in zip(self.compiled_inputs,inputs_sample_data):
+                if spec["constant_value"] is not None:
+                    value = get_constant_value(spec,sample,self.sample_data["Title"])
+                    if value!='':
+                        inputs_script += format_argument(spec,value)
+                else:
+                    files = get_input_files(spec,spec_sample_data,[sample])
+                    inputs_script += format_argument(spec,spec["sep"].join(files))
+                    # Generating delete script for input File_Types if specified
+                    if spec["del"] and not spec["project"]:
+                        for file2delete in files:
+                            del_script += "".join(get_delete_lines(file2delete))
+
+            # Add output files
+            for spec in self.compiled_outputs:
+                output_filename, real_filename = get_output_filenames(spec,use_dir,sample_dir,sample)
+                if spec["run"]:
+                    outputs_script += format_argument(spec,output_filename)
+
+                #updating the output File_Types
+                if spec["File_Type"]!=None:
+                    # Save output file location in File_Type
+                    self.sample_data[sample][spec["File_Type"]]=(real_filename)
+                    # Stamp the output file
+                    self.stamp_file(self.sample_data[sample][spec["File_Type"]])
+
+            if "inputs_last" in self.params:
                 self.script+=outputs_script
                 self.script+=inputs_script
             else:
                 self.script+=inputs_script
                 self.script+=outputs_script
-            
+
             self.script=self.script.rstrip("\\")
             self.script +="\n\n"
-            # Delete the input file/directory if specified, before updating the output File_Types!!! 
+            # Delete the input file/directory if specified, before updating the output File_Types!!!
             self.script += del_script
-                
+
             # Wrapping up function. Leave these lines at the end of every iteration:
             self.local_finish(use_dir,sample_dir)       # Sees to copying local files to final destination (and other stuff)
-            
-            
+
+
             self.create_low_level_script()
-                    
+
     def build_scripts_byproject(self):
         """ Script building function for project-level """
-        
+
+        inputs_sample_data = self.get_inputs_sample_data_list()
+
         del_script=""
         # Each iteration must define the following class variables:
         # spec_script_name
         # script
-        
+
         # Name of specific script:
         self.spec_script_name = self.set_spec_script_name()
         self.script = ""
-        
+
         inputs_script = ""
         outputs_script = ""
-        
-        
-        if 'use_base_dir' in list(self.params.keys()):
+
+
+        if 'use_base_dir' in self.params:
             self.base_dir = self.base_step_to_use.base_dir
-        
+
         # This line should be left before every new script. It sees to local issues.
         # Use the dir it returns as the base_dir for this step.
         use_dir = self.local_start(self.base_dir)
-        
-        if 'cd' in list(self.params.keys()):
+
+        if 'cd' in self.params:
             self.script += "cd %s \n\n" % use_dir
-        
-        # Add the script constant args 
+
+        # Add the script constant args
         self.script += self.get_script_const()
         # Adds inputs files
-        if len(get_File_Type_data(self.params,["inputs"]))>0:
-            for inputs in list(self.params["inputs"].keys()):
-                
-                if "constant_value" in list(self.params["inputs"][inputs].keys()):
-                    value =get_File_Type_data(self.params["inputs"],[inputs,"constant_value"],'')
-                    value = value.replace('{{sample_name}}',self.sample_data["Title"])
-                    value = value.replace('{{project_name}}',self.sample_data["Title"])
-                    if value!='':
-                        if inputs.startswith("Empty".lower()):
-                            inputs_script +="%s   \\\n\t"    % value
-                        else:
-                            inputs_script +="%s%%s%%%%s \\\n\t" % inputs \
-                                                                % self.params['arg_separator'] \
-                                                                % value
-                else:
-                    base=get_File_Type_data(self.params["inputs"],[inputs,"base"],None)                
-                    inputs_sample_data=self.sample_data
-                    if base!=None:
-                        if base in list(self.get_base_sample_data().keys()):
-                            inputs_sample_data=self.get_base_sample_data()[base]
-                        else:
-                            raise AssertionExcept("The step name %s is not one of the previous steps of the %%s step" % base  % self.step )
-                    else:
-                        base=self.step
-                    
-                    prefix    = get_File_Type_data(self.params["inputs"],[inputs,"prefix"])
-                    suffix    = get_File_Type_data(self.params["inputs"],[inputs,"suffix"])
-                    File_Type = ""
-                    
-                    if len(get_File_Type_data(self.params["inputs"],[inputs,"sep"]))>0:
-                        sep=get_File_Type_data(self.params["inputs"],[inputs,"sep"])
-                    else:
-                        if inputs.startswith("Empty".lower()):
-                            sep=" "
-                        else:
-                            sep=" \\\n\t"+inputs + self.params['arg_separator']
-                    
-                    if get_File_Type_data(self.params["inputs"],[inputs,"scope"])=="project":
-                        for File_Type_slot in str(get_File_Type_data(self.params["inputs"],[inputs,"File_Type"])).replace("'",'').replace(" ",'').strip('[').strip(']').strip('"').split(','):
-                            if len(File_Type)>0:
-                                File_Type+=sep
-                            
-                            if 'use_dirname' in self.params["inputs"][inputs].keys():
-                                File_Type+=     prefix + os.path.join(os.path.dirname(inputs_sample_data["project_data"][File_Type_slot])  , (suffix).lstrip(os.sep) )
-                            else:
-                                File_Type+=              os.path.join(os.path.dirname(inputs_sample_data["project_data"][File_Type_slot])  , ( prefix + os.path.basename(inputs_sample_data["project_data"][File_Type_slot]) + suffix).lstrip(os.sep) )
-                    else:
-                        for sample in self.sample_data["samples"]:
-                            for File_Type_slot in str(get_File_Type_data(self.params["inputs"],[inputs,"File_Type"])).replace("'",'').replace(" ",'').strip('[').strip(']').strip('"').split(','):
-                                if len(File_Type)>0:
-                                    File_Type+=sep
-                                if 'use_dirname' in self.params["inputs"][inputs].keys():
-                                    File_Type+=   prefix + os.path.join(os.path.dirname(        inputs_sample_data[sample][File_Type_slot])  , (suffix).lstrip(os.sep) )
-                                else:
-                                    File_Type+=            os.path.join(os.path.dirname(        inputs_sample_data[sample][File_Type_slot])  , ( prefix + os.path.basename(        inputs_sample_data[sample][File_Type_slot]) + suffix).lstrip(os.sep) )
-
-                    if inputs.startswith("Empty".lower()):
-                        inputs_script +="%s   \\\n\t"    % File_Type
-                    else:
-                        inputs_script +="%s%%s%%%%s \\\n\t" % inputs \
-                                                                % self.params['arg_separator'] \
-                                                                % File_Type
-            
-            
-        
-        if len(get_File_Type_data(self.params,["inputs"]))>0:
-            # Generating delete script for input File_Types if specified 
-            del_script=""
-            for inputs in list(self.params["inputs"].keys()): 
-                if "constant_value" not in list(self.params["inputs"][inputs].keys()):
-                    if "del" in list(self.params["inputs"][inputs].keys()):
-                        
-                        base=get_File_Type_data(self.params["inputs"],[inputs,"base"],None)                
-                        inputs_sample_data=self.sample_data
-                        if base!=None:
-                            if base in list(self.get_base_sample_data().keys()):
-                                inputs_sample_data=self.get_base_sample_data()[base]
-                            else:
-                                raise AssertionExcept("The step name %s is not one of the previous steps of the %%s step" % base  % self.step )
+        for spec,spec_sample_data in zip(self.compiled_inputs,inputs_sample_data):
+            if spec["constant_value"] is not None:
+                value = get_constant_value(spec,self.sample_data["Title"],self.sample_data["Title"])
+                if value!='':
+                    inputs_script += format_argument(spec,value)
+            else:
+                files = get_input_files(spec,spec_sample_data,self.sample_data["samples"])
+                inputs_script += format_argument(spec,spec["sep"].join(files))
+                # Generating delete script for input File_Types if specified
+                if spec["del"]:
+                    for file2delete in files:
+                        if spec["project"]:
+                            self.project_del_script.extend(get_delete_lines(file2delete))
                         else:
-                            base=self.step
-                        
-                        prefix   = get_File_Type_data(self.params["inputs"],[inputs,"prefix"])
-                        suffix   = get_File_Type_data(self.params["inputs"],[inputs,"suffix"])
-                        
-                        for File_Type_slot in str(get_File_Type_data(self.params["inputs"],[inputs,"File_Type"])).replace("'",'').replace(" ",'').strip('[').strip(']').strip('"').split(','):
-                            if get_File_Type_data(self.params["inputs"],[inputs,"scope"])=="project":
-                                if 'use_dirname' in self.params["inputs"][inputs].keys():
-                                    file2delete = prefix + os.path.join(os.path.dirname(inputs_sample_data["project_data"][File_Type_slot])  , (suffix).rstrip(os.sep) )
-                                else:
-                                    file2delete =          os.path.join(os.path.dirname(inputs_sample_data["project_data"][File_Type_slot])  , ( prefix + os.path.basename(inputs_sample_data["project_data"][File_Type_slot]) + suffix).rstrip(os.sep) )
-                                
-                                if file2delete.endswith(os.sep):
-                                    self.project_del_script.append("rm -rf %s*   \n\n"      % file2delete )
-                                else:
-                                    self.project_del_script.append("rm -rf %s   \n\n"       % file2delete )
-                                    self.project_del_script.append("echo > %s_DELETED \n\n" % file2delete.rstrip(os.path.sep))
-                            else:
-                                for sample in self.sample_data["samples"]:
-                                    if 'use_dirname' in self.params["inputs"][inputs].keys():
-                                        file2delete = prefix + os.path.join(os.path.dirname(     inputs_sample_data[sample][File_Type_slot]    )  , (suffix).rstrip(os.sep)  )
-                                    else:
-                                        file2delete =          os.path.join(os.path.dirname(     inputs_sample_data[sample][File_Type_slot]    )  , ( prefix + os.path.basename(     inputs_sample_data[sample][File_Type_slot]     ) + suffix).rstrip(os.sep)  )
-                                    
-                                    if file2delete.endswith(os.sep):
-                                        del_script +="rm -rf %s*   \n\n"       % file2delete
-                                    else:
-                                        del_script +="rm -rf %s   \n\n"        % file2delete
-                                        del_script +="echo > %s_DELETED  \n\n" % file2delete.rstrip(os.path.sep)
-
-        if len(get_File_Type_data(self.params,["outputs"]))>0:
-            # Add output files
-            for outputs in list(self.params["outputs"].keys()):
-                # Define output filename  
-                if get_File_Type_data(self.params["outputs"],[outputs,"constant_file_name"])=="":
-                    prefix=get_File_Type_data(self.params["outputs"],[outputs,"prefix"])
-                    suffix=get_File_Type_data(self.params["outputs"],[outputs,"suffix"])
-                    if "use_base_name" not in list(self.params["outputs"][outputs].keys()):                       
-                        output_filename = "".join([use_dir ,prefix, self.sample_data["Title"] , suffix])
-                        real_filename   = "".join([self.base_dir ,prefix, self.sample_data["Title"] , suffix])
-                    else:
-                        output_filename = "".join([prefix, self.sample_data["Title"] , suffix])
-                        real_filename   = "".join([prefix, self.sample_data["Title"] , suffix])
-                else:
-                    output_filename = "".join([use_dir ,get_File_Type_data(self.params["outputs"],[outputs,"constant_file_name"])])            
-                    real_filename   = "".join([self.base_dir ,get_File_Type_data(self.params["outputs"],[outputs,"constant_file_name"])])    
-                if outputs.startswith("No_run")==False:
-                    if outputs.startswith("Empty".lower()):
-                        outputs_script +="%s   \\\n\t"    % output_filename
-                    else:
-                        outputs_script +="%s%%s%%%%s \\\n\t" % outputs \
-                                                            % self.params['arg_separator'] \
-                                                            % output_filename
-
-                #updating the output File_Types
-                if get_File_Type_data(self.params["outputs"],[outputs,"File_Type"],None)!=None:
-                    File_Type=get_File_Type_data(self.params["outputs"],[outputs,"File_Type"])
-                    # Save output file location in File_Type
-                    self.sample_data["project_data"][File_Type] = (real_filename)
-                    # Stamp the output file
-                    self.stamp_file(self.sample_data["project_data"][File_Type])
-                    
-        if "inputs_last" in list(self.params.keys()):
+                            del_script += "".join(get_delete_lines(file2delete))
+
+        # Add output files
+        for spec in self.compiled_outputs:
+            output_filename, real_filename = get_output_filenames(spec,use_dir,self.base_dir,self.sample_data["Title"])
+            if spec["run"]:
+                outputs_script += format_argument(spec,output_filename)
+
+            #updating the output File_Types
+            if spec["File_Type"]!=None:
+                # Save output file location in File_Type
+                self.sample_data["project_data"][spec["File_Type"]] = (real_filename)
+                # Stamp the output file
+                self.stamp_file(self.sample_data["project_data"][spec["File_Type"]])
+
+        if "inputs_last" in self.params:
             self.script+=outputs_script
             self.script+=inputs_script
         else:
             self.script+=inputs_script
             self.script+=outputs_script
-            
-            
+
+
         self.script=self.script.rstrip("\\")
         self.script +="\n\n"
-        # Delete the input file/directory if specified, before updating the output File_Types!!! 
+        # Delete the input file/directory if specified, before updating the output File_Types!!!
         self.script += del_script
         # Wrapping up function. Leave these lines at the end of every iteration:
         self.local_finish(use_dir,self.base_dir)       # Sees to copying local files to final destination (and other stuff)
-        
-        
+
+
         self.create_low_level_script()
 
 
@@ -787,15 +554,8 @@ def get_File_Type_data(dic,category,default=""):
         return default
         
         
-def get_base_dirs_dict(step,depend_dir_dic={}):
-    """ Recursion. Beware
-    Returns list of base dirs of the base steps of 'step'
+def get_base_dirs_dict(step):
+    """ Returns dict of all the base steps of 'step', directly or indirectly, by step name
     """
 
-    
-    if step.base_step_list:
-        for base_step in step.base_step_list:
-            depend_dir_dic[base_step.name]=base_step
-            get_base_dirs_dict(base_step,depend_dir_dic)
-            
-    return depend_dir_dic
\ No newline at end of file
+    return dict(get_ancestors(step))
\ No newline at end of file
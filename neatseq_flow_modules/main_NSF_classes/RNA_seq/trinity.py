@@ -61,6 +61,8 @@ Parameters that can be set
     "get_Trinity_gene_to_trans_map", "", "Path to get_Trinity_gene_to_trans_map.pl. If not passed, will try guessing from Trinity path"
     "TrinityStats", "", "block with 'path:' set to `TrinityStats.pl` executable"
     "genome_guided", "", "Use if you have a project level BAM file with reads mapped to a reference genome and it is coordinate sorted"
+    "telemetry", "empty | path to directory", "Record the resource usage of the Trinity command in ``<step>.<name>.metrics.jsonl``, in the given directory or in the step directory. Summarize with ``utilities/telemetry.py collect``"
+    "resource_models", "path to models file", "Set ``-pe``, ``h_vmem`` and ``--CPU`` to values recommended from recorded metrics. See ``utilities/resources.py``"
 
     
 Lines for parameter file
@@ -99,10 +101,12 @@ import os
 import sys
 import re
 from neatseq_flow.PLC_step import Step,AssertionExcept
+from neatseq_flow_modules.utilities.telemetry import *
+from neatseq_flow_modules.utilities.resources import *
 
 
 __author__ = "Menachem Sklarz"
-__version__ = "1.6.0"
+__version__ = "1.6.2"
 
 
 class Step_trinity(Step):
@@ -177,6 +181,9 @@ class Step_trinity(Step):
         else:
             raise AssertionExcept("'scope' must be either 'sample' or 'project'")
 
+        self.telemetry_file = get_telemetry_file(self.params, self.base_dir, self.step, self.name)
+        self.resource_models = get_resource_models(self.params)
+
         for sample in sample_list:  # Getting list of samples out of samples_hash
 
             # Name of specific script:
@@ -197,6 +204,17 @@ class Step_trinity(Step):
                                                                 if sample != "project_data"
                                                                 else self.sample_data["Title"])
 
+            if "genome_guided" in list(self.params.keys()):
+                inputs = [self.sample_data[sample]['bam']]
+            else:
+                inputs = [self.sample_data[sample_k][direction]
+                          for sample_k in (self.sample_data["samples"] if sample == "project_data" else [sample])
+                          for direction in ["fastq.F", "fastq.R", "fastq.S"]
+                          if direction in self.sample_data[sample_k]]
+            set_recommended_resources(self.params, self.resource_models, self.step,
+                                      inputs=inputs,
+                                      threads_param="--CPU")
+
             self.script += self.get_script_const()
             self.script += "--output %s \\\n\t" % os.path.join(use_dir, output_basename)
 
@@ -254,6 +272,13 @@ class Step_trinity(Step):
             # If there is an extra "\\\n\t" at the end of the script, remove it.
             self.script = self.script.rstrip("\\\n\t") + "\n\n"
 
+            self.script = get_telemetry_script(command=self.script,
+                                               metrics_file=self.telemetry_file,
+                                               step=self.step,
+                                               name=self.name,
+                                               sample=sample,
+                                               inputs=inputs)
+
             if "TrinityStats" in self.params:
                 self.script += """  
 {TrinityStats} \\
@@ -53,6 +53,7 @@ import os
 import sys
 import re
 from neatseq_flow.PLC_step import Step,AssertionExcept
+from neatseq_flow_modules.utilities.step_ancestors import get_ancestor_base_dirs
 
 
 __author__ = "Levinl based on Menachem Sklarz"
@@ -132,17 +133,9 @@ class Step_Multiqc(Step):
 
         
 def get_base_dirs_str(step):
-    """ Recursion. Beware
-    Returns list of base dirs of the base steps of 'step'
+    """ Returns list of base dirs of the base steps of 'step', directly or indirectly
     """
 
-    
-    depend_dir_list = []
-    
-    if step.base_step_list:
-        for base_step in step.base_step_list:
-            depend_dir_list += ([base_step.base_dir] + get_base_dirs_str(base_step))
-
-    return list(set(depend_dir_list))
+    return get_ancestor_base_dirs(step)
 
     
\ No newline at end of file
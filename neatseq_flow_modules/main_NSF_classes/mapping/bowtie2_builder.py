@@ -39,6 +39,12 @@ Parameters that can be set
     :widths: 15, 10, 10
 
     "scope", "project | sample", "Indicates whether to use a project fasta or a sample fasta."
+    "index_cache", "path to shared cache directory", "Look for the index in a shared index cache, and build it there if missing. See note below."
+
+.. Note:: When ``index_cache`` is set, the index is stored in a shared, content-addressed cache, keyed on the content of the
+    fasta file, the builder executable (i.e. its version) and the builder parameters. If an identical index was already built, e.g. by another project,
+    it is used instead of building a new one. A failed build is not added to the cache. The step directory will contain a
+    symbolic link to the cached index.
 
 Lines for parameter file
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -60,10 +66,11 @@ Langmead, B. and Salzberg, S.L., 2012. **Fast gapped-read alignment with Bowtie
 import os
 import sys
 from neatseq_flow.PLC_step import Step,AssertionExcept
+from neatseq_flow_modules.utilities.index_cache import *
 
 
 __author__ = "Menachem Sklarz"
-__version__ = "1.6.0"
+__version__ = "1.6.1"
 
 
 class Step_bowtie2_builder(Step):
@@ -153,12 +160,26 @@ class Step_bowtie2_builder(Step):
                 # Define location and prefix for output files:
                 output_prefix = use_dir + sample + "_bowtie2.index"
                 
+                if "index_cache" in self.params:
+                    self.script += get_index_cache_start(cache_dir=self.params["index_cache"],
+                                                         builder="bowtie2",
+                                                         script_path=self.params["script_path"],
+                                                         files=[self.sample_data[sample]["fasta.nucl"]],
+                                                         params=get_index_cache_params(self.params["redir_params"]))
+                    # Build in cache and link to the cache entry from the step directory
+                    cache_link = sample_dir + os.path.basename(output_prefix)
+                    output_prefix = "$index_cache_tmp/" + INDEX_CACHE_NAME
+
                 # Get constant part of script:
                 self.script += self.get_script_const()
                 
                 self.script += "%s \\\n\t" % self.sample_data[sample]["fasta.nucl"]
                 self.script += "%s \n\n" % output_prefix
 
+                if "index_cache" in self.params:
+                    self.script += get_index_cache_end(link=cache_link)
+                    output_prefix = os.path.join(cache_link, INDEX_CACHE_NAME)
+
 
                 self.sample_data[sample]["bowtie2.index"] = output_prefix
                 self.sample_data[sample]["bowtie2.fasta"] = self.sample_data[sample]["fasta.nucl"]
@@ -187,12 +208,26 @@ class Step_bowtie2_builder(Step):
             # Define location and prefix for output files:
             output_prefix = use_dir + self.sample_data["Title"] + "_bowtie2.index"
             
+            if "index_cache" in self.params:
+                self.script += get_index_cache_start(cache_dir=self.params["index_cache"],
+                                                     builder="bowtie2",
+                                                     script_path=self.params["script_path"],
+                                                     files=[self.sample_data["project_data"]["fasta.nucl"]],
+                                                     params=get_index_cache_params(self.params["redir_params"]))
+                # Build in cache and link to the cache entry from the step directory
+                cache_link = self.base_dir + os.path.basename(output_prefix)
+                output_prefix = "$index_cache_tmp/" + INDEX_CACHE_NAME
+
             # Get constant part of script:
             self.script += self.get_script_const()
             
             self.script += "%s \\\n\t" % self.sample_data["project_data"]["fasta.nucl"]
             self.script += "%s \n\n" % output_prefix
 
+            if "index_cache" in self.params:
+                self.script += get_index_cache_end(link=cache_link)
+                output_prefix = os.path.join(cache_link, INDEX_CACHE_NAME)
+
 
             self.sample_data["project_data"]["bowtie2.index"] = output_prefix
             self.sample_data["project_data"]["bowtie2.fasta"] = self.sample_data["project_data"]["fasta.nucl"]
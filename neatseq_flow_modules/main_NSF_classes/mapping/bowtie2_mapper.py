@@ -56,6 +56,13 @@ Parameters that can be set
     "ref_genome", "path to genome fasta", "If -x is NOT given, will use the equivalent internal fasta. If -x is passed, and ref_genome is NOT passed, will leave the reference slot empty"
     "get_map_log", "", "Store the log produced by bowtie2 (This is bowtie2 standard output)"
     "scope", "project | sample", "Indicates whether to use a project or sample bowtie2 index."
+    "stage_inputs", "empty | path to node-local directory", "Copy the bowtie2 index to node-local scratch before mapping. See note below."
+    "stage_streams", "integer", "Number of parallel streams for copying with ``stage_inputs``. Default: 4"
+    "step_cache", "empty | content", "Skip samples whose command, read files, index and module version did not change since the last successful execution. With ``content``, compare file contents rather than sizes and modification times. See ``utilities/step_cache.py``"
+
+.. Note:: With ``stage_inputs``, every script copies the bowtie2 index to the given directory (default:
+    ``/tmp/neatseq_flow_inputs``) and maps against the local copy. Jobs running on the same node share the copy, which
+    is removed when the last of them finishes. See ``neatseq_flow_modules/utilities/input_staging.py``.
 
 Lines for parameter file
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -104,10 +111,12 @@ Langmead, B. and Salzberg, S.L., 2012. **Fast gapped-read alignment with Bowtie
 import os
 import sys
 from neatseq_flow.PLC_step import Step,AssertionExcept
+from neatseq_flow_modules.utilities.input_staging import *
+from neatseq_flow_modules.utilities.step_cache import *
 
 
 __author__ = "Menachem Sklarz"
-__version__ = "1.6.0"
+__version__ = "1.6.2"
 
 
 class Step_bowtie2_mapper(Step):
@@ -184,6 +193,14 @@ class Step_bowtie2_mapper(Step):
             # self.spec_script_name
             # self.script
         
+        self.stage_dir = get_input_stage_dir(self.params)
+        self.step_cache = get_step_cache_mode(self.params)
+        # Index passed with '-x', before it is replaced with the local copy
+        self.bowtie2_index = self.params["redir_params"].get("-x")
+        if self.stage_dir and "-x" in self.params["redir_params"]:
+            # The index passed with '-x' is replaced with the local copy in every script
+            self.params["redir_params"]["-x"] = "$bowtie2_index"
+
         for sample in self.sample_data["samples"]:      # Getting list of samples out of samples_hash
 
             # Make a dir for the current sample:
@@ -202,19 +219,33 @@ class Step_bowtie2_mapper(Step):
             output_prefix = sample + "_bowtie2_map"
             output_prefix = use_dir + output_prefix
             
+            if "scope" in self.params:  # If scope was passed, use either project or sample bowtie2 index
+                if self.params["scope"] == "project":
+                    bowtie2_index = self.sample_data["project_data"]["bowtie2.index"]
+                else:
+                    bowtie2_index = self.sample_data[sample]["bowtie2.index"]
+            else:  # Otherwise, '-x' is included through redirect params
+                bowtie2_index = None
+            # Original index, for the step cache
+            index_path = bowtie2_index if bowtie2_index else self.bowtie2_index
+
+            if self.stage_dir:
+                self.script += get_input_stage_script(inputs=[("bowtie2_index",
+                                                               bowtie2_index if bowtie2_index else self.bowtie2_index,
+                                                               "prefix")],
+                                                      stage_dir=self.stage_dir,
+                                                      streams=self.params.get("stage_streams"))
+                if bowtie2_index:
+                    bowtie2_index = "$bowtie2_index"
+
             # Get constant part of script:
             self.script += self.get_script_const()
             
             self.script += "--rg-id %s \\\n\t" % sample
             self.script += "--rg   SM:%s \\\n\t" % sample
             
-            try:  # If scope was passed, include either project or sample bowtie2 index
-                if self.params["scope"] == "project":
-                    self.script += "-x %s \\\n\t" % self.sample_data["project_data"]["bowtie2.index"]
-                else:
-                    self.script += "-x %s \\\n\t" % self.sample_data[sample]["bowtie2.index"]
-            except KeyError:  # Otherwise do nothing - '-x' is included through redirect params
-                pass
+            if bowtie2_index:
+                self.script += "-x %s \\\n\t" % bowtie2_index
             
                 
             # assert set("fastq.F","fastq.R","fastq.S") & self.sample_data["sample"].keys(), "There are no reads for sample %s" % sample
@@ -244,8 +275,17 @@ class Step_bowtie2_mapper(Step):
    
             # Move all files from temporary local dir to permanent base_dir
             self.local_finish(use_dir,self.base_dir)       # Sees to copying local files to final destination (and other stuff)
-       
-            
-            
+
+            # Reads and index files (the index is a prefix)
+            inputs = [self.sample_data[sample][x] for x in ["fastq.F", "fastq.R", "fastq.S"] if x in self.sample_data[sample]]
+            if index_path:
+                inputs.append(index_path + "*")
+            self.script = get_step_cache_script(command=self.script,
+                                                mode=self.step_cache,
+                                                cache_file=get_step_cache_file(sample_dir, self.spec_script_name),
+                                                module=self.step,
+                                                version=__version__,
+                                                inputs=inputs,
+                                                outputs=[self.sample_data[sample]["sam"]])
             self.create_low_level_script()
                     
@@ -39,6 +39,12 @@ Parameters that can be set
     :widths: 15, 10, 10
 
     "scope", "project | sample", "Indicates whether to use a project fasta or a sample fasta."
+    "index_cache", "path to shared cache directory", "Look for the index in a shared index cache, and build it there if missing. See note below."
+
+.. Note:: When ``index_cache`` is set, the index is stored in a shared, content-addressed cache, keyed on the content of the
+    fasta file, the builder executable (i.e. its version) and the builder parameters. If an identical index was already built, e.g. by another project,
+    it is used instead of building a new one. A failed build is not added to the cache. The step directory will contain a
+    symbolic link to the cached index.
 
 Lines for parameter file
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -51,6 +57,17 @@ Lines for parameter file
         script_path: /path/to/bwa index
         scope: project
 
+**Using a shared index cache:**
+
+::
+
+    bwa_bld_ind:
+        module: bwa_builder
+        base: spades1
+        script_path: /path/to/bwa index
+        scope: project
+        index_cache: /path/to/shared/index_cache
+
 References
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 Li, H. and Durbin, R., 2009. **Fast and accurate short read alignment with Burrows–Wheeler transform**. *Bioinformatics*, 25(14), pp.1754-1760.
@@ -59,10 +76,11 @@ Li, H. and Durbin, R., 2009. **Fast and accurate short read alignment with Burro
 import os
 import sys
 from neatseq_flow.PLC_step import Step,AssertionExcept
+from neatseq_flow_modules.utilities.index_cache import *
 
 
 __author__ = "Menachem Sklarz"
-__version__ = "1.6.0"
+__version__ = "1.6.1"
 
 
 class Step_bwa_builder(Step):
@@ -145,14 +163,27 @@ class Step_bwa_builder(Step):
                 # Define location and prefix for output files:
                 output_prefix = sample + "_bwa_index"
                 
+                if "index_cache" in self.params:
+                    self.script += get_index_cache_start(cache_dir=self.params["index_cache"],
+                                                         builder="bwa",
+                                                         script_path=self.params["script_path"],
+                                                         files=[self.sample_data[sample]["fasta.nucl"]],
+                                                         params=get_index_cache_params(self.params["redir_params"]))
+                    index_target = "$index_cache_tmp/" + INDEX_CACHE_NAME
+                else:
+                    index_target = use_dir + output_prefix
+
                 # Get constant part of script:
                 self.script += self.get_script_const()
 
                 # Add target for index
-                self.script += "-p %s \\\n\t" % (use_dir + output_prefix)
+                self.script += "-p %s \\\n\t" % index_target
                 # Add source for index
                 self.script += "%s \n\n" % self.sample_data[sample]["fasta.nucl"]
 
+                if "index_cache" in self.params:
+                    self.script += get_index_cache_end(link=sample_dir + output_prefix)
+                    output_prefix = os.path.join(output_prefix, INDEX_CACHE_NAME)
 
                 self.sample_data[sample]["bwa_index"] = (sample_dir + output_prefix)
                 self.sample_data[sample]["bwa_fasta"] = self.sample_data[sample]["fasta.nucl"]
@@ -181,14 +212,27 @@ class Step_bwa_builder(Step):
             # Define location and prefix for output files:
             output_prefix = self.sample_data["Title"] + "_bwa_index"
             
+            if "index_cache" in self.params:
+                self.script += get_index_cache_start(cache_dir=self.params["index_cache"],
+                                                     builder="bwa",
+                                                     script_path=self.params["script_path"],
+                                                     files=[self.sample_data["project_data"]["fasta.nucl"]],
+                                                     params=get_index_cache_params(self.params["redir_params"]))
+                index_target = "$index_cache_tmp/" + INDEX_CACHE_NAME
+            else:
+                index_target = use_dir + output_prefix
+
             # Get constant part of script:
             self.script += self.get_script_const()
             
             # Add target for index
-            self.script += "-p %s \\\n\t" % (use_dir + output_prefix)
+            self.script += "-p %s \\\n\t" % index_target
             # Add source for index
             self.script += "%s \n\n" % self.sample_data["project_data"]["fasta.nucl"]
 
+            if "index_cache" in self.params:
+                self.script += get_index_cache_end(link=self.base_dir + output_prefix)
+                output_prefix = os.path.join(output_prefix, INDEX_CACHE_NAME)
 
             self.sample_data["project_data"]["bwa_index"] = (self.base_dir + output_prefix)
             self.sample_data["project_data"]["bwa_fasta"] = self.sample_data["project_data"]["fasta.nucl"]
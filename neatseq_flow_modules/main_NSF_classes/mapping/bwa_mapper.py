@@ -53,6 +53,18 @@ Parameters that can be set
     "ref_index", "path to bwa index", "If not given, will look for a project bwa index and then for a sample bwa index"
     "ref_genome", "path to genome fasta", "If ref_index is NOT given, will use the equivalent internal fasta. If ref_index is passed, and ref_genome is NOT passed, will leave the reference slot empty"
     "scope", "project | sample", "Indicates whether to use a project or sample bwa index."
+    "telemetry", "empty | path to directory", "Record the resource usage of the bwa commands in a metrics file, in the given directory or in the step directory. See below."
+    "stage_inputs", "empty | path to node-local directory", "Copy the bwa index to node-local scratch before mapping. See below."
+    "stage_streams", "integer", "Number of parallel streams for copying with ``stage_inputs``. Default: 4"
+    "step_cache", "empty | content", "Skip scripts whose command, read files, index and module version did not change since the last successful execution. With ``content``, compare file contents rather than sizes and modification times. See ``utilities/step_cache.py``"
+
+.. Note:: With ``telemetry``, wall time, peak memory, CPU time and I/O of every bwa command are appended to
+    ``<step>.<name>.metrics.jsonl``. Summarize the metrics files of all steps with
+    ``python neatseq_flow_modules/utilities/telemetry.py collect``.
+
+.. Note:: With ``stage_inputs``, every script copies the bwa index to the given directory (default:
+    ``/tmp/neatseq_flow_inputs``) and maps against the local copy. Jobs running on the same node share the copy, which
+    is removed when the last of them finishes. See ``neatseq_flow_modules/utilities/input_staging.py``.
 
 Lines for parameter file
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -119,10 +131,13 @@ Li, H. and Durbin, R., 2009. **Fast and accurate short read alignment with Burro
 import os
 import sys, re
 from neatseq_flow.PLC_step import Step,AssertionExcept
+from neatseq_flow_modules.utilities.telemetry import *
+from neatseq_flow_modules.utilities.input_staging import *
+from neatseq_flow_modules.utilities.step_cache import *
 
 
 __author__ = "Menachem Sklarz"
-__version__ = "1.6.0"
+__version__ = "1.6.3"
 
 
 class Step_bwa_mapper(Step):
@@ -226,6 +241,26 @@ class Step_bwa_mapper(Step):
                 self.write_warning("No reference given. It is highly recommended to give one!\n")
 
         
+    def get_bwa_index(self, sample):
+        """ Return the bwa index to use for the sample (depends on scope)
+        """
+        if "scope" in self.params:  # If scope was passed, include either project or sample bwa index
+            if self.params["scope"] == "project":
+                return self.sample_data["project_data"]["bwa_index"]
+            else:
+                return self.sample_data[sample]["bwa_index"]
+        else:  # Otherwise add ref_index
+            return self.params["ref_index"]
+
+    def get_index_stage_script(self, sample):
+        """ Return the script part staging the bwa index, and the index path to use in the command
+        """
+        if not self.stage_dir:
+            return "", self.get_bwa_index(sample)
+        return get_input_stage_script(inputs=[("bwa_index", self.get_bwa_index(sample), "prefix")],
+                                      stage_dir=self.stage_dir,
+                                      streams=self.params.get("stage_streams")), "$bwa_index"
+
     def create_spec_wrapping_up_script(self):
         """ Add stuff to check and agglomerate the output data
         """
@@ -243,6 +278,10 @@ class Step_bwa_mapper(Step):
             # self.spec_script_name
             # self.script
         
+        self.telemetry_file = get_telemetry_file(self.params, self.base_dir, self.step, self.name)
+        self.stage_dir = get_input_stage_dir(self.params)
+        self.step_cache = get_step_cache_mode(self.params)
+
         for sample in self.sample_data["samples"]:      # Getting list of samples out of samples_hash
 
             # Make a dir for the current sample:
@@ -266,6 +305,7 @@ class Step_bwa_mapper(Step):
                     
 
                     output_filename = "%s.%s.bwa.sai" % (sample, direction)
+                    stage_script, bwa_index = self.get_index_stage_script(sample)
 
                     
                     # Get constant part of script:
@@ -277,13 +317,7 @@ class Step_bwa_mapper(Step):
 
                     
                     # Add ref_index (depends on scope)
-                    if "scope" in self.params:  # If scope was passed, include either project or sample bwa index
-                        if self.params["scope"] == "project":
-                            self.script += "%s \\\n\t" % self.sample_data["project_data"]["bwa_index"]
-                        else:
-                            self.script += "%s \\\n\t" % self.sample_data[sample]["bwa_index"]
-                    else:  # Otherwise add ref_index
-                        self.script += "%s \\\n\t" % self.params["ref_index"]
+                    self.script += "%s \\\n\t" % bwa_index
 
                     # Add reads
                     self.script += "%s \\\n\t" % self.sample_data[sample][direction]
@@ -291,6 +325,15 @@ class Step_bwa_mapper(Step):
                     # Add output:
                     self.script += "> %s\n\n" % (use_dir + output_filename)
 
+                    self.script = get_telemetry_script(command=self.script,
+                                                       metrics_file=self.telemetry_file,
+                                                       step=self.step,
+                                                       name=self.name,
+                                                       sample=sample,
+                                                       label=direction_tag,
+                                                       inputs=[self.sample_data[sample][direction]])
+                    self.script = stage_script + self.script
+
                     file_code = "sai%s" % direction_tag
                     self.sample_data[sample][file_code] = (sample_dir + output_filename)
                     self.stamp_file(self.sample_data[sample][file_code])
@@ -300,7 +343,15 @@ class Step_bwa_mapper(Step):
                     
                     # Move all files from temporary local dir to permanent base_dir
                     self.local_finish(use_dir,self.base_dir)       # Sees to copying local files to final destination (and other stuff)
-                    
+
+                    self.script = get_step_cache_script(command=self.script,
+                                                        mode=self.step_cache,
+                                                        cache_file=get_step_cache_file(sample_dir, self.spec_script_name),
+                                                        module=self.step,
+                                                        version=__version__,
+                                                        inputs=[self.sample_data[sample][direction],
+                                                                self.get_bwa_index(sample) + "*"],
+                                                        outputs=[self.sample_data[sample][file_code]])
                     self.create_low_level_script()
                            
             else:  # Not 'aln': one of the mods that create sam files.
@@ -312,6 +363,7 @@ class Step_bwa_mapper(Step):
                 
                 # Define location of output file:
                 output_filename = "%s.bwa.sam" % (sample)
+                stage_script, bwa_index = self.get_index_stage_script(sample)
 
                 # Get constant part of script:
                 self.script += self.get_script_env_path()
@@ -329,13 +381,7 @@ class Step_bwa_mapper(Step):
                     pass
                 
                 # Add ref_index (depends on scope)
-                if "scope" in self.params:  # If scope was passed, include either project or sample bwa index
-                    if self.params["scope"] == "project":
-                        self.script += "%s \\\n\t" % self.sample_data["project_data"]["bwa_index"]
-                    else:
-                        self.script += "%s \\\n\t" % self.sample_data[sample]["bwa_index"]
-                else:  # Otherwise add ref_index
-                    self.script += "%s \\\n\t" % self.params["ref_index"]
+                self.script += "%s \\\n\t" % bwa_index
 
                 # Add reads
                 if self.params["mod"] in ["mem"]:
@@ -366,8 +412,16 @@ class Step_bwa_mapper(Step):
                 # Add output:
                 self.script += "> %s\n\n" % (use_dir + output_filename)
 
-                
-                
+                self.script = get_telemetry_script(command=self.script,
+                                                   metrics_file=self.telemetry_file,
+                                                   step=self.step,
+                                                   name=self.name,
+                                                   sample=sample,
+                                                   inputs=[self.sample_data[sample][x]
+                                                           for x in ["fastq.F", "fastq.R", "fastq.S"]
+                                                           if x in self.sample_data[sample]])
+                self.script = stage_script + self.script
+
                 self.sample_data[sample]["sam"] = (sample_dir + output_filename)
                 self.stamp_file(self.sample_data[sample]["sam"])
                 
@@ -378,6 +432,16 @@ class Step_bwa_mapper(Step):
        
                 # Move all files from temporary local dir to permanent base_dir
                 self.local_finish(use_dir,self.base_dir)       # Sees to copying local files to final destination (and other stuff)
-                
+
+                # Reads, sai files and index files (the index is a prefix)
+                inputs = [self.sample_data[sample][x] for x in ["fastq.F", "fastq.R", "fastq.S", "saiF", "saiR", "saiS"]
+                          if x in self.sample_data[sample]]
+                self.script = get_step_cache_script(command=self.script,
+                                                    mode=self.step_cache,
+                                                    cache_file=get_step_cache_file(sample_dir, self.spec_script_name),
+                                                    module=self.step,
+                                                    version=__version__,
+                                                    inputs=inputs + [self.get_bwa_index(sample) + "*"],
+                                                    outputs=[self.sample_data[sample]["sam"]])
                 self.create_low_level_script()
                         
@@ -120,6 +120,7 @@ Parameters that can be set
     "region",       "",                                     "A region to limit the region-limitable programs, such as ``view``, ``merge``, ``mpileup``, etc.."
     "type2use",     "sam|bam",                              "Type of file to use. Must exist in scope"
     "keep_output",  "[sort, view, sort2]",                  "A list of programs for which to store the output files. By deafult, all files are saved."
+    "step_cache",   "empty | content",                      "Skip samples whose script, input files and module version did not change since the last successful execution. With ``content``, compare the contents of the input files rather than their sizes and modification times. See ``utilities/step_cache.py``"
 
 
 ..    "filter_by_tag", "*e.g.*: NM:i:[01]", "Filter BAM by one of the tags. Use an awk-compliant regular expression. In this example, keep only lines where the edit distance is 0 or 1. This is an experimental feature and should be used with caution..."
@@ -175,12 +176,13 @@ import os
 import sys
 import re
 from neatseq_flow.PLC_step import Step,AssertionExcept
+from neatseq_flow_modules.utilities.step_cache import *
 import yaml
 from pprint import pprint as pp
 
 
 __author__ = "Menachem Sklarz"
-__version__ = "1.6.0"
+__version__ = "1.6.1"
 
 
 class Step_samtools(Step):
@@ -380,6 +382,8 @@ class Step_samtools(Step):
         else:
             raise AssertionExcept("'scope' must be either 'sample' or 'project'")
 
+        self.step_cache = get_step_cache_mode(self.params)
+
         for sample in sample_list:      # Getting list of samples out of samples_hash
 
             # Make a dir for the current sample:
@@ -402,6 +406,8 @@ class Step_samtools(Step):
             self.active_type = self.file2use
 
             files2keep = list()
+            # Input files, for the step cache
+            inputs = [active_files[self.active_type]]
 
             # Starting off with local link to active file:
             self.script += """\
@@ -444,6 +450,8 @@ cp -fs \\
                         sys.exit("Strange error with eval(outfile_cmd)")
 
                     bed = self.set_bed(action_numbered, sample)
+                    if bed:
+                        inputs.append(bed)
 
                     cmd = self.samtools_params[action]["script"].format(action=action,
                                                                         env_path=self.get_script_env_path(),
@@ -510,6 +518,8 @@ cp -fs \\
 #                 active_file = temp_use_dir + outfile
 
 
+            # Final locations of the kept files, for the step cache
+            outputs = [sample_dir + os.path.basename(outfile) for outfile in files2keep]
             # files2keep = " \\\n\t".join(list(active_files.values()))
             files2keep = " \\\n\t".join(list(files2keep))
             if files2keep:
@@ -534,6 +544,13 @@ rmdir {temp}
 
 
             self.local_finish(use_dir,sample_dir)
+            self.script = get_step_cache_script(command=self.script,
+                                                mode=self.step_cache,
+                                                cache_file=get_step_cache_file(sample_dir, self.spec_script_name),
+                                                module=self.step,
+                                                version=__version__,
+                                                inputs=inputs,
+                                                outputs=outputs)
             self.create_low_level_script()
 
     def region_and_redirects(self, action, action_numbered):
@@ -77,6 +77,8 @@ The following examples cover most of the options:
     If a sample-scope slot is used, in the inputs or the outputs, the scripts will be sample-scope scripts. Otherwise, one project-scope script will be produced. To override this behaviour, set ``scope`` to ``project``.
     However, you cannot set ``scope`` to ``project`` if there are sample-scope fields defined.
 
+.. Note:: The script and output strings are parsed once, when the step is defined, and all fields that do not depend on the sample (project slots, separated lists, directories) are resolved once, before the scripts are built. Missing slots and bases are therefore reported before any script is created. Project slots are resolved before the scripts are built, so project-scope outputs of a sample-scope script are not visible to the other samples' scripts.
+
 
 Requires:
 ~~~~~~~~~~~~~
@@ -134,7 +136,7 @@ from neatseq_flow.PLC_step import Step, AssertionExcept
 
 
 __author__ = "Menachem Sklarz"
-__version__ = "1.6.0"
+__version__ = "1.6.1"
 
 
 class Step_Fillout_Generic(Step):
@@ -153,43 +155,51 @@ class Step_Fillout_Generic(Step):
         # pp(dict(self.params))
         # sys.exit()
 
-        # Get all user defined variables in string
-        variables = list(set(re.findall(pattern="\{\{(.*?)\}\}",
-                                        string=self.params["script_path"])))
+        # Split the script and the outputs into literal strings and variables, once.
+        self.script_template = self.tokenize_template(self.params["script_path"])
+        self.output_templates = dict()
         # Find all variables in outputs:
         try:
             for outp in list(self.params["output"].keys()):
                 # Check each 'output' has a 'string' and a 'scope' defined
                 try:
-                    # Extract the string from the {} and append to results:
-                    result = re.findall(pattern="\{\{(.*?)\}\}",
-                                        string=self.params["output"][outp]["string"])
+                    self.output_templates[outp] = self.tokenize_template(self.params["output"][outp]["string"])
                 except KeyError:
                     raise AssertionExcept("Make sure you have a 'string' and 'scope' defined "
                                           "for output {output}!".format(output=outp))
                 if not re.search(pattern="dir",string=self.params["output"][outp]["string"]):
                     self.write_warning("Are you sure you didn't mean to include {{{{dir}}}} or {{{{base_dir}}}} in output '{output}'?".
                                           format(output=outp))
-
-                variables.extend(result)
         except KeyError:
             self.write_warning("No 'output' section defined. Are you sure this is what you intended?")
         except TypeError:
             raise AssertionExcept("""\
-Make sure 'output' section is defined correctly: 
+Make sure 'output' section is defined correctly:
 output:
     TYPE:
         scope:
         string:""")
 
+        # Get all user defined variables in script and outputs
+        variables = [segment[1]
+                     for template in [self.script_template] + list(self.output_templates.values())
+                     for segment in template
+                     if isinstance(segment, tuple)]
+
+        # Check embedded outputs exist and do not embed each other
+        for segment in self.script_template:
+            if isinstance(segment, tuple) and segment[1][0] == "o":
+                self.check_output_references(segment[1][1])
+        for outp in self.output_templates:
+            self.check_output_references(outp)
+
         # Default scope is project
         scope = "project"
 
         # Check the definition of all variables
-        for variable in variables:
-            var_def = re.findall(pattern="([^\:]*)\:?", string=variable)
+        for var_def in variables:
             # If variable scope is sample and the separator field (3rd slot) is not defined, change scope to sample
-            if var_def[0] == "sample" and (len(var_def) < 3 or not var_def[2]):
+            if var_def[0] == "sample" and not var_def[2]:
                 scope = "sample"
 
         # If scope not passed, use automatically determined scope
@@ -243,7 +253,7 @@ output:
 
     def build_scripts(self):
         """ This is the actual script building function
-            
+
         """
         if self.params["scope"] == "project":
             sample_list = ["project_data"]
@@ -252,6 +262,13 @@ output:
         else:
             raise AssertionExcept("'scope' must be either 'sample' or 'project'")
 
+        # Resolve all variables which do not depend on the sample, once.
+        # Missing bases and file types are reported here, before building any script
+        self.compiled_outputs = dict()
+        for outp in self.output_templates:
+            self.compiled_outputs[outp] = self.compile_template(self.output_templates[outp])
+        compiled_script = self.compile_template(self.script_template)
+
         for sample in sample_list:  # Getting list of samples out of samples_hash
 
             # Name of specific script:
@@ -265,46 +282,33 @@ output:
             # Use the dir it returns as the base_dir for this step.
             use_dir = self.local_start(sample_dir)
 
-            # Creating new copy of params output so that samples don't modify the global version
-            if "output" in self.params:
-                self.params_output = deepcopy(self.params["output"])
-            else:
-                self.params_output = {}
-            for outp in self.params_output:
-                self.params_output[outp]["string"] = self.format_script_path(string=self.params_output[outp]["string"],
-                                                                           use_dir=use_dir,
-                                                                           sample=sample)
-
-            self.script = self.format_script_path(string=self.params["script_path"],
-                                                  use_dir=use_dir,
-                                                  sample=sample)
-            # # Try using function to include export (setenv) etc...
-            # if "output" in self.params:
-            for outp in self.params_output:
+            # Sample to fill in the templates. None for project scope scripts
+            fill_sample = None if sample == "project_data" else sample
+
+            self.script = self.render_template(compiled_script, fill_sample, use_dir)
+
+            for outp in self.compiled_outputs:
                 # If script and output scopes are identical:
-                if self.params_output[outp]["scope"] == self.params["scope"]:
+                if self.params["output"][outp]["scope"] == self.params["scope"]:
                     # Store type after formatting:
-                    self.sample_data[sample][outp] = \
-                        self.format_script_path(string=self.params_output[outp]["string"],
-                                                use_dir=use_dir,
-                                                sample=sample)
+                    self.sample_data[sample][outp] = self.render_template(self.compiled_outputs[outp],
+                                                                          fill_sample,
+                                                                          use_dir)
                     self.stamp_file(self.sample_data[sample][outp])
                 # If script is project and output is sample:
-                elif self.params_output[outp]["scope"] == "sample":
+                elif self.params["output"][outp]["scope"] == "sample":
                     self.write_warning("Writing sample scope output for project scope script!")
                     for outp_sample in self.sample_data["samples"]:
-                        self.sample_data[outp_sample][outp] = \
-                            self.format_script_path(string=self.params_output[outp]["string"],
-                                                    use_dir=use_dir,
-                                                    sample=outp_sample)
+                        self.sample_data[outp_sample][outp] = self.render_template(self.compiled_outputs[outp],
+                                                                                   outp_sample,
+                                                                                   use_dir)
                         self.stamp_file(self.sample_data[outp_sample][outp])
                 # If script is sample and output is project:
-                elif self.params_output[outp]["scope"] == "project":
+                elif self.params["output"][outp]["scope"] == "project":
                     self.write_warning("Writing project scope output for sample scope script!")
-                    self.sample_data["project_data"][outp] = \
-                        self.format_script_path(string=self.params_output[outp]["string"],
-                                                use_dir=use_dir,
-                                                sample=sample)
+                    self.sample_data["project_data"][outp] = self.render_template(self.compiled_outputs[outp],
+                                                                                  fill_sample,
+                                                                                  use_dir)
                     self.stamp_file(self.sample_data["project_data"][outp])
                 else:
                     pass
@@ -312,146 +316,160 @@ output:
             self.local_finish(use_dir, sample_dir)
             self.create_low_level_script()
 
-    def format_script_path(self, string, use_dir=None, sample=None):
+    def tokenize_template(self, string):
+        """ Split a template into a list of literal strings and variables.
+            Variables are (variable, var_def) tuples, where var_def is the list of the 4 colon separated fields.
         """
 
-        :return:
-        """
-        if sample == "project_data":
-            sample = None
-        # Use self.get_base_sample_data() to get historic files (4th entry in input strings)
-
-        rawstring=string
-        # Try using function to include export (setenv) etc...
-
-        variables = list(set(re.findall(pattern="(\{\{.*?\}\})", string=rawstring)))
-
-        for variable in variables:
+        segments = list()
+        for ind, token in enumerate(re.split(pattern="(\{\{.*?\}\})", string=string)):
+            if ind % 2 == 0:    # Literal string between variables
+                if token:
+                    segments.append(token)
+                continue
             # Splitting by ':'
-            var_def = re.findall(pattern="([^\:]*)\:?",string=variable.strip('{{').strip('}}'))
-            # var_def = variable.split(":")
-
+            var_def = re.findall(pattern="([^\:]*)\:?",string=token[2:-2])
             if len(var_def) < 4:
                 var_def = var_def + [''] * (4 - len(var_def))
             if var_def[2] == "colon":
                 var_def[2] = ":"
-            # print variable
-            # print var_def
-            # print "---------------------"
-
-            # ------------------------------
-            if var_def[0] == "dir" and not sample:  # for project scope, use_dir is the same as base_dir!
-                var_def[0] = "base_dir"
-            if var_def[0] == "dir":
-                # rawstring = rawstring.replace(variable, use_dir)
-                if not var_def[3]:  # Base not defined. Use current
-                    rawstring = rawstring.replace(variable, use_dir)
-                else:  # Base defined. Use defined base
-                    try:
-                        # Get base_dir of base and add the basename of use_dir.
-                        # For samples, basename of use_dir is the sample name.
-                        # Maybe one day will extend to other collections, so doing it this way...
-                        rawstring = rawstring.replace(variable,
-                                                      "{base_dir}{spec}{sep}".
-                                                      format(base_dir=self.get_base_instance(var_def[3]).base_dir,
-                                                             spec=os.path.basename(use_dir.rstrip(os.sep)),
-                                                             sep=os.sep))
-                    except AssertionExcept:
-                        raise
-                    # except:
-                    #     raise AssertionExcept("Unrecognized error!")
-                continue            # ------------------------------
-            if var_def[0] == "base_dir":
-                if not var_def[3]:  # Base not defined. Use current
-                    rawstring = rawstring.replace(variable, self.base_dir)
-                else:  # Base defined. Use defined base
-                    try:
-                        rawstring = rawstring.replace(variable, self.get_base_instance(var_def[3]).base_dir)
-                    except AssertionExcept:
-                        raise
-                    # except:
-                    #     raise AssertionExcept("Unrecognized error!")
-                continue
-            # ------------------------------
-            if var_def[0] == "project":
-                repl_str=""
-                if not var_def[1]:  # Type not defined, use title
-                    repl_str = self.sample_data["Title"]
-                else:                # Type defined
-                    if not var_def[3]:  # Base not defined. Use current
-                        try:
-                            repl_str = ("{!r}".format(self.sample_data["project_data"][var_def[1]])).strip("'")
-                        except KeyError:
-                            raise AssertionExcept(
-                                "File type '{type}' not found in project scope".format(type=var_def[1]))
-                    else:               # Base defined. Use defined base
-                        # print self.get_base_sample_data().keys()
-                        if var_def[3] not in self.get_base_sample_data():
-                            raise AssertionExcept("No base '{base}' defined!".format(base=var_def[3]))
-                        try:
-                            repl_str = ("{!r}".format(self.get_base_sample_data()[var_def[3]]["project_data"][var_def[1]])).strip("'")
-                        except KeyError:
-                            raise AssertionExcept("No file of type '{type}' in project scope for base '{base}'".
-                                                  format(type=var_def[1],
-                                                         base=var_def[3]))
-
-                rawstring = re.sub(pattern=re.escape(variable),
-                                   repl=repl_str,
-                                   string=rawstring)
+            if var_def[0] not in ["dir", "base_dir", "project", "sample", "o"]:
+                #  variable does not match any of the expected formats:
+                raise AssertionExcept('Variable {var} in script_path not identified'.format(var=token))
+            segments.append((token, var_def))
+        return segments
+
+    def check_output_references(self, outp, referring=()):
+        """ Make sure output 'outp' exists and does not embed itself, directly or through other outputs
+        """
 
-                continue
-            # ------------------------------
-            if var_def[0] == "sample":
-                # Create local copy of sample_data. If base is defined, this will be the base sample_data
-                if not var_def[3]:  # Base not defined. Use current
-                    sample_data = self.sample_data
-                    # print "self"
-                else:  # Base defined. Use defined base
-                    if var_def[3] not in self.get_base_sample_data():
-                        raise AssertionExcept("No base '{base}' defined!".format(base=var_def[3]))
-                    sample_data = self.get_base_sample_data()[var_def[3]]
-                    # print "base"
-
-                if var_def[2]:  # Separator is defined
-                    if not var_def[1]:  # Type is not defined
-                        repl_str = var_def[2].join(sample_data["samples"])
-                    else:           # Type is defined
-                        try:
-                            repl_str = var_def[2].join([("{!r}".format(sample_data[sample][var_def[1]])).strip("'")
-                                                  for sample
-                                                  in sample_data["samples"]])
-
-                        except KeyError:
-                            raise AssertionExcept("File type '{type}' not found in all samples".format(type=var_def[1]))
-                else:           # Separator is not defined
-                    if not sample:
-                        raise AssertionExcept("Trying to parse sample in project scope script!")
-                    if not var_def[1]:
-                        repl_str = sample
-                    else:
-                        try:
-                            repl_str=("{!r}".format(sample_data[sample][var_def[1]])).strip("'")
-                        except KeyError:
-                            raise AssertionExcept("File type '{type}' not found in sample".format(type=var_def[1]),
-                                                  sample)
-
-                rawstring = re.sub(pattern=re.escape(variable),
-                                   repl=repl_str,
-                                   string=rawstring)
+        if outp in referring:
+            raise AssertionExcept("Output '{output}' embeds itself".format(output=outp))
+        if outp not in self.output_templates:
+            raise AssertionExcept("Error embedding output '{{{{o:{output}}}}}'. No such output".format(output=outp))
+        for segment in self.output_templates[outp]:
+            if isinstance(segment, tuple) and segment[1][0] == "o":
+                self.check_output_references(segment[1][1], referring + (outp,))
+
+    def compile_template(self, template):
+        """ Resolve the variables in a tokenized template.
+            Returns a list of segments. Each segment is either a string, for literals and variables which do not depend
+            on the sample, or a function of (sample, use_dir) returning the variable value.
+        """
 
-                continue
-            # ------------------------------
-            if var_def[0] == "o":
+        compiled = list()
+        for segment in template:
+            if isinstance(segment, tuple):
+                segment = self.get_variable_accessor(*segment)
+            if isinstance(segment, str) and compiled and isinstance(compiled[-1], str):
+                compiled[-1] += segment
+            else:
+                compiled.append(segment)
+        return compiled
+
+    def render_template(self, compiled, sample, use_dir):
+        """ Fill in the sample dependent segments of a compiled template
+        """
+
+        return "".join([segment if isinstance(segment, str) else segment(sample, use_dir)
+                        for segment in compiled])
+
+    def get_variable_accessor(self, variable, var_def):
+        """ Return the value of 'variable' if it does not depend on the sample.
+            Otherwise, return a function of (sample, use_dir) returning the value.
+        """
+
+        # ------------------------------
+        if var_def[0] == "dir":
+            # for project scope, use_dir is the same as base_dir!
+            if not var_def[3]:  # Base not defined. Use current
+                return lambda sample, use_dir: use_dir if sample else self.base_dir
+            # Base defined. Use defined base
+            # Get base_dir of base and add the basename of use_dir.
+            # For samples, basename of use_dir is the sample name.
+            # Maybe one day will extend to other collections, so doing it this way...
+            base_dir = self.get_base_instance(var_def[3]).base_dir
+            return lambda sample, use_dir: "{base_dir}{spec}{sep}".format(base_dir=base_dir,
+                                                                          spec=os.path.basename(use_dir.rstrip(os.sep)),
+                                                                          sep=os.sep) \
+                if sample \
+                else base_dir
+        # ------------------------------
+        if var_def[0] == "base_dir":
+            if not var_def[3]:  # Base not defined. Use current
+                return self.base_dir
+            # Base defined. Use defined base
+            return self.get_base_instance(var_def[3]).base_dir
+        # ------------------------------
+        if var_def[0] == "project":
+            if not var_def[1]:  # Type not defined, use title
+                return self.sample_data["Title"]
+            if not var_def[3]:  # Base not defined. Use current
+                try:
+                    return get_value_string(self.sample_data["project_data"][var_def[1]])
+                except KeyError:
+                    raise AssertionExcept("File type '{type}' not found in project scope".format(type=var_def[1]))
+            # Base defined. Use defined base
+            if var_def[3] not in self.get_base_sample_data():
+                raise AssertionExcept("No base '{base}' defined!".format(base=var_def[3]))
+            try:
+                return get_value_string(self.get_base_sample_data()[var_def[3]]["project_data"][var_def[1]])
+            except KeyError:
+                raise AssertionExcept("No file of type '{type}' in project scope for base '{base}'".
+                                      format(type=var_def[1],
+                                             base=var_def[3]))
+        # ------------------------------
+        if var_def[0] == "sample":
+            # Create local copy of sample_data. If base is defined, this will be the base sample_data
+            if not var_def[3]:  # Base not defined. Use current
+                sample_data = self.sample_data
+            else:  # Base defined. Use defined base
+                if var_def[3] not in self.get_base_sample_data():
+                    raise AssertionExcept("No base '{base}' defined!".format(base=var_def[3]))
+                sample_data = self.get_base_sample_data()[var_def[3]]
+
+            if var_def[2]:  # Separator is defined
+                if not var_def[1]:  # Type is not defined
+                    return var_def[2].join(sample_data["samples"])
                 try:
-                    rawstring = re.sub(pattern=re.escape(variable),
-                                         repl=("{!r}".format(self.params_output[var_def[1]]["string"])).strip("'"),
-                                         string=rawstring)
+                    return var_def[2].join([get_value_string(sample_data[sample][var_def[1]])
+                                            for sample
+                                            in sample_data["samples"]])
+                except KeyError:
+                    raise AssertionExcept("File type '{type}' not found in all samples".format(type=var_def[1]))
+
+            # Separator is not defined
+            if not var_def[1]:
+                return lambda sample, use_dir: sample if sample else raise_project_scope_sample()
+            # Check the type exists for all samples now, rather than when building each sample's script
+            for sample in self.sample_data["samples"]:
+                if sample not in sample_data or var_def[1] not in sample_data[sample]:
+                    raise AssertionExcept("File type '{type}' not found in sample".format(type=var_def[1]),
+                                          sample)
+            return lambda sample, use_dir: get_value_string(sample_data[sample][var_def[1]]) \
+                if sample \
+                else raise_project_scope_sample()
+        # ------------------------------
+        if var_def[0] == "o":
+            return lambda sample, use_dir: self.render_template(self.compiled_outputs[var_def[1]], sample, use_dir)
 
-                except KeyError as exc:
-                    raise AssertionExcept("Error embedding output '{var}'".format(var=variable), sample)
-                continue
-            # ------------------------------
-            #  variable does not match any of the expected formats:
-            raise AssertionExcept('Variable {var} in script_path not identified'.format(var=variable))
-        # print "Return: ", rawstring
-        return rawstring
+    def format_script_path(self, string, use_dir=None, sample=None):
+        """ Fill in all the variables in 'string' for 'sample' and 'use_dir'
+
+        :return: The formatted string
+        """
+        if sample == "project_data":
+            sample = None
+
+        return self.render_template(self.compile_template(self.tokenize_template(string)), sample, use_dir)
+
+
+def get_value_string(value):
+    """ Return the string to embed for a slot value
+    """
+
+    return value if isinstance(value, str) else repr(value)
+
+
+def raise_project_scope_sample():
+    raise AssertionExcept("Trying to parse sample in project scope script!")
@@ -124,6 +124,7 @@ Parameters that can be set
     "scope", "sample | project", "The scope at which each of the sources can be found."
     "ext", "", "The suffix to append to the imported filename."
     "pipe", "", "Additional commands to be piped on the files before writing to file."
+    "step_cache", "empty | content", "Skip imports whose command, source files and module version did not change since the last successful execution. With ``content``, compare the contents of the source files rather than their sizes and modification times. Remote sources are compared by URL only. See ``utilities/step_cache.py``"
 
 Lines for parameter file
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -179,13 +180,14 @@ import os
 import sys
 import re
 from neatseq_flow.PLC_step import Step,AssertionExcept
+from neatseq_flow_modules.utilities.step_cache import *
 
 import yaml
 
 from pprint import pprint as pp
 
 __author__ = "Menachem Sklarz"
-__version__ = "1.6.0"
+__version__ = "1.6.1"
 
 
 class Step_Import(Step):
@@ -503,6 +505,8 @@ class Step_Import(Step):
     
     def build_scripts(self):
 
+        self.step_cache = get_step_cache_mode(self.params)
+
         for scope_ind in range(len(self.params["scope"])):
             src = self.params["src"][scope_ind]
             scope = self.params["scope"][scope_ind]
@@ -625,5 +629,12 @@ class Step_Import(Step):
                 self.sample_data[sample][trg] = self.base_dir + fq_fn
                 self.stamp_file(self.sample_data[sample][trg])
 
+                self.script = get_step_cache_script(command=self.script,
+                                                    mode=self.step_cache,
+                                                    cache_file=get_step_cache_file(self.base_dir, self.spec_script_name),
+                                                    module=self.step,
+                                                    version=__version__,
+                                                    inputs=self.sample_data[sample][src],
+                                                    outputs=[self.sample_data[sample][trg]])
                 self.create_low_level_script()
 
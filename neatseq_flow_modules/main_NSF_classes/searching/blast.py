@@ -94,9 +94,18 @@ Parameters that can be set
     "querytype", "nucl|prot", "Helps the module decide which fasta file to use."
     "query", "sample|project|<Path to fasta or BLAST index>", "Set to ``sample`` for sample-scope query, to ``project`` for project-scope query, or to a path for an external query file."
     "db", "sample|project|<Path to BLAST index>", "Set to ``sample`` for sample-scope index, to ``project`` for project-scope index, or to a path for an external index."
+    "query_shards", "int", "Split the query into this number of shards with similar numbers of residues, and run a separate BLAST job on each. See note below."
 
 .. Note:: You can't set both ``db`` and ``query`` to external files. One of them at least has to be ``sample`` or ``project``.
 
+.. Note:: If ``query_shards`` is set, the query is split by the preliminary script, and a BLAST script is created for
+    each shard. The per-shard reports are merged, in query order, into the ``blast`` slot by the wrapping up script.
+    Text and tabular reports are concatenated. XML reports (``-outfmt 5``) are merged into a single report. Other
+    formats are not supported with ``query_shards``.
+
+    A shard that completed successfully is marked with a ``.done`` file, and is not re-run if the step is re-run
+    (*e.g.* after some of the shards failed). The shards are created anew if the query file is modified.
+
 
 Lines for parameter file
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -130,7 +139,22 @@ Sample specific *prot*-type fasta, external database::
         db:                 {Vars.Genome.blast_index}
         redirects:
             -evalue: 0.0001
-            
+
+Project-wise query split into 50 shards, external database::
+
+    blst_sharded:
+        module:             blast
+        base:               merge1
+        script_path:        {Vars.Programs.blast.Bin}/blastx
+        query:              project
+        querytype:          nucl
+        db:                 /path/to/nr
+        query_shards:       50
+        redirects:
+            -evalue:        0.0001
+            -outfmt:        6
+            -num_threads:   4
+
 
 References
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -145,7 +169,7 @@ from neatseq_flow.PLC_step import Step, AssertionExcept
 
 
 __author__ = "Menachem Sklarz"
-__version__ = "1.6.0"
+__version__ = "1.6.1"
 
 
 class Step_blast(Step):
@@ -190,6 +214,12 @@ class Step_blast(Step):
         if self.params["query"] not in ["sample","project"] and self.params["db"] not in ["sample","project"]:
             raise AssertionExcept("At least one of 'query' and 'db' must be 'sample' or 'project'. You can't pass two paths.")
 
+        if "query_shards" in self.params:
+            try:
+                self.params["query_shards"] = int(self.params["query_shards"])
+            except (TypeError, ValueError):
+                raise AssertionExcept("'query_shards' must be an integer")
+
             
 
     def step_sample_initiation(self):
@@ -238,6 +268,10 @@ class Step_blast(Step):
 
         self.outfmt_txt = outfmt_txt[self.outfmt]
 
+        if "query_shards" in self.params and self.outfmt not in [0, 1, 2, 3, 4, 5, 6, 7, 10]:
+            raise AssertionExcept("Reports in format '{outfmt}' can't be merged. "
+                                  "Can't use 'query_shards' with this format".format(outfmt=self.outfmt_txt))
+
         
         if self.params["query"] == "sample" or self.params["db"] == "sample":
             self.params["scope"] = "sample"
@@ -272,28 +306,169 @@ class Step_blast(Step):
         # del self.params["redir_params"]["-db"]
         # del self.params["redir_params"]["-query"]
 
+    def get_sample_list(self):
+        """ Return list of samples to build scripts for, depending on scope
+        """
+
+        if self.params["scope"]=="project":
+            return ["project_data"]
+        elif self.params["scope"]=="sample":
+            return self.sample_data["samples"]
+        else:
+            raise AssertionExcept("'scope' must be either 'sample' or 'project'")
+
+    def get_shards(self, sample):
+        """ Return the shard file prefix and list of (shard fasta, shard report, done file) for sample
+        """
+
+        sample_title = sample if sample != "project_data" else self.sample_data["Title"]
+        prefix = self.base_dir + "shards" + os.sep + sample_title
+        width = max(len(str(self.params["query_shards"])), 2)
+        shards = list()
+        for ind in range(self.params["query_shards"]):
+            shard = "{prefix}.shard{ind:0{width}d}".format(prefix=prefix, ind=ind + 1, width=width)
+            shards.append((shard + ".fasta", shard + self.file_tag, shard + self.file_tag + ".done"))
+        return prefix, shards
+
+    def create_spec_preliminary_script(self):
+        """ Add script to run BEFORE all other steps
+        """
+
+        if "query_shards" not in self.params:
+            return
+
+        # Splitting the queries. If the shards are newer than the query, they are kept, together with the shards
+        # already completed
+        shards_script = os.path.join(os.path.dirname(os.path.realpath(__file__)), "blast_shards.py")
+        self.make_folder_for_sample("shards")
+        self.script = ""
+        for sample in self.get_sample_list():
+            prefix, shards = self.get_shards(sample)
+            self.script += """\
+if [ ! -f {prefix}.split.done ] || [ {query} -nt {prefix}.split.done ]; then
+    rm -f {prefix}.shard*
+    python {shards_script} split \\
+        -i {query} \\
+        -n {shard_num} \\
+        -o {prefix} && \\
+    touch {prefix}.split.done
+fi
+
+""".format(prefix=prefix,
+           query=self.get_query(sample),
+           shards_script=shards_script,
+           shard_num=self.params["query_shards"])
+
     def create_spec_wrapping_up_script(self):
         """ Add stuff to check and agglomerate the output data
         """
 
+        if "query_shards" in self.params:
+            self.script = ""
+            shards_script = os.path.join(os.path.dirname(os.path.realpath(__file__)), "blast_shards.py")
+            # XML reports are merged with the merger of the BlastXMLmerge module
+            xml_merge_script = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))),
+                                            "searching",
+                                            "blast_xml_merge.py")
+            for sample in self.get_sample_list():
+                prefix, shards = self.get_shards(sample)
+                # Merging only if all shards completed
+                self.script += """\
+for done_file in {done_files}; do
+    if [ ! -f $done_file ]; then
+        echo "Shard $done_file did not complete. Please re-run the step"
+        exit 1
+    fi
+done
+""".format(done_files=" ".join([done for fasta, report, done in shards]))
+                reports = " \\\n    ".join([report for fasta, report, done in shards])
+                if self.outfmt == 5:
+                    # Empty reports are created for empty shards
+                    self.script += """\
+python {xml_merge_script} \\
+    {output} \\
+    $(for report in {reports}; do [ -s $report ] && echo $report; done)
+
+""".format(xml_merge_script=xml_merge_script,
+           output=self.sample_data[sample]["blast"],
+           reports=reports)
+                else:
+                    self.script += """\
+python {shards_script} merge \\
+    -o {output} \\
+    {reports}
+
+""".format(shards_script=shards_script,
+           output=self.sample_data[sample]["blast"],
+           reports=reports)
+
         if self.params["scope"]=="project":
             pass
         elif self.params["scope"]=="sample":
             self.make_sample_file_index()   # see definition below
 
+    def get_db(self, sample):
+        """ Return the -db to use for sample
+        """
+
+        ## If db scope is 'project':
+        if self.db == "project":
+            # If dbtype is specified by user, look for the equivalent db in blastdb.nucl or blastdb.prot
+            # (both set by makeblastdb module)
+            if "dbtype" in self.params:
+                try:
+                    return self.sample_data["project_data"]["blastdb." + self.params["dbtype"]]
+                except KeyError:
+                    raise AssertionExcept("No blastdb of type %s exists" % self.params["dbtype"])
+            ## If dbtype is NOT specified by user, use default blastdb set by makeblastdb. Let the user beware...
+            else:
+                return self.sample_data["project_data"]["blastdb"]
+        # Same as above but for -db in sample scope.
+        elif self.db == "sample":
+            if "dbtype" in self.params:
+                try:
+                    return self.sample_data[sample]["blastdb." + self.params["dbtype"]]
+                except KeyError:
+                    raise AssertionExcept("No blastdb of type %s exists" % self.params["dbtype"], sample)
+            else:
+                return self.sample_data[sample]["blastdb"]
+        else: # -db is a user-defined path:
+            return self.db
+
+    def get_query(self, sample):
+        """ Return the -query to use for sample
+        """
+
+        ## Same as for -db. See documentation above
+        if self.query == "project":
+            if "querytype" in self.params:
+                try:
+                    return self.sample_data["project_data"]["fasta." + self.params["querytype"]]
+                except KeyError:
+                    raise AssertionExcept("No fasta of type %s exists" % self.params["querytype"])
+            else:
+                raise AssertionExcept("You must specify querytype")
+        elif self.query == "sample":
+            if "querytype" in self.params:
+                try:
+                    return self.sample_data[sample]["fasta." + self.params["querytype"]]
+                except KeyError:
+                    raise AssertionExcept("No blastdb of type %s exists" % self.params["querytype"], sample)
+            else:
+                raise AssertionExcept("You must specify querytype", sample)
+        else: # Path
+            return self.query
+
     def build_scripts(self):
         """ This is the actual script building function
-            
+
         """
 
-        if self.params["scope"]=="project":
-            sample_list = ["project_data"]
-        elif self.params["scope"]=="sample":
-            sample_list = self.sample_data["samples"]
-        else:
-            raise AssertionExcept("'scope' must be either 'sample' or 'project'")
+        if "query_shards" in self.params:
+            self.build_scripts_sharded()
+            return
 
-        for sample in sample_list:
+        for sample in self.get_sample_list():
 
             sample_title = sample if sample != "project_data" else self.sample_data["Title"]
 
@@ -314,53 +489,12 @@ class Step_blast(Step):
             self.script += self.get_script_const()
 
             # Adding -db :
-            ## If db scope is 'project':
-            if self.db == "project":
-                # If dbtype is specified by user, look for the equivalent db in blastdb.nucl or blastdb.prot
-                # (both set by makeblastdb module)
-                if "dbtype" in self.params:
-                    try:
-                        self.script += "-db %s \\\n\t" % self.sample_data["project_data"]["blastdb." + self.params["dbtype"]]
-                    except KeyError:
-                        raise AssertionExcept("No blastdb of type %s exists" % self.params["dbtype"])
-                ## If dbtype is NOT specified by user, use default blastdb set by makeblastdb. Let the user beware...
-                else:
-                    self.script += "-db %s \\\n\t" % self.sample_data["project_data"]["blastdb"]
-            # Same as above but for -db in sample scope.
-            elif self.db == "sample":
-                if "dbtype" in self.params:
-                    try:
-                        self.script += "-db %s \\\n\t" % self.sample_data[sample]["blastdb." + self.params["dbtype"]]
-                    except KeyError:
-                        raise AssertionExcept("No blastdb of type %s exists" % self.params["dbtype"], sample)
-                else:
-                    self.script += "-db %s \\\n\t" % self.sample_data[sample]["blastdb"]
-            else: # -db is a user-defined path:
-                self.script += "-db %s \\\n\t" % self.db
-                    
+            self.script += "-db %s \\\n\t" % self.get_db(sample)
             # Adding -query :
-            ## Same as for -db. See documentation above
-            if self.query == "project":
-                if "querytype" in self.params:
-                    try:
-                        self.script += "-query %s \\\n\t" % self.sample_data["project_data"]["fasta." + self.params["querytype"]]
-                    except KeyError:
-                        raise AssertionExcept("No fasta of type %s exists" % self.params["querytype"])
-                else:
-                    raise AssertionExcept("You must specify querytype")
-            elif self.query == "sample":
-                if "querytype" in self.params:
-                    try:
-                        self.script += "-query %s \\\n\t" % self.sample_data[sample]["fasta." + self.params["querytype"]]
-                    except KeyError:
-                        raise AssertionExcept("No blastdb of type %s exists" % self.params["querytype"], sample)
-                else:
-                    raise AssertionExcept("You must specify querytype", sample)
-            else: # Path
-                self.script += "-query %s \\\n\t" % self.query
-                
+            self.script += "-query %s \\\n\t" % self.get_query(sample)
+
             self.script += "-out %s\n\n" % output_filename
-            
+
             # Store BLAST result file:
             self.sample_data[sample]["blast"] = (sample_dir + os.path.basename(output_filename))
             self.sample_data[sample]["blast." + self.params["querytype"]] = self.sample_data[sample]["blast"]
@@ -370,6 +504,48 @@ class Step_blast(Step):
             self.create_low_level_script()
 
                     
+    def build_scripts_sharded(self):
+        """ Build a script per query shard. The shards are merged by the wrapping up script
+        """
+
+        self.make_folder_for_sample("shards")
+        for sample in self.get_sample_list():
+
+            sample_title = sample if sample != "project_data" else self.sample_data["Title"]
+            sample_dir = self.make_folder_for_sample(sample)
+            prefix, shards = self.get_shards(sample)
+
+            for fasta, report, done in shards:
+                # Name of specific script:
+                self.spec_script_name = self.jid_name_sep.join([self.step,self.name,sample_title,
+                                                                os.path.basename(fasta).split(".")[-2]])
+                self.script = ""
+
+                # Completed shards are not re-run.
+                # Empty shards (more shards than sequences) get an empty report
+                self.script += """\
+if [ -f {done} ]; then
+    echo "Shard already completed. Skipping"
+elif [ ! -s {fasta} ]; then
+    touch {report}
+    touch {done}
+else
+""".format(done=done, fasta=fasta, report=report)
+
+                self.script += self.get_script_const()
+                self.script += "-db %s \\\n\t" % self.get_db(sample)
+                self.script += "-query %s \\\n\t" % fasta
+                self.script += "-out %s.tmp && \\\n" % report
+                self.script += "mv %s.tmp %s && \\\n" % (report, report)
+                self.script += "touch %s\nfi\n\n" % done
+
+                self.create_low_level_script()
+
+            # Store BLAST result file:
+            self.sample_data[sample]["blast"] = sample_dir + sample_title + self.file_tag
+            self.sample_data[sample]["blast." + self.params["querytype"]] = self.sample_data[sample]["blast"]
+            self.stamp_file(self.sample_data[sample]["blast"])
+
     def make_sample_file_index(self):
         """ Make file containing samples and target file names.
             This can be used by scripts called by create_spec_wrapping_up_script() to summarize the BLAST outputs.
@@ -0,0 +1,97 @@
+# -*- coding: UTF-8 -*-
+"""
+Split a BLAST query fasta into shards and merge the per-shard BLAST reports.
+
+``split``: Divides the fasta into N files with similar numbers of residues. Sequences are not reordered, so that merging
+the reports in shard order keeps the query order.
+
+``merge``: Concatenates the per-shard text and tabular reports, in order, into a single report. XML reports
+(``-outfmt 5``) are merged with ``searching/blast_xml_merge.py``.
+
+Used by the ``blast`` module.
+"""
+
+import os
+import sys
+import argparse
+
+__author__ = "Menachem Sklarz"
+__version__ = "1.6.1"
+
+
+def read_fasta_lengths(fasta):
+    """ Return list of sequence lengths, in file order
+    """
+
+    lengths = list()
+    with open(fasta, "r") as fasta_fh:
+        for line in fasta_fh:
+            if line.startswith(">"):
+                lengths.append(0)
+            elif lengths:
+                lengths[-1] += len(line.strip())
+    return lengths
+
+
+def split_fasta(fasta, shard_num, prefix):
+    """ Write 'shard_num' fasta files with similar numbers of residues. Returns list of file names.
+    """
+
+    lengths = read_fasta_lengths(fasta)
+    total = sum(lengths)
+    width = max(len(str(shard_num)), 2)
+    files = ["{prefix}.shard{ind:0{width}d}.fasta".format(prefix=prefix, ind=ind + 1, width=width)
+             for ind in range(shard_num)]
+    out_fhs = [open(filename, "w") for filename in files]
+
+    seq_ind = -1
+    cumulative = 0
+    out_fh = out_fhs[0]
+    with open(fasta, "r") as fasta_fh:
+        for line in fasta_fh:
+            if line.startswith(">"):
+                seq_ind += 1
+                # Shard is determined by the middle of the sequence
+                shard = int((cumulative + lengths[seq_ind] / 2.0) * shard_num / total) if total else 0
+                out_fh = out_fhs[min(shard, shard_num - 1)]
+                cumulative += lengths[seq_ind]
+            out_fh.write(line)
+
+    for out_fh in out_fhs:
+        out_fh.close()
+    return files
+
+
+def merge_text(reports, out_fh):
+    """ Concatenate reports
+    """
+
+    for report in reports:
+        with open(report, "r") as report_fh:
+            for line in report_fh:
+                out_fh.write(line)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Split a BLAST query into shards, or merge per-shard BLAST reports")
+    subparsers = parser.add_subparsers(dest="command")
+    split_parser = subparsers.add_parser("split", help="Split query fasta")
+    split_parser.add_argument("-i", "--input", required=True, help="Query fasta")
+    split_parser.add_argument("-n", "--shards", required=True, type=int, help="Number of shards")
+    split_parser.add_argument("-o", "--prefix", required=True, help="Prefix for shard fasta files")
+    merge_parser = subparsers.add_parser("merge", help="Merge text and tabular BLAST reports")
+    merge_parser.add_argument("reports", nargs="+", help="Per-shard reports, in shard order")
+    merge_parser.add_argument("-o", "--output", required=True, help="Merged report")
+    args = parser.parse_args()
+
+    if args.command == "split":
+        split_fasta(args.input, args.shards, args.prefix)
+    elif args.command == "merge":
+        # Empty reports are created for empty shards
+        reports = [report for report in args.reports if os.path.getsize(report) > 0]
+        with open(args.output, "w") as out_fh:
+            merge_text(reports, out_fh)
+    else:
+        parser.print_help()
+        sys.exit(1)
@@ -43,6 +43,12 @@ Parameters that can be set:
 
     "scope", "sample|project", "Set if project-wide or sample fasta slot should be used"
     "-dbtype", "nucl/prot", "This is a compulsory redirected parameter.Helps the module decide which fasta file to use."
+    "index_cache", "path to shared cache directory", "Look for the index in a shared index cache, and build it there if missing. See note below."
+
+.. Note:: When ``index_cache`` is set, the index is stored in a shared, content-addressed cache, keyed on the content of the
+    fasta file, the builder executable (i.e. its version) and the builder parameters. If an identical index was already built, e.g. by another project,
+    it is used instead of building a new one. A failed build is not added to the cache. The step directory will contain a
+    symbolic link to the cached index.
 
 Lines for parameter file
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -67,10 +73,11 @@ Altschul, S.F., Madden, T.L., Schäffer, A.A., Zhang, J., Zhang, Z., Miller, W.
 import os
 import sys
 from neatseq_flow.PLC_step import Step,AssertionExcept
+from neatseq_flow_modules.utilities.index_cache import *
 
 
 __author__ = "Menachem Sklarz"
-__version__ = "1.6.0"
+__version__ = "1.6.1"
 
 
 class Step_makeblastdb(Step):
@@ -151,13 +158,27 @@ class Step_makeblastdb(Step):
             output_filename = ".".join([sample_title, self.name, self.file_tag])
             blastdb_title = os.path.basename(output_filename)
 
+            blastdb_out = use_dir + output_filename
+            if "index_cache" in self.params:
+                self.script += get_index_cache_start(cache_dir=self.params["index_cache"],
+                                                     builder="makeblastdb",
+                                                     script_path=self.params["script_path"],
+                                                     files=[self.sample_data[sample]["fasta." + self.dbtype]],
+                                                     params=get_index_cache_params(self.params["redir_params"]))
+                blastdb_out = "$index_cache_tmp/" + INDEX_CACHE_NAME
+
             self.script += self.get_script_const()
-            self.script += "-out {dir}{fn} \\\n\t".format(dir= use_dir, fn=output_filename)
+            self.script += "-out %s \\\n\t" % blastdb_out
             self.script += "-in %s \\\n\t" % self.sample_data[sample]["fasta." + self.dbtype]
             self.script += "-title %s \\\n\t" % blastdb_title
             self.script += "-logfile {dir}{outname}.log \n\n".format(dir=use_dir,outname=output_filename)
 
-            self.sample_data[sample]["blastdb." + self.dbtype] = (sample_dir + output_filename)
+            if "index_cache" in self.params:
+                self.script += get_index_cache_end(link=sample_dir + output_filename)
+                self.sample_data[sample]["blastdb." + self.dbtype] = os.path.join(sample_dir + output_filename,
+                                                                                  INDEX_CACHE_NAME)
+            else:
+                self.sample_data[sample]["blastdb." + self.dbtype] = (sample_dir + output_filename)
             self.sample_data[sample]["blastdb." + self.dbtype + ".log"] = "{dir}{fn}.log".format(dir= sample_dir,
                                                                                                  fn=output_filename)
 
@@ -44,6 +44,7 @@ Parameters that can be set
 
     "scope", "project | sample", "The scope of the RSEM index. Must match the scope in the RSEM_prep instance."
     "result2use", "genes | isoforms", "Summarize counts at the gene or isoform level."
+    "step_cache", "empty | content", "Skip samples whose command, read or alignment files, RSEM index and module version did not change since the last successful execution. With ``content``, compare file contents rather than sizes and modification times. See ``utilities/step_cache.py``"
 
 Lines for parameter file
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -82,10 +83,11 @@ References
 import os
 import sys
 from neatseq_flow.PLC_step import Step,AssertionExcept
+from neatseq_flow_modules.utilities.step_cache import *
 
 
 __author__ = "Menachem Sklarz"
-__version__ = "0.2.0"
+__version__ = "0.2.1"
 class Step_RSEM_mapper(Step):
     
     def step_specific_init(self):
@@ -100,6 +102,8 @@ class Step_RSEM_mapper(Step):
         if self.params["result2use"] not in ["genes","isoforms"]:
             raise AssertionExcept("'result2use' must be either 'genes' or 'isoforms'")
 
+        self.step_cache = get_step_cache_mode(self.params)
+
     def step_sample_initiation(self):
         """ A place to do initiation stages following setting of sample_data
         """
@@ -143,8 +147,10 @@ class Step_RSEM_mapper(Step):
             self.script += self.get_script_const()
 
             if alignment:
+                inputs = [alignment]
                 self.script += "--alignments %s \\\n\t" % alignment
             elif "fastq.F" in self.sample_data[sample]:
+                inputs = [self.sample_data[sample]["fastq.F"], self.sample_data[sample]["fastq.R"]]
                 self.script += """\
 --paired-end \\
 \t{readsF} \\
@@ -152,14 +158,18 @@ class Step_RSEM_mapper(Step):
 \t""".format(readsF=self.sample_data[sample]["fastq.F"],
            readsR=self.sample_data[sample]["fastq.R"])
             elif "fastq.S" in self.sample_data[sample]:
+                inputs = [self.sample_data[sample]["fastq.S"]]
                 self.script += "{readsS} \\\n\t".format(readsS=self.sample_data[sample]["fastq.S"])
             else:
                 raise AssertionExcept("No fastq file. You must have either alignment files or fastq files...\n", sample)
 
             if self.params["scope"] == "sample":
-                self.script += "%s \\\n\t" % self.sample_data[sample]["RSEM.index"]
+                rsem_index = self.sample_data[sample]["RSEM.index"]
             else:    # if self.params["scope"] == "project":
-                self.script += "%s \\\n\t" % self.sample_data["project_data"]["RSEM.index"]
+                rsem_index = self.sample_data["project_data"]["RSEM.index"]
+            self.script += "%s \\\n\t" % rsem_index
+            # The index is a prefix
+            inputs.append(rsem_index + "*")
 
             self.script += "{dir}{sample}\n\n".format(dir=sample_dir,sample=sample)
             # Saving bam files:
@@ -183,7 +193,15 @@ class Step_RSEM_mapper(Step):
         
             # Move all files from temporary local dir to permanent base_dir
             self.local_finish(use_dir,sample_dir)       # Sees to copying local files to final destination (and other stuff)
-           
+
+            self.script = get_step_cache_script(command=self.script,
+                                                mode=self.step_cache,
+                                                cache_file=get_step_cache_file(sample_dir, self.spec_script_name),
+                                                module=self.step,
+                                                version=__version__,
+                                                inputs=inputs,
+                                                outputs=[self.sample_data[sample]["genes.counts"],
+                                                         self.sample_data[sample]["isoforms.counts"]])
             self.create_low_level_script()
 
     def create_spec_wrapping_up_script(self):
@@ -39,6 +39,12 @@ Parameters that can be set
 
     "scope", "project | sample", "Where to take the reference from"
     "reference", "path to reference", "Use this fasta file. See the definition for reference_fasta_file(s) in the ARGUMENTS section of rsem-prepare-reference help"
+    "index_cache", "path to shared cache directory", "Look for the index in a shared index cache, and build it there if missing. See note below."
+
+.. Note:: When ``index_cache`` is set, the index is stored in a shared, content-addressed cache, keyed on the content of the
+    reference fasta file, the annotation files, the builder executable (i.e. its version) and the builder parameters. If an identical index was already built, e.g. by another project,
+    it is used instead of building a new one. A failed build is not added to the cache. The step directory will contain a
+    symbolic link to the cached index.
 
 Lines for parameter file
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -66,10 +72,11 @@ References
 import os
 import sys
 from neatseq_flow.PLC_step import Step,AssertionExcept
+from neatseq_flow_modules.utilities.index_cache import *
 
 
 __author__ = "Menachem Sklarz"
-__version__ = "1.6.0"
+__version__ = "1.6.1"
 class Step_RSEM_prep(Step):
 
     
@@ -141,20 +148,43 @@ class Step_RSEM_prep(Step):
 
             reference_name = "{ref_name}_rsem_ref".format(ref_name=sample_title)
 
-            # Get constant part of script:
-            self.script += self.get_script_const()
+            # Annotation files passed to rsem-prepare-reference. Stored for hashing by the index cache:
+            other_files = dict()
             for other_file in ["gtf","gff3","transcript-to-gene-map","allele-to-gene-map","no-polyA-subset"]:
-                if "--"+other_file not in self.params["redir_params"]:  # If passed by user, do not include internal
-                    if other_file in self.sample_data[sample]:          # If file exists internally
-                        self.script += "--{tag} {value} \\\n\t".format(tag=other_file,
-                                                                       value=self.sample_data[sample][other_file])
+                if "--"+other_file in self.params["redir_params"]:
+                    other_files["--"+other_file] = self.params["redir_params"]["--"+other_file]
+                elif other_file in self.sample_data[sample]:            # If file exists internally
+                    other_files["--"+other_file] = self.sample_data[sample][other_file]
             # If an internal "gene_trans_map" exists AND it was not passed in redirects, use it
             if "gene_trans_map" in self.sample_data[sample] and \
-                    "transcript-to-gene-map" not in self.params["redir_params"]:
-                self.script += "--transcript-to-gene-map %s \\\n\t" % self.sample_data[sample]["gene_trans_map"]
+                    "--transcript-to-gene-map" not in self.params["redir_params"]:
+                other_files["--transcript-to-gene-map"] = self.sample_data[sample]["gene_trans_map"]
+
+            index_dir = use_dir
+            if "index_cache" in self.params:
+                self.script += get_index_cache_start(cache_dir=self.params["index_cache"],
+                                                     builder="RSEM",
+                                                     script_path=self.params["script_path"],
+                                                     files=[reference_fasta_file] + [other_files[key]
+                                                                                     for key in sorted(other_files)],
+                                                     params=get_index_cache_params(self.params["redir_params"],
+                                                                                   exclude=list(other_files)))
+                index_dir = "$index_cache_tmp/"
+                reference_name = INDEX_CACHE_NAME
+
+            # Get constant part of script:
+            self.script += self.get_script_const()
+            for other_file in sorted(other_files):
+                if other_file not in self.params["redir_params"]:  # If passed by user, already included
+                    self.script += "{tag} {value} \\\n\t".format(tag=other_file,
+                                                                 value=other_files[other_file])
 
             self.script += "%s \\\n\t"  % reference_fasta_file
-            self.script += "%s \n\n"  % (use_dir+reference_name)
+            self.script += "%s \n\n"  % (index_dir+reference_name)
+
+            if "index_cache" in self.params:
+                self.script += get_index_cache_end(link=sample_dir + "RSEM_index")
+                sample_dir = sample_dir + "RSEM_index/"
 
             self.sample_data[sample]["RSEM.index"] = "{dir}{ref_name}".format(dir=sample_dir, ref_name=reference_name)
             self.sample_data[sample]["RSEM_fasta"] = reference_fasta_file
@@ -50,6 +50,12 @@ Parameters that can be set
     :widths: 15, 10, 10
 
     "scope", "project | sample", "Not used"
+    "index_cache", "path to shared cache directory", "Look for the index in a shared index cache, and build it there if missing. See note below."
+
+.. Note:: When ``index_cache`` is set, the index is stored in a shared, content-addressed cache, keyed on the content of the
+    fasta file, the splice junction and GTF files, the builder executable (i.e. its version) and the builder parameters. If an identical index was already built, e.g. by another project,
+    it is used instead of building a new one. A failed build is not added to the cache. The step directory will contain a
+    symbolic link to the cached index.
 
 Lines for parameter file
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -81,10 +87,11 @@ Dobin, A., Davis, C.A., Schlesinger, F., Drenkow, J., Zaleski, C., Jha, S., Batu
 import os, re
 import sys
 from neatseq_flow.PLC_step import Step,AssertionExcept
+from neatseq_flow_modules.utilities.index_cache import *
 
 
 __author__ = "Menachem Sklarz"
-__version__ = "1.2.0"
+__version__ = "1.2.1"
 
 
 class Step_STAR_builder(Step):
@@ -207,13 +214,33 @@ class Step_STAR_builder(Step):
             if self.use_internal_GTF_file:
                 self.params["redir_params"]["--sjdbGTFfile"] = self.sample_data[sample]["gtf"]
 
+            genomeDir = use_dir
+            if "index_cache" in self.params:
+                # Annotation files are hashed by content, rather than by path
+                index_files = [self.sample_data[sample]["fasta.nucl"]] + \
+                              [self.params["redir_params"][param]
+                               for param in ["--sjdbGTFfile", "--sjdbFileChrStartEnd"]
+                               if self.params["redir_params"].get(param)]
+                self.script += get_index_cache_start(cache_dir=self.params["index_cache"],
+                                                     builder="STAR",
+                                                     script_path=self.params["script_path"],
+                                                     files=index_files,
+                                                     params=get_index_cache_params(self.params["redir_params"],
+                                                                                   exclude=["--sjdbGTFfile",
+                                                                                            "--sjdbFileChrStartEnd"]))
+                genomeDir = "$index_cache_tmp/"
+
             # Get constant part of script:
             self.script += self.get_script_const()
             self.script += "--runMode genomeGenerate \\\n\t"
-            self.script += "--genomeDir %s \\\n\t"  % use_dir
+            self.script += "--genomeDir %s \\\n\t"  % genomeDir
             self.script += "--genomeFastaFiles %s \n\n"  % self.sample_data[sample]["fasta.nucl"]
 
-            self.sample_data[sample]["STAR.index"] = sample_dir
+            if "index_cache" in self.params:
+                self.script += get_index_cache_end(link=sample_dir + "STAR_index")
+                self.sample_data[sample]["STAR.index"] = sample_dir + "STAR_index/"
+            else:
+                self.sample_data[sample]["STAR.index"] = sample_dir
             self.sample_data[sample]["STAR.fasta"] = self.sample_data[sample]["fasta.nucl"]
 
             # Move all files from temporary local dir to permanent base_dir
@@ -91,6 +91,13 @@ Parameters that can be set
 
     "ref_genome", "path to genome fasta", ""
     "scope", "project | sample", "The scope from which to take the genome directory"
+    "batch_size", "integer", "Map samples in batches of this size, loading the genome into shared memory once per batch. See note below."
+    "batch_concurrency", "integer", "Number of samples within a batch to map concurrently against the shared genome. Default: 1"
+    "telemetry", "empty | path to directory", "Record the resource usage of the STAR commands in a metrics file, in the given directory or in the step directory. See note below."
+    "resource_models", "path to models file", "Set ``-pe``, ``h_vmem`` and ``--runThreadN`` of every script to values recommended from recorded metrics. In batch mode, the recommendation is for the largest sample in the batch. See ``utilities/resources.py``"
+    "stage_inputs", "empty | path to node-local directory", "Copy the genome directory to node-local scratch before mapping. See note below."
+    "stage_streams", "integer", "Number of parallel streams for copying with ``stage_inputs``. Default: 4"
+    "step_cache", "empty | content", "Skip samples whose command, read files, genome dir and module version did not change since the last successful execution. With ``content``, compare file contents rather than sizes and modification times. Can not be used with ``batch_size``. See ``utilities/step_cache.py``"
 
 .. Note::
     You can set the RG atrribute of the resulting SAM/BAM files with the redirected parameter ``--outSAMattrRGline``
@@ -99,6 +106,27 @@ Parameters that can be set
     By default, the parameter will be set to include ID and SM tags, both set to the sample name.
     You can set the SM tag, but any ID tags will be removed and replaced with the sample name.
 
+.. Note:: Setting ``batch_size`` creates one script per batch of samples instead of one script per sample.
+    Each batch script loads the genome into shared memory once (``--genomeLoad LoadAndExit``), maps all samples in the
+    batch with ``--genomeLoad LoadAndKeep`` and removes the genome from memory when the script exits, whether mapping
+    succeeded or not. Since the genome is loaded and removed on the node executing the batch, you do not have to
+    hand-pin nodes or use ``STAR_LoadRemoveGenome``. If ``node`` is set in ``qsub_params``, batches are distributed
+    between the nodes round-robin.
+    The output slots are the same as in per-sample mode.
+
+.. Note:: With ``telemetry``, wall time, peak memory, CPU time and I/O of the mapping of every sample are appended to
+    ``<step>.<name>.metrics.jsonl``. Summarize the metrics files of all steps with
+    ``python neatseq_flow_modules/utilities/telemetry.py collect``.
+
+.. Note:: With ``stage_inputs``, every script copies the genome directory to the given directory (default:
+    ``/tmp/neatseq_flow_inputs``) and maps against the local copy. Jobs running on the same node share the copy, which
+    is removed when the last of them finishes. In batch mode, the genome is copied once per batch, and loaded into
+    shared memory from the local copy. See ``neatseq_flow_modules/utilities/input_staging.py``.
+
+.. Attention:: Batch mode is defined for project-scope or external genomes only. It cannot be used with
+    sample-scope genomes. Note that STAR cannot sort BAM files on the fly with a shared genome unless
+    ``--limitBAMsortRAM`` is set.
+
 Lines for parameter file
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
@@ -126,6 +154,20 @@ Lines for parameter file
         scope:              project
         redirects:
             --readMapNumber:    1000
+
+**For batched mapping with a shared-memory genome:**
+
+::
+
+    STAR_map:
+        module:             STAR_mapper
+        base:               STAR_bld_ind
+        script_path:        /path/to/STAR
+        scope:              project
+        batch_size:         16
+        batch_concurrency:  2
+        redirects:
+            --readMapNumber:    1000
     
 References
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -138,9 +180,13 @@ Dobin, A., Davis, C.A., Schlesinger, F., Drenkow, J., Zaleski, C., Jha, S., Batu
 import os, re
 import sys
 from neatseq_flow.PLC_step import Step,AssertionExcept
+from neatseq_flow_modules.utilities.telemetry import *
+from neatseq_flow_modules.utilities.resources import *
+from neatseq_flow_modules.utilities.input_staging import *
+from neatseq_flow_modules.utilities.step_cache import *
 
 __author__ = "Menachem Sklarz"
-__version__ = "1.6.0"
+__version__ = "1.6.5"
 
 class Step_STAR_mapper(Step):
 
@@ -188,6 +234,26 @@ class Step_STAR_mapper(Step):
         else:
             self.wig_type = "None"
 
+        self.step_cache = get_step_cache_mode(self.params)
+
+        if "batch_size" in self.params:
+            if self.step_cache:
+                raise AssertionExcept("'step_cache' can not be used with 'batch_size'")
+            try:
+                self.params["batch_size"] = int(self.params["batch_size"])
+                self.params["batch_concurrency"] = int(self.params.setdefault("batch_concurrency", 1))
+            except (TypeError, ValueError):
+                raise AssertionExcept("'batch_size' and 'batch_concurrency' must be integers")
+            if self.params["batch_size"] < 1 or self.params["batch_concurrency"] < 1:
+                raise AssertionExcept("'batch_size' and 'batch_concurrency' must be positive")
+            if "--genomeLoad" in self.params["redir_params"] and \
+                    self.params["redir_params"]["--genomeLoad"] != "LoadAndKeep":
+                raise AssertionExcept("In batch mode, --genomeLoad must be 'LoadAndKeep' or left unset")
+            self.params["redir_params"]["--genomeLoad"] = "LoadAndKeep"
+            if "--limitBAMsortRAM" not in self.params["redir_params"] and \
+                    self.output_type == "BAM" and "SortedByCoordinate" in self.bam_types:
+                self.write_warning("Sorting BAM with a shared genome requires --limitBAMsortRAM. Please set it!")
+
     def step_sample_initiation(self):
         """ A place to do initiation stages following setting of sample_data
         """
@@ -217,6 +283,9 @@ class Step_STAR_mapper(Step):
 
             if "ref_genome" in list(self.params.keys()):
                 raise AssertionExcept("ref_genome was passed, and 'scope' was defined. Resolve!\n")
+
+            if "batch_size" in self.params and self.params["scope"] == "sample":
+                raise AssertionExcept("'batch_size' can not be used with sample-scope genomes")
         else:
             # If scope is not defined, require '--genomeDir'
             if not "--genomeDir" in self.params["redir_params"]:
@@ -243,116 +312,260 @@ class Step_STAR_mapper(Step):
             Most, if not all, editing should be done here 
             HOWEVER, DON'T FORGET TO CHANGE THE CLASS NAME AND THE FILENAME!
         """
-        
-        for sample in self.sample_data["samples"]:      # Getting list of samples out of samples_hash
 
-            # Make a dir for the current sample:
-            sample_dir = self.make_folder_for_sample(sample)
+        self.telemetry_file = get_telemetry_file(self.params, self.base_dir, self.step, self.name)
+        self.resource_models = get_resource_models(self.params)
+        self.stage_dir = get_input_stage_dir(self.params)
+        # External genome dir. With stage_inputs, replaced with the local copy in redir_params
+        self.genome_dir = self.params["redir_params"].get("--genomeDir")
+
+        if "batch_size" in self.params:
+            self.build_scripts_batched()
+            return
+
+        for sample in self.sample_data["samples"]:      # Getting list of samples out of samples_hash
 
             # Name of specific script:
             self.spec_script_name = self.set_spec_script_name(sample)
             self.script = ""
 
-            # This line should be left before every new script. It sees to local issues.
-            # Use the dir it returns as the base_dir for this step.
-            use_dir = self.local_start(sample_dir)
+            set_recommended_resources(self.params, self.resource_models, self.step,
+                                      inputs=self.get_sample_reads(sample),
+                                      threads_param="--runThreadN")
+
+            inputs = self.add_sample_mapping(sample)
+
+            outputs = [self.sample_data[sample]["SJ.out.tab"]]
+            if self.output_type == "SAM":
+                outputs.append(self.sample_data[sample]["sam"])
+            elif self.output_type == "BAM":
+                outputs.append(self.sample_data[sample]["bam"])
+            self.script = get_step_cache_script(command=self.script,
+                                                mode=self.step_cache,
+                                                cache_file=get_step_cache_file(self.make_folder_for_sample(sample),
+                                                                               self.spec_script_name),
+                                                module=self.step,
+                                                version=__version__,
+                                                inputs=inputs,
+                                                outputs=outputs)
+            self.create_low_level_script()
+
+    def build_scripts_batched(self):
+        """ Build one script per batch of samples.
+            The genome is loaded into shared memory once per batch and removed on exit, even if mapping fails.
+        """
+
+        genomeDir = self.params["redir_params"]["--genomeDir"] if "--genomeDir" in self.params["redir_params"] \
+            else self.sample_data["project_data"]["STAR.index"]
+        batch_size = self.params["batch_size"]
+        concurrency = self.params["batch_concurrency"]
+        samples = self.sample_data["samples"]
+        batches = [samples[i:i + batch_size] for i in range(0, len(samples), batch_size)]
+
+        nodes_list = None
+        if "qsub_params" in self.params and self.params["qsub_params"].get("node"):
+            nodes_list = self.params["qsub_params"]["node"]
+
+        for batch_ind, batch in enumerate(batches):
+            batch_name = "batch{ind}".format(ind=batch_ind + 1)
+            batch_dir = self.make_folder_for_sample(batch_name)
+
+            # Name of specific script:
+            self.spec_script_name = self.jid_name_sep.join([self.step, self.name, batch_name])
+
+            if self.resource_models:
+                largest = max(batch, key=lambda x: get_existing_input_bytes(self.get_sample_reads(x)) or 0)
+                set_recommended_resources(self.params, self.resource_models, self.step,
+                                          inputs=self.get_sample_reads(largest),
+                                          threads_param="--runThreadN")
+
+            genome_cmd = "{script_path} --genomeDir {genomeDir} --outFileNamePrefix {prefix}".\
+                format(script_path=self.params["script_path"],
+                       genomeDir="$STAR_genome_dir" if self.stage_dir else genomeDir,
+                       prefix=batch_dir + batch_name + "_STAR_memory.")
+
+            self.script = """
+# Remove the shared genome when the script exits, whether or not mapping succeeded
+trap '{genome_cmd} --genomeLoad Remove' EXIT
+""".format(genome_cmd=genome_cmd)
+
+            if self.stage_dir:
+                self.script += get_input_stage_script(inputs=[("STAR_genome_dir", genomeDir, "dir")],
+                                                      stage_dir=self.stage_dir,
+                                                      streams=self.params.get("stage_streams"))
 
-            # Define location and prefix for output files:
-            output_prefix = sample + "_STAR_map"
-            # output_prefix = use_dir + output_prefix
-            
-            # Adding sample ID to ID: attribute:
-            if "outSAMattrRGline" in self.params:
-                self.params["redir_params"]["--outSAMattrRGline"] = "ID:{ID} SM:{ID} {rest}".format(ID=sample, \
-                                                                                rest=self.params["outSAMattrRGline"])
-            else:
-                self.params["redir_params"]["--outSAMattrRGline"] = "ID:{ID} SM:{ID}".format(ID=sample)
-            
-            # If using internal index, define it here:
-            if "scope" in self.params:
-                if self.params["scope"] == "sample":
-                    self.params["redir_params"]["--genomeDir"] = self.sample_data[sample]["STAR.index"]
-                else:   
-                    self.params["redir_params"]["--genomeDir"] = self.sample_data["project_data"]["STAR.index"]
             self.script += """
+{genome_cmd} --genomeLoad LoadAndExit
+
+""".format(genome_cmd=genome_cmd)
+
+            for sample_ind, sample in enumerate(batch):
+                if concurrency > 1:
+                    self.script += "(\n"
+                self.add_sample_mapping(sample, stage_genome=False, status_var="STAR_status")
+                if concurrency > 1:
+                    self.script += "exit $STAR_status\n) &\n\n"
+                else:
+                    # Stop the batch if mapping of a sample fails
+                    self.script += "if [ $STAR_status -ne 0 ]; then exit 1; fi\n\n"
+                if (sample_ind + 1) % concurrency == 0 or sample_ind + 1 == len(batch):
+                    self.script += """
+batch_status=0
+for job in $(jobs -p); do
+    wait $job || batch_status=1
+done
+if [ $batch_status -ne 0 ]; then
+    exit 1
+fi
+
+"""
+
+            if nodes_list:
+                self.params["qsub_params"]["node"] = [nodes_list[batch_ind % len(nodes_list)]]
+            self.create_low_level_script()
+
+        # Reset node list to list of nodes.
+        if nodes_list:
+            self.params["qsub_params"]["node"] = nodes_list
+
+    def get_sample_reads(self, sample):
+        """ Return list of the sample's read files
+        """
+        return [self.sample_data[sample][x] for x in ["fastq.F", "fastq.R", "fastq.S"] if x in self.sample_data[sample]]
+
+    def add_sample_mapping(self, sample, stage_genome=True, status_var=None):
+        """ Add the mapping commands for a single sample to self.script and set the sample's output slots
+            With stage_inputs, the genome dir is staged unless 'stage_genome' is False (i.e. staged by the caller)
+            If 'status_var' is passed, the exit status of STAR is stored in a shell variable of that name
+            Returns the input files and directories of the sample, for the step cache
+        """
+
+        # Make a dir for the current sample:
+        sample_dir = self.make_folder_for_sample(sample)
+
+        # This line should be left before every new script. It sees to local issues.
+        # Use the dir it returns as the base_dir for this step.
+        use_dir = self.local_start(sample_dir)
+
+        # Define location and prefix for output files:
+        output_prefix = sample + "_STAR_map"
+        # output_prefix = use_dir + output_prefix
+        
+        # Adding sample ID to ID: attribute:
+        if "outSAMattrRGline" in self.params:
+            self.params["redir_params"]["--outSAMattrRGline"] = "ID:{ID} SM:{ID} {rest}".format(ID=sample, \
+                                                                            rest=self.params["outSAMattrRGline"])
+        else:
+            self.params["redir_params"]["--outSAMattrRGline"] = "ID:{ID} SM:{ID}".format(ID=sample)
+        
+        # If using internal index, define it here:
+        if "scope" in self.params:
+            if self.params["scope"] == "sample":
+                self.params["redir_params"]["--genomeDir"] = self.sample_data[sample]["STAR.index"]
+            else:   
+                self.params["redir_params"]["--genomeDir"] = self.sample_data["project_data"]["STAR.index"]
+        elif self.genome_dir:
+            self.params["redir_params"]["--genomeDir"] = self.genome_dir
+        genome_dir = self.params["redir_params"]["--genomeDir"]
+        if self.stage_dir:
+            if stage_genome:
+                self.script += get_input_stage_script(inputs=[("STAR_genome_dir",
+                                                               self.params["redir_params"]["--genomeDir"],
+                                                               "dir")],
+                                                      stage_dir=self.stage_dir,
+                                                      streams=self.params.get("stage_streams"))
+            self.params["redir_params"]["--genomeDir"] = "$STAR_genome_dir"
+        self.script += """
 if [ -e {tmpdir} ]; then 
     rm -rf {tmpdir}; 
 fi\n\n""".format(tmpdir=use_dir+"STAR_tmp")
 
-            # Get constant part of script:
-            self.script += self.get_script_const()
-            # Setting location of temporary dir:
-            self.script += "--outTmpDir {tmp_dir} \\\n\t".format(tmp_dir=use_dir+"STAR_tmp")
-
-            if "fastq.F" in self.sample_data[sample]:
-                self.script += "--readFilesIn {fastqF} {fastqR}\\\n\t".\
-                    format(fastqF=self.sample_data[sample]["fastq.F"],
-                           fastqR=self.sample_data[sample]["fastq.R"])
-            elif "fastq.S" in self.sample_data[sample]:
-                self.script += "--readFilesIn {fastqS} \\\n\t".format(fastqS=self.sample_data[sample]["fastq.S"])
-            else:
-                raise AssertionExcept("No fastq files exist for sample!!\n" , sample)
+        # Get constant part of script:
+        command = self.get_script_const()
+        # Setting location of temporary dir:
+        command += "--outTmpDir {tmp_dir} \\\n\t".format(tmp_dir=use_dir+"STAR_tmp")
+
+        if "fastq.F" in self.sample_data[sample]:
+            command += "--readFilesIn {fastqF} {fastqR}\\\n\t".\
+                format(fastqF=self.sample_data[sample]["fastq.F"],
+                       fastqR=self.sample_data[sample]["fastq.R"])
+            reads = [self.sample_data[sample]["fastq.F"], self.sample_data[sample]["fastq.R"]]
+        elif "fastq.S" in self.sample_data[sample]:
+            command += "--readFilesIn {fastqS} \\\n\t".format(fastqS=self.sample_data[sample]["fastq.S"])
+            reads = [self.sample_data[sample]["fastq.S"]]
+        else:
+            raise AssertionExcept("No fastq files exist for sample!!\n" , sample)
+    
+        command += "--outFileNamePrefix %s%s. \n\n" % (use_dir,output_prefix)
+
+        self.script += get_telemetry_script(command=command,
+                                            metrics_file=self.telemetry_file,
+                                            step=self.step,
+                                            name=self.name,
+                                            sample=sample,
+                                            inputs=reads)
+        if status_var:
+            self.script += "{var}=$?\n\n".format(var=status_var)
+
+        if self.output_type == "SAM":
+            self.sample_data[sample]["sam"] = "%s%s.Aligned.out.sam" % (sample_dir,output_prefix)
+            self.stamp_file(self.sample_data[sample]["sam"])
+        elif self.output_type == "BAM":
+            if "Unsorted" in self.bam_types:
+                self.sample_data[sample]["bam"] = "%s%s.Aligned.out.bam" % (sample_dir,output_prefix)
+                self.sample_data[sample]["bam_unsorted"] = "%s%s.Aligned.out.bam" % (sample_dir,output_prefix)
+                self.stamp_file(self.sample_data[sample]["bam_unsorted"])
+            if "SortedByCoordinate" in self.bam_types:
+                self.sample_data[sample]["bam"] = "%s%s.Aligned.sortedByCoord.out.bam" % (sample_dir,output_prefix)
+            self.stamp_file(self.sample_data[sample]["bam"])
+        else:  # None
+            pass
+
+        # Storing the SJ file:
+        self.sample_data[sample]["SJ.out.tab"] = "%s%s.SJ.out.tab" % (sample_dir,output_prefix)
+        self.stamp_file(self.sample_data[sample]["SJ.out.tab"])
+
+        if self.wig_type == "bedGraph":
+            if "--outWigStrand" not in self.params["redir_params"] or self.params["redir_params"]["--outWigStrand"] == "Stranded":
+                self.sample_data[sample]["bdg2_UniqueMultiple"] = "%s%s.Signal.UniqueMultiple.str2.out.bg" % (sample_dir,output_prefix)
+                self.sample_data[sample]["bdg2_Unique"] = "%s%s.Signal.Unique.str2.out.bg" % (sample_dir,output_prefix)
+                self.stamp_file(self.sample_data[sample]["bdg2_UniqueMultiple"])
+                self.stamp_file(self.sample_data[sample]["bdg2_Unique"])
+            self.sample_data[sample]["bdg1_UniqueMultiple"] = "%s%s.Signal.UniqueMultiple.str1.out.bg" % (sample_dir,output_prefix)
+            self.sample_data[sample]["bdg1_Unique"] = "%s%s.Signal.Unique.str1.out.bg" % (sample_dir,output_prefix)
+            self.stamp_file(self.sample_data[sample]["bdg1_UniqueMultiple"])
+            self.stamp_file(self.sample_data[sample]["bdg1_Unique"])
+            self.sample_data[sample]["bdg"] = self.sample_data[sample]["bdg1_UniqueMultiple"]
+        elif self.wig_type == "wiggle":
+            if "--outWigStrand" not in self.params["redir_params"] or self.params["redir_params"]["--outWigStrand"] == "Stranded":
+                self.sample_data[sample]["wig2_UniqueMultiple"] = "%s%s.Signal.UniqueMultiple.str2.out.wig" % (sample_dir,output_prefix)
+                self.sample_data[sample]["wig2_Unique"] = "%s%s.Signal.Unique.str2.out.wig" % (sample_dir,output_prefix)
+                self.stamp_file(self.sample_data[sample]["wig2_UniqueMultiple"])
+                self.stamp_file(self.sample_data[sample]["wig2_Unique"])
+            self.sample_data[sample]["wig1_UniqueMultiple"] = "%s%s.Signal.UniqueMultiple.str1.out.wig" % (sample_dir,output_prefix)
+            self.sample_data[sample]["wig1_Unique"] = "%s%s.Signal.Unique.str1.out.wig" % (sample_dir,output_prefix)
+            self.stamp_file(self.sample_data[sample]["wig1_UniqueMultiple"])
+            self.stamp_file(self.sample_data[sample]["wig1_Unique"])
+            self.sample_data[sample]["wig"] = self.sample_data[sample]["wig1_UniqueMultiple"]
+        else:
+            pass
+
+        if "--quantMode" in self.params["redir_params"]:
+            if re.search(string=self.params["redir_params"]["--quantMode"], pattern="GeneCounts"):
+                self.sample_data[sample]["GeneCounts"] = "%s%s.ReadsPerGene.out.tab" % (sample_dir,output_prefix)
+                self.stamp_file(self.sample_data[sample]["GeneCounts"])
+            if re.search(string=self.params["redir_params"]["--quantMode"], pattern="TranscriptomeSAM"):
+                self.sample_data[sample]["bam_transcriptome"] = "%s%s.Aligned.toTranscriptome.out.bam" % (sample_dir,output_prefix)
+                self.stamp_file(self.sample_data[sample]["bam_transcriptome"])
+
+        # Storing name of mapper. might be useful:
+        self.sample_data[sample]["mapper"] = self.get_step_step()  
         
-            self.script += "--outFileNamePrefix %s%s. \n\n" % (use_dir,output_prefix)
+        # Storing reference genome for use by downstream steps:
+        if "ref_genome" in list(self.params.keys()):
+            self.sample_data[sample]["reference"] = self.params["ref_genome"]
 
-            if self.output_type == "SAM":
-                self.sample_data[sample]["sam"] = "%s%s.Aligned.out.sam" % (sample_dir,output_prefix)
-                self.stamp_file(self.sample_data[sample]["sam"])
-            elif self.output_type == "BAM":
-                if "Unsorted" in self.bam_types:
-                    self.sample_data[sample]["bam"] = "%s%s.Aligned.out.bam" % (sample_dir,output_prefix)
-                    self.sample_data[sample]["bam_unsorted"] = "%s%s.Aligned.out.bam" % (sample_dir,output_prefix)
-                    self.stamp_file(self.sample_data[sample]["bam_unsorted"])
-                if "SortedByCoordinate" in self.bam_types:
-                    self.sample_data[sample]["bam"] = "%s%s.Aligned.sortedByCoord.out.bam" % (sample_dir,output_prefix)
-                self.stamp_file(self.sample_data[sample]["bam"])
-            else:  # None
-                pass
-
-            # Storing the SJ file:
-            self.sample_data[sample]["SJ.out.tab"] = "%s%s.SJ.out.tab" % (sample_dir,output_prefix)
-            self.stamp_file(self.sample_data[sample]["SJ.out.tab"])
-
-            if self.wig_type == "bedGraph":
-                if "--outWigStrand" not in self.params["redir_params"] or self.params["redir_params"]["--outWigStrand"] == "Stranded":
-                    self.sample_data[sample]["bdg2_UniqueMultiple"] = "%s%s.Signal.UniqueMultiple.str2.out.bg" % (sample_dir,output_prefix)
-                    self.sample_data[sample]["bdg2_Unique"] = "%s%s.Signal.Unique.str2.out.bg" % (sample_dir,output_prefix)
-                    self.stamp_file(self.sample_data[sample]["bdg2_UniqueMultiple"])
-                    self.stamp_file(self.sample_data[sample]["bdg2_Unique"])
-                self.sample_data[sample]["bdg1_UniqueMultiple"] = "%s%s.Signal.UniqueMultiple.str1.out.bg" % (sample_dir,output_prefix)
-                self.sample_data[sample]["bdg1_Unique"] = "%s%s.Signal.Unique.str1.out.bg" % (sample_dir,output_prefix)
-                self.stamp_file(self.sample_data[sample]["bdg1_UniqueMultiple"])
-                self.stamp_file(self.sample_data[sample]["bdg1_Unique"])
-                self.sample_data[sample]["bdg"] = self.sample_data[sample]["bdg1_UniqueMultiple"]
-            elif self.wig_type == "wiggle":
-                if "--outWigStrand" not in self.params["redir_params"] or self.params["redir_params"]["--outWigStrand"] == "Stranded":
-                    self.sample_data[sample]["wig2_UniqueMultiple"] = "%s%s.Signal.UniqueMultiple.str2.out.wig" % (sample_dir,output_prefix)
-                    self.sample_data[sample]["wig2_Unique"] = "%s%s.Signal.Unique.str2.out.wig" % (sample_dir,output_prefix)
-                    self.stamp_file(self.sample_data[sample]["wig2_UniqueMultiple"])
-                    self.stamp_file(self.sample_data[sample]["wig2_Unique"])
-                self.sample_data[sample]["wig1_UniqueMultiple"] = "%s%s.Signal.UniqueMultiple.str1.out.wig" % (sample_dir,output_prefix)
-                self.sample_data[sample]["wig1_Unique"] = "%s%s.Signal.Unique.str1.out.wig" % (sample_dir,output_prefix)
-                self.stamp_file(self.sample_data[sample]["wig1_UniqueMultiple"])
-                self.stamp_file(self.sample_data[sample]["wig1_Unique"])
-                self.sample_data[sample]["wig"] = self.sample_data[sample]["wig1_UniqueMultiple"]
-            else:
-                pass
-
-            if "--quantMode" in self.params["redir_params"]:
-                if re.search(string=self.params["redir_params"]["--quantMode"], pattern="GeneCounts"):
-                    self.sample_data[sample]["GeneCounts"] = "%s%s.ReadsPerGene.out.tab" % (sample_dir,output_prefix)
-                    self.stamp_file(self.sample_data[sample]["GeneCounts"])
-                if re.search(string=self.params["redir_params"]["--quantMode"], pattern="TranscriptomeSAM"):
-                    self.sample_data[sample]["bam_transcriptome"] = "%s%s.Aligned.toTranscriptome.out.bam" % (sample_dir,output_prefix)
-                    self.stamp_file(self.sample_data[sample]["bam_transcriptome"])
-
-            # Storing name of mapper. might be useful:
-            self.sample_data[sample]["mapper"] = self.get_step_step()  
-            
-            # Storing reference genome for use by downstream steps:
-            if "ref_genome" in list(self.params.keys()):
-                self.sample_data[sample]["reference"] = self.params["ref_genome"]
+        # Move all files from temporary local dir to permanent base_dir
+        self.local_finish(use_dir,self.base_dir)
 
-            # Move all files from temporary local dir to permanent base_dir
-            self.local_finish(use_dir,self.base_dir)
-            self.create_low_level_script()
+        return reads + [genome_dir]
@@ -38,6 +38,7 @@ Parameters that can be set
 
     "gff", "path to bowtie1 index", "If not given, will look for a project bowtie1 index and then for a sample bowtie1 index"
     "-f|--format", "sam | bam", "In redirects. Tells htseq-count which file to use. If not specified, will use whichever file exists."
+    "step_cache", "empty | content", "Skip samples whose command, alignment file, gff and module version did not change since the last successful execution. With ``content``, compare file contents rather than sizes and modification times. See ``utilities/step_cache.py``"
 
 Lines for parameter file
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -70,10 +71,11 @@ Anders, S., Pyl, P.T. and Huber, W., 2015. **HTSeq—a Python framework to work
 import os
 import sys
 from neatseq_flow.PLC_step import Step,AssertionExcept
+from neatseq_flow_modules.utilities.step_cache import *
 
 
 __author__ = "Menachem Sklarz"
-__version__ = "1.6.0"
+__version__ = "1.6.1"
 
 
 class Step_htseq_count(Step):
@@ -97,6 +99,8 @@ class Step_htseq_count(Step):
         
         if "--format" in self.params["redir_params"] and self.params["redir_params"]["--format"] not in ["sam","bam"]:
             raise AssertionExcept("-f/--format can be either 'bam' or 'sam'")
+
+        self.step_cache = get_step_cache_mode(self.params)
             
 
     def step_sample_initiation(self):
@@ -175,9 +179,14 @@ class Step_htseq_count(Step):
         
             # Move all files from temporary local dir to permanent base_dir
             self.local_finish(use_dir,sample_dir)       # Sees to copying local files to final destination (and other stuff)
-       
-            
-            
+
+            self.script = get_step_cache_script(command=self.script,
+                                                mode=self.step_cache,
+                                                cache_file=get_step_cache_file(sample_dir, self.spec_script_name),
+                                                module=self.step,
+                                                version=__version__,
+                                                inputs=[input_file, self.params["gff"]],
+                                                outputs=[self.sample_data[sample]["HTSeq.counts"]])
             self.create_low_level_script()
                     
         
@@ -41,6 +41,18 @@ Output:
 
     * ``sample_data[<sample>]["mash.dist.table"]``
     * ``sample_data["mash.dist.table"]``
+
+* With ``shards``, puts the distance matrix in the following slot (the row and column names are in files with the same
+  prefix and suffixes ``.rows`` and ``.cols``):
+
+    * ``sample_data["mash.dist.matrix"]``
+
+.. Note:: With ``shards``, and a ``query`` of scope ``all_samples`` with ``msh``, the queries are split into blocks of
+    consecutive samples, and each block is compared to the reference by a separate script, so that the blocks run in
+    parallel. Each script converts its ``mash dist`` output into a binary block, without storing the text table, and
+    the wrapping up script combines the blocks into a single matrix of 32 bit floats (see
+    ``mash_module/mash_matrix.py``). Use ``matrix_format: triangle`` for all-against-all comparisons, *i.e.* when the
+    reference is the project sketch combined from the sample sketches, to store only the lower triangle.
     
 
 Parameters that can be set        
@@ -52,6 +64,8 @@ Parameters that can be set
     
     "reference", "", "A block including 'path' or 'scope', 'type' and optionally 'msh'"
     "query", "", "A block including 'scope' (sample, project or all_samples), 'type' and optionally 'msh'"
+    "shards", "int", "Number of parallel scripts for query scope ``all_samples``. The results are stored as a binary matrix."
+    "matrix_format", "square|triangle", "Format of the matrix with ``shards``. Default: square"
 
 
 Lines for parameter file
@@ -131,6 +145,28 @@ Lines for parameter file
             type:       fastq
             msh:
 
+5. All-against-all comparison of the samples in 20 parallel scripts, stored as a triangular matrix.
+    Use with a ``mash_sketch`` instance with ``incremental``, ``scope=project`` and ``src_scope=sample``.
+
+::
+
+    dist_all:
+        module:         mash_dist
+        base:           sketch_proj_inc
+        script_path:    "{Vars.paths.mash} dist"
+        shards:         20
+        matrix_format:  triangle
+        reference:
+            scope:      project
+            type:       fastq
+            msh:
+        query:
+            scope:      all_samples
+            type:       fastq
+            msh:
+        redirects:
+            -p:         4
+
 
 References
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -146,7 +182,10 @@ from neatseq_flow.PLC_step import Step, AssertionExcept
 
 
 __author__ = "Menachem Sklarz"
-__version__ = "1.6.0"
+__version__ = "1.6.1"
+
+# Script for storing the distances in a binary matrix
+MASH_MATRIX = os.path.join(os.path.dirname(os.path.realpath(__file__)), "mash_matrix.py")
 
 
 class Step_mash_dist(Step):
@@ -164,6 +203,22 @@ class Step_mash_dist(Step):
         if not (set(self.params) & {"reference" ,"query"}):
             raise AssertionExcept("You must pass 'reference' and 'query' blocks of params. See help")
 
+        if "shards" in self.params:
+            if self.params["query"]["scope"] != "all_samples" or "msh" not in self.params["query"]:
+                raise AssertionExcept("'shards' requires a 'query' of scope 'all_samples' with 'msh'")
+            try:
+                self.params["shards"] = int(self.params["shards"])
+            except (TypeError, ValueError):
+                raise AssertionExcept("'shards' must be a positive integer")
+            if self.params["shards"] < 1:
+                raise AssertionExcept("'shards' must be a positive integer")
+            if "matrix_format" not in self.params or not self.params["matrix_format"]:
+                self.params["matrix_format"] = "square"
+            if self.params["matrix_format"] not in ["square", "triangle"]:
+                raise AssertionExcept("'matrix_format' must be either 'square' or 'triangle'")
+        elif "matrix_format" in self.params:
+            raise AssertionExcept("'matrix_format' can only be used with 'shards'")
+
     def step_sample_initiation(self):
         """ A place to do initiation stages following setting of sample_data
         """
@@ -174,14 +229,37 @@ class Step_mash_dist(Step):
     def create_spec_wrapping_up_script(self):
         """ Add stuff to check and agglomerate the output data
         """
-        pass
+
+        self.script = ""
+        if "shards" in self.params:
+            output_prefix = self.base_dir + self.sample_data["Title"] + ".mash.dist"
+            self.script += """\
+# Combining the distance blocks into a single matrix
+python {path} combine \\
+\t--format {format} \\
+\t--output {prefix} \\
+\t{blocks} \\
+\t&& rm -f {block_files}
+
+""".format(path=MASH_MATRIX,
+           format=self.params["matrix_format"],
+           prefix=output_prefix,
+           blocks=" \\\n\t".join(self.shard_blocks),
+           block_files=" ".join(["{block}.bin {block}.rows {block}.cols".format(block=block)
+                                 for block in self.shard_blocks]))
+
+            # Store results matrix
+            self.sample_data["project_data"]["mash.dist.matrix"] = output_prefix + ".bin"
+            self.stamp_file(self.sample_data["project_data"]["mash.dist.matrix"])
 
     def build_scripts(self):
         """ This is the actual script building function
             
         """
 
-        if self.params["query"]["scope"] in ["all_samples", "project"]:
+        if "shards" in self.params:
+            self.build_scripts_sharded()
+        elif self.params["query"]["scope"] in ["all_samples", "project"]:
             self.build_scripts_byproject()
         else:
             self.build_scripts_bysample()
@@ -293,28 +371,7 @@ class Step_mash_dist(Step):
         self.script = ""
 
         # Setting reference sources:
-        if "path" in self.params["reference"]:
-            ref_path = self.params["reference"]["path"]
-        else:
-            if "type" in self.params["reference"] and self.params["reference"]["type"] == "fasta":
-                type2use = "fasta"
-            else:
-                type2use = "fastq"
-
-            if "msh" in self.params["reference"]:
-                # if msh2use not in self.sample_data[sample]:
-                try:
-                    ref_path = self.sample_data["project_data"]["msh." + type2use]
-                except KeyError:
-                    raise AssertionExcept("No {type} mash sketch (in reference) for project".format(type=type2use))
-
-            else:
-                if type2use == "fasta":
-                    type2use = "fasta.nucl"
-                try:
-                    ref_path = self.sample_data["project_data"][type2use]
-                except KeyError:
-                    raise AssertionExcept("No {type} file (in reference) for project".format(type=type2use))
+        ref_path = self.get_project_ref_path()
 
         # Setting query sources:
         if "type" in self.params["query"] and self.params["query"]["type"] == "fasta":
@@ -368,3 +425,89 @@ class Step_mash_dist(Step):
         self.local_finish(use_dir,self.base_dir)
         self.create_low_level_script()
 
+    def build_scripts_sharded(self):
+        """ Script building function for comparing blocks of samples to the reference in parallel scripts
+
+        """
+
+        ref_path = self.get_project_ref_path()
+
+        if "type" in self.params["query"] and self.params["query"]["type"] == "fasta":
+            type2use = "fasta"
+        else:
+            type2use = "fastq"
+        for sample in self.sample_data["samples"]:
+            if "msh." + type2use not in self.sample_data[sample]:
+                raise AssertionExcept("No {type} mash sketch (in query) for sample".format(type=type2use), sample)
+
+        shard_size = -(-len(self.sample_data["samples"]) // self.params["shards"])
+        shards = [self.sample_data["samples"][ind:ind + shard_size]
+                  for ind in range(0, len(self.sample_data["samples"]), shard_size)]
+        width = len(str(len(shards)))
+
+        self.shard_blocks = list()
+        for shard_ind, shard in enumerate(shards):
+
+            shard_name = "shard{ind:0{width}d}".format(ind=shard_ind + 1, width=width)
+            # Name of specific script:
+            self.spec_script_name = self.jid_name_sep.join([self.step,self.name,shard_name])
+
+            # This line should be left before every new script. It sees to local issues.
+            # Use the dir it returns as the base_dir for this step.
+            use_dir = self.local_start(self.base_dir)
+
+            output_prefix = ".".join([self.sample_data["Title"], shard_name])
+            # List of query sketches in shard
+            list_filename = self.base_dir + output_prefix + ".queries.txt"
+            with open(list_filename, "w") as list_fh:
+                list_fh.write("\n".join([self.sample_data[sample]["msh." + type2use] for sample in shard]) + "\n")
+
+            self.script = """\
+# Comparing samples {first} to {last} to the reference
+(
+set -o pipefail
+{const}{ref} \\
+\t-l {queries} \\
+\t| python {path} block \\
+\t\t--output {out}
+)
+
+""".format(first=shard[0],
+           last=shard[-1],
+           const=self.get_script_const(),
+           ref=ref_path,
+           queries=list_filename,
+           path=MASH_MATRIX,
+           out=use_dir + output_prefix)
+
+            self.shard_blocks.append(self.base_dir + output_prefix)
+
+            self.local_finish(use_dir,self.base_dir)
+            self.create_low_level_script()
+
+    def get_project_ref_path(self):
+        """ Return the reference for project scope queries
+
+        """
+
+        if "path" in self.params["reference"]:
+            return self.params["reference"]["path"]
+
+        if "type" in self.params["reference"] and self.params["reference"]["type"] == "fasta":
+            type2use = "fasta"
+        else:
+            type2use = "fastq"
+
+        if "msh" in self.params["reference"]:
+            try:
+                return self.sample_data["project_data"]["msh." + type2use]
+            except KeyError:
+                raise AssertionExcept("No {type} mash sketch (in reference) for project".format(type=type2use))
+
+        if type2use == "fasta":
+            type2use = "fasta.nucl"
+        try:
+            return self.sample_data["project_data"][type2use]
+        except KeyError:
+            raise AssertionExcept("No {type} file (in reference) for project".format(type=type2use))
+
@@ -0,0 +1,124 @@
+# -*- coding: UTF-8 -*-
+"""
+Store ``mash dist`` results as a compact, binary distance matrix.
+
+Works in two stages:
+
+* ``block``: Reads the ``mash dist`` table of a block of queries from stdin, and writes the distances as a binary
+  block. The text table is not stored.
+* ``combine``: Concatenates the blocks, in order, into a single matrix.
+
+The matrix is stored in three files:
+
+* ``<prefix>.bin``: 32 bit floats (little endian). For ``square``, the full matrix, row by row. For ``triangle``, the
+  lower triangle, without the diagonal, row by row: row ``i`` holds the distances of query ``i`` to references ``0``
+  to ``i-1``. ``triangle`` requires the queries and references to be identical, as in all-against-all comparisons.
+* ``<prefix>.rows``: The query names, one per line.
+* ``<prefix>.cols``: The reference names, one per line.
+
+Used by the ``mash_dist`` module.
+"""
+
+import sys
+import argparse
+from array import array
+
+__author__ = "Menachem Sklarz"
+__version__ = "1.6.0"
+
+
+def read_names(filename):
+    with open(filename, "r") as names_fh:
+        return [line.rstrip("\n") for line in names_fh if line.strip()]
+
+
+def write_names(names, filename):
+    with open(filename, "w") as names_fh:
+        for name in names:
+            names_fh.write(name + "\n")
+
+
+def write_array(values, out_fh):
+    if sys.byteorder != "little":
+        values.byteswap()
+    values.tofile(out_fh)
+
+
+def write_block(in_fh, prefix):
+    """ Convert the mash dist table on in_fh to a binary block
+    """
+
+    queries = dict()    # query: row
+    refs = dict()       # reference: column
+    distances = dict()  # (row, column): distance
+    for line in in_fh:
+        fields = line.rstrip("\n").split("\t")
+        if len(fields) < 3:
+            continue
+        ref, query = fields[0], fields[1]
+        row = queries.setdefault(query, len(queries))
+        col = refs.setdefault(ref, len(refs))
+        distances[(row, col)] = float(fields[2])
+
+    if len(distances) != len(queries) * len(refs):
+        sys.exit("Incomplete mash dist table: found {found} distances for {rows} queries and {cols} references".
+                 format(found=len(distances), rows=len(queries), cols=len(refs)))
+
+    with open(prefix + ".bin", "wb") as out_fh:
+        for row in range(len(queries)):
+            write_array(array("f", [distances[(row, col)] for col in range(len(refs))]), out_fh)
+    write_names(sorted(queries, key=queries.get), prefix + ".rows")
+    write_names(sorted(refs, key=refs.get), prefix + ".cols")
+
+
+def combine_blocks(blocks, prefix, matrix_format):
+    """ Concatenate the binary blocks into a single matrix
+    """
+
+    rows = list()
+    cols = None
+    with open(prefix + ".bin", "wb") as out_fh:
+        for block in blocks:
+            block_rows = read_names(block + ".rows")
+            block_cols = read_names(block + ".cols")
+            if cols is None:
+                cols = block_cols
+            elif block_cols != cols:
+                sys.exit("References of block {block} differ from the first block".format(block=block))
+            with open(block + ".bin", "rb") as block_fh:
+                for name in block_rows:
+                    values = array("f")
+                    values.fromfile(block_fh, len(cols))
+                    if sys.byteorder != "little":
+                        values.byteswap()
+                    if matrix_format == "triangle":
+                        values = values[:len(rows)]
+                    write_array(values, out_fh)
+                    rows.append(name)
+
+    if matrix_format == "triangle" and rows != cols:
+        sys.exit("'triangle' requires identical queries and references. Use 'square'")
+    write_names(rows, prefix + ".rows")
+    write_names(cols, prefix + ".cols")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Store mash dist results as a compact, binary distance matrix")
+    subparsers = parser.add_subparsers(dest="command")
+    block_parser = subparsers.add_parser("block", help="Convert a mash dist table, read from stdin, to a binary block")
+    block_parser.add_argument("-o", "--output", required=True, help="Output prefix")
+    combine_parser = subparsers.add_parser("combine", help="Combine binary blocks into a single matrix")
+    combine_parser.add_argument("-o", "--output", required=True, help="Output prefix")
+    combine_parser.add_argument("-f", "--format", choices=["square", "triangle"], default="square",
+                                help="Matrix format")
+    combine_parser.add_argument("blocks", nargs="+", help="Prefixes of blocks, in row order")
+    args = parser.parse_args()
+
+    if args.command == "block":
+        write_block(sys.stdin, args.output)
+    elif args.command == "combine":
+        combine_blocks(args.blocks, args.output, args.format)
+    else:
+        parser.print_help()
+        sys.exit(1)
@@ -19,6 +19,13 @@ Works in three modes:
 * ``scope=project``
     Builds a sketch from project sequence files.
 
+.. Note:: With ``incremental``, and ``src_scope=sample``, each sample is sketched into a sample sketch, by a separate
+    script, and the sample's sequence files are streamed into ``mash`` rather than concatenated into a merged file. The
+    sample script stores a key of the sketch parameters and the names, sizes and modification times of the sequence
+    files alongside the sketch, and does not sketch again if the key has not changed. For ``scope=project``, the
+    sample sketches are then combined into the project sketch with ``mash paste``. Adding samples to a project
+    therefore sketches only the new samples. Sketches of reads (fastq) are named by the sample name (``-I``).
+
     
 Requires:
 ~~~~~~~~~~~~~
@@ -60,6 +67,8 @@ Parameters that can be set
     "scope", "project|sample", "The scope for which to build the sketch."
     "src_scope", "project|sample", "The scope from which to take the sequence files. Default - same as ``scope``"
     "type", "nucl|prot", "Use fastq or fasta files. By default, uses any that exist."
+    "incremental", "", "Sketch each sample separately, and only if its sequence files changed. Requires ``src_scope=sample``."
+    "mash_path", "", "Path to ``mash``, for ``mash paste``. By default, derived from ``script_path``."
 
 
 Lines for parameter file
@@ -98,6 +107,22 @@ Lines for parameter file
             -m:         2
             -p:         10
 
+3. Create project sketch from sample sketches, sketching only new or changed samples
+
+::
+
+    sketch_proj_inc:
+        module:         mash_sketch
+        base:           trim_gal
+        script_path:    "{Vars.paths.mash} sketch"
+        src_scope:      sample
+        scope:          project
+        type:           fastq
+        incremental:
+        redirects:
+            -m:         2
+            -p:         10
+
 
 References
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -106,11 +131,14 @@ Ondov, Brian D., et al. **Mash: fast genome and metagenome distance estimation u
 
 
 """
+import os
 import sys
+import re
+import hashlib
 from neatseq_flow.PLC_step import Step,AssertionExcept
 
 __author__ = "Menachem Sklarz"
-__version__ = "1.6.0"
+__version__ = "1.6.2"
 
 class Step_mash_sketch(Step):
     
@@ -142,6 +170,15 @@ class Step_mash_sketch(Step):
             if isinstance(self.params["type"], str):
                 self.params["type"] = [self.params["type"]]
 
+        if "incremental" in self.params:
+            if self.params["src_scope"] != "sample":
+                raise AssertionExcept("'incremental' requires 'src_scope' sample")
+            if "mash_path" not in self.params or not self.params["mash_path"]:
+                # script_path is 'mash sketch'. Removing the 'sketch' command
+                if not re.search("\s+sketch\s*$", self.params["script_path"]):
+                    raise AssertionExcept("Can't derive path to mash from 'script_path'. Please pass 'mash_path'")
+                self.params["mash_path"] = re.sub("\s+sketch\s*$", "", self.params["script_path"])
+
     def step_sample_initiation(self):
         """ A place to do initiation stages following setting of sample_data
         """
@@ -154,7 +191,10 @@ class Step_mash_sketch(Step):
         """
         
         self.script = ""
-        if self.params["scope"]=="project" and self.params["src_scope"] == "sample":
+        if "incremental" in self.params:
+            if self.params["scope"] == "project":
+                self.script = self.get_paste_script()
+        elif self.params["scope"]=="project" and self.params["src_scope"] == "sample":
             for type in list(set(self.params["type"]) & {"fastq", "fasta"}):
 
                 # Create script only if there are files in files4mashing_lists
@@ -184,6 +224,8 @@ class Step_mash_sketch(Step):
 
         if self.params["src_scope"] == "project":
             self.build_scripts_byproject()
+        elif "incremental" in self.params:
+            self.build_scripts_incremental()
         else:
             self.build_scripts_bysample()
 
@@ -272,6 +314,125 @@ class Step_mash_sketch(Step):
                     self.local_finish(use_dir,sample_dir)
                     self.create_low_level_script()
             
+    def build_scripts_incremental(self):
+        """ Script building function for sketching each sample separately, only if its files changed
+
+        """
+
+        self.sample_sketches = dict()
+        self.sample_sketches["fasta"] = list()
+        self.sample_sketches["fastq"] = list()
+
+        # Changing the sketch parameters requires sketching again
+        params_key = hashlib.md5(self.get_script_const().encode("utf-8")).hexdigest()
+
+        for sample in self.sample_data["samples"]:      # Getting list of samples out of samples_hash
+
+            # Make a dir for the current sample:
+            sample_dir = self.make_folder_for_sample(sample)
+
+            filetype_lists = {"fastq": sorted(set(self.sample_data[sample].keys()) & {"fastq.F", "fastq.R", "fastq.S"}),
+                              "fasta": sorted(set(self.sample_data[sample].keys()) & {"fasta.nucl"})}
+
+            # Loop over all types requested by user in 'type'
+            for filetype in list(set(self.params["type"]) & {"fastq", "fasta"}):
+
+                # If no files of type filetype exist, move on to next type
+                if not filetype_lists[filetype]:
+                    continue
+
+                # Name of specific script:
+                self.spec_script_name = self.jid_name_sep.join([self.step,self.name,sample,filetype])
+
+                # This line should be left before every new script. It sees to local issues.
+                # Use the dir it returns as the base_dir for this step.
+                use_dir = self.local_start(sample_dir)
+
+                input_files = [self.sample_data[sample][spec_type] for spec_type in filetype_lists[filetype]]
+                # Define output filename
+                output_filename = "%s.%s" % (sample, filetype)  # The 'msh' tag get added automatically by mash
+
+                # Reads are sketched from stdin, so that several files are sketched together without merging
+                if len(input_files) > 1:
+                    sketch_cmd = "cat {files} \\\n\t| {const}{id}-o {out} \\\n\t-".\
+                        format(files=" \\\n\t".join(input_files),
+                               const=self.get_script_const(),
+                               id="-I %s \\\n\t" % sample if filetype == "fastq" else "",
+                               out=use_dir + output_filename)
+                else:
+                    sketch_cmd = "{const}{id}-o {out} \\\n\t{file}".\
+                        format(const=self.get_script_const(),
+                               id="-I %s \\\n\t" % sample if filetype == "fastq" else "",
+                               out=use_dir + output_filename,
+                               file=input_files[0])
+
+                self.script = """\
+# Sketching only if the sequence files or the sketch parameters changed
+mash_key=$( {{ echo {params_key}; stat -L -c "%n %s %Y" {files}; }} | md5sum | cut -d" " -f1)
+if [ -e {msh} ] && [ "$(cat {msh}.key 2> /dev/null)" == "$mash_key" ]; then
+    echo "Sequence files of {sample} did not change. Keeping {msh}"
+else
+    rm -f {msh} {msh}.key {out}.msh
+    if {sketch_cmd}
+    then
+        echo $mash_key > {out}.msh.key
+    else
+        echo "Sketching {sample} failed"
+        rm -f {out}.msh
+        exit 1
+    fi
+fi
+
+""".format(params_key=params_key,
+           files=" ".join(input_files),
+           msh=sample_dir + output_filename + ".msh",
+           sample=sample,
+           sketch_cmd=sketch_cmd,
+           out=use_dir + output_filename)
+
+                # Store msh file:
+                self.sample_data[sample]["msh." + filetype] = (sample_dir + output_filename + ".msh")
+                self.stamp_file(self.sample_data[sample]["msh." + filetype])
+                self.sample_sketches[filetype].append(self.sample_data[sample]["msh." + filetype])
+
+                # Wrapping up function. Leave these lines at the end of every iteration:
+                self.local_finish(use_dir,sample_dir)
+                self.create_low_level_script()
+
+    def get_paste_script(self):
+        """ Return script combining the sample sketches into project sketches with 'mash paste'
+
+        """
+
+        script = ""
+        for filetype in sorted(set(self.params["type"]) & {"fastq", "fasta"}):
+            if not self.sample_sketches[filetype]:
+                continue
+            # Define output filename
+            output_filename = "".join([self.base_dir , self.sample_data["Title"] , ".", filetype])
+            # List of sample sketches. Avoids long command lines for large projects
+            list_filename = output_filename + ".sketches.txt"
+            with open(list_filename, "w") as list_fh:
+                list_fh.write("\n".join(self.sample_sketches[filetype]) + "\n")
+
+            script += """\
+# Combining the sample sketches into the project sketch
+rm -f {out}.tmp.msh
+{mash} paste \\
+\t-l {out}.tmp \\
+\t{list} \\
+\t&& mv {out}.tmp.msh {out}.msh
+
+""".format(mash=self.params["mash_path"],
+           out=output_filename,
+           list=list_filename)
+
+            # Store msh file:
+            self.sample_data["project_data"]["msh." + filetype] = (output_filename + ".msh")
+            self.stamp_file(self.sample_data["project_data"]["msh." + filetype])
+
+        return script
+
     def build_scripts_byproject(self):
         """ Script building function for project-level BLAST
 
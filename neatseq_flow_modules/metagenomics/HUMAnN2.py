@@ -45,6 +45,20 @@ Output
 
 .. Note:: If both ``humann2_renorm_table`` and ``humann2_join_tables`` blocks exist in params, ``humann2_join_tables`` will work on the normalized tables produced by ``humann2_renorm_table``! To join the non-normalized tables, do not normalize the tables by not including a ``humann2_renorm_table`` block.
 
+.. Note:: Three parameters reduce the time spent on large projects:
+
+    * ``db_stage_dir``: Each sample script copies the ``--nucleotide-database`` and ``--protein-database`` directories to
+      this node-local directory, and runs ``humann2`` on the local copies. The copies are shared by all samples running on
+      the same node, so each database is copied once per node (see ``neatseq_flow_modules/utilities/db_staging.py``).
+    * ``resume``: Adds ``--resume`` to the ``humann2`` command. When the step is re-run, *e.g.* after changing downstream
+      options, ``humann2`` reuses the bowtie2 and diamond alignments kept in the sample's temporary output directory
+      instead of repeating the searches. Do not pass ``--remove-temp-output``.
+    * ``single_pass_tables``: Normalizes and joins the tables of all samples in the wrapping up script, with
+      ``humann2_tables.py`` (located in the module directory), instead of calling ``humann2_renorm_table`` for every
+      table and ``humann2_join_tables`` for every table type. Each table is read once. The ``humann2_renorm_table`` and
+      ``humann2_join_tables`` blocks define what is done, and do not need a ``path``. Only ``--units`` (``cpm`` or
+      ``relab``), ``--special`` and ``--update-snames`` are supported in the ``humann2_renorm_table`` redirects.
+
 Parameters that can be set
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
@@ -55,6 +69,10 @@ Parameters that can be set
     "humann2_join_tables", "", "Block containing ``path`` to ``humann2_join_tables``, and a ``redirects`` block if necessary."
     "humann2_renorm_table", "", "Block containing ``path`` to ``humann2_renorm_table``, and a ``redirects`` block if necessary."
     "protein-database", "uniref50|uniref90", "Protein database used for analysis."
+    "db_stage_dir", "empty or path", "Copy the databases to this node-local directory (*e.g.* ``/dev/shm``) and use the copies. If empty, ``$TMPDIR`` is used."
+    "resume", "", "Reuse the intermediate files of a previous run of the sample."
+    "single_pass_tables", "", "Normalize and join the tables of all samples in a single pass."
+    "single_pass_processes", "int", "Number of processes for reading tables with ``single_pass_tables``. Default: 1"
 
 .. Warning:: The ``protein-database`` parameter records the protein database being used: *uniref50* or *uniref90*. It is not used by this module but is required by the downstream module, ``HUMAnN2_further_processing``. If you do not include it, you will not be able to add a ``HUMAnN2_further_processing`` instance for downstream analysis.
 
@@ -85,6 +103,25 @@ Lines for parameter file
             path: humann2_renorm_table
             redirects:
                 --units: cpm
+
+Staging the databases to a local disk, and normalizing and joining the tables in a single pass::
+
+    HUMAnN2_uniref90:
+        module: HUMAnN2
+        base: Trim_Galore
+        script_path: '{Vars.Programs_path.humann2}'
+        protein-database:   uniref90
+        db_stage_dir:       /scratch/humann2_db
+        resume:
+        single_pass_tables:
+        redirects:
+            --nucleotide-database: '{Vars.databases.humann2.chocophlan}'
+            --protein-database: '{Vars.databases.humann2.uniref90}'
+            --threads: '30'
+        humann2_join_tables:
+        humann2_renorm_table:
+            redirects:
+                --units: cpm
             
 References
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -98,10 +135,14 @@ import os
 import sys
 import re
 from neatseq_flow.PLC_step import Step,AssertionExcept
+from neatseq_flow_modules.utilities.db_staging import *
 
 
 __author__ = "Menachem Sklarz"
-__version__ = "1.6.0"
+__version__ = "1.6.1"
+
+# Script for normalizing and joining all tables in a single pass
+HUMANN2_TABLES = os.path.join(os.path.dirname(os.path.realpath(__file__)), "humann2_tables.py")
 
 
 class Step_HUMAnN2(Step):
@@ -188,6 +229,8 @@ class Step_HUMAnN2(Step):
         #         self.params["humann2_join_tables"]["redirects"] = self.params["join_tables"]
 
         if "humann2_join_tables" in self.params:
+            if not self.params["humann2_join_tables"]:
+                self.params["humann2_join_tables"] = dict()
             if "redirects" in self.params["humann2_join_tables"]:
                 if not isinstance(self.params["humann2_join_tables"]["redirects"], dict):
                     raise AssertionExcept("humann2_join_tables redirects must be a dict!")
@@ -195,6 +238,41 @@ class Step_HUMAnN2(Step):
                         "--output" in self.params["humann2_join_tables"]["redirects"]:
                     raise AssertionExcept("Please do not pass --input and --output in humann2_join_tables redirects!")
 
+        if "single_pass_tables" in self.params:
+            if "humann2_renorm_table" not in self.params and "humann2_join_tables" not in self.params:
+                raise AssertionExcept("'single_pass_tables' requires a 'humann2_renorm_table' or a 'humann2_join_tables' block")
+            if "humann2_renorm_table" in self.params:
+                if self.units not in ["cpm", "relab"]:
+                    raise AssertionExcept("With 'single_pass_tables', --units must be 'cpm' or 'relab'")
+                unsupported = set(self.params["humann2_renorm_table"]["redirects"]) - {"--units", "--special", "--update-snames"}
+                if unsupported:
+                    raise AssertionExcept("With 'single_pass_tables', only --units, --special and --update-snames "
+                                          "are supported in humann2_renorm_table redirects")
+            if "humann2_join_tables" in self.params and "redirects" in self.params["humann2_join_tables"]:
+                self.write_warning("With 'single_pass_tables', humann2_join_tables redirects are ignored")
+            if "single_pass_processes" not in self.params or not self.params["single_pass_processes"]:
+                self.params["single_pass_processes"] = 1
+        else:
+            for prog_name in ["humann2_join_tables", "humann2_renorm_table"]:
+                if prog_name in self.params and "path" not in self.params[prog_name]:
+                    self.params[prog_name]["path"] = self.params[prog_name+"_path"]
+
+        if "resume" in self.params:
+            if "--remove-temp-output" in self.params["redir_params"]:
+                raise AssertionExcept("'resume' requires the temporary output. Do not pass --remove-temp-output")
+            self.params["redir_params"]["--resume"] = None
+
+        # Databases to copy to local storage: shell variable: database
+        self.staged_dbs = dict()
+        if "db_stage_dir" in self.params:
+            for db_param, variable in [("--nucleotide-database", "humann2_nucleotide_db"),
+                                       ("--protein-database", "humann2_protein_db")]:
+                if db_param in self.params["redir_params"] and self.params["redir_params"][db_param]:
+                    self.staged_dbs[variable] = self.params["redir_params"][db_param]
+                    self.params["redir_params"][db_param] = "$" + variable
+            if not self.staged_dbs:
+                raise AssertionExcept("'db_stage_dir' requires --nucleotide-database or --protein-database in redirects")
+
 
     def step_sample_initiation(self):
         """ A place to do initiation stages following setting of sample_data
@@ -211,7 +289,11 @@ class Step_HUMAnN2(Step):
         """ Add stuff to check and agglomerate the output data
         """
         
-        if "humann2_join_tables" in self.params:
+        if "single_pass_tables" in self.params:
+
+            self.script += self.get_single_pass_script()
+
+        elif "humann2_join_tables" in self.params:
 
             if "redirects" in self.params["humann2_join_tables"]:
                 redirects = " \\\n\t" + " \\\n\t".join(
@@ -325,6 +407,12 @@ class Step_HUMAnN2(Step):
             else:
                 raise AssertionExcept("Are you sure you have fastq files in sample?",sample)
 
+            for variable in sorted(self.staged_dbs):
+                self.script += get_db_stage_script(database=self.staged_dbs[variable],
+                                                   stage_dir=get_db_stage_dir(self.params),
+                                                   variable=variable,
+                                                   label=variable)
+
             self.script += """
 {const} --output {dir} \\
 \t--output-basename {basename} \\
@@ -354,7 +442,7 @@ class Step_HUMAnN2(Step):
             self.stamp_file(self.sample_data[sample]["HUMAnN2.pathcoverage"])
 
 
-            if "humann2_renorm_table" in self.params:
+            if "humann2_renorm_table" in self.params and "single_pass_tables" not in self.params:
                 # Adding code for normalization if required
                 # Checking redirects exists although in init this was checked already
                 if "redirects" in self.params["humann2_renorm_table"]:
@@ -384,9 +472,7 @@ class Step_HUMAnN2(Step):
            out_pw="{basefn}_pathabundance.{norm}.tsv".format(basefn=use_dir + output_filename,norm=self.units),
            redirs=redirects)
 
-                # self.sample_data[sample]["HUMAnN2.genefamilies"] = "%s_genefamilies.norm.tsv" % (sample_dir + output_filename)
-                # self.sample_data[sample]["HUMAnN2.pathabundance"] = "%s_pathabundance.norm.tsv" % (sample_dir + output_filename)
-
+            if "humann2_renorm_table" in self.params:
                 self.sample_data[sample]["HUMAnN2.genefamilies"] = \
                     "{basefn}_genefamilies.{norm}.tsv".format(basefn=sample_dir + output_filename,
                                                               norm=self.units)
@@ -414,4 +500,54 @@ class Step_HUMAnN2(Step):
             for sample in self.sample_data["samples"]:      # Getting list of samples out of samples_hash
                 index_fh.write("%s\t%s\n" % (sample,self.sample_data[sample]["classification"]))
                 
-        self.sample_data["project_data"]["HUMAnN2.files_index"] = self.base_dir + "HUMAnN2_files_index.txt"
\ No newline at end of file
+        self.sample_data["project_data"]["HUMAnN2.files_index"] = self.base_dir + "HUMAnN2_files_index.txt"
+
+    def get_single_pass_script(self):
+        """ Return script normalizing and joining the tables of all samples with a single call to humann2_tables.py
+        """
+
+        index_fn = self.base_dir + "HUMAnN2_tables_index.txt"
+        with open(index_fn, "w") as index_fh:
+            for sample in self.sample_data["samples"]:      # Getting list of samples out of samples_hash
+                for table_type in ["genefamilies", "pathabundance", "pathcoverage"]:
+                    raw_table = self.sample_data[sample]["HUMAnN2." + table_type + ".RPK"] \
+                        if table_type != "pathcoverage" \
+                        else self.sample_data[sample]["HUMAnN2.pathcoverage"]
+                    # Normalized table, if normalizing
+                    norm_table = self.sample_data[sample]["HUMAnN2." + table_type] \
+                        if "humann2_renorm_table" in self.params and table_type != "pathcoverage" \
+                        else ""
+                    index_fh.write("\t".join([table_type, sample, raw_table, norm_table]) + "\n")
+
+        args = list()
+        if "humann2_renorm_table" in self.params:
+            renorm_redirects = self.params["humann2_renorm_table"]["redirects"]
+            args.append("--units " + self.units)
+            if "--special" in renorm_redirects:
+                args.append("--special " + renorm_redirects["--special"])
+            if "--update-snames" in renorm_redirects:
+                args.append("--update-snames")
+
+        if "humann2_join_tables" in self.params:
+            norm = "." + self.units if "humann2_renorm_table" in self.params else ""
+            merged = {"genefamilies": "{dir}merged.genefamilies{norm}.tsv".format(dir=self.base_dir, norm=norm),
+                      "pathabundance": "{dir}merged.pathabundance{norm}.tsv".format(dir=self.base_dir, norm=norm),
+                      "pathcoverage": "{dir}merged.pathcoverage.tsv".format(dir=self.base_dir)}
+            for table_type in ["genefamilies", "pathabundance", "pathcoverage"]:
+                args.append("--join {type}:{file}".format(type=table_type, file=merged[table_type]))
+                ## Storing in dict and stamping
+                self.sample_data["project_data"]["HUMAnN2." + table_type] = merged[table_type]
+                self.stamp_file(self.sample_data["project_data"]["HUMAnN2." + table_type])
+
+        return """\
+# Normalizing and joining the tables of all samples
+
+python {path} \\
+\t--index {index} \\
+\t--processes {processes} \\
+\t{args}
+
+""".format(path=HUMANN2_TABLES,
+           index=index_fn,
+           processes=self.params["single_pass_processes"],
+           args=" \\\n\t".join(args))
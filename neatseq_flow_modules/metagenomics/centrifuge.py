@@ -13,7 +13,15 @@ A module for running ``centrifuge``:
 
 Pass the full path to the ``centrifuge`` executable in ``script_path``.
 
-Merging of sample centrifuge reports in done with krona. See the section on Parameters that can be set.
+Merging of sample centrifuge reports in done with krona. See the section on Parameters that can be set. The input for
+krona is created from the centrifuge output while centrifuge is running, so the raw classification is not read again.
+
+.. Note:: Loading the centrifuge index often takes longer than classifying a small sample. With ``batch_size``, the
+    samples are classified in batches, one job per batch: the samples are classified one after the other with ``--mm``
+    (memory-mapped index), so that after the first sample the index is read from the page cache. With
+    ``db_stage_dir``, the index files are first copied to a local disk or tmpfs on the node, and the local copy is
+    shared by all batches running on the same node (see ``neatseq_flow_modules/utilities/db_staging.py``). Each sample
+    still gets its own ``-S`` output and report.
 
 .. CHECK THIS WORKS!! You can follow this module with the ``kraken-biom`` module to create a biom table from the reports.
 
@@ -51,6 +59,8 @@ Parameters that can be set
     :widths: 15, 10, 10
 
     "ktImportTaxonomy_path", "", "Path to ktImportTaxonomy. You can additional ``ktImportTaxonomy`` parameters at the end of the path. If not passed, the ``krona`` report will not be built."
+    "batch_size", "int", "Classify this many samples in each job, loading the index once per job."
+    "db_stage_dir", "empty or path", "With ``batch_size``, copy the index (``-x``) to this node-local directory (*e.g.* ``/dev/shm``) and use the copy. If empty, ``$TMPDIR`` is used."
 
     
 Lines for parameter file
@@ -71,6 +81,18 @@ Lines for parameter file
             --quick: 
             --threads:  20
 
+Batches of 50 samples, with the index copied to a local disk::
+
+    Centrifuge_batched:
+        module:         centrifuge
+        base:           trim1
+        script_path:    {Vars.paths.centrifuge}
+        batch_size:     50
+        db_stage_dir:   /scratch/centrifuge
+        redirects:
+            -x:         /path/to/centrifuge_db/p_compressed+h+v
+            --threads:  20
+
 References
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 Kim, D., Song, L., Breitwieser, F. P., & Salzberg, S. L. (2016). **Centrifuge: rapid and sensitive classification of metagenomic sequences**. *Genome research*, 26(12), 1721-1729.
@@ -81,12 +103,13 @@ Kim, D., Song, L., Breitwieser, F. P., & Salzberg, S. L. (2016). **Centrifuge: r
 
 import os, sys, re
 from neatseq_flow.PLC_step import Step,AssertionExcept
+from neatseq_flow_modules.utilities.db_staging import *
 
 from pkg_resources import resource_filename
 
 
 __author__ = "Menachem Sklarz"
-__version__ = "1.6.0"
+__version__ = "1.6.1"
 
 
 class Step_centrifuge(Step):
@@ -106,6 +129,22 @@ class Step_centrifuge(Step):
         if "-x" not in list(self.params["redir_params"].keys()):
             raise AssertionExcept("You didn't pass a database with -x in redirects.\n")
 
+        self.centrifuge_db = self.params["redir_params"]["-x"]
+        if "batch_size" in self.params:
+            try:
+                self.params["batch_size"] = int(self.params["batch_size"])
+            except (TypeError, ValueError):
+                raise AssertionExcept("'batch_size' must be a positive integer")
+            if self.params["batch_size"] < 1:
+                raise AssertionExcept("'batch_size' must be a positive integer")
+            # All samples in a batch read the index from the page cache
+            if "--mm" not in self.params["redir_params"]:
+                self.params["redir_params"]["--mm"] = None
+            # The index is set in the script, to allow using a local copy
+            self.params["redir_params"]["-x"] = "$centrifuge_db"
+        elif "db_stage_dir" in self.params:
+            raise AssertionExcept("'db_stage_dir' can only be used with 'batch_size'")
+
             
         
     def step_sample_initiation(self):
@@ -158,6 +197,10 @@ class Step_centrifuge(Step):
         
     
         
+        if "batch_size" in self.params:
+            self.build_scripts_batched()
+            return
+
         # Each iteration must define the following class variables:
             # spec_script_name
             # script
@@ -180,74 +223,159 @@ class Step_centrifuge(Step):
             output_filename = "".join([use_dir , sample , self.file_tag])
         
         
-            ######### Step 1, run centrifuge itself
-            # Create script and write to SCRPT
-            # Add parameters passed to main script by user:
-            # If the following params are not supplied by the user, add the defaults...
-
-            self.script += self.get_script_const()
-            # self.script += "%s \\\n\t" % self.params["script_path"]
-            # self.script += self.get_redir_parameters_script()
-            self.script += "-S %s \\\n\t" % output_filename
-
-            if "fastq.F" in self.sample_data[sample]:
-                self.script += "-1 {m1} \\\n\t-2 {m2} \\\n\t".format(
-                                    m1=self.sample_data[sample]["fastq.F"],
-                                    m2=self.sample_data[sample]["fastq.R"])
+            ######### Steps 1 to 3, run centrifuge itself, translate raw centrifuge into useful names and
+            # create file for krona report:
+            self.script += self.get_centrifuge_script(sample, output_filename, self.centrifuge_db)
+
+            self.store_sample_outputs(sample, sample_dir + os.path.basename(output_filename))
+            
+            # Move all files from temporary local dir to permanent base_dir
+            self.local_finish(use_dir,self.base_dir)       # Sees to copying local files to final destination (and other stuff)
+                        
+            
+            self.create_low_level_script()
+                    
+
+                    
+    def build_scripts_batched(self):
+        """ Script building function for batches of samples.
+            Each script classifies a batch of samples, one after the other, loading the index once.
+        """
+
+        batch_size = self.params["batch_size"]
+        batches = [self.sample_data["samples"][ind:ind + batch_size]
+                   for ind in range(0, len(self.sample_data["samples"]), batch_size)]
+        width = len(str(len(batches)))
+
+        for batch_ind, batch in enumerate(batches):
+
+            batch_name = "batch{ind:0{width}d}".format(ind=batch_ind + 1, width=width)
+            # Name of specific script:
+            self.spec_script_name = self.jid_name_sep.join([self.step,self.name,batch_name])
+
+            # This line should be left before every new script. It sees to local issues.
+            # Use the dir it returns as the base_dir for this step.
+            use_dir = self.local_start(self.base_dir)
+
+            self.script = "# Classifying samples: {samples}\n".format(samples=", ".join(batch))
+            stage_dir = get_db_stage_dir(self.params)
+            if stage_dir:
+                self.script += get_db_stage_script(database=self.centrifuge_db,
+                                                   stage_dir=stage_dir,
+                                                   variable="centrifuge_db",
+                                                   label="centrifuge")
+            else:
+                self.script += "centrifuge_db={db}\n\n".format(db=self.centrifuge_db)
+
+            for sample in batch:
+
+                # Make a dir for the current sample:
+                sample_dir = self.make_folder_for_sample(sample)
+                output_filename = "".join([sample , self.file_tag])
+
+                self.script += """\
+###########
+# Sample {sample}
+mkdir -p {dir}
+""".format(sample=sample,
+           dir=use_dir + sample)
+                self.script += self.get_centrifuge_script(sample,
+                                                          use_dir + sample + os.sep + output_filename,
+                                                          "$centrifuge_db")
+                # Stop the batch if classification of a sample fails
+                self.script += "if [ $centrifuge_status -ne 0 ]; then exit 1; fi\n\n"
+
+                self.store_sample_outputs(sample, sample_dir + output_filename)
+
+            # Move all files from temporary local dir to permanent base_dir
+            self.local_finish(use_dir,self.base_dir)
+            self.create_low_level_script()
+
+    def get_centrifuge_script(self, sample, out, db):
+        """ Return the centrifuge command for sample, writing the output to 'out', followed by centrifuge-kreport.
+            If a krona report is requested, the ktImportTaxonomy input is created through a named pipe while centrifuge
+            is running. The exit status of centrifuge is stored in $centrifuge_status.
+        """
+
+        if "fastq.F" in self.sample_data[sample] and "fastq.R" in self.sample_data[sample]:
+            reads = "-1 {m1} \\\n\t-2 {m2}".format(m1=self.sample_data[sample]["fastq.F"],
+                                                    m2=self.sample_data[sample]["fastq.R"])
             if "fastq.S" in self.sample_data[sample]:
-                self.script += "-U {r} \n\n".format(r=self.sample_data[sample]["fastq.S"])
-            self.script = re.sub("\\\\\n$","\n\n",self.script)
-                
-            # Find path to centrifuge scripts
-            centrifuge_path = os.path.dirname(self.params["script_path"])
-            if centrifuge_path:
-                centrifuge_path = centrifuge_path + os.sep
+                reads += " \\\n\t-U {r}".format(r=self.sample_data[sample]["fastq.S"])
+        elif "fastq.S" in self.sample_data[sample]:
+            reads = "-U {r}".format(r=self.sample_data[sample]["fastq.S"])
+        else:
+            raise AssertionExcept("No fastq files found for sample", sample)
 
-            ######### Step 2, translate raw centrifuge into useful names
-            kreport_params = ((self.params["centrifuge-kreport"] + " \\\n\t") if "centrifuge-kreport" in self.params else "") 
-            self.script += """
+        script = ""
+        if "ktImportTaxonomy_path" in list(self.params.keys()):
+            # Split the classification into the raw output and the ktImportTaxonomy input, in a single pass
+            output = out + ".fifo"
+            script += """
+# Named pipe for creating the ktImportTaxonomy input while centrifuge is running
+rm -f {fifo}
+mkfifo {fifo}
+tee {out} < {fifo} \\
+    | cut -f 1,3 \\
+    > {out}.forKrona &
+""".format(fifo=output,
+           out=out)
+        else:
+            output = out
+
+        script += """
+{const}-S {output} \\
+\t{reads}
+centrifuge_status=$?
+""".format(const=self.get_script_const(),
+           output=output,
+           reads=reads)
+
+        if "ktImportTaxonomy_path" in list(self.params.keys()):
+            script += """
+# Release the pipe reader if centrifuge did not open the pipe, and wait for the reader to finish
+exec 3<> {fifo}
+exec 3>&-
+wait
+rm -f {fifo}
+""".format(fifo=output)
+
+        # Find path to centrifuge scripts
+        centrifuge_path = os.path.dirname(self.params["script_path"])
+        if centrifuge_path:
+            centrifuge_path = centrifuge_path + os.sep
+
+        kreport_params = ((self.params["centrifuge-kreport"] + " \\\n\t") if "centrifuge-kreport" in self.params else "")
+        script += """
 # Create useful centrifuge output 
-if [ -e {centrifuge_out} ]
+if [ $centrifuge_status -eq 0 ] && [ -e {centrifuge_out} ]
 then
 {centrifuge_path}centrifuge-kreport \\
     -x {db} \\
     {params} {centrifuge_out} > \\
     {centrifuge_out}.report
 fi
-""".format(centrifuge_path = centrifuge_path, 
-            centrifuge_out = output_filename,
-            params        = kreport_params,
-            db            = self.params["redir_params"]["-x"])
-
-            ######### Step 3, create krona report:
-            if "ktImportTaxonomy_path" in list(self.params.keys()):
-                self.script += """
-# Create file for ktImportTaxonomy
-if [ -e {centrifuge_out} ]
-then
-    cut -f 1,3 {centrifuge_out} \\
-        > {centrifuge_out}.forKrona
-fi
 
-""".format(centrifuge_out = output_filename)
-    
-            # Storing the output file in $samples_hash
-            self.sample_data[sample]["raw_classification"]        = "%s" % (sample_dir + os.path.basename(output_filename))
-            self.sample_data[sample]["classification"]        = "%s.labels" % (sample_dir + os.path.basename(output_filename))
-            self.sample_data[sample]["classification_report"] = "%s.report" % (sample_dir + os.path.basename(output_filename))
-                
-            self.stamp_file(self.sample_data[sample]["raw_classification"])
-            self.stamp_file(self.sample_data[sample]["classification"])
-            self.stamp_file(self.sample_data[sample]["classification_report"])
-            
-            # Move all files from temporary local dir to permanent base_dir
-            self.local_finish(use_dir,self.base_dir)       # Sees to copying local files to final destination (and other stuff)
-                        
-            
-            self.create_low_level_script()
-                    
+""".format(centrifuge_path = centrifuge_path,
+           centrifuge_out = out,
+           params        = kreport_params,
+           db            = db)
+
+        return script
+
+    def store_sample_outputs(self, sample, output_prefix):
+        """ Store the centrifuge outputs of sample in sample_data
+        """
+
+        # Storing the output file in $samples_hash
+        self.sample_data[sample]["raw_classification"]        = "%s" % (output_prefix)
+        self.sample_data[sample]["classification"]        = "%s.labels" % (output_prefix)
+        self.sample_data[sample]["classification_report"] = "%s.report" % (output_prefix)
+
+        self.stamp_file(self.sample_data[sample]["raw_classification"])
+        self.stamp_file(self.sample_data[sample]["classification"])
+        self.stamp_file(self.sample_data[sample]["classification_report"])
 
-                    
     def make_sample_file_index(self):
         """ Make file containing samples and target file names for use by centrifuge analysis R script
         """
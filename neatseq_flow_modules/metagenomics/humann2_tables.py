@@ -0,0 +1,151 @@
+# -*- coding: UTF-8 -*-
+"""
+Normalize and join HUMAnN2 tables of all samples in a single pass.
+
+Replaces running ``humann2_renorm_table`` on every table of every sample, followed by ``humann2_join_tables`` on every
+table type. Each table is read once: it is normalized, if requested, and its non-zero values are added to a sparse
+feature x sample matrix of its table type (see ``merge_profiles.py``), from which the joined table is written.
+
+Normalization follows ``humann2_renorm_table``: the values in each column are divided by the sum of the community
+(unstratified) rows, and multiplied by 1e6 for ``cpm``. With ``--special n``, the UNMAPPED, UNGROUPED and UNINTEGRATED
+rows are removed before normalizing.
+
+The tables are passed in an index file, with a table type, a sample name, a table file and, optionally, a file for the
+normalized table, on each line.
+
+Used by the ``HUMAnN2`` module.
+"""
+
+import sys
+import argparse
+import multiprocessing
+
+from merge_profiles import SparseProfiles, format_value
+
+__author__ = "Menachem Sklarz"
+__version__ = "1.6.0"
+
+
+SPECIAL_FEATURES = ["UNMAPPED", "UNGROUPED", "UNINTEGRATED"]
+
+
+def read_index(index):
+    """ Return list of (table type, sample, table file, normalized table file or None) tuples from the index file
+    """
+
+    tables = list()
+    with open(index, "r") as index_fh:
+        for line in index_fh:
+            if not line.strip():
+                continue
+            fields = line.rstrip("\n").split("\t") + [""]
+            tables.append((fields[0], fields[1], fields[2], fields[3] if fields[3] else None))
+    return tables
+
+
+def read_table(table):
+    """ Return the header and list of (feature, value string) of a single-sample HUMAnN2 table
+    """
+
+    header = None
+    rows = list()
+    with open(table, "r") as table_fh:
+        for line in table_fh:
+            fields = line.rstrip("\n").split("\t")
+            if line.startswith("#"):
+                if header is None:
+                    header = fields
+                continue
+            if len(fields) < 2:
+                continue
+            rows.append((fields[0], fields[1]))
+    if header is None or len(header) < 2:
+        sys.exit("No header found in {table}".format(table=table))
+    return header, rows
+
+
+def renorm_table(header, rows, units, special, update_snames):
+    """ Normalize the values of a table. Returns the new header and rows
+    """
+
+    if not special:
+        rows = [(feature, value) for feature, value in rows if feature.split("|")[0] not in SPECIAL_FEATURES]
+    total = sum(float(value) for feature, value in rows if "|" not in feature)
+    divisor = 1e6 if units == "cpm" else 1.0
+    rows = [(feature, "%.6g" % (divisor * float(value) / total) if total else "0") for feature, value in rows]
+    if update_snames:
+        header = [header[0]] + [name + "-" + units for name in header[1:]]
+    return header, rows
+
+
+def process_table(args):
+    """ Read a single table, normalize and write it, if required. For use with multiprocessing
+    """
+
+    (table_type, sample, table, output), units, special, update_snames = args
+    header, rows = read_table(table)
+    if output:
+        header, rows = renorm_table(header, rows, units, special, update_snames)
+        with open(output, "w") as out_fh:
+            out_fh.write("\t".join(header) + "\n")
+            for feature, value in rows:
+                out_fh.write(feature + "\t" + value + "\n")
+    return header, [(feature, feature, [float(value)]) for feature, value in rows]
+
+
+def write_joined(profiles, heading, out_fh):
+    """ Write the joined table of a table type, with features in order of first appearance
+    """
+
+    taxa = profiles.get_taxa()
+    out_fh.write("\t".join([heading] + profiles.samples) + "\n")
+    for row, row_values in profiles.iter_rows():
+        line = ["0"] * len(profiles.samples)
+        for col, values in row_values:
+            line[col] = format_value(values[0])
+        out_fh.write("\t".join([taxa[row]] + line) + "\n")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Normalize and join HUMAnN2 tables of all samples")
+    parser.add_argument("-i", "--index", required=True,
+                        help="Tab-separated file with table type, sample, table and normalized table on each line")
+    parser.add_argument("-u", "--units", choices=["cpm", "relab"], default="cpm", help="Normalization units")
+    parser.add_argument("-s", "--special", choices=["y", "n"], default="y",
+                        help="Include the special features (UNMAPPED, UNINTEGRATED etc.) when normalizing")
+    parser.add_argument("--update-snames", action="store_true", help="Add the units to the sample names")
+    parser.add_argument("-j", "--join", action="append", default=list(), metavar="TYPE:FILE",
+                        help="Join the tables of table type TYPE into FILE. Can be passed more than once")
+    parser.add_argument("-p", "--processes", type=int, default=1, help="Number of processes for reading tables")
+    args = parser.parse_args()
+
+    tables = read_index(args.index)
+    joined = dict(join.split(":", 1) for join in args.join)
+    unknown_types = set(joined) - set(table[0] for table in tables)
+    if unknown_types:
+        sys.exit("No tables of type {types} in index".format(types=", ".join(sorted(unknown_types))))
+
+    profiles = dict((table_type, SparseProfiles(["value"])) for table_type in joined)
+    headings = dict()
+    jobs = [(table, args.units, args.special == "y", args.update_snames) for table in tables]
+    if args.processes > 1:
+        pool = multiprocessing.Pool(args.processes)
+        results = pool.imap(process_table, jobs, chunksize=4)
+    else:
+        pool = None
+        results = (process_table(job) for job in jobs)
+
+    for (table_type, sample, table, output), (header, entries) in zip(tables, results):
+        if table_type not in joined:
+            continue
+        headings.setdefault(table_type, header[0])
+        profiles[table_type].add_sample(header[1], entries)
+
+    if pool:
+        pool.close()
+        pool.join()
+
+    for table_type in joined:
+        with open(joined[table_type], "w") as out_fh:
+            write_joined(profiles[table_type], headings[table_type], out_fh)
@@ -34,6 +34,16 @@ Output
     * ``self.sample_data[<sample>]["kaiju.report.family"]``
     * ``self.sample_data[<sample>]["kaiju.report.genus"]``
     * ``self.sample_data[<sample>]["kaiju.report.species"]``
+
+* If ``merge_count_tables`` was passed, puts the merged tables in:
+
+    * ``self.sample_data["project_data"]["kaiju.report.<level>"]``
+
+* If ``merge_formats`` includes ``triplets``, ``biom`` or ``parquet``, puts the sparse and columnar tables in:
+
+    * ``self.sample_data["project_data"]["kaiju.report.<level>.triplets"]``
+    * ``self.sample_data["project_data"]["kaiju.report.<level>.biom"]``
+    * ``self.sample_data["project_data"]["kaiju.report.<level>.parquet"]``
     
 
 Parameters that can be set
@@ -44,7 +54,16 @@ Parameters that can be set
     :widths: 15, 10, 10
 
     "script_path", "", "Path to kaiju2table."
-    "merge_count_tables", "", "Should the sample-wise tables be merged?"
+    "merge_count_tables", "", "Should the sample-wise tables be merged? If empty, the module's own merging script is used (see below). Otherwise, a command merging the tables, with the arguments of ``merge_count_tables.pl``."
+    "merge_formats", "tsv, triplets, biom, parquet", "List of formats for the merged tables, when ``merge_count_tables`` is empty. Default: ``tsv``"
+    "merge_processes", "int", "Number of processes for reading the tables, when ``merge_count_tables`` is empty. Default: 1"
+
+.. Note:: When ``merge_count_tables`` is empty, the tables are merged by ``merge_profiles.py``, which is located in the
+    ``metagenomics`` module directory. The tables are read one at a time into a sparse taxon x sample matrix, so memory
+    grows with the number of non-zero counts rather than with the number of samples times the number of taxa.
+    ``tsv`` is the dense table produced by ``merge_count_tables.pl``. ``triplets`` (one line per taxon and sample),
+    ``biom`` (BIOM 1.0, JSON) and ``parquet`` (columnar, requires the ``pyarrow`` python package) are sparse tables of
+    the read numbers.
 
 .. Attention:: You must provide ``-n`` (names file) and ``-t`` (nodes file) via the redirects. See example
 
@@ -65,6 +84,7 @@ Lines for parameter file
             -n: {Vars.databases/kaiju}/names.dmp
             -p:
         merge_count_tables:
+        merge_formats:  [tsv, biom]
 
 References
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -82,7 +102,11 @@ from neatseq_flow.PLC_step import Step,AssertionExcept
 
 
 __author__ = "Menachem Sklarz"
-__version__ = "1.6.0"
+__version__ = "1.6.1"
+
+# Built-in script for merging the sample tables
+MERGE_PROFILES = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "merge_profiles.py")
+MERGE_FORMATS = ["tsv", "triplets", "biom", "parquet"]
 
 
 
@@ -117,6 +141,21 @@ class Step_kaiju2table(Step):
         if "scope" not in self.params:
             self.params["scope"] = "sample"
 
+        if "merge_count_tables" in self.params and not self.params["merge_count_tables"]:
+            if "merge_formats" not in self.params or not self.params["merge_formats"]:
+                self.params["merge_formats"] = ["tsv"]
+            if isinstance(self.params["merge_formats"], str):
+                self.params["merge_formats"] = re.split("\s*,\s*", self.params["merge_formats"])
+            unknown_formats = set(self.params["merge_formats"]) - set(MERGE_FORMATS)
+            if unknown_formats:
+                raise AssertionExcept("Unknown 'merge_formats': {formats}. Use {allowed}".
+                                      format(formats=", ".join(sorted(unknown_formats)),
+                                             allowed=", ".join(MERGE_FORMATS)))
+            if "merge_processes" not in self.params or not self.params["merge_processes"]:
+                self.params["merge_processes"] = 1
+        elif "merge_formats" in self.params or "merge_processes" in self.params:
+            raise AssertionExcept("'merge_formats' and 'merge_processes' can only be used with an empty 'merge_count_tables'")
+
     def step_sample_initiation(self):
         """ A place to do initiation stages following setting of sample_data
         """
@@ -137,9 +176,42 @@ class Step_kaiju2table(Step):
     def create_spec_wrapping_up_script(self):
         """ Add stuff to check and agglomerate the output data
         """
-        if "merge_count_tables" in self.params:
-            if not self.params["merge_count_tables"]:
-                self.params["merge_count_tables"] = "perl " + os.path.join(os.path.dirname(os.path.realpath(__file__)), "merge_count_tables.pl")
+        if "merge_count_tables" in self.params and not self.params["merge_count_tables"]:
+
+            self.script = ""
+            for tax_level in self.levels:
+                index_fn = self.make_merge_index(tax_level)
+                outputs = dict((merge_format, "{dir}{project}.kaiju.summary.{level}.{ext}".
+                                format(dir=self.base_dir,
+                                       project=self.sample_data["Title"],
+                                       level=tax_level,
+                                       ext=merge_format))
+                               for merge_format in self.params["merge_formats"])
+
+                self.script += """
+# Merging {level} tables
+python {path} \\
+\t--index {index} \\
+\t--format kaiju \\
+\t--processes {processes} \\
+\t{outputs}
+
+""".format(level=tax_level,
+           path=MERGE_PROFILES,
+           index=index_fn,
+           processes=self.params["merge_processes"],
+           outputs=" \\\n\t".join(["--{format} {output}".format(format=merge_format,
+                                                                     output=outputs[merge_format])
+                                       for merge_format in self.params["merge_formats"]]))
+
+                for merge_format in self.params["merge_formats"]:
+                    if merge_format == "tsv":
+                        self.sample_data["project_data"]["kaiju.report."+tax_level] = outputs[merge_format]
+                    else:
+                        self.sample_data["project_data"]["kaiju.report."+tax_level+"."+merge_format] = outputs[merge_format]
+                    self.stamp_file(outputs[merge_format])
+
+        elif "merge_count_tables" in self.params:
 
             self.script = ""
             for tax_level in self.levels:
@@ -218,4 +290,15 @@ class Step_kaiju2table(Step):
     def make_sample_file_index(self):
         """ Make file containing samples and target file names for use by kraken analysis R script
         """
-        pass
\ No newline at end of file
+        pass
+
+    def make_merge_index(self, tax_level):
+        """ Make file containing samples and table file names of 'tax_level' for merging the tables
+        """
+
+        index_fn = "{dir}kaiju2table_merge_index.{level}.txt".format(dir=self.base_dir, level=tax_level)
+        with open(index_fn, "w") as index_fh:
+            for sample in self.sample_data["samples"]:      # Getting list of samples out of samples_hash
+                index_fh.write("%s\t%s\n" % (sample,self.sample_data[sample]["kaiju.report."+tax_level]))
+
+        return index_fn
\ No newline at end of file
@@ -13,10 +13,17 @@ A module for running ``kraken`` version 2:
 
 Pass the full path to the ``kraken2`` executable in ``script_path``.
 
-Merging of sample kraken reports in done with krona. See the section on Parameters that can be set.
+Merging of sample kraken reports in done with krona. See the section on Parameters that can be set. The input for
+krona is created from the kraken2 output while kraken2 is running, so the raw classification is not read again.
 
 You can follow this module with the ``kraken-biom`` module to create a biom table from the reports.
 
+.. Note:: Loading the kraken2 database often takes longer than classifying a small sample. With ``batch_size``, the
+    samples are classified in batches, one job per batch, and the database is loaded once per batch: the samples are
+    classified one after the other with ``--memory-mapping``, so that after the first sample the database is read from
+    the page cache. With ``db_stage_dir``, the database is first copied to a local disk or tmpfs on the node, and the
+    local copy is shared by all batches running on the same node (see ``neatseq_flow_modules/utilities/db_staging.py``).
+
 Requires
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
@@ -38,6 +45,12 @@ Output
     * ``self.sample_data[<sample>]["unclassified"]``
     * ``self.sample_data[<sample>]["classified"]``
 
+.. Note:: The ``unclassified`` and ``classified`` slots contain the prefix of the read files. By default, the reads
+    are written uncompressed, *e.g.* ``<prefix>_1.fq`` and ``<prefix>_2.fq`` for paired-end reads. With
+    ``classified_out`` set to ``gzip`` or ``bgzip``, the reads are compressed through named pipes while kraken2 is
+    running, *e.g.* ``<prefix>_1.fq.gz`` and ``<prefix>_2.fq.gz`` for paired-end reads and ``<prefix>.fq.gz`` for
+    single-end reads.
+
 
 * If ``ktImportTaxonomy`` parameter was passed, puts the krona reports in
 
@@ -53,6 +66,10 @@ Parameters that can be set
     :widths: 15, 10, 10
 
     "ktImportTaxonomy_path", "", "Path to ktImportTaxonomy. You can additional ``ktImportTaxonomy`` parameters at the end of the path. If not passed, the ``krona`` report will not be built."
+    "classified_out", "``gzip|bgzip|fastq|skip``", "How to write the classified and unclassified reads. ``fastq`` (default) writes uncompressed ``#.fq`` files. ``gzip`` and ``bgzip`` compress the reads while they are written. ``skip`` does not write the reads, and the ``classified`` and ``unclassified`` slots are not set. Use when no downstream step needs the reads."
+    "compressor_path", "", "Compression command to use instead of ``gzip`` or ``bgzip``, *e.g.* ``pigz -p 4``. Must accept ``-c``. Requires ``classified_out`` to be ``gzip`` or ``bgzip``."
+    "batch_size", "int", "Classify this many samples in each job, loading the database once per job. Only for ``sample`` scope."
+    "db_stage_dir", "empty or path", "With ``batch_size``, copy the database to this node-local directory (*e.g.* ``/dev/shm``) and use the copy. If empty, ``$TMPDIR`` is used."
 
     
 Lines for parameter file
@@ -73,6 +90,19 @@ Lines for parameter file
             --quick: 
             --threads: 20
 
+Batches of 50 samples, with the database copied to a tmpfs::
+
+    kraken2_batched:
+        module: kraken2
+        base: trim1
+        script_path: {Vars.paths.kraken2}
+        scope: sample
+        batch_size: 50
+        db_stage_dir: /dev/shm/kraken2
+        redirects:
+            --db: /path/to/kraken2_std_db
+            --threads: 20
+
 References
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 Wood, D.E. and Salzberg, S.L., 2014. **Kraken: ultrafast metagenomic sequence classification using exact alignments**. *Genome biology*, 15(3), p.R46.
@@ -83,12 +113,13 @@ Wood, D.E. and Salzberg, S.L., 2014. **Kraken: ultrafast metagenomic sequence cl
 import os
 import sys
 from neatseq_flow.PLC_step import Step,AssertionExcept
+from neatseq_flow_modules.utilities.db_staging import *
 
 from pkg_resources import resource_filename
 
 
 __author__ = "Menachem Sklarz"
-__version__ = "1.6.0"
+__version__ = "1.6.3"
 
 
 class Step_kraken2(Step):
@@ -126,6 +157,36 @@ class Step_kraken2(Step):
             self.params["ktImportTaxonomy"]["path"] = self.params["ktImportTaxonomy_path"]
             self.params["ktImportTaxonomy"]["redirects"] = ""
 
+        # Format of the classified and unclassified reads files
+        if "classified_out" not in self.params or not self.params["classified_out"]:
+            self.params["classified_out"] = "fastq"
+        if self.params["classified_out"] not in ["gzip", "bgzip", "fastq", "skip"]:
+            raise AssertionExcept("'classified_out' must be one of 'gzip', 'bgzip', 'fastq' or 'skip'")
+        if "compressor_path" in self.params and self.params["compressor_path"]:
+            if self.params["classified_out"] not in ["gzip", "bgzip"]:
+                raise AssertionExcept("'compressor_path' requires 'classified_out' to be 'gzip' or 'bgzip'")
+            self.compressor = self.params["compressor_path"]
+        else:
+            self.compressor = self.params["classified_out"]
+
+        if "batch_size" in self.params:
+            if self.params["scope"] != "sample":
+                raise AssertionExcept("'batch_size' can only be used in 'sample' scope")
+            try:
+                self.params["batch_size"] = int(self.params["batch_size"])
+            except (TypeError, ValueError):
+                raise AssertionExcept("'batch_size' must be a positive integer")
+            if self.params["batch_size"] < 1:
+                raise AssertionExcept("'batch_size' must be a positive integer")
+            # All samples in a batch read the database from the page cache
+            if "--memory-mapping" not in self.params["redir_params"]:
+                self.params["redir_params"]["--memory-mapping"] = None
+            # The database is set in the script, to allow using a local copy
+            self.kraken2_db = self.params["redir_params"]["--db"]
+            self.params["redir_params"]["--db"] = "$kraken2_db"
+        elif "db_stage_dir" in self.params:
+            raise AssertionExcept("'db_stage_dir' can only be used with 'batch_size'")
+
     def step_sample_initiation(self):
         """ A place to do initiation stages following setting of sample_data
         """
@@ -171,10 +232,14 @@ class Step_kraken2(Step):
 
     def build_scripts(self):
         """ This is the actual script building function
-            Most, if not all, editing should be done here 
+            Most, if not all, editing should be done here
             HOWEVER, DON'T FORGET TO CHANGE THE CLASS NAME AND THE FILENAME!
         """
 
+        if "batch_size" in self.params:
+            self.build_scripts_batched()
+            return
+
         if self.params["scope"] == "project":
             sample_list = ["project_data"]
         else:   #self.params["scope"] == "sample"
@@ -201,54 +266,174 @@ class Step_kraken2(Step):
             # Add parameters passed to main script by user:
             # If the following params are not supplied by the user, add the defaults...
 
-            if "fastq.F" in self.sample_data[sample] and "fastq.R" in self.sample_data[sample]:
-                reads = """\
+            # The ktImportTaxonomy input is created while kraken2 is running
+            self.script = self.get_kraken_script(sample, use_dir+output_filename)
+            self.script += "if [ $kraken2_status -ne 0 ]; then exit 1; fi\n\n"
+
+            self.store_sample_outputs(sample, sample_dir + output_filename)
+
+            # Move all files from temporary local dir to permanent base_dir
+            self.local_finish(use_dir,self.base_dir)
+            self.create_low_level_script()
+
+    def build_scripts_batched(self):
+        """ Script building function for batches of samples.
+            Each script classifies a batch of samples, one after the other, loading the database once.
+        """
+
+        batch_size = self.params["batch_size"]
+        batches = [self.sample_data["samples"][ind:ind + batch_size]
+                   for ind in range(0, len(self.sample_data["samples"]), batch_size)]
+        width = len(str(len(batches)))
+
+        for batch_ind, batch in enumerate(batches):
+
+            batch_name = "batch{ind:0{width}d}".format(ind=batch_ind + 1, width=width)
+            # Name of specific script:
+            self.spec_script_name = self.jid_name_sep.join([self.step,self.name,batch_name])
+
+            # This line should be left before every new script. It sees to local issues.
+            # Use the dir it returns as the base_dir for this step.
+            use_dir = self.local_start(self.base_dir)
+
+            self.script = "# Classifying samples: {samples}\n".format(samples=", ".join(batch))
+            stage_dir = get_db_stage_dir(self.params)
+            if stage_dir:
+                self.script += get_db_stage_script(database=self.kraken2_db,
+                                                   stage_dir=stage_dir,
+                                                   variable="kraken2_db",
+                                                   label="kraken2")
+            else:
+                self.script += "kraken2_db={db}\n\n".format(db=self.kraken2_db)
+
+            for sample in batch:
+
+                # Make a dir for the current sample:
+                sample_dir = self.make_folder_for_sample(sample)
+                output_filename = ".".join([sample , self.file_tag])
+
+                self.script += """\
+###########
+# Sample {sample}
+mkdir -p {dir}
+""".format(sample=sample,
+           dir=use_dir + sample)
+                self.script += self.get_kraken_script(sample, use_dir + sample + os.sep + output_filename)
+                # Stop the batch if classification of a sample fails
+                self.script += "if [ $kraken2_status -ne 0 ]; then exit 1; fi\n\n"
+
+                self.store_sample_outputs(sample, sample_dir + output_filename)
+
+            # Move all files from temporary local dir to permanent base_dir
+            self.local_finish(use_dir,self.base_dir)
+            self.create_low_level_script()
+
+    def get_reads(self, sample):
+        """ Return the reads part of the kraken2 command for sample
+        """
+
+        if "fastq.F" in self.sample_data[sample] and "fastq.R" in self.sample_data[sample]:
+            return """\
 --paired \\
 \t{forward} \\
 \t{reverse} """.format(forward=self.sample_data[sample]["fastq.F"],
-                         reverse=self.sample_data[sample]["fastq.R"])
-            elif "fastq.S" in self.sample_data[sample]:
-                reads = self.sample_data[sample]["fastq.S"]
-            else:
-                self.write_warning("KRAKEN on mixed PE/SE samples is not defined. Using only PE data!\n")
+                     reverse=self.sample_data[sample]["fastq.R"])
+        elif "fastq.S" in self.sample_data[sample]:
+            return self.sample_data[sample]["fastq.S"]
+        else:
+            raise AssertionExcept("No fastq files found for sample", sample)
 
-            self.script = """
-{const}--output {out} \\
-\t--report {out}.report \\
-\t--unclassified-out {out}.unclassified#.fq \\
+    def get_kraken_script(self, sample, out):
+        """ Return the kraken2 command for sample, writing outputs with prefix 'out'.
+            Classified and unclassified reads are compressed, and the ktImportTaxonomy input is created, through named
+            pipes while kraken2 is running. The exit status of kraken2 is stored in $kraken2_status.
+        """
+
+        paired = "fastq.F" in self.sample_data[sample] and "fastq.R" in self.sample_data[sample]
+        fifos = list()
+        readers = ""
+
+        if "ktImportTaxonomy" in self.params:
+            # Split the classification into the raw output and the ktImportTaxonomy input, in a single pass
+            fifos.append("{out}.fifo".format(out=out))
+            readers += """\
+tee {out} < {out}.fifo \\
+    | awk 'BEGIN{{FS="\\t"}}{{taxid=$3; if (match(taxid,/taxid [0-9]+/)) {{taxid=substr(taxid,RSTART+6,RLENGTH-6)}}; printf("%s\\t%s\\n",$2,taxid)}}' \\
+    > {out}.forKrona &
+""".format(out=out)
+            output = "{out}.fifo".format(out=out)
+        else:
+            output = out
+
+        if self.params["classified_out"] == "fastq":
+            read_outputs = """\
+--unclassified-out {out}.unclassified#.fq \\
 \t--classified-out {out}.classified#.fq \\
-\t{reads}
-            """.format(out=use_dir+output_filename,
-                       const=self.get_script_const(),
-                       reads=reads)
-
-            ######### Step 4, create krona report:
-            if "ktImportTaxonomy" in list(self.params.keys()):
-                self.script += """
-# Create file for ktImportTaxonomy
-if [ -e {krak_out} ]
-then
-    awk 'BEGIN{{FS="\\t"}}{{printf("%s\\t%s\\n",$2,gensub(/.*taxid ([0-9]+).*/, "\\\\1", "g", $3))}}' \\
-        {krak_out} \\
-        > {krak_out}.forKrona
-fi
-
-""".format(krak_out=use_dir+output_filename)
-    
-            # Storing the output file in $samples_hash
-            self.sample_data[sample]["raw_classification"] = "%s" % (sample_dir + output_filename)
-            self.sample_data[sample]["unclassified"] = "%s.unclassified" % (sample_dir + output_filename)
-            self.sample_data[sample]["classified"] = "%s.classified" % (sample_dir + output_filename)
-            self.sample_data[sample]["kraken.report"] = "%s.report" % (sample_dir + output_filename)
-                
-            self.stamp_file(self.sample_data[sample]["raw_classification"])
+\t""".format(out=out)
+        elif self.params["classified_out"] == "skip":
+            read_outputs = ""
+        else:
+            read_outputs = ""
+            for read_set in ["unclassified", "classified"]:
+                # kraken2 replaces '#' with _1 and _2 for paired reads
+                read_outputs += "--{read_set}-out {out}.{read_set}{num}.fq \\\n\t".format(read_set=read_set,
+                                                                                       out=out,
+                                                                                       num="#" if paired else "")
+                for num in (["_1", "_2"] if paired else [""]):
+                    fifo = "{out}.{read_set}{num}.fq".format(out=out, read_set=read_set, num=num)
+                    fifos.append(fifo)
+                    readers += "{compress} -c < {fifo} > {fifo}.gz &\n".format(compress=self.compressor,
+                                                                              fifo=fifo)
+
+        script = ""
+        if fifos:
+            script += """
+# Named pipes for streaming kraken2 outputs
+rm -f {fifos}
+mkfifo {fifos}
+{readers}""".format(fifos=" ".join(fifos),
+                    readers=readers)
+
+        script += """
+{const}--output {output} \\
+\t--report {out}.report \\
+\t{read_outputs}{reads}
+kraken2_status=$?
+""".format(out=out,
+           output=output,
+           read_outputs=read_outputs,
+           const=self.get_script_const(),
+           reads=self.get_reads(sample))
+
+        if fifos:
+            script += """
+# Release readers of pipes kraken2 did not open, and wait for all readers to finish
+for kraken2_fifo in {fifos}; do
+    exec 3<> $kraken2_fifo
+    exec 3>&-
+done
+wait
+rm -f {fifos}
+""".format(fifos=" ".join(fifos))
+
+        return script + "\n"
+
+    def store_sample_outputs(self, sample, output_prefix):
+        """ Store the kraken2 outputs of sample in sample_data
+        """
+
+        # Storing the output file in $samples_hash
+        self.sample_data[sample]["raw_classification"] = "%s" % (output_prefix)
+        self.sample_data[sample]["kraken.report"] = "%s.report" % (output_prefix)
+
+        self.stamp_file(self.sample_data[sample]["raw_classification"])
+        self.stamp_file(self.sample_data[sample]["kraken.report"])
+
+        if self.params["classified_out"] != "skip":
+            self.sample_data[sample]["unclassified"] = "%s.unclassified" % (output_prefix)
+            self.sample_data[sample]["classified"] = "%s.classified" % (output_prefix)
             self.stamp_file(self.sample_data[sample]["unclassified"])
             self.stamp_file(self.sample_data[sample]["classified"])
-            self.stamp_file(self.sample_data[sample]["kraken.report"])
-            
-            # Move all files from temporary local dir to permanent base_dir
-            self.local_finish(use_dir,self.base_dir)
-            self.create_low_level_script()
 
     def make_sample_file_index(self):
         """ Make file containing samples and target file names for use by kraken analysis R script
@@ -0,0 +1,352 @@
+# -*- coding: UTF-8 -*-
+"""
+Merge per-sample taxonomic profiles into a single taxon x sample table.
+
+The per-sample profiles are read one at a time (optionally parsed in parallel) and their non-zero values are stored in
+a sparse matrix: a taxon dictionary, mapping each taxon to a row number, and arrays of (row, sample, value) triplets.
+Memory therefore grows with the number of non-zero entries and not with the number of samples times the number of
+taxa.
+
+Supported profile formats:
+
+* ``metaphlan2``: ``metaphlan2`` profiles. The value is the relative abundance.
+* ``kaiju``: ``kaiju2table`` reports. The values are the read numbers and the percents.
+
+Output formats:
+
+* ``tsv``: Dense, tab-separated table. Values are written as found in the profiles, and missing values as 0. For
+  ``metaphlan2``, the layout of ``merge_metaphlan_tables.py``. For ``kaiju``, the layout of ``merge_count_tables.pl``:
+  taxon id, taxon path, total reads, a reads column per sample and a percent column per sample, with the unclassified
+  and unassigned lines first, sorted by total reads and viruses last.
+* ``triplets``: Sparse, tab-separated table with one line per non-zero value: taxon, sample, value.
+* ``biom``: Sparse BIOM (version 1.0, JSON) table.
+* ``parquet``: Columnar, sparse table with taxon, sample and value columns. Requires ``pyarrow``.
+
+For ``kaiju``, the sparse and columnar outputs contain the read numbers.
+
+The samples are passed in an index file, with a sample name and a profile file on each line.
+
+Used by the ``metaphlan2`` and ``kaiju2table`` modules.
+"""
+
+import os
+import sys
+import json
+import argparse
+import datetime
+import multiprocessing
+from array import array
+
+__author__ = "Menachem Sklarz"
+__version__ = "1.6.1"
+
+
+# kaiju2table taxon ids for reads which are not assigned to a taxon, sorted to the top of the table
+KAIJU_UNCLASSIFIED = "-2"
+KAIJU_UNASSIGNED = "-1"
+KAIJU_VIRUSES = "10239"
+
+
+def read_index(index):
+    """ Return list of (sample, profile file) tuples from the index file
+    """
+
+    samples = list()
+    with open(index, "r") as index_fh:
+        for line in index_fh:
+            if not line.strip() or line.startswith("#"):
+                continue
+            sample, profile = line.rstrip("\n").split("\t")[:2]
+            samples.append((sample, profile))
+    return samples
+
+
+def parse_value(value):
+    try:
+        return float(value)
+    except ValueError:
+        return 0.0
+
+
+def read_metaphlan2(profile):
+    """ Return list of (taxon, name, [relative abundance], [relative abundance]) from a metaphlan2 profile.
+        The last list holds the value as written in the profile, for the dense table
+    """
+
+    entries = list()
+    value_col = 1
+    with open(profile, "r") as profile_fh:
+        for line in profile_fh:
+            fields = line.rstrip("\n").split("\t")
+            if line.startswith("#"):
+                # Newer profiles include a header line with the column names
+                if fields[0] == "#clade_name" and "relative_abundance" in fields:
+                    value_col = fields.index("relative_abundance")
+                continue
+            if len(fields) <= value_col:
+                continue
+            entries.append((fields[0], fields[0], [parse_value(fields[value_col])], [fields[value_col]]))
+    return entries
+
+
+def read_kaiju(profile):
+    """ Return list of (taxon id, taxon path, [reads, percent], [reads, percent]) from a kaiju2table report.
+        The last list holds the values as written in the report, for the dense table
+    """
+
+    entries = list()
+    with open(profile, "r") as profile_fh:
+        profile_fh.readline()   # Heading
+        for line in profile_fh:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 5:
+                continue
+            percent, reads, taxon_id, taxon_path = fields[1:5]
+            # Separate the unclassified and unassigned lines, which both have taxon id 0
+            if taxon_id == "0":
+                if taxon_path.startswith("cannot be assigned"):
+                    taxon_id = KAIJU_UNASSIGNED
+                elif taxon_path == "unclassified":
+                    taxon_id = KAIJU_UNCLASSIFIED
+            entries.append((taxon_id, taxon_path, [parse_value(reads), parse_value(percent)], [reads, percent]))
+    return entries
+
+
+READERS = {"metaphlan2": (read_metaphlan2, ["relative_abundance"]),
+           "kaiju":      (read_kaiju,      ["reads", "percent"])}
+
+
+class SparseProfiles(object):
+    """ Sparse taxon x sample matrices, one for each value read from the profiles
+    """
+
+    def __init__(self, value_names):
+        self.value_names = value_names
+        self.taxa = dict()          # taxon: row
+        self.taxon_names = list()   # row: name (e.g. taxon path)
+        self.samples = list()
+        self.rows = array("l")
+        self.cols = array("l")
+        self.values = [array("d") for name in value_names]
+        self.texts = list()         # Values as written in the profiles, for readers which return them
+
+    def get_row(self, taxon, name):
+        if taxon not in self.taxa:
+            self.taxa[taxon] = len(self.taxon_names)
+            self.taxon_names.append(name)
+        return self.taxa[taxon]
+
+    def add_sample(self, sample, entries):
+        col = len(self.samples)
+        self.samples.append(sample)
+        for entry in entries:
+            taxon, name, values = entry[:3]
+            if not any(values):
+                continue
+            self.rows.append(self.get_row(taxon, name))
+            self.cols.append(col)
+            for ind, value in enumerate(values):
+                self.values[ind].append(value)
+            if len(entry) > 3:
+                self.texts.append(tuple(entry[3]))
+
+    def get_taxa(self):
+        """ Return list of taxa, by row
+        """
+
+        taxa = [None] * len(self.taxa)
+        for taxon, row in self.taxa.items():
+            taxa[row] = taxon
+        return taxa
+
+    def iter_rows(self):
+        """ Yield (row, [(col, [values], texts)]) for each row, in row order. 'texts' holds the values as written in the
+            profiles, or None if the reader does not return them.
+            Only the order of the triplets is sorted, so memory stays proportional to the non-zero entries.
+        """
+
+        order = sorted(range(len(self.rows)), key=lambda ind: (self.rows[ind], self.cols[ind]))
+        current = None
+        row_values = list()
+        for ind in order:
+            if self.rows[ind] != current:
+                if current is not None:
+                    yield current, row_values
+                current = self.rows[ind]
+                row_values = list()
+            row_values.append((self.cols[ind], [values[ind] for values in self.values],
+                               self.texts[ind] if self.texts else None))
+        if current is not None:
+            yield current, row_values
+
+
+def format_value(value):
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def write_tsv_metaphlan2(profiles, out_fh):
+    taxa = profiles.get_taxa()
+    out_fh.write("\t".join(["ID"] + profiles.samples) + "\n")
+    for row, row_values in profiles.iter_rows():
+        line = ["0"] * len(profiles.samples)
+        for col, values, texts in row_values:
+            # Written as in the profiles
+            line[col] = texts[0]
+        out_fh.write("\t".join([taxa[row]] + line) + "\n")
+
+
+def write_tsv_kaiju(profiles, out_fh):
+    taxa = profiles.get_taxa()
+    sample_num = len(profiles.samples)
+    out_fh.write("\t".join(["taxon_id", "taxon_path", "total_reads"] +
+                           ["reads " + sample for sample in profiles.samples] +
+                           ["percent " + sample for sample in profiles.samples]) + "\n")
+    # Sorting requires the totals of all taxa. Lines are built one at a time when writing.
+    totals = [0.0] * len(taxa)
+    for ind, row in enumerate(profiles.rows):
+        totals[row] += profiles.values[0][ind]
+    first = [row for taxon in [KAIJU_UNCLASSIFIED, KAIJU_UNASSIGNED] for row in [profiles.taxa.get(taxon)]
+             if row is not None]
+    last = [profiles.taxa[KAIJU_VIRUSES]] if KAIJU_VIRUSES in profiles.taxa else []
+    middle = sorted([row for row in range(len(taxa)) if row not in first and row not in last],
+                    key=lambda row: -totals[row])
+    rank = dict((row, ind) for ind, row in enumerate(first + middle + last))
+
+    # Triplets are visited in table order, so that each line is built and written once
+    order = sorted(range(len(profiles.rows)), key=lambda ind: (rank[profiles.rows[ind]], profiles.cols[ind]))
+    current = None
+    for ind in order + [None]:
+        row = profiles.rows[ind] if ind is not None else None
+        if row != current:
+            if current is not None:
+                taxon_id = "" if taxa[current] in [KAIJU_UNCLASSIFIED, KAIJU_UNASSIGNED] else taxa[current]
+                out_fh.write("\t".join([taxon_id, profiles.taxon_names[current], format_value(totals[current])] +
+                                       reads + percents) + "\n")
+            if row is None:
+                break
+            current = row
+            reads = ["0"] * sample_num
+            percents = ["0"] * sample_num
+        # Reads and percents are written as in the reports, as merge_count_tables.pl does
+        reads[profiles.cols[ind]], percents[profiles.cols[ind]] = profiles.texts[ind]
+
+
+def write_triplets(profiles, out_fh):
+    taxa = profiles.get_taxa()
+    out_fh.write("\t".join(["taxon", "sample", profiles.value_names[0]]) + "\n")
+    for row, row_values in profiles.iter_rows():
+        for col, values, texts in row_values:
+            out_fh.write("\t".join([taxa[row], profiles.samples[col], format_value(values[0])]) + "\n")
+
+
+def write_biom(profiles, out_fh):
+    """ Write a sparse BIOM 1.0 (JSON) table. The data is written triplet by triplet.
+    """
+
+    taxa = profiles.get_taxa()
+    out_fh.write("{")
+    out_fh.write(", ".join(['"id": %s' % json.dumps(None),
+                            '"format": "Biological Observation Matrix 1.0.0"',
+                            '"format_url": "http://biom-format.org"',
+                            '"type": "Taxon table"',
+                            '"generated_by": "NeatSeq-Flow merge_profiles.py %s"' % __version__,
+                            '"date": %s' % json.dumps(datetime.datetime.now().isoformat()),
+                            '"matrix_type": "sparse"',
+                            '"matrix_element_type": "float"',
+                            '"shape": [%d, %d]' % (len(taxa), len(profiles.samples))]))
+    out_fh.write(', "rows": [')
+    out_fh.write(", ".join([json.dumps({"id": taxon, "metadata": None}) for taxon in taxa]))
+    out_fh.write('], "columns": [')
+    out_fh.write(", ".join([json.dumps({"id": sample, "metadata": None}) for sample in profiles.samples]))
+    out_fh.write('], "data": [')
+    first = True
+    for row, row_values in profiles.iter_rows():
+        for col, values, texts in row_values:
+            out_fh.write("%s[%d, %d, %s]" % ("" if first else ", ", row, col, repr(values[0])))
+            first = False
+    out_fh.write("]}\n")
+
+
+def write_parquet(profiles, filename):
+    """ Write a columnar, sparse table: taxon, sample, value. Taxon and sample are dictionary encoded.
+    """
+
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        sys.exit("Writing parquet tables requires the 'pyarrow' python package")
+
+    taxa = profiles.get_taxa()
+    columns = [pyarrow.DictionaryArray.from_arrays(pyarrow.array(profiles.rows, type=pyarrow.int32()),
+                                                   pyarrow.array(taxa)),
+               pyarrow.DictionaryArray.from_arrays(pyarrow.array(profiles.cols, type=pyarrow.int32()),
+                                                   pyarrow.array(profiles.samples))]
+    names = ["taxon", "sample"]
+    for name, values in zip(profiles.value_names, profiles.values):
+        columns.append(pyarrow.array(values, type=pyarrow.float64()))
+        names.append(name)
+    pyarrow.parquet.write_table(pyarrow.Table.from_arrays(columns, names=names), filename)
+
+
+def read_profile(args):
+    """ Read a single profile. For use with multiprocessing
+    """
+
+    profile_format, profile = args
+    return READERS[profile_format][0](profile)
+
+
+def merge_profiles(samples, profile_format, processes=1):
+    """ Read the profiles of 'samples', a list of (sample, profile) tuples, into a SparseProfiles object
+    """
+
+    profiles = SparseProfiles(READERS[profile_format][1])
+    jobs = [(profile_format, profile) for sample, profile in samples]
+    if processes > 1:
+        pool = multiprocessing.Pool(processes)
+        # imap keeps the sample order and does not keep all parsed profiles in memory
+        entries_iter = pool.imap(read_profile, jobs, chunksize=8)
+    else:
+        pool = None
+        entries_iter = (read_profile(job) for job in jobs)
+    for (sample, profile), entries in zip(samples, entries_iter):
+        profiles.add_sample(sample, entries)
+    if pool:
+        pool.close()
+        pool.join()
+    return profiles
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Merge per-sample taxonomic profiles into a taxon x sample table")
+    parser.add_argument("-i", "--index", required=True,
+                        help="Tab-separated file with a sample name and a profile file on each line")
+    parser.add_argument("-f", "--format", required=True, choices=sorted(READERS.keys()), help="Profile format")
+    parser.add_argument("-p", "--processes", type=int, default=1, help="Number of processes for reading profiles")
+    parser.add_argument("--tsv", help="Dense table")
+    parser.add_argument("--triplets", help="Sparse table: taxon, sample, value")
+    parser.add_argument("--biom", help="Sparse BIOM 1.0 (JSON) table")
+    parser.add_argument("--parquet", help="Columnar table. Requires pyarrow")
+    args = parser.parse_args()
+
+    if not any([args.tsv, args.triplets, args.biom, args.parquet]):
+        sys.exit("Please specify at least one output")
+
+    profiles = merge_profiles(read_index(args.index), args.format, args.processes)
+
+    if args.tsv:
+        with open(args.tsv, "w") as out_fh:
+            if args.format == "kaiju":
+                write_tsv_kaiju(profiles, out_fh)
+            else:
+                write_tsv_metaphlan2(profiles, out_fh)
+    if args.triplets:
+        with open(args.triplets, "w") as out_fh:
+            write_triplets(profiles, out_fh)
+    if args.biom:
+        with open(args.biom, "w") as out_fh:
+            write_biom(profiles, out_fh)
+    if args.parquet:
+        write_parquet(profiles, args.parquet)
@@ -40,6 +40,12 @@ Output
 
     * ``self.sample_data["project_data"]["merged_metaphlan2"]``
 
+* If ``merge_metaphlan_tables`` was passed without a ``path``, and ``merge_formats`` includes ``triplets``, ``biom`` or ``parquet``, puts the sparse and columnar tables in:
+
+    * ``self.sample_data["project_data"]["merged_metaphlan2.triplets"]``
+    * ``self.sample_data["project_data"]["merged_metaphlan2.biom"]``
+    * ``self.sample_data["project_data"]["merged_metaphlan2.parquet"]``
+
 
 * If '--biom' is set in ``redirects``, the biom table is put in:
 
@@ -62,7 +68,16 @@ Parameters that can be set
     :widths: 15, 10, 10
 
     "ktImportText_path",      "", "Path to ktImportText."
-    "merge_metaphlan_tables", "", "Path to merge_metaphlan_tables.py. If not specified, will derive it from the location of ``metaphlan2``"
+    "merge_metaphlan_tables", "", "Merge the sample reports. Can contain a ``path`` to merge_metaphlan_tables.py and ``redirects``. If ``path`` is not specified, the reports are merged with the module's own merging script (see below)."
+    "merge_formats", "tsv, triplets, biom, parquet", "List of formats for the merged table, when ``merge_metaphlan_tables`` has no ``path``. Default: ``tsv``"
+    "merge_processes", "int", "Number of processes for reading the reports, when ``merge_metaphlan_tables`` has no ``path``. Default: 1"
+
+.. Note:: When ``merge_metaphlan_tables`` has no ``path``, the reports are merged by ``merge_profiles.py``, which is
+    located in the module directory. The reports are read one at a time into a sparse taxon x sample matrix, so memory
+    grows with the number of non-zero abundances rather than with the number of samples times the number of clades.
+    ``tsv`` is the dense table produced by ``merge_metaphlan_tables.py``. ``triplets`` is a sparse table with one line
+    per clade and sample. ``biom`` is a sparse BIOM 1.0 (JSON) table. ``parquet`` is a columnar table, and requires the
+    ``pyarrow`` python package.
     "metaphlan2krona_path",   "", "Path to metaphlan2krona.py"
 
 
@@ -78,6 +93,7 @@ Lines for parameter file
         script_path: {Vars.paths.metaphlan2}
         ktImportText_path: /path/to/ktImportText
         merge_metaphlan_tables: 
+        merge_formats:          [tsv, biom]
         metaphlan2krona_path:   /path/to/metaphlan2krona.py
         redirects:
             --biom: 
@@ -99,11 +115,16 @@ Truong, D.T., Franzosa, E.A., Tickle, T.L., Scholz, M., Weingart, G., Pasolli, E
 
 import os
 import sys
+import re
 from neatseq_flow.PLC_step import Step,AssertionExcept
 
 
 __author__ = "Menachem Sklarz"
-__version__ = "1.6.0"
+__version__ = "1.6.1"
+
+# Built-in script for merging the sample reports
+MERGE_PROFILES = os.path.join(os.path.dirname(os.path.realpath(__file__)), "merge_profiles.py")
+MERGE_FORMATS = ["tsv", "triplets", "biom", "parquet"]
 
 
 class Step_metaphlan2(Step):
@@ -138,10 +159,21 @@ class Step_metaphlan2(Step):
                 else:
                     self.params["merge_metaphlan_tables"] = dict()
             if "path" not in self.params["merge_metaphlan_tables"]:
-                self.params["merge_metaphlan_tables"]["path"] = os.sep.join([os.path.basename(self.params["script_path"]),
-                                                                             "utils/merge_metaphlan_tables.py"])
                 self.write_warning("You did not provided a path in 'merge_metaphlan_tables'. Using '{path}'".
-                                   format(path=self.params["merge_metaphlan_tables"]["path"]))
+                                   format(path=MERGE_PROFILES))
+                if "merge_formats" not in self.params or not self.params["merge_formats"]:
+                    self.params["merge_formats"] = ["tsv"]
+                if isinstance(self.params["merge_formats"], str):
+                    self.params["merge_formats"] = re.split("\s*,\s*", self.params["merge_formats"])
+                unknown_formats = set(self.params["merge_formats"]) - set(MERGE_FORMATS)
+                if unknown_formats:
+                    raise AssertionExcept("Unknown 'merge_formats': {formats}. Use {allowed}".
+                                          format(formats=", ".join(sorted(unknown_formats)),
+                                                 allowed=", ".join(MERGE_FORMATS)))
+                if "merge_processes" not in self.params or not self.params["merge_processes"]:
+                    self.params["merge_processes"] = 1
+            elif "merge_formats" in self.params or "merge_processes" in self.params:
+                raise AssertionExcept("'merge_formats' and 'merge_processes' can only be used if 'merge_metaphlan_tables' has no 'path'")
 
         if "ktImportText" in self.params:
             if not isinstance(self.params["ktImportText"], dict) or "path" not in self.params["ktImportText"]:
@@ -201,7 +233,37 @@ class Step_metaphlan2(Step):
             self.sample_data["project_data"]["krona"] = krona_report_fn
             self.stamp_file(self.sample_data["project_data"]["krona"])
             
-        if "merge_metaphlan_tables" in self.params:
+        if "merge_metaphlan_tables" in self.params and "path" not in self.params["merge_metaphlan_tables"]:
+
+            self.make_merge_index()
+            outputs = dict((merge_format, "{dir}{title}_merged_table.{ext}".
+                            format(dir=self.base_dir,
+                                   title=self.sample_data["Title"],
+                                   ext="txt" if merge_format == "tsv" else merge_format))
+                           for merge_format in self.params["merge_formats"])
+
+            self.script += """# Merging all metaphlan2 reports into single table
+python {path} \\
+\t--index {index} \\
+\t--format metaphlan2 \\
+\t--processes {processes} \\
+\t{outputs}
+
+""".format(path=MERGE_PROFILES,
+           index=self.sample_data["project_data"]["metaphlan2_merge_index"],
+           processes=self.params["merge_processes"],
+           outputs=" \\\n\t".join(["--{format} {output}".format(format=merge_format,
+                                                                     output=outputs[merge_format])
+                                       for merge_format in self.params["merge_formats"]]))
+
+            for merge_format in self.params["merge_formats"]:
+                if merge_format == "tsv":
+                    self.sample_data["project_data"]["merged_metaphlan2"] = (self.base_dir, os.path.basename(outputs[merge_format]))
+                else:
+                    self.sample_data["project_data"]["merged_metaphlan2." + merge_format] = outputs[merge_format]
+                    self.stamp_file(outputs[merge_format])
+
+        elif "merge_metaphlan_tables" in self.params:
 
             if "redirects" in self.params["merge_metaphlan_tables"]:
                 redirects = " \\\n\t" + " \\\n\t".join(
@@ -319,4 +381,14 @@ class Step_metaphlan2(Step):
             for sample in self.sample_data["samples"]:      # Getting list of samples out of samples_hash
                 index_fh.write("%s\t%s\n" % (sample,self.sample_data[sample]["classification"]))
                 
-        self.sample_data["project_data"]["metaphlan2_files_index"] = self.base_dir + "metaphlan2_files_index.txt"
\ No newline at end of file
+        self.sample_data["project_data"]["metaphlan2_files_index"] = self.base_dir + "metaphlan2_files_index.txt"
+
+    def make_merge_index(self):
+        """ Make file containing samples and report file names for merging the reports
+        """
+
+        with open(self.base_dir + "metaphlan2_merge_index.txt", "w") as index_fh:
+            for sample in self.sample_data["samples"]:      # Getting list of samples out of samples_hash
+                index_fh.write("%s\t%s\n" % (sample,self.sample_data[sample]["raw_classification"]))
+
+        self.sample_data["project_data"]["metaphlan2_merge_index"] = self.base_dir + "metaphlan2_merge_index.txt"
@@ -12,6 +12,12 @@ A module for running ``BlastXMLmerge.py``, available from github at https://gith
 
 The program merges sample-wise XML blast reports into a single project-wide XML BLAST report.
 
+If ``script_path`` is left empty, the reports are merged with ``blast_xml_merge.py``, which is included with the module.
+It reads the reports incrementally and renumbers the iterations on the fly, so memory use does not depend on the size
+of the reports. With this engine, the reports can be validated in parallel before merging (``validate``), and a tabular
+report (equivalent to ``-outfmt 6``) can be written in the same pass (``tabular``). It supports XML (``-outfmt 5``)
+reports only. To merge single-file XML2 (``-outfmt 16``) reports, set ``script_path`` to an external merger.
+
 Can be used together with the ``split_fasta`` module to parallelize BLAST searches: If you have a project-wide fasta file which you want to BLAST, split it into samples with ``split_fasta``, run BLAST on sample scope, and then merge the individual reports with this module.
 
 
@@ -31,6 +37,10 @@ Output
 
     * ``self.sample_data["project_data"]["blast.nucl|blast.prot"]``            if ``scope = project``
 
+* If ``tabular`` is set, puts the tabular report in:
+
+    * ``self.sample_data["project_data"]["blast.tabular"]``
+
     
 
 Parameters that can be set
@@ -41,6 +51,8 @@ Parameters that can be set
     :widths: 15, 10, 10
 
     "blast2use", "``nucl|prot``", "If both nucl and prot BLAST reports exist, you have to specify which one to use with this parameter. If unspecified, will merge both."
+    "validate", "int", "Validate the reports before merging, using this number of parallel processes. Only when ``script_path`` is empty"
+    "tabular", "", "Write a tabular (``-outfmt 6``) report as well. Only when ``script_path`` is empty"
 
 Lines for parameter file
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -53,6 +65,16 @@ Lines for parameter file
         script_path:    {Vars.paths.BlastXMLmerge.py}
         blast2use:      nucl
 
+Using the included streaming merger::
+
+    merge_xml_blast:
+        module:         BlastXMLmerge
+        base:           blst_xml
+        script_path:
+        blast2use:      nucl
+        validate:       8
+        tabular:
+
 """
 
 
@@ -64,7 +86,7 @@ from neatseq_flow.PLC_step import Step,AssertionExcept
 
 
 __author__ = "Menachem Sklarz"
-__version__ = "1.1.0"
+__version__ = "1.1.1"
 
 class Step_BlastXMLmerge(Step):
     """ A class that defines a pipeline step name (=instance).
@@ -79,6 +101,16 @@ class Step_BlastXMLmerge(Step):
         self.shell = "bash"      # Can be set to "bash" by inheriting instances
         self.file_tag = ".blast.parsed"
 
+        if not self.params["script_path"]:
+            if "validate" in self.params:
+                try:
+                    self.params["validate"] = int(self.params["validate"]) if self.params["validate"] else 1
+                except (TypeError, ValueError):
+                    raise AssertionExcept("'validate' must be the number of processes to use")
+        elif "validate" in self.params or "tabular" in self.params:
+            raise AssertionExcept("'validate' and 'tabular' can only be used with the included merger. "
+                                  "Leave 'script_path' empty")
+
         
     def step_sample_initiation(self):
         """ A place to do initiation stages following setting of sample_data
@@ -91,6 +123,9 @@ class Step_BlastXMLmerge(Step):
                 self.write_warning("No 'blast.outfmt.txt' exists for sample. Assuming is XML!")
             if self.sample_data[sample]["blast.outfmt"] not in [5,16]:
                 raise AssertionExcept("BLAST report does not seem to be in XML (5) or single-file XML2 (16) format")
+            if self.sample_data[sample]["blast.outfmt"] == 16 and not self.params["script_path"]:
+                raise AssertionExcept("The included merger supports only XML (5) reports. "
+                                      "Pass a 'script_path' for merging XML2 (16) reports", sample)
             
         
     def create_spec_wrapping_up_script(self):
@@ -130,7 +165,19 @@ class Step_BlastXMLmerge(Step):
             raise AssertionExcept("No BLAST Results defined\n")
 
         
-        self.script += self.get_script_const()
+        if self.params["script_path"]:
+            self.script += self.get_script_const()
+        else:
+            self.script += "python %s \\\n\t" % os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                                              "blast_xml_merge.py")
+            if "validate" in self.params:
+                self.script += "--validate %d \\\n\t" % self.params["validate"]
+            if "tabular" in self.params:
+                self.script += "--tabular {dir}{file}.blast.tab \\\n\t".format(dir = use_dir,
+                                                                                 file=self.sample_data["Title"])
+                self.sample_data["project_data"]["blast.tabular"] = "{dir}{file}.blast.tab".format(dir = self.base_dir,
+                                                                                                  file=self.sample_data["Title"])
+                self.stamp_file(self.sample_data["project_data"]["blast.tabular"])
         self.script += "{dir}{file}.blast.xml \\\n\t".format(dir = use_dir, file=self.sample_data["Title"])
         for sample in self.sample_data["samples"]:
             self.script += "%s \\\n\t" % self.sample_data[sample][blast2use]
@@ -0,0 +1,173 @@
+# -*- coding: UTF-8 -*-
+"""
+Merge BLAST XML reports (``-outfmt 5``) into a single XML report, with constant memory.
+
+Each report is read with an incremental parser (``iterparse``). Every ``Iteration`` is written to the merged report
+as soon as it is parsed and then discarded, with ``Iteration_iter-num`` renumbered so that the numbering is continuous
+across the reports. The ``BlastOutput`` header is taken from the first report.
+
+Optionally:
+
+* The reports are checked for being complete, well-formed BLAST XML before merging, in parallel.
+* A tabular report, equivalent to ``-outfmt 6``, is written in the same pass.
+
+Used by the ``BlastXMLmerge`` module.
+"""
+
+import re
+import sys
+import argparse
+import multiprocessing
+import xml.etree.ElementTree as ET
+
+__author__ = "Menachem Sklarz"
+__version__ = "1.6.0"
+
+XML_HEADER = """<?xml version="1.0"?>
+<!DOCTYPE BlastOutput PUBLIC "-//NCBI//NCBI BlastOutput/EN" "http://www.ncbi.nlm.nih.gov/dtd/NCBI_BlastOutput.dtd">
+"""
+
+
+def iter_report(report):
+    """ Yield ("header", element) for BlastOutput children preceding the iterations,
+        and ("iteration", element) for each Iteration. Elements are removed from the tree after being yielded,
+        so that memory use does not depend on the size of the report.
+    """
+
+    depth = 0
+    root = None
+    iterations = None
+    for event, elem in ET.iterparse(report, events=("start", "end")):
+        if event == "start":
+            depth += 1
+            if depth == 1:
+                root = elem
+                if elem.tag != "BlastOutput":
+                    raise ValueError("{report} is not a BLAST XML report".format(report=report))
+            elif depth == 2 and elem.tag == "BlastOutput_iterations":
+                iterations = elem
+            continue
+
+        depth -= 1
+        if depth == 1 and iterations is None:
+            yield "header", elem
+            root.remove(elem)
+        elif depth == 2 and elem.tag == "Iteration":
+            yield "iteration", elem
+            iterations.remove(elem)
+        elif depth == 1:
+            # Iterations container and elements following it
+            root.remove(elem)
+
+
+def validate_report(report):
+    """ Parse the whole report. Return None if valid, or an error message
+    """
+
+    try:
+        for elem_type, elem in iter_report(report):
+            pass
+        return None
+    except (ET.ParseError, ValueError) as err:
+        return "{report}: {err}".format(report=report, err=err)
+
+
+def get_first_word(text):
+    return text.split()[0] if text and text.split() else ""
+
+
+def get_gap_opens(seq):
+    return len(re.findall("-+", seq or ""))
+
+
+def write_tabular(iteration, tab_fh):
+    """ Write the HSPs of an iteration in -outfmt 6 format
+    """
+
+    query_def = iteration.findtext("Iteration_query-def")
+    if not query_def or query_def == "No definition line":
+        qseqid = iteration.findtext("Iteration_query-ID")
+    else:
+        qseqid = get_first_word(query_def)
+
+    for hit in iteration.iter("Hit"):
+        sseqid = hit.findtext("Hit_id")
+        # Local database ids are stored in the definition
+        if sseqid.startswith("gnl|BL_ORD_ID|"):
+            sseqid = get_first_word(hit.findtext("Hit_def"))
+        for hsp in hit.iter("Hsp"):
+            align_len = int(hsp.findtext("Hsp_align-len"))
+            identity = int(hsp.findtext("Hsp_identity"))
+            gaps = int(hsp.findtext("Hsp_gaps") or 0)
+            tab_fh.write("\t".join([qseqid,
+                                    sseqid,
+                                    "%.3f" % (100.0 * identity / align_len),
+                                    str(align_len),
+                                    str(align_len - identity - gaps),
+                                    str(get_gap_opens(hsp.findtext("Hsp_qseq")) +
+                                        get_gap_opens(hsp.findtext("Hsp_hseq"))),
+                                    hsp.findtext("Hsp_query-from"),
+                                    hsp.findtext("Hsp_query-to"),
+                                    hsp.findtext("Hsp_hit-from"),
+                                    hsp.findtext("Hsp_hit-to"),
+                                    "%.2e" % float(hsp.findtext("Hsp_evalue")),
+                                    "%.1f" % float(hsp.findtext("Hsp_bit-score"))]) + "\n")
+
+
+def merge_reports(reports, out_fh, tab_fh=None):
+    """ Merge 'reports' into 'out_fh'. If 'tab_fh' is passed, write a tabular report into it as well.
+        Returns number of iterations written.
+    """
+
+    out_fh.write(XML_HEADER)
+    out_fh.write("<BlastOutput>\n")
+    iteration_num = 0
+    for ind, report in enumerate(reports):
+        for elem_type, elem in iter_report(report):
+            if elem_type == "header":
+                if ind == 0:
+                    elem.tail = "\n"
+                    out_fh.write("  " + ET.tostring(elem, encoding="unicode"))
+                continue
+            iteration_num += 1
+            if iteration_num == 1:
+                out_fh.write("  <BlastOutput_iterations>\n")
+            elem.find("Iteration_iter-num").text = str(iteration_num)
+            query_id = elem.find("Iteration_query-ID")
+            if query_id is not None and re.match(r"^Query_\d+$", query_id.text or ""):
+                query_id.text = "Query_{num}".format(num=iteration_num)
+            if tab_fh:
+                write_tabular(elem, tab_fh)
+            elem.tail = "\n"
+            out_fh.write(ET.tostring(elem, encoding="unicode"))
+
+    if iteration_num == 0:
+        out_fh.write("  <BlastOutput_iterations>\n")
+    out_fh.write("  </BlastOutput_iterations>\n")
+    out_fh.write("</BlastOutput>\n")
+    return iteration_num
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Merge BLAST XML reports with constant memory")
+    parser.add_argument("output", help="Merged XML report")
+    parser.add_argument("reports", nargs="+", help="BLAST XML reports to merge")
+    parser.add_argument("--validate", type=int, default=0, metavar="PROCESSES",
+                        help="Validate the reports before merging, using this number of parallel processes")
+    parser.add_argument("--tabular", help="Write a tabular (-outfmt 6) report to this file as well")
+    args = parser.parse_args()
+
+    if args.validate:
+        pool = multiprocessing.Pool(args.validate)
+        errors = [error for error in pool.map(validate_report, args.reports) if error]
+        pool.close()
+        if errors:
+            sys.exit("The following reports are not valid BLAST XML:\n" + "\n".join(errors))
+
+    with open(args.output, "w") as out_fh:
+        if args.tabular:
+            with open(args.tabular, "w") as tab_fh:
+                merge_reports(args.reports, out_fh, tab_fh)
+        else:
+            merge_reports(args.reports, out_fh)
@@ -0,0 +1,193 @@
+# -*- coding: UTF-8 -*-
+"""
+Staging of large, read-only databases and inputs to node-local storage.
+
+Modules which read a large database (kraken2, centrifuge, HUMAnN2 etc.) can call ``get_db_stage_script()`` at the
+beginning of a script. At run time, the database is copied to a local directory (a local disk or a tmpfs such as
+``/dev/shm``) and a shell variable is set to the location of the local copy. The script then uses the variable in
+place of the original database path.
+
+The local copy is shared by all jobs running on the same node: the staging directory name includes a key built from
+the database path and the names, sizes and modification times of its files, and a lock file prevents concurrent jobs
+from copying the same database at the same time. Subsequent jobs find the complete copy and use it without copying.
+If the database changes, a new copy is created under a new key. Files are copied in chunks with several parallel
+streams, which is faster than a single stream on most network file systems.
+
+Local copies are either kept or released:
+
+* Kept copies (the default) are used by future jobs and are not removed. Clean the staging directory periodically, or
+  use a tmpfs which is cleaned on reboot.
+* With ``release=True``, each job using a local copy registers itself in ``<local copy>.users``. When the job exits,
+  successfully or not, it removes itself, and the last user removes the local copy and its lock file. Registrations
+  of jobs which were killed without cleaning up are detected by process ID and ignored. A copy which was also staged
+  without release is kept. ``input_staging.py`` uses this mode for mapping and variant calling inputs.
+
+If the copy fails, *e.g.* for lack of space, the variable is left pointing at the original database.
+
+The database can be either a directory (*e.g.* kraken2 database) or a prefix shared by the database files (*e.g.*
+centrifuge and bowtie2 indices). In the latter case, the variable is set to the prefix within the local copy.
+
+:Authors: Menachem Sklarz
+:Affiliation: Bioinformatics core facility
+:Organization: National Institute of Biotechnology in the Negev, Ben Gurion University.
+"""
+
+__author__ = "Menachem Sklarz"
+__version__ = "1.6.1"
+
+
+# Default location for local copies, if the stage directory parameter is passed without a value
+DB_STAGE_DEFAULT_DIR = "${TMPDIR:-/tmp}"
+# Default number of parallel copy streams
+DB_STAGE_STREAMS = 4
+# Size of copied chunks (megabytes)
+DB_STAGE_CHUNK = 64
+
+
+def get_db_stage_dir(params, param_name="db_stage_dir"):
+    """ Return the staging directory defined in step parameter 'param_name', or None if staging was not requested
+    """
+
+    if param_name not in params:
+        return None
+    return params[param_name] if params[param_name] else DB_STAGE_DEFAULT_DIR
+
+
+def get_db_stage_functions(streams=None):
+    """ Return script part defining the shell functions which create and release local copies.
+        May be included more than once in a script. The EXIT trap releasing the local copies is installed once, and an
+        existing EXIT trap is kept, and runs before the release.
+
+        Usage of the shell function: db_stage <stage dir> <label> <path> <dir|prefix> <keep|release> <files>
+        It sets $db_stage_path to the local copy of 'path', or to 'path' if it was not copied.
+        :param streams: Number of parallel copy streams
+    """
+
+    return """
+# Functions for staging read-only files to local storage. Local copies are shared by jobs on this node
+db_stage_copy() {{
+    local dest=$1 file size; shift
+    for file in "$@"; do
+        size=$(stat -L -c %s $file)
+        touch $dest/$(basename $file)
+        seq 0 $(( (size - 1) / ({chunk} * 1048576) )) | sed "s|^|$file $dest/$(basename $file) |"
+    done | xargs -n 3 -P {streams} sh -c 'dd if="$0" of="$1" bs={chunk}M skip=$2 seek=$2 count=1 iflag=fullblock conv=notrunc status=none' || return 1
+    for file in "$@"; do
+        [ "$(stat -L -c %s $file)" = "$(stat -c %s $dest/$(basename $file))" ] || return 1
+    done
+}}
+db_stage_lock() {{
+    # The last user of a local copy removes the lock file. Lock again if it was removed while waiting
+    while true; do
+        exec 9> $1.lock
+        flock -x 9
+        [ $1.lock -ef /dev/fd/9 ] && break
+        exec 9>&-
+    done
+}}
+db_stage_unlock() {{
+    flock -u 9
+    exec 9>&-
+}}
+db_stage_prune() {{
+    local user
+    for user in $1.users/$(hostname).*; do
+        [ -e "$user" ] && ! kill -0 ${{user##*.}} 2> /dev/null && rm -f $user
+    done
+}}
+db_stage_release() {{
+    local entry
+    for entry in $db_stage_entries; do
+        db_stage_lock $entry
+        rm -f $entry.users/$db_stage_id
+        db_stage_prune $entry
+        if [ -z "$(ls -A $entry.users 2> /dev/null)" ]; then
+            echo "Removing local copy $entry"
+            rm -rf $entry $entry.users $entry.lock
+        fi
+        db_stage_unlock
+    done
+}}
+db_stage() {{
+    local stage_dir=$1 label=$2 path=$3 kind=$4 mode=$5; shift 5
+    local files="$@" key entry size avail tmp
+    db_stage_path=$path
+    [ -n "$files" ] || return 0
+    key=$( {{ readlink -f $path; for file in $files; do stat -L -c "%n %s %Y" $file; done; }} | md5sum | cut -d" " -f1)
+    entry=$stage_dir/$label.$key
+    mkdir -p $stage_dir
+    db_stage_lock $entry
+    if [ ! -e $entry/.complete ]; then
+        size=$(du -cbL $files | tail -n1 | cut -f1)
+        avail=$(df -P -B1 $stage_dir | awk 'NR==2 {{print $4}}')
+        if [ "$size" -lt "$avail" ]; then
+            echo "Copying $label to $entry"
+            tmp=$(mktemp -d $entry.tmp.XXXXXX)
+            if db_stage_copy $tmp $files && touch $tmp/.complete; then
+                rm -rf $entry
+                mv $tmp $entry
+            else
+                echo "Failed copying $label. Using original location"
+                rm -rf $tmp
+            fi
+        else
+            echo "Not enough space in $stage_dir for $label. Using original location"
+        fi
+    fi
+    if [ -e $entry/.complete ]; then
+        mkdir -p $entry.users
+        db_stage_prune $entry
+        if [ "$mode" = "release" ]; then
+            touch $entry.users/$db_stage_id
+            db_stage_entries="$db_stage_entries $entry"
+        else
+            touch $entry.users/keep
+        fi
+        if [ "$kind" = "dir" ]; then
+            db_stage_path=$entry
+        else
+            db_stage_path=$entry/$(basename $path)
+        fi
+        echo "Using local copy of $label: $db_stage_path"
+    else
+        # No copy, hence no users
+        rm -f $entry.lock
+    fi
+    db_stage_unlock
+}}
+if [ -z "$db_stage_id" ]; then
+    db_stage_id=$(hostname).$$
+    db_stage_entries=""
+    db_stage_trap=""
+    eval "$(trap -p EXIT | sed -e 's/^trap -- /db_stage_trap=/' -e 's/ EXIT$//')"
+    trap 'eval "$db_stage_trap"; db_stage_release' EXIT
+fi
+
+""".format(streams=streams if streams else DB_STAGE_STREAMS,
+           chunk=DB_STAGE_CHUNK)
+
+
+def get_db_stage_script(database, stage_dir, variable, label="db", release=False, streams=None):
+    """ Return script part setting shell variable 'variable' to a node-local copy of 'database'.
+        :param database: Database directory, or prefix of database files
+        :param stage_dir: Directory in which to create the local copy. May contain shell variables.
+        :param variable: Name of shell variable to set
+        :param label: Prefix for the name of the local copy, for readability
+        :param release: Remove the local copy when the last job using it exits
+        :param streams: Number of parallel copy streams
+    """
+
+    return get_db_stage_functions(streams) + """\
+# Staging {label} database to local storage
+if [ -d {database} ]; then
+    db_stage {stage_dir} {label} {database} dir {mode} $(find -L {database} -mindepth 1 -maxdepth 1 -type f)
+else
+    db_stage {stage_dir} {label} {database} prefix {mode} $(ls -d {database}* 2> /dev/null)
+fi
+{variable}=$db_stage_path
+
+""".format(database=database.rstrip("/"),
+           stage_dir=stage_dir.rstrip("/"),
+           variable=variable,
+           label=label,
+           mode="release" if release else "keep")
@@ -0,0 +1,266 @@
+# -*- coding: UTF-8 -*-
+"""
+Precompiled ``inputs`` and ``outputs`` specifications for the ``Generic`` module.
+
+The ``inputs`` and ``outputs`` sections are parsed once, when the step is initiated, into lists of argument
+specifications with all the per-argument decisions already taken (scope, File_Type slots, separator, prefix, suffix,
+argument string etc.). Building the script of each sample is then only a matter of looking up the slots in the sample
+data and concatenating strings.
+
+Running this file directly benchmarks a full step build (initiation, scripts and wrapping up) with a previous version
+of ``Generic.py`` and with the current one, and checks that both build the same scripts::
+
+    git show <previous commit>:neatseq_flow_modules/main_NSF_classes/Generic_module/Generic.py > Generic_legacy.py
+    python generic_spec.py --legacy Generic_legacy.py --samples 10000 --arguments 1 10 50
+
+The ``neatseq_flow`` package must be importable.
+
+:Authors: Liron Levin
+:Affiliation: Bioinformatics core facility
+:Organization: National Institute of Biotechnology in the Negev, Ben Gurion University.
+"""
+
+import os
+import copy
+import argparse
+from timeit import default_timer as timer
+
+__author__ = "Liron Levin"
+__version__ = "1.6.0"
+
+
+def _get(dic, key, default=""):
+    """ Return dic[key], or default if the key is missing or empty (None)
+    """
+
+    res = dic.get(key) if isinstance(dic, dict) else None
+    return default if res is None else res
+
+
+def split_File_Types(File_Type):
+    """ Return list of File_Type slots from a File_Type parameter, e.g. 'fastq.F,fastq.R' or [fastq.F, fastq.R]
+    """
+
+    return str(File_Type).replace("'", '').replace(" ", '').strip('[').strip(']').strip('"').split(',')
+
+
+def _get_arg_format(arg, arg_separator):
+    """ Return (head, tail) to put around the value of argument 'arg'
+    """
+
+    if arg.startswith("Empty".lower()):
+        return "", "   \\\n\t"
+    return arg + arg_separator, " \\\n\t"
+
+
+def compile_inputs(inputs, arg_separator):
+    """ Return list of input argument specifications, in parameter file order
+    """
+
+    compiled = list()
+    for arg in (inputs or {}):
+        arg_params = inputs[arg] or {}
+        head, tail = _get_arg_format(arg, arg_separator)
+        spec = {"arg":            arg,
+                "head":           head,
+                "tail":           tail,
+                "constant_value": None,
+                "base":           _get(arg_params, "base", None),
+                "File_Type":      _get(arg_params, "File_Type", None),
+                "slots":          [],
+                "project":        _get(arg_params, "scope") == "project",
+                "prefix":         _get(arg_params, "prefix"),
+                "suffix":         _get(arg_params, "suffix"),
+                "use_dirname":    "use_dirname" in arg_params,
+                "del":            "del" in arg_params}
+        if "constant_value" in arg_params:
+            spec["constant_value"] = _get(arg_params, "constant_value")
+        if spec["File_Type"] is not None:
+            spec["slots"] = split_File_Types(spec["File_Type"])
+        if len(_get(arg_params, "sep")) > 0:
+            spec["sep"] = _get(arg_params, "sep")
+        elif arg.startswith("Empty".lower()):
+            spec["sep"] = " "
+        else:
+            spec["sep"] = " \\\n\t" + arg + arg_separator
+        compiled.append(spec)
+    return compiled
+
+
+def compile_outputs(outputs, arg_separator):
+    """ Return list of output argument specifications, in parameter file order
+    """
+
+    compiled = list()
+    for arg in (outputs or {}):
+        arg_params = outputs[arg] or {}
+        head, tail = _get_arg_format(arg, arg_separator)
+        compiled.append({"arg":                arg,
+                         "head":               head,
+                         "tail":               tail,
+                         "run":                not arg.startswith("No_run"),
+                         "File_Type":          _get(arg_params, "File_Type", None),
+                         "constant_file_name": _get(arg_params, "constant_file_name"),
+                         "prefix":             _get(arg_params, "prefix"),
+                         "suffix":             _get(arg_params, "suffix"),
+                         "use_base_name":      "use_base_name" in arg_params,
+                         "del":                "del" in arg_params})
+    return compiled
+
+
+def format_argument(spec, value):
+    """ Return the script line for argument 'spec' with value 'value'
+    """
+
+    return spec["head"] + value + spec["tail"]
+
+
+def get_input_filename(spec, filename):
+    """ Apply the prefix, suffix and use_dirname of input argument 'spec' to 'filename'
+    """
+
+    if spec["use_dirname"]:
+        return spec["prefix"] + os.path.join(os.path.dirname(filename), spec["suffix"].lstrip(os.sep))
+    return os.path.join(os.path.dirname(filename),
+                        (spec["prefix"] + os.path.basename(filename) + spec["suffix"]).lstrip(os.sep))
+
+
+def get_input_files(spec, sample_data, samples):
+    """ Return list of files for input argument 'spec'.
+        Project scope arguments are taken from the project data, sample scope arguments from each of 'samples'.
+    """
+
+    if spec["project"]:
+        return [get_input_filename(spec, sample_data["project_data"][slot]) for slot in spec["slots"]]
+    return [get_input_filename(spec, sample_data[sample][slot]) for sample in samples for slot in spec["slots"]]
+
+
+def get_constant_value(spec, sample, project):
+    """ Return the constant value of input argument 'spec' with the sample and project names filled in
+    """
+
+    return spec["constant_value"].replace('{{sample_name}}', sample).replace('{{project_name}}', project)
+
+
+def get_output_filenames(spec, directory, real_directory, name):
+    """ Return (filename for the script, filename to store in the File_Type) for output argument 'spec'
+    """
+
+    if spec["constant_file_name"] == "":
+        filename = "".join([spec["prefix"], name, spec["suffix"]])
+        if spec["use_base_name"]:
+            return filename, filename
+        return directory + filename, real_directory + filename
+    return directory + spec["constant_file_name"], real_directory + spec["constant_file_name"]
+
+
+def get_delete_lines(filename):
+    """ Return the script lines deleting 'filename'. Directories (ending with a separator) are emptied.
+    """
+
+    if filename.endswith(os.sep):
+        return ["rm -rf %s*   \n\n" % filename]
+    return ["rm -rf %s   \n\n" % filename,
+            "echo > %s_DELETED  \n\n" % filename.rstrip(os.sep)]
+
+
+def _load_generic(path, name):
+    """ Load the Generic module in 'path', for the benchmark
+    """
+
+    import importlib.util
+
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _get_benchmark_step(module, params, sample_data):
+    """ Return a Step_Generic instance of 'module' for the benchmark.
+        The framework methods creating directories and writing scripts are replaced, so that only the module's own
+        work is timed. The replacements are the same for all versions of the module.
+    """
+
+    step = module.Step_Generic.__new__(module.Step_Generic)
+    step.params = copy.deepcopy(params)
+    step.sample_data = copy.deepcopy(sample_data)
+    step.step = "Generic"
+    step.name = "benchmark"
+    step.base_dir = "/out/"
+    step.scripts = list()
+    step.script = ""
+    step.get_base_sample_data = lambda: dict()
+    step.get_base_step_list = lambda: list()
+    step.make_folder_for_sample = lambda sample="project_data": "/out/" + sample + os.sep
+    step.set_spec_script_name = lambda sample="project_data": sample
+    step.local_start = lambda base_dir: base_dir
+    step.local_finish = lambda use_dir, base_dir: None
+    step.get_script_const = lambda: "generic \\\n\t"
+    step.stamp_file = lambda filename: None
+    step.write_warning = lambda *args, **kwargs: None
+    step.create_low_level_script = lambda: step.scripts.append(step.script)
+    return step
+
+
+def _time_build(module, params, sample_data):
+    """ Time a full step build (initiation, scripts and wrapping up) with 'module'.
+        Returns the time and the scripts built
+    """
+
+    step = _get_benchmark_step(module, params, sample_data)
+    start = timer()
+    step.step_specific_init()
+    step.step_sample_initiation()
+    step.build_scripts()
+    step.create_spec_wrapping_up_script()
+    return timer() - start, step.scripts
+
+
+def _get_benchmark_data(sample_num, arg_num):
+    """ Return (params, sample_data) with 'arg_num' input and output arguments for 'sample_num' samples
+    """
+
+    sample_data = {"samples": ["Sample%d" % ind for ind in range(sample_num)], "project_data": {}}
+    for sample in sample_data["samples"]:
+        sample_data[sample] = {"type%d" % ind: "/data/%s/%s.type%d" % (sample, sample, ind) for ind in range(arg_num)}
+    params = {"script_path": "generic",
+              "redir_params": {},
+              "inputs": {"--in%d" % ind: {"File_Type": "type%d" % ind, "suffix": ".gz"} for ind in range(arg_num)},
+              "outputs": {"--out%d" % ind: {"File_Type": "out%d" % ind, "suffix": ".out"}
+                          for ind in range(arg_num)}}
+    return params, sample_data
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Benchmark building Generic scripts with a previous version of the "
+                                                 "Generic module and with the current one")
+    parser.add_argument("--legacy", required=True,
+                        help="Generic.py of the previous version, e.g. extracted with 'git show'")
+    parser.add_argument("--current", default=os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))),
+                                                          "main_NSF_classes", "Generic_module", "Generic.py"),
+                        help="Generic.py of the current version. Default: the one in this package")
+    parser.add_argument("--samples", type=int, default=10000, help="Number of samples")
+    parser.add_argument("--arguments", type=int, nargs="+", default=[1, 10, 50],
+                        help="Numbers of input (and output) arguments to test")
+    parser.add_argument("--repeats", type=int, default=3, help="Number of builds per version. The fastest is reported")
+    args = parser.parse_args()
+
+    legacy_module = _load_generic(args.legacy, "Generic_legacy")
+    current_module = _load_generic(args.current, "Generic_current")
+
+    print("\t".join(["arguments", "legacy_sec", "current_sec", "legacy_usec_per_arg", "current_usec_per_arg"]))
+    for arg_num in args.arguments:
+        params, sample_data = _get_benchmark_data(args.samples, arg_num)
+        legacy_time = current_time = None
+        for repeat in range(args.repeats):
+            build_time, legacy = _time_build(legacy_module, params, sample_data)
+            legacy_time = build_time if legacy_time is None else min(legacy_time, build_time)
+            build_time, current = _time_build(current_module, params, sample_data)
+            current_time = build_time if current_time is None else min(current_time, build_time)
+        if legacy != current:
+            raise SystemExit("The versions produced different scripts!")
+        per_arg = 1e6 / (args.samples * arg_num * 2)
+        print("%d\t%.3f\t%.3f\t%.2f\t%.2f" % (arg_num, legacy_time, current_time,
+                                              legacy_time * per_arg, current_time * per_arg))
@@ -0,0 +1,99 @@
+# -*- coding: UTF-8 -*-
+"""
+Shared, content-addressed index cache for index builder modules.
+
+Builder modules call ``get_index_cache_start()`` before the build command and ``get_index_cache_end()`` after it.
+The build command must write its index into ``$index_cache_tmp``.
+
+At run time, the cache key is the md5 of the input files (reference fasta, gtf etc.), of the builder command and
+executable and of the builder parameters. If the key exists in the cache, the build is skipped. Otherwise, the index
+is built into a temporary directory in the cache and moved into place if the builder succeeds. If it fails, the
+temporary directory is removed and the script exits with an error. A lock file prevents concurrent projects from
+building the same index at the same time. In both cases, a symbolic link to the cached index is created in the step
+directory.
+
+:Authors: Menachem Sklarz
+:Affiliation: Bioinformatics core facility
+:Organization: National Institute of Biotechnology in the Negev, Ben Gurion University.
+"""
+
+__author__ = "Menachem Sklarz"
+__version__ = "1.6.1"
+
+
+# Name of index files within a cache entry. Must be known at build time, so that the index slots can be set.
+INDEX_CACHE_NAME = "index"
+# Parameters that do not affect the index content and are therefore not part of the cache key
+INDEX_CACHE_IGNORED_PARAMS = ["--threads", "--runThreadN", "-p", "--num-threads"]
+
+
+def get_index_cache_params(redir_params, exclude=()):
+    """ Return a canonical string of builder parameters for inclusion in the cache key.
+        Parameters in 'exclude' (e.g. output locations and input files, which are hashed by content) are ignored,
+        as are thread numbers.
+    """
+
+    exclude = list(exclude) + INDEX_CACHE_IGNORED_PARAMS
+
+    return " ".join(["{key} {val}".format(key=key, val=redir_params[key] if redir_params[key] is not None else "")
+                     for key in sorted(redir_params)
+                     if key not in exclude])
+
+
+def get_index_cache_start(cache_dir, builder, files, params, script_path):
+    """ Return the script part looking up the index in the cache and, if missing, opening the build block.
+        :param cache_dir: Location of the shared cache
+        :param builder: Name of the builder. Each builder has it's own directory in the cache
+        :param files: List of input files to hash
+        :param params: Parameter string, as returned by get_index_cache_params()
+        :param script_path: The builder command. The command and the md5 of its executable, i.e. its version,
+                            are part of the key
+    """
+
+    script_path = script_path.strip() if script_path else ""
+
+    return """
+# Looking for index in shared index cache
+mkdir -p {cache_dir}
+index_cache_exec=$(command -v {executable} 2> /dev/null)
+index_cache_key=$( {{ for index_file in {files} $index_cache_exec; do md5sum < $index_file; done; echo '{script_path}'; echo '{params}'; }} | md5sum | cut -d" " -f1)
+index_cache_entry={cache_dir}$index_cache_key
+exec 9> $index_cache_entry.lock
+flock -x 9
+if [ -e $index_cache_entry/.complete ]; then
+    echo "Using cached index $index_cache_entry"
+else
+    echo "Index not found in cache. Building into $index_cache_entry"
+    index_cache_tmp=$(mktemp -d $index_cache_entry.tmp.XXXXXX)
+
+""".format(cache_dir=cache_dir.rstrip("/") + "/" + builder + "/",
+           files=" ".join(files),
+           executable=script_path.split()[0] if script_path else "''",
+           script_path=script_path.replace("'", "'\\''"),
+           params=params.replace("'", "'\\''"))
+
+
+def get_index_cache_end(link):
+    """ Return the script part publishing a newly built index and linking to the cached index.
+        Must directly follow the build command: the index is published only if the command succeeded.
+        :param link: Path of the symbolic link to the cache entry.
+    """
+
+    return """
+    index_cache_status=$?
+    if [ $index_cache_status -ne 0 ]; then
+        echo "Index build failed with status $index_cache_status. Not adding $index_cache_entry to the cache"
+        rm -rf $index_cache_tmp
+        exit 1
+    fi
+    touch $index_cache_tmp/.complete
+    chmod -R a+rX $index_cache_tmp
+    rm -rf $index_cache_entry
+    mv $index_cache_tmp $index_cache_entry
+fi
+flock -u 9
+exec 9>&-
+
+ln -sfn $index_cache_entry {link}
+
+""".format(link=link.rstrip("/"))
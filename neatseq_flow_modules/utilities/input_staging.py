@@ -0,0 +1,89 @@
+# -*- coding: UTF-8 -*-
+"""
+Staging of read-only step inputs to node-local scratch.
+
+Mapping and variant calling modules (bwa_mapper, bowtie2_mapper, STAR_mapper, GATK_gvcf, freebayes etc.) can call
+``get_input_stage_script()`` at the beginning of a script, with a list of the inputs they read repeatedly: index
+directories or prefixes, reference fasta files and BAM files. At run time, each input, with its companion files
+(``.fai`` and ``.dict`` for references, ``.bai`` for BAM files), is copied to a local directory, and a shell variable
+is set to the location of the local copy. The script then uses the variable in place of the original path.
+
+The copies are made by the database staging functions (see ``db_staging.py``), in release mode: jobs on the same node
+share local copies, and the last job using a local copy removes it when it exits.
+
+If the copy fails, *e.g.* for lack of space, the variable is left pointing at the original input.
+
+The staging directory should be node-local and shared by all jobs on the node. Do not use per-job temporary
+directories, such as the ``$TMPDIR`` created by SGE, if local copies are to be shared.
+
+:Authors: Menachem Sklarz
+:Affiliation: Bioinformatics core facility
+:Organization: National Institute of Biotechnology in the Negev, Ben Gurion University.
+"""
+
+import os
+
+from neatseq_flow_modules.utilities.db_staging import get_db_stage_functions
+
+__author__ = "Menachem Sklarz"
+__version__ = "1.6.1"
+
+
+# Default location for local copies, if the stage directory parameter is passed without a value
+INPUT_STAGE_DEFAULT_DIR = "/tmp/neatseq_flow_inputs"
+# Kinds of inputs:
+#   dir:        Directory of files (e.g. STAR genome dir). The variable is set to the local directory
+#   prefix:     Prefix shared by the input files (e.g. bwa and bowtie2 indices)
+#   reference:  Reference fasta, with .fai and .dict
+#   bam:        BAM file, with .bai
+INPUT_STAGE_KINDS = ["dir", "prefix", "reference", "bam"]
+
+
+def get_input_stage_dir(params, param_name="stage_inputs"):
+    """ Return the staging directory defined in step parameter 'param_name', or None if staging was not requested
+    """
+
+    if param_name not in params:
+        return None
+    return params[param_name] if params[param_name] else INPUT_STAGE_DEFAULT_DIR
+
+
+def get_input_stage_files(path, kind):
+    """ Return shell command listing the files of input 'path'
+    """
+
+    path = path.rstrip("/")
+    if kind == "dir":
+        return "find -L {path} -mindepth 1 -maxdepth 1 -type f".format(path=path)
+    if kind == "prefix":
+        return "ls -d {path}*".format(path=path)
+    if kind == "reference":
+        files = [path, path + ".fai", os.path.splitext(path)[0] + ".dict"]
+    elif kind == "bam":
+        files = [path, path + ".bai", os.path.splitext(path)[0] + ".bai"]
+    else:
+        raise ValueError("Unknown input kind {kind}. Must be one of {kinds}".format(kind=kind,
+                                                                                  kinds=", ".join(INPUT_STAGE_KINDS)))
+    return "ls -d {files}".format(files=" ".join(files))
+
+
+def get_input_stage_script(inputs, stage_dir, streams=None):
+    """ Return script part setting shell variables to node-local copies of the inputs.
+        Local copies are released when the script exits. An existing EXIT trap is kept, and runs before the release.
+        :param inputs: List of (variable, path, kind) tuples. 'kind' is one of INPUT_STAGE_KINDS
+        :param stage_dir: Directory in which to create the local copies. May contain shell variables.
+        :param streams: Number of parallel copy streams
+    """
+
+    script = get_db_stage_functions(streams)
+    for variable, path, kind in inputs:
+        script += """\
+db_stage {stage_dir} {variable} {path} {kind} release $({files} 2> /dev/null)
+{variable}=$db_stage_path
+""".format(stage_dir=stage_dir.rstrip("/"),
+           variable=variable,
+           path=path.rstrip("/"),
+           kind=kind if kind == "dir" else "prefix",
+           files=get_input_stage_files(path, kind))
+
+    return script + "\n"
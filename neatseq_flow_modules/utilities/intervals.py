@@ -0,0 +1,181 @@
+# -*- coding: UTF-8 -*-
+"""
+Size-balanced scatter intervals over a reference genome.
+
+Used by modules which scatter their work over genomic intervals (see ``scatter`` parameter in ``GATK_gvcf``).
+
+The reference contigs are read from the fasta index (``.fai``) or, if missing, from the sequence dictionary (``.dict``).
+Contigs longer than the shard size are split into roughly equal pieces, optionally at runs of N's. Contigs shorter than
+the shard size are packed together. Pieces are packed in reference order, so concatenating per-shard results in shard
+order produces reference-ordered output.
+
+:Authors: Menachem Sklarz
+:Affiliation: Bioinformatics core facility
+:Organization: National Institute of Biotechnology in the Negev, Ben Gurion University.
+"""
+
+import os
+import re
+import math
+from neatseq_flow.PLC_step import AssertionExcept
+
+__author__ = "Menachem Sklarz"
+__version__ = "1.6.0"
+
+
+def read_reference_contigs(reference):
+    """ Return list of (contig, length) tuples, in reference order.
+        Reads the fasta index if it exists, otherwise the picard sequence dictionary.
+    """
+
+    if os.path.isfile(reference + ".fai"):
+        with open(reference + ".fai", "r") as fai_fh:
+            return [(line.split("\t")[0], int(line.split("\t")[1]))
+                    for line in fai_fh
+                    if line.strip()]
+
+    dict_file = re.sub(r"\.(fa|fasta|fna)(\.gz)?$", "", reference) + ".dict"
+    if os.path.isfile(dict_file):
+        contigs = list()
+        with open(dict_file, "r") as dict_fh:
+            for line in dict_fh:
+                if line.startswith("@SQ"):
+                    fields = dict(field.split(":", 1) for field in line.rstrip("\n").split("\t")[1:] if ":" in field)
+                    contigs.append((fields["SN"], int(fields["LN"])))
+        return contigs
+
+    raise AssertionExcept("No .fai or .dict found for reference {ref}. "
+                          "Please index it with 'samtools faidx'".format(ref=reference))
+
+
+def find_gaps(reference, min_gap=1000):
+    """ Return dict of contig: list of (start, end) of runs of N's of at least 'min_gap' bases (0-based, half-open).
+        Reads the whole fasta file once.
+    """
+
+    gaps = dict()
+    contig = None
+    pos = 0
+    gap_start = None
+
+    def close_gap(end):
+        if gap_start is not None and end - gap_start >= min_gap:
+            gaps.setdefault(contig, []).append((gap_start, end))
+
+    with open(reference, "r") as fasta_fh:
+        for line in fasta_fh:
+            if line.startswith(">"):
+                close_gap(pos)
+                contig = line[1:].split()[0]
+                pos = 0
+                gap_start = None
+                continue
+            line = line.rstrip()
+            for match in re.finditer(r"[Nn]+|[^Nn]+", line):
+                if match.group(0)[0] in "Nn":
+                    if gap_start is None:
+                        gap_start = pos + match.start()
+                else:
+                    close_gap(pos + match.start())
+                    gap_start = None
+            pos += len(line)
+        close_gap(pos)
+
+    return gaps
+
+
+def split_contig(contig, length, shard_size, gaps=None):
+    """ Split a contig into pieces of approximately 'shard_size' bases.
+        If gaps are given, split points are moved to the middle of a nearby gap.
+        Returns list of (contig, start, end), 1-based, inclusive.
+    """
+
+    piece_num = int(math.ceil(float(length) / shard_size))
+    piece_size = float(length) / piece_num
+    breaks = [int(round(ind * piece_size)) for ind in range(1, piece_num)]
+
+    if gaps:
+        gap_middles = [(start + end) // 2 for start, end in gaps]
+        for ind, breakpoint in enumerate(breaks):
+            nearest = min(gap_middles, key=lambda middle: abs(middle - breakpoint))
+            if abs(nearest - breakpoint) < piece_size / 4:
+                breaks[ind] = nearest
+        breaks = sorted(set(breaks))
+
+    bounds = [0] + breaks + [length]
+    return [(contig, bounds[ind] + 1, bounds[ind + 1]) for ind in range(len(bounds) - 1)]
+
+
+def get_scatter_intervals(reference, shard_num, min_gap=None):
+    """ Divide the reference into approximately 'shard_num' shards of similar size.
+        Returns list of shards. Each shard is a list of (contig, start, end) tuples, 1-based, inclusive.
+        :param min_gap: If set, split large contigs at runs of N's of at least this length.
+    """
+
+    contigs = read_reference_contigs(reference)
+    shard_size = int(math.ceil(float(sum([length for contig, length in contigs])) / int(shard_num)))
+    gaps = find_gaps(reference, int(min_gap)) if min_gap else dict()
+
+    pieces = list()
+    for contig, length in contigs:
+        if length > shard_size:
+            pieces.extend(split_contig(contig, length, shard_size, gaps.get(contig)))
+        else:
+            pieces.append((contig, 1, length))
+
+    # Packing pieces in reference order
+    shards = list()
+    current, current_size = list(), 0
+    for piece in pieces:
+        piece_size = piece[2] - piece[1] + 1
+        if current and current_size + piece_size > shard_size:
+            shards.append(current)
+            current, current_size = list(), 0
+        current.append(piece)
+        current_size += piece_size
+    if current:
+        # A small remainder is added to the previous shard rather than getting a shard of it's own
+        if shards and current_size < shard_size / 2:
+            shards[-1].extend(current)
+        else:
+            shards.append(current)
+
+    return shards
+
+
+def write_scatter_intervals(shards, out_dir, interval_format="gatk"):
+    """ Write an interval file per shard into 'out_dir'.
+        Returns list of [shard_name, interval_file] pairs, in reference order.
+        :param interval_format: 'gatk' for 'contig:start-end' lines, 'bed' for 0-based BED files.
+    """
+
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+
+    width = len(str(len(shards)))
+    intervals = list()
+    for ind, shard in enumerate(shards):
+        shard_name = "shard{ind:0{width}d}".format(ind=ind + 1, width=width)
+        ext = "bed" if interval_format == "bed" else "intervals"
+        interval_file = os.path.join(out_dir, "{name}.{ext}".format(name=shard_name, ext=ext))
+        with open(interval_file, "w") as interval_fh:
+            for contig, start, end in shard:
+                if interval_format == "bed":
+                    interval_fh.write("{contig}\t{start}\t{end}\n".format(contig=contig, start=start - 1, end=end))
+                else:
+                    interval_fh.write("{contig}:{start}-{end}\n".format(contig=contig, start=start, end=end))
+        intervals.append([shard_name, interval_file])
+
+    return intervals
+
+
+def get_region_list(params, sample_data):
+    """ Return list of (region name, value for -L) pairs for steps working per chromosome or per shard.
+        Uses 'chrom_list' if passed. Otherwise, uses the scatter intervals stored by an upstream step.
+    """
+
+    if "chrom_list" in params:
+        return [(chrom.strip(), chrom.strip()) for chrom in params["chrom_list"].split(",")]
+    if "scatter_intervals" in sample_data["project_data"]:
+        return [(name, interval_file) for name, interval_file in sample_data["project_data"]["scatter_intervals"]]
+    raise AssertionExcept("Please pass 'chrom_list' or set 'scatter' in an upstream step")
@@ -0,0 +1,322 @@
+# -*- coding: UTF-8 -*-
+"""
+Resource recommendations from recorded step metrics.
+
+Fits simple per-module models of the resources used by commands, as recorded with ``telemetry`` (see
+``telemetry.py``), against the size of their inputs, and recommends ``-pe``, ``h_vmem`` and thread values from them.
+
+For each module, peak memory (of the whole process tree), wall time and CPU time are fitted with least-squares lines
+against the total size of the command's input files. Only successful commands are used. To avoid under-provisioning,
+recommendations add the largest observed excess over the line, and a relative headroom (default 20%), to the fitted
+value. The number of threads is the median CPU usage (CPU time / wall time) of the recorded commands, rounded up.
+``h_vmem`` is set per slot, *i.e.* the recommended memory divided by the number of threads.
+
+The script has three commands:
+
+* ``fit``: Fit models for all modules in the metrics files and write them to a JSON file::
+
+    python resources.py fit --output resource_models.json <project dir>/data
+
+* ``recommend``: Print recommended ``qsub_params`` and threads, for a module and input size::
+
+    python resources.py recommend --models resource_models.json --step STAR_mapper --inputs sample1_R1.fq.gz sample1_R2.fq.gz
+
+* ``benchmark``: Run a synthetic workload on inputs of increasing size, fit models on the smaller inputs and test the
+  recommendations for the largest ones.
+
+Modules apply the recommendations at build time when ``resource_models`` is set to a models file, by calling
+``get_resource_models()`` once and ``set_recommended_resources()`` before building each script. If the inputs do not
+exist yet at build time, *e.g.* they are created by upstream steps, the largest input size recorded for the module is
+used.
+
+:Authors: Menachem Sklarz
+:Affiliation: Bioinformatics core facility
+:Organization: National Institute of Biotechnology in the Negev, Ben Gurion University.
+"""
+
+import os
+import re
+import sys
+import json
+import math
+import argparse
+
+__author__ = "Menachem Sklarz"
+__version__ = "1.6.0"
+
+
+RESOURCE_SCRIPT = os.path.realpath(__file__)
+# Relative headroom added to recommended memory and time
+RESOURCE_HEADROOM = 0.2
+# Metrics modelled against input size: model name: metrics field
+RESOURCE_METRICS = {"memory": "peak_tree_rss",
+                    "wall_time": "wall_time",
+                    "cpu_time": "cpu_time"}
+
+
+def fit_line(x, y):
+    """ Least-squares fit of y = intercept + slope * x.
+        Resources are assumed not to decrease with input size, so negative slopes are replaced by a flat line.
+        'excess' is the largest amount by which an observation exceeds the line.
+    """
+
+    mean_x = float(sum(x)) / len(x)
+    mean_y = float(sum(y)) / len(y)
+    var_x = sum((xi - mean_x) ** 2 for xi in x)
+    slope = sum((xi - mean_x) * (yi - mean_y) for xi, yi in zip(x, y)) / var_x if var_x else 0.0
+    if slope < 0:
+        slope = 0.0
+    intercept = mean_y - slope * mean_x
+    excess = max([0.0] + [yi - (intercept + slope * xi) for xi, yi in zip(x, y)])
+    return {"intercept": intercept, "slope": slope, "excess": excess}
+
+
+def fit_models(records):
+    """ Return dict of models per module ('step' field of the records), fitted on the successful records
+    """
+
+    modules = dict()
+    for record in records:
+        if record["exit_status"] == 0:
+            modules.setdefault(record["step"], list()).append(record)
+
+    models = dict()
+    for module, module_records in sorted(modules.items()):
+        inputs = [record.get("input_bytes", 0) for record in module_records]
+        model = {"records": len(module_records),
+                 "input_bytes": [min(inputs), max(inputs)]}
+        for name, field in RESOURCE_METRICS.items():
+            model[name] = fit_line(inputs, [record.get(field, 0) for record in module_records])
+        cpus = sorted(float(record["cpu_time"]) / record["wall_time"]
+                      for record in module_records if record["wall_time"] > 0)
+        model["threads"] = max(1, int(math.ceil(cpus[len(cpus) // 2]))) if cpus else 1
+        models[module] = model
+    return models
+
+
+def predict(line, input_bytes, headroom=RESOURCE_HEADROOM):
+    return (line["intercept"] + line["slope"] * input_bytes + line["excess"]) * (1 + headroom)
+
+
+def get_recommendation(model, input_bytes=None, headroom=RESOURCE_HEADROOM, max_threads=None):
+    """ Return dict of recommended threads, memory (bytes), h_vmem (bytes per thread) and wall time (seconds).
+        If 'input_bytes' is None, the recommendation is for the largest input recorded for the module.
+    """
+
+    if input_bytes is None:
+        input_bytes = model["input_bytes"][1]
+    threads = min(model["threads"], max_threads) if max_threads else model["threads"]
+    memory = predict(model["memory"], input_bytes, headroom)
+    return {"input_bytes": input_bytes,
+            "threads": threads,
+            "memory": int(memory),
+            "h_vmem": int(math.ceil(memory / threads)),
+            "wall_time": int(math.ceil(predict(model["wall_time"], input_bytes, headroom)))}
+
+
+def format_memory(value):
+    """ Format bytes for qsub, rounding up to whole megabytes or gigabytes
+    """
+
+    if value >= 1024 ** 3:
+        return "{size}G".format(size=int(math.ceil(float(value) / 1024 ** 3)))
+    return "{size}M".format(size=max(1, int(math.ceil(float(value) / 1024 ** 2))))
+
+
+def get_existing_input_bytes(files):
+    """ Return the total size of the files, or None if none of them exist
+    """
+
+    sizes = [os.path.getsize(filename) for filename in files if os.path.isfile(filename)]
+    return sum(sizes) if sizes else None
+
+
+def get_qsub_params(recommendation, qsub_params=None):
+    """ Return a copy of 'qsub_params' with -pe and h_vmem set to the recommended values.
+        The parallel environment name of an existing -pe is kept. Other -l resources are kept.
+    """
+
+    qsub_params = dict(qsub_params) if qsub_params else dict()
+    pe_name = qsub_params["-pe"].split()[0] if qsub_params.get("-pe") else "shared"
+    qsub_params["-pe"] = "{pe} {threads}".format(pe=pe_name, threads=recommendation["threads"])
+    h_vmem = "h_vmem=" + format_memory(recommendation["h_vmem"])
+    resources = [resource for resource in re.split(r"\s*,\s*", str(qsub_params.get("-l") or ""))
+                 if resource and not resource.startswith("h_vmem=")]
+    qsub_params["-l"] = ",".join(resources + [h_vmem])
+    return qsub_params
+
+
+#### Build time functions
+
+def get_resource_models(params):
+    """ Return the models in the file passed in the 'resource_models' parameter, or None if not passed
+    """
+
+    if "resource_models" not in params:
+        return None
+    from neatseq_flow.PLC_step import AssertionExcept
+    if not params["resource_models"] or not os.path.isfile(params["resource_models"]):
+        raise AssertionExcept("'resource_models' must be set to a models file created with 'resources.py fit'")
+    with open(params["resource_models"], "r") as models_fh:
+        return json.load(models_fh)
+
+
+def set_recommended_resources(params, models, module, inputs, threads_param=None):
+    """ Set -pe and h_vmem in params["qsub_params"], and the threads parameter in params["redir_params"], to the
+        values recommended for 'module' with the given input files.
+        Does nothing if 'models' is None or has no model for the module. Returns the recommendation, or None.
+        Optional parameters: 'resource_headroom' (fraction) and 'resource_max_threads'.
+    """
+
+    if not models or module not in models:
+        return None
+    recommendation = get_recommendation(models[module],
+                                        input_bytes=get_existing_input_bytes(inputs),
+                                        headroom=float(params.get("resource_headroom") or RESOURCE_HEADROOM),
+                                        max_threads=params.get("resource_max_threads"))
+    params.setdefault("qsub_params", dict()).update(get_qsub_params(recommendation, params.get("qsub_params")))
+    if threads_param:
+        params["redir_params"][threads_param] = recommendation["threads"]
+    return recommendation
+
+
+#### Benchmark
+
+# Synthetic workload: holds two copies of the input in memory and hashes it. Memory and CPU grow with input size
+BENCHMARK_WORKLOAD = """{python} -c "
+import sys, hashlib
+data = open(sys.argv[1], 'rb').read()
+copy = bytearray(data)
+for i in range(4):
+    hashlib.sha256(data + bytes(i)).hexdigest()
+" {input}"""
+
+
+def write_synthetic_input(filename, size):
+    chunk = os.urandom(1024 * 1024)
+    with open(filename, "wb") as out_fh:
+        for i in range(size // len(chunk)):
+            out_fh.write(chunk)
+        out_fh.write(chunk[:size % len(chunk)])
+
+
+def run_benchmark(directory, sizes, holdout, repeats, headroom):
+    """ Run the workload on synthetic inputs, fit models on all but the 'holdout' largest sizes, and compare the
+        recommendations for the held out sizes to the observed usage. Returns list of result rows.
+        The workload is run with the telemetry wrapper, as in step scripts.
+    """
+
+    import subprocess
+    from telemetry import TELEMETRY_SCRIPT, read_records
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    metrics_file = os.path.join(directory, "benchmark.metrics.jsonl")
+    if os.path.exists(metrics_file):
+        os.remove(metrics_file)
+    for size in sizes:
+        input_file = os.path.join(directory, "input_{size}.bin".format(size=size))
+        write_synthetic_input(input_file, size)
+        for repeat in range(repeats):
+            proc = subprocess.Popen([sys.executable, TELEMETRY_SCRIPT, "run",
+                                     "--metrics", metrics_file,
+                                     "--step", "benchmark",
+                                     "--name", "replay",
+                                     "--sample", str(size),
+                                     "--label", str(repeat),
+                                     "--interval", "0.05",
+                                     "--inputs", input_file],
+                                    stdin=subprocess.PIPE)
+            proc.communicate(BENCHMARK_WORKLOAD.format(python=sys.executable, input=input_file).encode())
+            if proc.returncode:
+                sys.exit("Benchmark workload failed on input of {size} bytes".format(size=size))
+        os.remove(input_file)
+
+    records = read_records([metrics_file], all_runs=True)
+    train_sizes = sorted(sizes)[:-holdout]
+    models = fit_models([record for record in records if record["input_bytes"] in train_sizes])
+    results = list()
+    for record in records:
+        recommendation = get_recommendation(models["benchmark"], record["input_bytes"], headroom)
+        results.append({"input_bytes": record["input_bytes"],
+                        "set": "train" if record["input_bytes"] in train_sizes else "holdout",
+                        "observed_memory": record["peak_tree_rss"],
+                        "recommended_memory": recommendation["memory"],
+                        "memory_error": round(float(recommendation["memory"]) / record["peak_tree_rss"] - 1, 3),
+                        "observed_wall_time": record["wall_time"],
+                        "recommended_wall_time": recommendation["wall_time"],
+                        "covered": int(recommendation["memory"] >= record["peak_tree_rss"] and
+                                       recommendation["wall_time"] >= record["wall_time"])})
+    return results
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Resource recommendations from recorded step metrics")
+    subparsers = parser.add_subparsers(dest="command")
+    fit_parser = subparsers.add_parser("fit", help="Fit per-module resource models")
+    fit_parser.add_argument("--output", required=True, help="JSON file to write the models to")
+    fit_parser.add_argument("paths", nargs="+", help="Metrics files, or directories to search for them")
+    recommend_parser = subparsers.add_parser("recommend", help="Print recommended resources")
+    recommend_parser.add_argument("--models", required=True, help="JSON file created by 'fit'")
+    recommend_parser.add_argument("--step", action="append", help="Module. Default: all modules in the models file")
+    recommend_parser.add_argument("--input-bytes", type=int, help="Input size. Default: largest recorded input")
+    recommend_parser.add_argument("--inputs", nargs="+", default=list(), help="Input files, instead of --input-bytes")
+    recommend_parser.add_argument("--headroom", type=float, default=RESOURCE_HEADROOM)
+    recommend_parser.add_argument("--max-threads", type=int)
+    recommend_parser.add_argument("--pe", default="shared", help="Parallel environment name")
+    benchmark_parser = subparsers.add_parser("benchmark", help="Validate the models on a synthetic workload")
+    benchmark_parser.add_argument("--dir", required=True, help="Directory for synthetic inputs and metrics")
+    benchmark_parser.add_argument("--sizes", default="8,16,32,48,64,96,128",
+                                  help="Comma-separated input sizes, in megabytes")
+    benchmark_parser.add_argument("--holdout", type=int, default=2,
+                                  help="Number of largest sizes to hold out of the fit")
+    benchmark_parser.add_argument("--repeats", type=int, default=2)
+    benchmark_parser.add_argument("--headroom", type=float, default=RESOURCE_HEADROOM)
+    args = parser.parse_args()
+
+    if args.command == "fit":
+        from telemetry import find_metrics_files, read_records
+        models = fit_models(read_records(find_metrics_files(args.paths)))
+        with open(args.output, "w") as out_fh:
+            json.dump(models, out_fh, indent=4, sort_keys=True)
+    elif args.command == "recommend":
+        with open(args.models, "r") as models_fh:
+            models = json.load(models_fh)
+        input_bytes = get_existing_input_bytes(args.inputs) if args.inputs else args.input_bytes
+        for module in args.step or sorted(models):
+            if module not in models:
+                sys.exit("No model for {module} in {models}".format(module=module, models=args.models))
+            recommendation = get_recommendation(models[module], input_bytes, args.headroom, args.max_threads)
+            qsub_params = get_qsub_params(recommendation, {"-pe": args.pe})
+            sys.stdout.write("""\
+# {module}: {input_bytes} input bytes, {memory} memory, {wall_time} seconds ({records} recorded commands)
+qsub_params:
+    -pe: {pe}
+    -l: {l}
+threads: {threads}
+
+""".format(module=module,
+           input_bytes=recommendation["input_bytes"],
+           memory=format_memory(recommendation["memory"]),
+           wall_time=recommendation["wall_time"],
+           records=models[module]["records"],
+           pe=qsub_params["-pe"],
+           l=qsub_params["-l"],
+           threads=recommendation["threads"]))
+    elif args.command == "benchmark":
+        sizes = [int(float(size) * 1024 ** 2) for size in args.sizes.split(",")]
+        if not 0 < args.holdout < len(set(sizes)) - 1:
+            sys.exit("--holdout must leave at least two sizes for fitting")
+        results = run_benchmark(args.dir, sizes, args.holdout, args.repeats, args.headroom)
+        columns = ["set", "input_bytes", "observed_memory", "recommended_memory", "memory_error",
+                   "observed_wall_time", "recommended_wall_time", "covered"]
+        sys.stdout.write("\t".join(columns) + "\n")
+        for row in results:
+            sys.stdout.write("\t".join([str(row[column]) for column in columns]) + "\n")
+        holdout = [row for row in results if row["set"] == "holdout"]
+        sys.stdout.write("# Held out commands covered by recommendation: {covered}/{total}\n".
+                         format(covered=sum(row["covered"] for row in holdout), total=len(holdout)))
+    else:
+        parser.print_help()
+        sys.exit(1)
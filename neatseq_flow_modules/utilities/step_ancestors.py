@@ -0,0 +1,86 @@
+# -*- coding: UTF-8 -*-
+"""
+Cached resolution of the ancestors of a step.
+
+The ancestors of a step are all the steps reachable through ``base_step_list``. On workflows with diamond-shaped
+dependencies, a recursive walk visits shared ancestors once for every path leading to them. Here, the ancestors of
+each step are computed once, in topological order, from the already computed ancestors of its base steps, and
+cached for the rest of the build.
+
+Used by the ``Generic`` and ``Multiqc`` modules.
+
+:Authors: Menachem Sklarz
+:Affiliation: Bioinformatics core facility
+:Organization: National Institute of Biotechnology in the Negev, Ben Gurion University.
+"""
+
+__author__ = "Menachem Sklarz"
+__version__ = "1.6.0"
+
+# id(step): (step, ids of base steps, ancestors dict)
+# The step is kept in the cache so that it's id is not reused by another object.
+_ancestors_cache = dict()
+
+
+def _get_base_steps(step):
+    return step.base_step_list if step.base_step_list else []
+
+
+def _is_cached(step):
+    """ Check that step has a cache entry, computed with the current base steps
+    """
+
+    entry = _ancestors_cache.get(id(step))
+    return entry is not None and entry[1] == tuple(id(base_step) for base_step in _get_base_steps(step))
+
+
+def _topological_order(step):
+    """ Return the uncached ancestors of step, and step itself, with every step following all of it's base steps.
+        Iterative depth first search.
+    """
+
+    order = list()
+    visited = set()
+    stack = [(step, False)]
+    while stack:
+        current, expanded = stack.pop()
+        if expanded:
+            order.append(current)
+            continue
+        if id(current) in visited or _is_cached(current):
+            continue
+        visited.add(id(current))
+        stack.append((current, True))
+        for base_step in _get_base_steps(current):
+            if id(base_step) not in visited:
+                stack.append((base_step, False))
+    return order
+
+
+def get_ancestors(step):
+    """ Return dict of step name: step for all ancestors of 'step'.
+        The dict is shared by the cache. Do not modify it.
+    """
+
+    for current in _topological_order(step):
+        ancestors = dict()
+        for base_step in _get_base_steps(current):
+            ancestors.update(_ancestors_cache[id(base_step)][2])
+            ancestors[base_step.name] = base_step
+        _ancestors_cache[id(current)] = (current,
+                                         tuple(id(base_step) for base_step in _get_base_steps(current)),
+                                         ancestors)
+    return _ancestors_cache[id(step)][2]
+
+
+def get_ancestor_base_dirs(step):
+    """ Return list of base dirs of all ancestors of 'step', without duplicates
+    """
+
+    base_dirs = list()
+    seen = set()
+    for ancestor in get_ancestors(step).values():
+        if ancestor.base_dir not in seen:
+            seen.add(ancestor.base_dir)
+            base_dirs.append(ancestor.base_dir)
+    return base_dirs
@@ -0,0 +1,141 @@
+# -*- coding: UTF-8 -*-
+"""
+Skipping of unchanged step scripts on re-execution.
+
+Modules can pass the script of a sample (or project) to ``get_step_cache_script()`` just before calling
+``create_low_level_script()``. The script is wrapped in a test which compares a cache key with the key recorded by the
+last successful execution. If the keys match, and the outputs exist, the script does nothing. Otherwise, the original
+script is executed and, if it succeeds, the new key is recorded in a hidden file beside the outputs.
+
+The key is built from:
+
+* An md5 digest of the script text and the module name and version, computed when the scripts are built. Changing a
+  parameter of a step changes the script text of that step only.
+* The names, sizes and modification times of the input files, or, with ``step_cache: content``, the md5 sums of their
+  contents. Directories are replaced by the files they contain.
+
+The input fingerprints are computed when the script is executed, not when it is built, since inputs are usually
+created by upstream steps of the same workflow execution. An upstream step which is re-executed produces inputs with
+new modification times, and its downstream steps are executed as well. With ``content`` hashing, downstream steps are
+skipped if the re-executed step produced identical files, at the cost of reading all inputs.
+
+Changing a parameter of one step therefore re-executes only that step and the steps downstream of it, provided that
+every step upstream of it supports the step cache. Modules supporting it: ``Import``, ``bwa_mapper``,
+``bowtie2_mapper``, ``STAR_mapper`` (not with ``batch_size``), ``samtools``, ``htseq_count``, ``RSEM_mapper``,
+``RSEM``, ``GATK_gvcf`` and ``DeSeq2``. Steps of other modules are always executed. Set ``content`` in the steps
+following them.
+
+.. Note:: Success is judged by the exit status of every command and pipeline in the script (with ``pipefail``), not
+    only the last one, and by the existence of the outputs passed to ``get_step_cache_script()``. A script in which a
+    command fails exits with status 1. A script containing a failing command whose failure is tolerated, *e.g.*
+    ``grep`` finding nothing, therefore fails too. Remove the ``.step_cache`` file to force re-execution.
+
+:Authors: Menachem Sklarz
+:Affiliation: Bioinformatics core facility
+:Organization: National Institute of Biotechnology in the Negev, Ben Gurion University.
+"""
+
+import os
+import hashlib
+
+__author__ = "Menachem Sklarz"
+__version__ = "1.6.1"
+
+
+# Suffix of the files storing the keys of the last successful execution
+STEP_CACHE_SUFFIX = ".step_cache"
+# Ways of fingerprinting input files:
+#   stat:       File name, size and modification time (default)
+#   content:    md5 sum of the file contents
+STEP_CACHE_MODES = ["stat", "content"]
+
+
+def get_step_cache_mode(params, param_name="step_cache"):
+    """ Return the fingerprinting mode defined in step parameter 'param_name', or None if caching was not requested
+    """
+
+    if param_name not in params:
+        return None
+    mode = params[param_name] if params[param_name] else "stat"
+    if mode not in STEP_CACHE_MODES:
+        from neatseq_flow.PLC_step import AssertionExcept
+        raise AssertionExcept("'{param}' must be empty or one of: {modes}".format(param=param_name,
+                                                                               modes=", ".join(STEP_CACHE_MODES)))
+    return mode
+
+
+def get_step_cache_file(out_dir, spec_script_name):
+    """ Return path of the file storing the key of script 'spec_script_name'
+    """
+
+    return os.path.join(out_dir, "." + spec_script_name + STEP_CACHE_SUFFIX)
+
+
+def get_redirect_files(params):
+    """ Return redirected parameter values which are existing files, e.g. design or annotation files.
+        These are inputs of the step which are not found in sample_data
+    """
+
+    files = list()
+    for value in params.get("redir_params", {}).values():
+        if isinstance(value, str) and os.path.isfile(value):
+            files.append(value)
+    return files
+
+
+def get_step_cache_script(command, mode, cache_file, module, version, inputs, outputs=()):
+    """ Return 'command' wrapped in a test skipping it if its key matches the key of the last successful execution.
+        If 'mode' is None, 'command' is returned unchanged.
+        :param command: The script to wrap. Should contain everything the script does, including local_finish() lines
+        :param mode: One of STEP_CACHE_MODES
+        :param cache_file: File in which to record the key. See get_step_cache_file()
+        :param module: Name of the module
+        :param version: Version of the module
+        :param inputs: List of input files and directories. URLs are ignored
+        :param outputs: List of files which must exist for the script to be skipped or its key recorded
+    """
+
+    if not mode:
+        return command
+
+    digest = hashlib.md5("\n".join([module, version, command]).encode("utf-8")).hexdigest()
+    inputs = sorted(set(path.rstrip("/") for path in inputs if path and "://" not in path))
+    if mode == "content":
+        fingerprint = "md5sum $step_cache_input"
+    else:
+        fingerprint = 'stat -L -c "%n %s %Y" $step_cache_input'
+    outputs_test = " && ls -d {outputs} > /dev/null 2>&1".format(outputs=" ".join(outputs)) if outputs else ""
+
+    return """\
+# Step cache: Skipping if the script, the inputs and the module version did not change since the last successful run
+step_cache_file={cache_file}
+step_cache_key=$( {{ echo {digest}; for step_cache_input in $(find -L {inputs} -type f 2> /dev/null | sort); do {fingerprint}; done; }} | md5sum | cut -d" " -f1)
+if [ "$(cat $step_cache_file 2> /dev/null)" = "$step_cache_key" ]{outputs_test}; then
+    echo "Outputs are up to date (step cache key $step_cache_key). Skipping"
+else
+rm -f $step_cache_file
+# Record the failure of any command or pipeline, since the last command is usually copying or stamping the outputs
+step_cache_status=0
+step_cache_pipefail=$(shopt -po pipefail || true)
+step_cache_err_trap=$(trap -p ERR)
+set -o pipefail
+trap 'step_cache_status=1' ERR
+
+{command}
+
+trap - ERR
+eval "$step_cache_err_trap"
+eval "$step_cache_pipefail"
+if [ $step_cache_status -eq 0 ]{outputs_test}; then
+    echo $step_cache_key > $step_cache_file
+elif [ $step_cache_status -ne 0 ]; then
+    exit 1
+fi
+fi
+
+""".format(cache_file=cache_file,
+           digest=digest,
+           inputs=" ".join(inputs) if inputs else "/dev/null",
+           fingerprint=fingerprint,
+           outputs_test=outputs_test,
+           command=command.rstrip("\n"))
@@ -0,0 +1,344 @@
+# -*- coding: UTF-8 -*-
+"""
+Resource telemetry for commands in low-level scripts.
+
+Modules call ``get_telemetry_file()`` once, in ``step_specific_init()``, and wrap their main commands, *e.g.* the
+output of ``get_script_const()`` with the arguments added to it, with ``get_telemetry_script()``. Steps without a
+``telemetry`` parameter are not affected: ``get_telemetry_script()`` returns the command as is.
+
+At run time, the command is executed by this script (``python telemetry.py run``), in a child ``bash``, and the
+following are appended, as a single JSON line, to the step metrics file:
+
+* ``wall_time``, ``user_time``, ``system_time`` and ``cpu_time`` (seconds)
+* ``max_rss``: Peak resident memory of the largest process (bytes)
+* ``peak_tree_rss``: Peak total resident memory of all processes of the command, sampled from ``/proc`` (bytes)
+* ``read_bytes`` and ``write_bytes``: Block I/O of the command (bytes)
+* ``input_bytes``: Total size of the command's declared input files (bytes)
+* ``exit_status``
+* ``step``, ``name``, ``sample``, ``label``, ``host`` and ``start``, identifying the command
+
+Shell variables used in the command are exported before running it. The exit status of the wrapper is the exit status
+of the command.
+
+The metrics files of all steps are summarized with ``python telemetry.py collect``, which writes a per-step,
+per-sample resource report and, optionally, a per-step summary::
+
+    python telemetry.py collect --output resources.tsv --summary resources.summary.tsv <project dir>/data
+
+:Authors: Menachem Sklarz
+:Affiliation: Bioinformatics core facility
+:Organization: National Institute of Biotechnology in the Negev, Ben Gurion University.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import socket
+import argparse
+import datetime
+import subprocess
+
+__author__ = "Menachem Sklarz"
+__version__ = "1.6.0"
+
+
+TELEMETRY_SCRIPT = os.path.realpath(__file__)
+# Suffix of step metrics files. Used by the collector to find them
+TELEMETRY_SUFFIX = ".metrics.jsonl"
+# Delimiter of the here-document passing the command to the wrapper
+TELEMETRY_DELIMITER = "NSF_TELEMETRY_COMMAND"
+# Interval for sampling memory usage of running commands (seconds)
+TELEMETRY_INTERVAL = 1.0
+
+
+def get_telemetry_file(params, base_dir, step, name):
+    """ Return the metrics file for the step, or None if telemetry was not requested.
+        The file is in the directory passed in the 'telemetry' parameter or, if empty, in the step directory.
+    """
+
+    if "telemetry" not in params:
+        return None
+    telemetry_dir = params["telemetry"] if params["telemetry"] else base_dir
+    if not os.path.isdir(telemetry_dir):
+        os.makedirs(telemetry_dir)
+    return os.path.join(telemetry_dir, ".".join([step, name]) + TELEMETRY_SUFFIX)
+
+
+def get_telemetry_script(command, metrics_file, step, name, sample, label="", inputs=()):
+    """ Return 'command' wrapped for recording its resource usage in 'metrics_file'.
+        If 'metrics_file' is None, 'command' is returned unchanged.
+        :param command: The command text, as it would be written to the script
+        :param sample: Sample name, or 'project_data'
+        :param label: Distinguishes between commands of the same sample (e.g. read direction or chromosome)
+        :param inputs: Input files, whose total size is recorded
+    """
+
+    if not metrics_file:
+        return command
+
+    script = "\n# Recording resource usage of the following command in {file}\n".format(file=metrics_file)
+    # The command runs in a child shell. Variables set earlier in the script must be exported
+    variables = sorted(set(re.findall(r"\$\{?([A-Za-z_][A-Za-z0-9_]*)", command)))
+    if variables:
+        script += "export {variables} 2> /dev/null\n".format(variables=" ".join(variables))
+    script += """\
+python {path} run \\
+\t--metrics {file} \\
+\t--step {step} \\
+\t--name {name} \\
+\t--sample {sample} \\
+""".format(path=TELEMETRY_SCRIPT,
+           file=metrics_file,
+           step=step,
+           name=name,
+           sample=sample)
+    if label:
+        script += "\t--label {label} \\\n".format(label=label)
+    if inputs:
+        script += "\t--inputs {inputs} \\\n".format(inputs=" ".join(inputs))
+    script += """\
+\t<<'{delimiter}'
+{command}
+{delimiter}
+
+""".format(delimiter=TELEMETRY_DELIMITER,
+           command=command.rstrip(" \t\n\\"))
+
+    return script
+
+
+#### Run time functions
+
+def get_process_tree_rss(root_pid):
+    """ Return the total resident memory (bytes) of process 'root_pid' and its descendants, read from /proc
+    """
+
+    children = dict()
+    rss = dict()
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    try:
+        pids = [pid for pid in os.listdir("/proc") if pid.isdigit()]
+    except OSError:
+        return 0
+    for pid in pids:
+        try:
+            with open("/proc/{pid}/stat".format(pid=pid), "r") as stat_fh:
+                # The command name may contain spaces. Fields after it are separated by spaces
+                stat = stat_fh.read().rsplit(")", 1)[1].split()
+            with open("/proc/{pid}/statm".format(pid=pid), "r") as statm_fh:
+                rss[int(pid)] = int(statm_fh.read().split()[1]) * page_size
+        except (OSError, IOError, IndexError, ValueError):
+            continue    # Process ended
+        children.setdefault(int(stat[1]), list()).append(int(pid))
+
+    total = 0
+    pending = [root_pid]
+    while pending:
+        pid = pending.pop()
+        total += rss.get(pid, 0)
+        pending.extend(children.get(pid, list()))
+    return total
+
+
+def get_input_bytes(inputs):
+    total = 0
+    for filename in inputs:
+        try:
+            total += os.path.getsize(filename)
+        except OSError:
+            pass
+    return total
+
+
+def run_command(command, interval=TELEMETRY_INTERVAL):
+    """ Run 'command' with bash. Returns the exit status and dict of resource usage
+    """
+
+    import resource
+    import threading
+
+    start = time.time()
+    with open(os.devnull, "r") as devnull:
+        proc = subprocess.Popen(["bash", "-c", command], stdin=devnull)
+    peak_tree_rss = [0]
+    finished = threading.Event()
+
+    def sample_memory():
+        while not finished.is_set():
+            peak_tree_rss[0] = max(peak_tree_rss[0], get_process_tree_rss(proc.pid))
+            finished.wait(interval)
+
+    sampler = threading.Thread(target=sample_memory)
+    sampler.daemon = True
+    sampler.start()
+    proc.wait()
+    wall_time = time.time() - start
+    finished.set()
+    sampler.join()
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    # ru_maxrss is in kilobytes on Linux, and in bytes on macOS
+    max_rss = usage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    exit_status = proc.returncode if proc.returncode >= 0 else 128 - proc.returncode
+    return exit_status, {"start": datetime.datetime.fromtimestamp(start).isoformat(),
+                         "wall_time": round(wall_time, 3),
+                         "user_time": round(usage.ru_utime, 3),
+                         "system_time": round(usage.ru_stime, 3),
+                         "cpu_time": round(usage.ru_utime + usage.ru_stime, 3),
+                         "max_rss": max_rss,
+                         "peak_tree_rss": max(peak_tree_rss[0], max_rss),
+                         "read_bytes": usage.ru_inblock * 512,
+                         "write_bytes": usage.ru_oublock * 512,
+                         "exit_status": exit_status}
+
+
+def append_record(metrics_file, record):
+    """ Append a JSON line to the metrics file. Locked, as commands of several samples may end at the same time
+    """
+
+    import fcntl
+
+    with open(metrics_file, "a") as metrics_fh:
+        fcntl.flock(metrics_fh, fcntl.LOCK_EX)
+        metrics_fh.write(json.dumps(record, sort_keys=True) + "\n")
+        metrics_fh.flush()
+        fcntl.flock(metrics_fh, fcntl.LOCK_UN)
+
+
+def find_metrics_files(paths):
+    files = list()
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                files.extend([os.path.join(dirpath, filename)
+                              for filename in sorted(filenames)
+                              if filename.endswith(TELEMETRY_SUFFIX)])
+        else:
+            files.append(path)
+    return files
+
+
+def read_records(metrics_files, all_runs=False):
+    """ Return the records in the metrics files.
+        Unless 'all_runs' is set, only the last run of each command (step, name, sample and label) is returned.
+    """
+
+    records = list()
+    for metrics_file in metrics_files:
+        with open(metrics_file, "r") as metrics_fh:
+            for line in metrics_fh:
+                if line.strip():
+                    records.append(json.loads(line))
+    if all_runs:
+        return records
+    latest = dict()
+    for record in sorted(records, key=lambda record: record["start"]):
+        latest[(record["step"], record["name"], record["sample"], record.get("label", ""))] = record
+    return list(latest.values())
+
+
+SAMPLE_COLUMNS = ["step", "name", "sample", "commands", "failed", "wall_time", "cpu_time", "max_rss", "peak_tree_rss",
+                  "read_bytes", "write_bytes", "input_bytes"]
+SUMMARY_COLUMNS = ["step", "name", "samples", "failed", "wall_time_mean", "wall_time_max", "cpu_time_mean",
+                   "cpu_time_max", "cpus_mean", "peak_tree_rss_mean", "peak_tree_rss_max", "read_bytes_total",
+                   "write_bytes_total"]
+
+
+def summarize_samples(records):
+    """ Return list of per-step, per-sample rows. Times and I/O are summed over the sample's commands, memory is the
+        maximum over the commands
+    """
+
+    samples = dict()
+    for record in records:
+        row = samples.setdefault((record["step"], record["name"], record["sample"]),
+                                 dict((column, 0) for column in SAMPLE_COLUMNS))
+        row.update({"step": record["step"], "name": record["name"], "sample": record["sample"]})
+        row["commands"] += 1
+        row["failed"] += 1 if record["exit_status"] else 0
+        for column in ["wall_time", "cpu_time", "read_bytes", "write_bytes", "input_bytes"]:
+            row[column] += record.get(column, 0)
+        for column in ["max_rss", "peak_tree_rss"]:
+            row[column] = max(row[column], record.get(column, 0))
+    return [samples[key] for key in sorted(samples)]
+
+
+def summarize_steps(sample_rows):
+    """ Return list of per-step rows summarizing the sample rows
+    """
+
+    steps = dict()
+    for row in sample_rows:
+        steps.setdefault((row["step"], row["name"]), list()).append(row)
+    summary = list()
+    for (step, name), rows in sorted(steps.items()):
+        wall = [row["wall_time"] for row in rows]
+        cpu = [row["cpu_time"] for row in rows]
+        rss = [row["peak_tree_rss"] for row in rows]
+        summary.append({"step": step,
+                        "name": name,
+                        "samples": len(rows),
+                        "failed": sum(1 for row in rows if row["failed"]),
+                        "wall_time_mean": round(sum(wall) / len(wall), 3),
+                        "wall_time_max": max(wall),
+                        "cpu_time_mean": round(sum(cpu) / len(cpu), 3),
+                        "cpu_time_max": max(cpu),
+                        "cpus_mean": round(sum(cpu) / sum(wall), 2) if sum(wall) else 0,
+                        "peak_tree_rss_mean": int(sum(rss) / len(rss)),
+                        "peak_tree_rss_max": max(rss),
+                        "read_bytes_total": sum(row["read_bytes"] for row in rows),
+                        "write_bytes_total": sum(row["write_bytes"] for row in rows)})
+    return summary
+
+
+def write_rows(rows, columns, filename):
+    with open(filename, "w") as out_fh:
+        out_fh.write("\t".join(columns) + "\n")
+        for row in rows:
+            out_fh.write("\t".join([str(row[column]) for column in columns]) + "\n")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Resource telemetry for NeatSeq-Flow scripts")
+    subparsers = parser.add_subparsers(dest="command")
+    run_parser = subparsers.add_parser("run", help="Run a command, read from stdin, and record its resource usage")
+    run_parser.add_argument("--metrics", required=True, help="Metrics file to append to")
+    run_parser.add_argument("--step", required=True)
+    run_parser.add_argument("--name", required=True)
+    run_parser.add_argument("--sample", required=True)
+    run_parser.add_argument("--label", default="")
+    run_parser.add_argument("--inputs", nargs="*", default=list(), help="Input files")
+    run_parser.add_argument("--interval", type=float, default=TELEMETRY_INTERVAL,
+                            help="Interval for sampling memory usage (seconds)")
+    collect_parser = subparsers.add_parser("collect", help="Summarize metrics files")
+    collect_parser.add_argument("--output", required=True, help="Per-step, per-sample resource report")
+    collect_parser.add_argument("--summary", help="Per-step resource summary")
+    collect_parser.add_argument("--all-runs", action="store_true",
+                                help="Include all runs of each command, not only the last one")
+    collect_parser.add_argument("paths", nargs="+", help="Metrics files, or directories to search for them")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        exit_status, record = run_command(sys.stdin.read(), args.interval)
+        record.update({"step": args.step,
+                       "name": args.name,
+                       "sample": args.sample,
+                       "label": args.label,
+                       "host": socket.gethostname(),
+                       "input_bytes": get_input_bytes(args.inputs)})
+        try:
+            append_record(args.metrics, record)
+        except (OSError, IOError) as error:
+            sys.stderr.write("Failed recording resource usage: {error}\n".format(error=error))
+        sys.exit(exit_status)
+    elif args.command == "collect":
+        sample_rows = summarize_samples(read_records(find_metrics_files(args.paths), args.all_runs))
+        write_rows(sample_rows, SAMPLE_COLUMNS, args.output)
+        if args.summary:
+            write_rows(summarize_steps(sample_rows), SUMMARY_COLUMNS, args.summary)
+    else:
+        parser.print_help()
+        sys.exit(1)
@@ -40,6 +40,11 @@ Output
         ``sample_data["vcf"]``  (if ``output_type`` is set to ``vcf``)
         ``sample_data["gvcf"]`` (if ``output_type`` is set to ``gvcf``)
 
+.. Note:: If ``scatter`` is set, the reference is divided into ``scatter`` regions of similar size, based on the
+    reference ``.fai`` index (which must exist when building the scripts). freebayes is run on each region in a
+    separate script (with ``-t``), and the per-region outputs are merged in reference order by the wrapping up script.
+    Sites reported by the regions on both sides of a boundary are written once. The output slots are the same as above.
+
 
 Parameters that can be set
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -49,6 +54,15 @@ Parameters that can be set
     :widths: 15, 10, 10
 
     "output_type",  "vcf|gvcf", "The type of output produced by freebayes. (Can be specified alternatively with appropriate redirects)"
+    "scatter", "Number of regions", "Run freebayes on size-balanced regions in parallel. See note above"
+    "scatter_gap_size", "Integer", "When ``scatter`` is set, split large chromosomes at runs of N's of at least this length. Requires reading the reference fasta"
+    "stage_inputs", "empty | path to node-local directory", "Copy the reference (with ``.fai``) and BAM files (with indices) to node-local scratch. See note below."
+    "stage_streams", "integer", "Number of parallel streams for copying with ``stage_inputs``. Default: 4"
+
+.. Note:: With ``stage_inputs``, every script copies the reference and BAM files to the given directory (default:
+    ``/tmp/neatseq_flow_inputs``) and runs freebayes on the local copies. Jobs running on the same node, *e.g.* the
+    scripts of different regions, share the copies, which are removed when the last of them finishes.
+    See ``neatseq_flow_modules/utilities/input_staging.py``.
     
 
 Comments
@@ -66,9 +80,23 @@ Lines for parameter file
         script_path: /path/to/freebayes
         scope: sample
         output_type: vcf
-        redirects: 
+        redirects:
             --strict-vcf:
-    
+
+**Running on regions in parallel:**
+
+::
+
+    freebayes1:
+        module: freebayes
+        base: samtools1
+        script_path: /path/to/freebayes
+        scope: project
+        output_type: vcf
+        scatter: 100
+        redirects:
+            --strict-vcf:
+
 References
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
@@ -81,10 +109,12 @@ Marth GT, Korf I, Yandell MD, Yeh RT, Gu Z, Zakeri H, Stitziel NO, Hillier L, Kw
 import os
 import sys
 from neatseq_flow.PLC_step import Step,AssertionExcept
+from neatseq_flow_modules.utilities.intervals import *
+from neatseq_flow_modules.utilities.input_staging import *
 
 
 __author__ = "Menachem Sklarz"
-__version__ = "1.2.0"
+__version__ = "1.2.2"
 
 
 class Step_freebayes(Step):
@@ -124,7 +154,18 @@ class Step_freebayes(Step):
             except KeyError:
                 pass
 
-            
+        if "scatter" in self.params:
+            if "-r" in self.params["redir_params"] or "--region" in self.params["redir_params"] or \
+                    "-t" in self.params["redir_params"] or "--targets" in self.params["redir_params"]:
+                raise AssertionExcept("Regions or targets can't be passed in redirects when 'scatter' is set")
+            try:
+                self.params["scatter"] = int(self.params["scatter"])
+            except (TypeError, ValueError):
+                raise AssertionExcept("'scatter' must be the number of regions")
+        # Regions per reference, created on first use
+        self.scatter_regions = dict()
+
+
     def step_sample_initiation(self):
         """ A place to do initiation stages following setting of sample_data
         """
@@ -140,12 +181,100 @@ class Step_freebayes(Step):
         
             
         
+    def get_regions(self, reference):
+        """ Return list of [region name, bed file] for 'reference'. The bed files are written on first call.
+        """
+
+        if reference not in self.scatter_regions:
+            regions_dir = os.path.join(self.base_dir, "regions", "ref{ind}".format(ind=len(self.scatter_regions) + 1))
+            shards = get_scatter_intervals(reference=reference,
+                                           shard_num=self.params["scatter"],
+                                           min_gap=self.params.get("scatter_gap_size"))
+            self.scatter_regions[reference] = write_scatter_intervals(shards, regions_dir, interval_format="bed")
+        return self.scatter_regions[reference]
+
+    def get_region_outputs(self):
+        """ Return list of (prefix, output dir, output file, reference, list of (region name, bed file, region output)).
+            One element for the project, or one per sample, depending on scope.
+        """
+
+        if self.params["scope"] == "project":
+            # Get list of reference fasta files from samples, and convert to set, removing duplicates
+            reference_fasta = set([self.sample_data[sample]["reference"] for sample in self.sample_data["samples"]])
+            if len(reference_fasta) > 1:
+                raise AssertionExcept("There is more than one reference file for the samples. Weird!!!" )
+            units = [(self.sample_data["Title"],
+                      self.base_dir,
+                      self.base_dir + "regions" + os.sep,
+                      list(reference_fasta)[0])]
+        else:
+            units = [(sample,
+                      self.base_dir + sample + os.sep,
+                      self.base_dir + sample + os.sep,
+                      self.sample_data[sample]["reference"])
+                     for sample in self.sample_data["samples"]]
+
+        outputs = list()
+        for prefix, out_dir, regions_dir, reference in units:
+            output_prefix = "{prefix}_{step}".format(prefix=prefix, step=self.get_step_name())
+            regions = [(region,
+                        bed,
+                        "{dir}{prefix}.{region}.{ext}".format(dir=regions_dir,
+                                                              prefix=output_prefix,
+                                                              region=region,
+                                                              ext=self.params["output_type"]))
+                       for region, bed in self.get_regions(reference)]
+            outputs.append((prefix,
+                            regions_dir,
+                            "{dir}{prefix}.{ext}".format(dir=out_dir, prefix=output_prefix, ext=self.params["output_type"]),
+                            reference,
+                            regions))
+        return outputs
+
+    def get_stage_script(self, reference, bam_files):
+        """ Return the script part staging the reference and BAM files, and the reference and BAM files to use in the
+            command. Without stage_inputs, returns an empty script and the original files.
+        """
+
+        if "stage_inputs" not in self.params:
+            return "", reference, bam_files
+        bam_vars = ["freebayes_bam{ind}".format(ind=ind + 1) for ind in range(len(bam_files))]
+        script = get_input_stage_script(inputs=[("freebayes_reference", reference, "reference")] +
+                                               [(var, bam, "bam") for var, bam in zip(bam_vars, bam_files)],
+                                        stage_dir=get_input_stage_dir(self.params),
+                                        streams=self.params.get("stage_streams"))
+        return script, "$freebayes_reference", ["$" + var for var in bam_vars]
+
     def create_spec_wrapping_up_script(self):
         """ Add stuff to check and agglomerate the output data
         """
-        pass
-        
-    
+
+        if "scatter" not in self.params:
+            return
+
+        # Merging the per-region outputs in reference order
+        # If a region output is missing, the merge fails, the region outputs are kept and the script fails
+        merge_script = os.path.join(os.path.dirname(os.path.realpath(__file__)), "merge_region_vcfs.py")
+        self.script = "merge_status=0\n\n"
+        for prefix, regions_dir, output, reference, regions in self.get_region_outputs():
+            region_outputs = " \\\n\t".join([region_output for region, bed, region_output in regions])
+            self.script += """\
+python {merge_script} \\
+\t-o {output} \\
+\t{region_outputs}
+if [ $? -eq 0 ]; then
+    rm -f {region_outputs_rm}
+else
+    merge_status=1
+fi
+
+""".format(merge_script=merge_script,
+           output=output,
+           region_outputs=region_outputs,
+           region_outputs_rm=" ".join([region_output for region, bed, region_output in regions]))
+        self.script += "if [ $merge_status -ne 0 ]; then exit 1; fi\n\n"
+
+
     def build_scripts(self):
         """ This is the actual script building function
             Most, if not all, editing should be done here 
@@ -157,6 +286,10 @@ class Step_freebayes(Step):
             # self.spec_script_name
             # self.script
 
+        if "scatter" in self.params:
+            self.build_scripts_scatter()
+            return
+
         if self.params["scope"] == "project":
             # Name of specific script:
             self.set_spec_script_name() #"_".join([self.step,self.name,self.sample_data["Title"]])
@@ -179,13 +312,18 @@ class Step_freebayes(Step):
             # Convert set into list and return first, and only, element:
             reference_fasta = list(reference_fasta)[0]
             
+            stage_script, reference_fasta, bam_files = \
+                self.get_stage_script(reference_fasta,
+                                      [self.sample_data[sample]["bam"] for sample in self.sample_data["samples"]])
+            self.script += stage_script
+
             # Get constant part of script:
             self.script += self.get_script_const()
             # Reference file:
             self.script += "-f %s \\\n\t" % reference_fasta
             # BAM files:
-            for sample in self.sample_data["samples"]:      # Getting list of samples out of samples_hash
-                self.script += "-b %s \\\n\t" % self.sample_data[sample]["bam"]
+            for bam in bam_files:
+                self.script += "-b %s \\\n\t" % bam
             
             if self.params["output_type"] == "vcf":
                 self.script += "--vcf %s%s_%s.vcf \n\n" % (use_dir, self.sample_data["Title"], self.get_step_name())
@@ -226,12 +364,16 @@ class Step_freebayes(Step):
                 # Get list of reference fasta files from samples, and convert to set, removing duplicates
                 reference_fasta = self.sample_data[sample]["reference"] 
                 
+                stage_script, reference_fasta, bam_files = \
+                    self.get_stage_script(reference_fasta, [self.sample_data[sample]["bam"]])
+                self.script += stage_script
+
                 # Get constant part of script:
                 self.script += self.get_script_const()
                 # Reference file:
                 self.script += "-f %s \\\n\t" % reference_fasta
                 # BAM files:
-                self.script += "-b %s \\\n\t" % self.sample_data[sample]["bam"]
+                self.script += "-b %s \\\n\t" % bam_files[0]
                 
                 if self.params["output_type"] == "vcf":
                     self.script += "--vcf %s%s_%s.vcf \n\n" % (use_dir, sample, self.get_step_name())
@@ -251,4 +393,53 @@ class Step_freebayes(Step):
                 self.local_finish(use_dir,sample_dir)       # Sees to copying local files to final destination (and other stuff)
                 
                 self.create_low_level_script()
-                         
+
+
+    def build_scripts_scatter(self):
+        """ Build a script per region (and sample, if scope is 'sample').
+            The outputs are merged by the wrapping up script.
+        """
+
+        for prefix, regions_dir, output, reference, regions in self.get_region_outputs():
+            if self.params["scope"] == "project":
+                self.make_folder_for_sample("regions")
+                bam_files = [self.sample_data[sample]["bam"] for sample in self.sample_data["samples"]]
+                data = self.sample_data["project_data"]
+            else:
+                self.make_folder_for_sample(prefix)
+                bam_files = [self.sample_data[prefix]["bam"]]
+                data = self.sample_data[prefix]
+
+            for region, bed, region_output in regions:
+                # Name of specific script:
+                self.spec_script_name = self.jid_name_sep.join([self.step,self.name,prefix,region])
+                self.script = ""
+
+                # This line should be left before every new script. It sees to local issues.
+                # Use the dir it returns as the base_dir for this step.
+                use_dir = self.local_start(regions_dir)
+
+                stage_script, region_reference, region_bam_files = self.get_stage_script(reference, bam_files)
+                self.script += stage_script
+
+                # Get constant part of script:
+                self.script += self.get_script_const()
+                # Reference file:
+                self.script += "-f %s \\\n\t" % region_reference
+                # Region:
+                self.script += "-t %s \\\n\t" % bed
+                # BAM files:
+                for bam in region_bam_files:
+                    self.script += "-b %s \\\n\t" % bam
+                self.script += "--%s %s%s \n\n" % (self.params["output_type"],
+                                                     use_dir,
+                                                     os.path.basename(region_output))
+
+                # Move all files from temporary local dir to permanent base_dir
+                self.local_finish(use_dir,regions_dir)       # Sees to copying local files to final destination (and other stuff)
+
+                self.create_low_level_script()
+
+            data[self.params["output_type"]] = output
+            data[self.params["output_type"] + ".source"] = "freebayes"
+            self.stamp_file(data[self.params["output_type"]])
@@ -0,0 +1,102 @@
+# -*- coding: UTF-8 -*-
+"""
+Merge VCFs called on consecutive genomic regions into a single VCF.
+
+The inputs must be passed in reference order. The header is taken from the first input. Records are streamed through
+a small sorting window, so that records reported out of order near a region boundary are put back in place, and
+records reported by both regions on either side of a boundary (same CHROM, POS, REF and ALT) are written once.
+
+Memory use is bounded by the number of records within the window, not by the size of the inputs.
+
+All inputs must exist and be non-empty, since a region caller writes at least a header. Otherwise, the script exits
+with an error without writing the output, so that a failed region is not silently lost.
+
+Used by the ``freebayes`` module.
+"""
+
+import os
+import sys
+import gzip
+import heapq
+import argparse
+
+__author__ = "Menachem Sklarz"
+__version__ = "1.6.1"
+
+
+def open_vcf(filename):
+    return gzip.open(filename, "rt") if filename.endswith(".gz") else open(filename, "r")
+
+
+def get_missing_vcfs(vcfs):
+    """ Return list of 'vcfs' which do not exist or are empty
+    """
+
+    return [vcf for vcf in vcfs if not os.path.isfile(vcf) or os.path.getsize(vcf) == 0]
+
+
+def merge_vcfs(vcfs, out_fh, window=1000):
+    """ Merge 'vcfs' into 'out_fh'.
+        :param window: Maximal distance, in bp, a record may appear out of order.
+    """
+
+    contig_order = dict()
+    buffer = list()         # heap of (contig index, pos, serial, key, line)
+    buffered = set()        # keys of records in buffer
+    flushed = dict()        # key: (contig index, pos) of records already written and still within window
+    serial = 0
+
+    def flush(contig_ind, pos):
+        """ Write records before (contig_ind, pos - window) """
+        while buffer and (buffer[0][0] < contig_ind or buffer[0][1] < pos - window):
+            rec_contig, rec_pos, _, key, line = heapq.heappop(buffer)
+            buffered.discard(key)
+            out_fh.write(line)
+            flushed[key] = (rec_contig, rec_pos)
+        # Forget written records which can not be duplicated anymore
+        for key in [key for key, (rec_contig, rec_pos) in flushed.items()
+                    if rec_contig < contig_ind or rec_pos < pos - 2 * window]:
+            del flushed[key]
+
+    header_written = False
+    for vcf in vcfs:
+        write_header = not header_written
+        with open_vcf(vcf) as vcf_fh:
+            for line in vcf_fh:
+                if line.startswith("#"):
+                    if write_header:
+                        out_fh.write(line)
+                        header_written = True
+                    continue
+                fields = line.split("\t", 5)
+                if len(fields) < 5:
+                    continue
+                contig_ind = contig_order.setdefault(fields[0], len(contig_order))
+                pos = int(fields[1])
+                key = (fields[0], pos, fields[3], fields[4])
+                if key in buffered or key in flushed:
+                    continue
+                flush(contig_ind, pos)
+                heapq.heappush(buffer, (contig_ind, pos, serial, key, line))
+                buffered.add(key)
+                serial += 1
+
+    flush(len(contig_order) + 1, 0)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Merge VCFs called on consecutive regions, removing duplicate sites")
+    parser.add_argument("vcfs", nargs="+", help="VCF files, in reference order. All must exist and be non-empty")
+    parser.add_argument("-o", "--output", help="Output VCF. Default: stdout")
+    parser.add_argument("-w", "--window", type=int, default=1000,
+                        help="Maximal distance, in bp, records may be out of order. Default: 1000")
+    args = parser.parse_args()
+
+    missing = get_missing_vcfs(args.vcfs)
+    if missing:
+        sys.exit("Missing or empty region VCFs. Not merging:\n\t{files}".format(files="\n\t".join(missing)))
+
+    out_fh = open(args.output, "w") if args.output else sys.stdout
+    merge_vcfs(args.vcfs, out_fh, args.window)
+    out_fh.close()
@@ -39,6 +39,11 @@ Output
         ``sample_data["vcf"]``
         ``sample_data["variants"]`` (if ``--output-vcf`` is not redirected in ``redirects``)
 
+.. Note:: If ``scatter`` is set, the reference is divided into ``scatter`` intervals of similar size, based on the
+    reference ``.fai`` index (which must exist when building the scripts). A separate ``mpileup | varscan`` script is
+    created for each interval (and each sample, if ``scope`` is ``sample``). The per-interval outputs are concatenated
+    in reference order by the wrapping up script, with the header written once. The output slots are the same as above.
+
 
 Parameters that can be set
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -49,6 +54,8 @@ Parameters that can be set
 
     "mpileup_path",  "path", "The full path to the mpileup program. You can append additional mpileup arguments after the path (see example lines)"
     "script_path",  "path", "The full path to the relevant varscan program (see example lines)."
+    "scatter", "Number of intervals", "Run on size-balanced intervals in parallel. See note above"
+    "scatter_gap_size", "Integer", "When ``scatter`` is set, split large chromosomes at runs of N's of at least this length. Requires reading the reference fasta"
     
 
 Comments
@@ -70,7 +77,23 @@ Lines for parameter file
             --min-coverage: 4
             --output-vcf:
             --variants: 1
-    
+
+**Running on intervals in parallel:**
+
+::
+
+    mpileup_varscan1:
+        module: mpileup_varscan
+        base: samtools1
+        script_path: /path/to/java -jar /path/to/VarScan.v2.3.9.jar mpileup2snp
+        mpileup_path: /path/to/samtools mpileup --max-depth 6000
+        scope: project
+        scatter: 50
+        redirects:
+            --min-coverage: 4
+            --output-vcf:
+            --variants: 1
+
 References
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 - Li, H., Handsaker, B., Wysoker, A., Fennell, T., Ruan, J., Homer, N., Marth, G., Abecasis, G. and Durbin, R., 2009. **The sequence alignment/map format and SAMtools**. *Bioinformatics*, 25(16), pp.2078-2079.
@@ -82,10 +105,11 @@ References
 import os
 import sys
 from neatseq_flow.PLC_step import Step,AssertionExcept
+from neatseq_flow_modules.utilities.intervals import *
 
 
 __author__ = "Menachem Sklarz"
-__version__ = "1.6.0"
+__version__ = "1.6.1"
 
 
 class Step_mpileup_varscan(Step):
@@ -99,6 +123,14 @@ class Step_mpileup_varscan(Step):
         
         if "scope" not in list(self.params.keys()):
             raise AssertionExcept("You must supply a 'scope' param. Either 'sample' or 'project'")
+
+        if "scatter" in self.params:
+            try:
+                self.params["scatter"] = int(self.params["scatter"])
+            except (TypeError, ValueError):
+                raise AssertionExcept("'scatter' must be the number of intervals")
+        # Intervals per reference, created on first use
+        self.scatter_regions = dict()
             
     def step_sample_initiation(self):
         """ A place to do initiation stages following setting of sample_data
@@ -128,18 +160,94 @@ class Step_mpileup_varscan(Step):
             
             
         
+    def get_output_suffix(self):
+        """ Define output_suffix depending on redir_params
+        """
+
+        return "vcf" if "--output-vcf" in self.params["redir_params"] else "unknown"
+
+    def get_regions(self, reference):
+        """ Return list of [interval name, interval file] for 'reference'. The interval files are written on first call.
+        """
+
+        if reference not in self.scatter_regions:
+            regions_dir = os.path.join(self.base_dir, "regions", "ref{ind}".format(ind=len(self.scatter_regions) + 1))
+            shards = get_scatter_intervals(reference=reference,
+                                           shard_num=self.params["scatter"],
+                                           min_gap=self.params.get("scatter_gap_size"))
+            self.scatter_regions[reference] = write_scatter_intervals(shards, regions_dir)
+        return self.scatter_regions[reference]
+
+    def get_region_outputs(self):
+        """ Return list of (prefix, output dir, output file, reference, list of (interval name, interval file, interval output)).
+            One element for the project, or one per sample, depending on scope.
+        """
+
+        if self.params["scope"] == "project":
+            # Get list of reference fasta files from samples, and convert to set, removing duplicates
+            reference_fasta = set([self.sample_data[sample]["reference"] for sample in self.sample_data["samples"]])
+            if len(reference_fasta) > 1:
+                raise AssertionExcept("There is more than one reference file for different samples. Weird!!!")
+            units = [(self.sample_data["Title"],
+                      self.base_dir + "regions" + os.sep,
+                      self.base_dir + ".".join([self.sample_data["Title"], self.get_output_suffix()]),
+                      list(reference_fasta)[0])]
+        else:
+            units = [(sample,
+                      self.base_dir + sample + os.sep,
+                      "%s%s_%s.%s" % (self.base_dir + sample + os.sep, sample, self.get_step_name(), self.get_output_suffix()),
+                      self.sample_data[sample]["reference"])
+                     for sample in self.sample_data["samples"]]
+
+        outputs = list()
+        for prefix, regions_dir, output, reference in units:
+            regions = [(region,
+                        interval_file,
+                        "{dir}{prefix}.{region}.{ext}".format(dir=regions_dir,
+                                                              prefix=prefix,
+                                                              region=region,
+                                                              ext=self.get_output_suffix()))
+                       for region, interval_file in self.get_regions(reference)]
+            outputs.append((prefix, regions_dir, output, reference, regions))
+        return outputs
+
     def create_spec_wrapping_up_script(self):
         """ Add stuff to check and agglomerate the output data
         """
-        pass
-        
-    
+
+        if "scatter" not in self.params:
+            return
+
+        # Concatenating the per-interval outputs in reference order, with a single header.
+        # VCF headers are lines starting with '#'. Tables have a single header line
+        if self.get_output_suffix() == "vcf":
+            awk_cmd = "awk 'FNR==1 {file_num++} file_num==1 || !/^#/'"
+        else:
+            awk_cmd = "awk 'FNR==1 {file_num++} file_num==1 || FNR>1'"
+        self.script = ""
+        for prefix, regions_dir, output, reference, regions in self.get_region_outputs():
+            self.script += """\
+{awk_cmd} \\
+\t{region_outputs} \\
+\t> {output} && \\
+rm -f {region_outputs_rm}
+
+""".format(awk_cmd=awk_cmd,
+           output=output,
+           region_outputs=" \\\n\t".join([region_output for region, interval_file, region_output in regions]),
+           region_outputs_rm=" ".join([region_output for region, interval_file, region_output in regions]))
+
+
     def build_scripts(self):
         """ This is the actual script building function
-            Most, if not all, editing should be done here 
+            Most, if not all, editing should be done here
             HOWEVER, DON'T FORGET TO CHANGE THE CLASS NAME AND THE FILENAME!
         """
-        
+
+        if "scatter" in self.params:
+            self.build_scripts_scatter()
+            return
+
         if self.params["scope"] == "project":
 
             # Name of specific script:
@@ -299,4 +407,67 @@ class Step_mpileup_varscan(Step):
                 self.local_finish(use_dir,self.base_dir)       # Sees to copying local files to final destination (and other stuff)
                 
                 self.create_low_level_script()
-                    
\ No newline at end of file
+
+
+    def build_scripts_scatter(self):
+        """ Build an mpileup | varscan script per interval (and sample, if scope is 'sample').
+            The outputs are concatenated by the wrapping up script.
+        """
+
+        for prefix, regions_dir, output, reference, regions in self.get_region_outputs():
+            if self.params["scope"] == "project":
+                self.make_folder_for_sample("regions")
+                samples = self.sample_data["samples"]
+                sample_list = self.base_dir + "sample_list.txt"
+            else:
+                self.make_folder_for_sample(prefix)
+                samples = [prefix]
+                sample_list = regions_dir + "sample_list.txt"
+
+            ### Create file with list of sample names, one per line
+            with open(sample_list, "w") as smp_lst:
+                for sample in samples:
+                    smp_lst.write("%s\n" % sample)
+
+            for region, interval_file, region_output in regions:
+                # Name of specific script:
+                self.spec_script_name = self.jid_name_sep.join([self.step,self.name,prefix,region])
+                self.script = ""
+
+                # This line should be left before every new script. It sees to local issues.
+                # Use the dir it returns as the base_dir for this step.
+                use_dir = self.local_start(regions_dir)
+
+                # mpileup is run separately on each interval of the shard, using the BAM index.
+                self.script += "set -o pipefail\n"
+                self.script += "while read region; do\n"
+                self.script += "\t%s \\\n\t" % self.params["mpileup_path"]
+                # Reference file:
+                self.script += "-f %s \\\n\t" % reference
+                self.script += "-r $region \\\n\t"
+                # BAM files:
+                for sample in samples:
+                    self.script += "%s \\\n\t" % self.sample_data[sample]["bam"]
+                # Remove extra stuff from end of script:
+                self.script = self.script.rstrip("\\\n\t")
+                self.script += "\ndone < %s | \\\n" % interval_file
+
+                self.script += "%s \\\n\t" % self.params["script_path"]
+                self.script += self.get_redir_parameters_script()
+                self.script += "--vcf-sample-list %s \\\n\t" % sample_list
+                self.script += "> %s\n\n"  % (use_dir + os.path.basename(region_output))
+
+                # Move all files from temporary local dir to permanent base_dir
+                self.local_finish(use_dir,regions_dir)       # Sees to copying local files to final destination (and other stuff)
+
+                self.create_low_level_script()
+
+            data = self.sample_data["project_data"] if self.params["scope"] == "project" else self.sample_data[prefix]
+            if self.get_output_suffix() == "vcf":
+                data["vcf"] = output
+                data["vcf.source"] = "varscan"
+                self.stamp_file(data["vcf"])
+            else:
+                data["variants"] = output
+                data["variants.source"] = "varscan"
+                self.stamp_file(data["variants"])